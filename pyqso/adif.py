@@ -18,14 +18,15 @@
 #    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
+import io
+import gzip
 import logging
 from datetime import datetime
 import calendar
-try:
-    import configparser
-except ImportError:
-    import ConfigParser as configparser
-from os.path import expanduser
+import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import escape
+
+from pyqso.preferences import get_preferences
 
 # ADIF field names and their associated data types available in PyQSO.
 AVAILABLE_FIELD_NAMES_TYPES = {"CALL": "S",
@@ -199,14 +200,212 @@ PROPAGATION_MODES = ["", "AS", "AUE", "AUR", "BS", "ECH", "EME", "ES", "F2", "FA
 
 ADIF_VERSION = "3.0.4"
 
+# Matches a data specifier (e.g. <call:6>) or an end-of-header/end-of-record marker.
+DATA_SPECIFIER = re.compile(r"<([A-Za-z_][A-Za-z0-9_]*:\d+(:[A-Za-z])?|eor|eoh)>", re.IGNORECASE)
+MAXIMUM_SPECIFIER_LENGTH = 64
+# Matches anything that looks like a data specifier or marker, capturing the field name and data length (if present).
+TAG = re.compile(r"<([^<>:]+)(?::(\d+)(?::[^<>]*)?|:[^<>]*)?>")
+
+# The validators for each ADIF data type, compiled once when the module is loaded. Each one takes some (non-empty) data and returns True if it is valid.
+# See http://www.adif.org/304/ADIF_304.htm#Data_Types for the full list of data types with descriptions.
+# Allow a decimal point before and/or after any numbers, but don't allow a decimal point on its own.
+NUMBER = re.compile(r"-?(([0-9]+\.?[0-9]*)|([0-9]*\.?[0-9]+))")
+DATE = re.compile(r"([0-9]{4})([0-9]{2})([0-9]{2})")
+TIME = re.compile(r"([0-9]{2})([0-9]{2})([0-9]{2})?")
+LOCATION = re.compile(r"[EWNS]([0-9]{3})([0-9]{2}\.[0-9]{3})", re.IGNORECASE)
+MULTILINE_STRING = re.compile(r"(.+(\r\n)*.*)", re.UNICODE)
+
+
+def _is_valid_number(data):
+    # Make sure we match the whole string, otherwise there may be an invalid character after the match.
+    m = NUMBER.match(data)
+    return m is not None and m.group(0) == data
+
+
+def _is_valid_date(data):
+    m = DATE.fullmatch(data)
+    if m is None:
+        return False
+    (year, month, day) = (int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    return year >= 1930 and 1 <= month <= 12 and 1 <= day <= calendar.monthrange(year, month)[1]
+
+
+def _is_valid_time(data):
+    # Either HHMM or HHMMSS format.
+    m = TIME.fullmatch(data)
+    return m is not None and int(m.group(1)) <= 23 and int(m.group(2)) <= 59 and (m.group(3) is None or int(m.group(3)) <= 59)
+
+
+def _is_valid_string(data):
+    # FIXME: Need to make sure that the "S" and "M" data types accept ASCII-only characters in the range 32-126 inclusive.
+    return "\n" not in data
+
+
+def _is_valid_multiline_string(data):
+    m = MULTILINE_STRING.match(data)
+    return m is not None and m.group(0) == data
+
+
+def _is_valid_location(data):
+    m = LOCATION.fullmatch(data)
+    return m is not None and int(m.group(1)) <= 180 and float(m.group(2)) <= 59.999
+
+
+def _is_always_valid(data):
+    return True
+
+
+VALIDATORS = {"N": _is_valid_number,
+              "B": frozenset(["Y", "N"]).__contains__,
+              "D": _is_valid_date,
+              "T": _is_valid_time,
+              "S": _is_valid_string,
+              "I": _is_valid_string,
+              "G": _is_valid_multiline_string,
+              "M": _is_always_valid,
+              "L": _is_valid_location}
+
+# The enumerations that the data in some fields (of the "E" and "A" data types) must be a member of. Data in any other enumerated field is not checked.
+ENUMERATIONS = {"MODE": frozenset(MODES.keys()),
+                "SUBMODE": frozenset([submode for mode in MODES for submode in MODES[mode]]),
+                "BAND": frozenset(BANDS)}
+
+
+def get_validator(field_name, data_type):
+    """ Return the validator for the data in a field.
+
+    :arg str field_name: The name of the ADIF field.
+    :arg str data_type: The ADIF data type of the field.
+    :returns: A function which takes some (non-empty) data and returns True if it is valid, and False otherwise.
+    :rtype: callable
+    """
+    if(data_type == "E" or data_type == "A"):
+        if(field_name in ENUMERATIONS):
+            return ENUMERATIONS[field_name].__contains__
+        return _is_always_valid
+    return VALIDATORS.get(data_type, _is_always_valid)
+
+
+# The validator for each of the fields available in PyQSO, and the bit which represents each field in an error mask (following the order of AVAILABLE_FIELD_NAMES_ORDERED).
+FIELD_VALIDATORS = {field_name: get_validator(field_name, data_type) for (field_name, data_type) in AVAILABLE_FIELD_NAMES_TYPES.items()}
+FIELD_BITS = {field_name: 1 << i for (i, field_name) in enumerate(AVAILABLE_FIELD_NAMES_ORDERED)}
+
+
+def validate_record(record):
+    """ Validate the data in each of the fields of a record. Empty fields, and any fields that are not available in PyQSO, are not checked.
+
+    :arg dict record: The field-value pairs of the record (with the field names in upper case).
+    :returns: An error mask, in which the bit of each field (given by FIELD_BITS) is set if the field's data is not valid. A mask of 0 means that the whole record is valid.
+    :rtype: int
+    """
+    mask = 0
+    for (field_name, data) in record.items():
+        if(data):
+            validator = FIELD_VALIDATORS.get(field_name)
+            if(validator is not None and not validator(data)):
+                mask |= FIELD_BITS[field_name]
+    return mask
+
+
+def validate_many(records):
+    """ Validate the data in each of the fields of many records.
+
+    :arg records: An iterable of records, where each record is a dictionary of field-value pairs.
+    :returns: The error mask of each record (see validate_record).
+    :rtype: list
+    """
+    return [validate_record(record) for record in records]
+
+
+def get_invalid_field_names(mask):
+    """ Return the names of the fields which are not valid, according to an error mask.
+
+    :arg int mask: The error mask of a record, as returned by validate_record.
+    :returns: The names of the fields whose bits are set in the mask, in the order given by AVAILABLE_FIELD_NAMES_ORDERED.
+    :rtype: list
+    """
+    return [field_name for field_name in AVAILABLE_FIELD_NAMES_ORDERED if(mask & FIELD_BITS[field_name])]
+
+
+# The number of records that are formatted before being written out to an ADIF file in one go, and the size of the file's buffer.
+WRITE_BATCH_SIZE = 1000
+WRITE_BUFFER_SIZE = 1024*1024
+# The space left in the header of an ADIF file for the number of records (e.g. "123 record(s)."), when it is only known once the records have been written.
+RECORD_COUNT_WIDTH = 24
+
+
+def get_write_columns(keys):
+    """ Work out which keys of a record hold the standard ADIF fields, in the order that the fields should be written to an ADIF file.
+
+    :arg list keys: The keys of the record (i.e. the field names, in upper or lower case).
+    :returns: A list of (key, field name) tuples, e.g. ("call", "CALL").
+    :rtype: list
+    """
+    key_by_field_name = {}
+    for key in keys:
+        field_name = key.upper()
+        if(field_name not in key_by_field_name or key == field_name):
+            key_by_field_name[field_name] = key
+    return [(key_by_field_name[field_name], field_name) for field_name in AVAILABLE_FIELD_NAMES_ORDERED if(field_name in key_by_field_name)]
+
+
+def is_compressed(path):
+    """ Determine whether a file is (or should be) compressed with gzip, based on its name.
+
+    :arg str path: The path to the file.
+    :returns: True if the file's name ends in '.gz', and False otherwise.
+    :rtype: bool
+    """
+    return path.lower().endswith(".gz")
+
+
+def is_adx(path):
+    """ Determine whether a file is (or should be) in the XML version of ADIF (ADX), rather than the tagged-text version (ADI), based on its name.
+
+    :arg str path: The path to the file.
+    :returns: True if the file's name ends in '.adx' (or '.adx.gz'), and False otherwise.
+    :rtype: bool
+    """
+    path = path.lower()
+    if(is_compressed(path)):
+        path = path[:-len(".gz")]
+    return path.endswith(".adx")
+
+
+def open_file(path, mode="r", buffer_size=io.DEFAULT_BUFFER_SIZE, encoding=None):
+    """ Open a file, decompressing/compressing it with gzip if its name ends in '.gz'.
+
+    :arg str path: The path to the file.
+    :arg str mode: Either "r" to read the file or "w" to write to it, as text. Append "b" to read/write the file in binary mode instead.
+    :arg int buffer_size: The size of the buffer used when reading/writing the file.
+    :arg str encoding: The encoding of the text in the file. If None, the platform's default encoding is used.
+    :returns: The file object.
+    :raises IOError: If the file cannot be opened.
+    """
+    binary = "b" in mode
+    if(is_compressed(path)):
+        f = gzip.GzipFile(path, mode=mode.replace("b", "") + "b")
+        if(binary):
+            return f
+        return io.TextIOWrapper(f, encoding=encoding, errors="replace")
+    if(binary):
+        return open(path, mode=mode, buffering=buffer_size)
+    return open(path, mode=mode, encoding=encoding, errors="replace", buffering=buffer_size)
+
 
 class ADIF:
 
     """ The ADIF class supplies methods for reading, parsing, and writing log files in the Amateur Data Interchange Format (ADIF).
     For more information, visit http://adif.org/ """
 
-    def __init__(self):
-        """ Initialise class for I/O of files using the Amateur Data Interchange Format (ADIF). """
+    def __init__(self, preferences=None):
+        """ Initialise class for I/O of files using the Amateur Data Interchange Format (ADIF).
+
+        :arg Preferences preferences: The user's preferences. If None, the preferences shared by the whole application are used.
+        """
+        if(preferences is None):
+            preferences = get_preferences()
+        self.preferences = preferences
         return
 
     def read(self, path):
@@ -217,20 +416,39 @@ class ADIF:
         :rtype: list
         :raises IOError: If the ADIF file does not exist or cannot be read (e.g. due to lack of read permissions).
         """
-        logging.debug("Reading in ADIF file with path: %s..." % path)
-
-        text = ""
-        with open(path, mode="r", errors="replace") as f:
-            text = f.read()
-
-        records = self.parse_adi(text)
+        records = list(self.iter_read(path))
 
         if(records == []):
             logging.warning("No records found in the file. Empty file or wrong file type?")
 
-        logging.info("Read %d QSOs from %s in ADIF format." % (len(records), path))
         return records
 
+    def iter_read(self, path):
+        """ Read an ADIF file and parse it one record at a time. Unlike the read method, the file is never loaded into memory in its entirety.
+
+        :arg str path: The path to the ADIF file to read. If it ends in '.adx' (or '.adx.gz'), the file is read as ADX (the XML version of ADIF). If it ends in '.gz', the file is decompressed as it is read.
+        :returns: A generator which yields one dictionary of field-value pairs per QSO.
+        :rtype: generator
+        :raises IOError: If the ADIF file does not exist or cannot be read (e.g. due to lack of read permissions).
+        :raises ElementTree.ParseError: If an ADX file is not well-formed XML.
+        """
+        logging.debug("Reading in ADIF file with path: %s..." % path)
+
+        n_record = 0
+        if(is_adx(path)):
+            # Let the XML parser work out the encoding of the file from its XML declaration.
+            f = open_file(path, mode="rb")
+            parse = self.parse_adx_stream
+        else:
+            f = open_file(path, mode="r")
+            parse = self.parse_adi_stream
+        with f:
+            for record in parse(f):
+                n_record += 1
+                yield record
+
+        logging.info("Read %d QSOs from %s in ADIF format." % (n_record, path))
+
     def parse_adi(self, text):
         """ Parse some raw text (defined in the 'text' argument) for ADIF field data.
 
@@ -238,137 +456,261 @@ class ADIF:
         :returns: A list of dictionaries (one dictionary per QSO). Each dictionary contains the field-value pairs, e.g. {"FREQ": "145.500", "BAND": "2M", "MODE": "FM"}.
         :rtype: list
         """
+        return list(self.parse_adi_stream(io.StringIO(text)))
 
-        logging.debug("Parsing text from the ADIF file...")
+    def parse_adi_stream(self, stream, chunk_size=65536):
+        """ Parse ADIF field data from a file-like object, reading it in chunks of 'chunk_size' characters.
+        The length given in each <field:length> data specifier is used to determine how much data belongs to the field.
 
-        records = []
+        :arg stream: The file-like object (opened in text mode) to read from.
+        :arg int chunk_size: The number of characters to read from the stream at a time.
+        :returns: A generator which yields one dictionary of field-value pairs per QSO, e.g. {"FREQ": "145.500", "BAND": "2M", "MODE": "FM"}.
+        :rtype: generator
+        """
+
+        logging.debug("Parsing text from the ADIF file...")
 
         # ADIF-related configuration options
-        config = configparser.ConfigParser()
-        have_config = (config.read(expanduser("~/.config/pyqso/preferences.ini")) != [])
-        (section, option) = ("import_export", "merge_comment")
-        if(have_config and config.has_option(section, option) and config.getboolean(section, option)):
-            merge_comment = True
-        else:
-            merge_comment = False
-
-        # Separate the text at the <eor> or <eoh> markers.
-        tokens = re.split("(<eor>|<eoh>)", text, flags=re.IGNORECASE)
-        tokens.pop()  # Anything after the final <eor> marker should be ignored.
-
-        # The header might tell us the number of records, but let's not assume
-        # this and simply ignore it instead (if it exists).
-        if(re.search("<eoh>", text, flags=re.IGNORECASE) is not None):
-            # There is a header present, so let's ignore everything
-            # up to and including the <eoh> marker.
-            while len(tokens) > 0:
-                t = tokens.pop(0)
-                if(re.match("<eoh>", t, flags=re.IGNORECASE) is not None):
-                    break
+        merge_comment = self.preferences.getboolean("import_export", "merge_comment", fallback=False)
 
-        n_eor = 0
-        n_record = 0
-        records = []
-        pattern = re.compile(r"<(.*?):(\d*).*?>([^<]+)")
+        buffer = ""
+        position = 0
+        exhausted = False
+        search = TAG.search
+        # Cache the normalised version of each field name, since the same few field names appear over and over again.
+        field_names = {}
+
+        # Any fields which appear before the <eoh> marker belong to the header and will be discarded.
+        fields_and_data = []
+
+        while True:
+            m = search(buffer, position)
+            if(m is None):
+                if(exhausted):
+                    break
+                # Keep any partial data specifier and read in some more text.
+                start = buffer.rfind("<", position)
+                buffer = buffer[start:] if start >= 0 else ""
+                position = 0
+                chunk = stream.read(chunk_size)
+                if(not chunk):
+                    exhausted = True
+                buffer += chunk
+                continue
 
-        for t in tokens:
-            if(re.match("<eor>", t, flags=re.IGNORECASE) is not None):
-                n_eor += 1
+            (name, length) = m.group(1, 2)
+            end = m.end()
+            try:
+                field_name = field_names[name]
+            except KeyError:
+                field_name = field_names[name] = name.strip().upper()
+
+            if(length is None):
+                if(field_name == "EOR"):
+                    yield self._build_record(fields_and_data, merge_comment)
+                    fields_and_data = []
+                elif(field_name == "EOH"):
+                    fields_and_data = []
+                position = end
                 continue
-            else:
-                n_record += 1
-                # Each record will have field names and corresponding
-                # data entries. Store this in a dictionary.
-                # Note: This is based on the code written by OK4BX.
-                # (http://web.bxhome.org/blog/ok4bx/2012/05/adif-parser-python)
-                fields_and_data_dictionary = {}
-                fields_and_data = pattern.findall(t)
-                comment = None
-                for fd in fields_and_data:
-                    # Let's force all field names to be in upper case.
-                    # This will help us later when comparing the field names
-                    # against the available field names in the ADIF specification.
-                    field_name = fd[0].upper()
-                    # Only read in the number of characters specified by the data length.
-                    field_data = fd[2][:int(fd[1])]
-
-                    # Combo boxes are used later on and these are case sensitive,
-                    # so adjust the field data accordingly.
-                    if(field_name == "BAND"):
-                        field_data = field_data.lower()
-                    elif(field_name == "CALL" or field_name == "MODE" or field_name == "SUBMODE"):
-                        field_data = field_data.upper()
-                    elif(field_name == "COMMENT"):
-                        # Keep a copy of the COMMENT field data, in case we want to merge
-                        # it with the NOTES field.
-                        comment = field_data
-                    if(field_name in AVAILABLE_FIELD_NAMES_ORDERED):
-                        field_data_type = AVAILABLE_FIELD_NAMES_TYPES[field_name]
-                        if(self.is_valid(field_name, field_data, field_data_type)):
-                            # Only add the field if it is a standard ADIF field and it holds valid data.
-                            fields_and_data_dictionary[field_name] = field_data
-
-                # Merge the COMMENT field with the NOTES field, if desired and applicable.
-                if(merge_comment):
-                    if("NOTES" in list(fields_and_data_dictionary.keys()) and comment):
-                        logging.debug("Merging COMMENT field with NOTES field...")
-                        fields_and_data_dictionary["NOTES"] += "\n" + comment
-                        logging.debug("Merged fields.")
-                    elif(comment):
-                        # Create the NOTES entry, but only store the contents of the COMMENT field.
-                        logging.debug("The COMMENT field is present, but not the NOTES field. The NOTES field will be created and will only hold the COMMENT.")
-                        fields_and_data_dictionary["NOTES"] = comment
-                    else:
-                        pass
-                records.append(fields_and_data_dictionary)
-
-        assert n_eor == n_record
+            length = int(length)
+
+            # Make sure that all of the field's data (plus enough text to recognise a data specifier straight after it) is in the buffer.
+            while(len(buffer) - end < length + MAXIMUM_SPECIFIER_LENGTH and not exhausted):
+                chunk = stream.read(max(chunk_size, length))
+                if(not chunk):
+                    exhausted = True
+                buffer += chunk
+
+            field_data = buffer[end:end+length]
+            # Some applications write out data lengths which are too long. Do not let the data run into the next data specifier.
+            if("<" in field_data):
+                i = field_data.find("<")
+                while(i >= 0):
+                    if(DATA_SPECIFIER.match(buffer, end+i) is not None):
+                        field_data = field_data[:i]
+                        break
+                    i = field_data.find("<", i + 1)
+            fields_and_data.append((field_name, field_data))
+            position = end + len(field_data)
+
+            # Discard the text that has already been parsed.
+            if(position > chunk_size):
+                buffer = buffer[position:]
+                position = 0
 
         logging.debug("Finished parsing text.")
 
-        return records
+    def parse_adx_stream(self, stream):
+        """ Parse ADIF field data from a file-like object containing ADX (the XML version of ADIF). The XML is parsed incrementally,
+        and each record's elements are discarded once the record has been built, so the memory used does not grow with the size of the file.
 
-    def write(self, records, path):
-        """ Write an ADIF file containing all the QSOs in the 'records' list.
+        :arg stream: The file-like object (opened in binary mode) to read from.
+        :returns: A generator which yields one dictionary of field-value pairs per QSO, e.g. {"FREQ": "145.500", "BAND": "2M", "MODE": "FM"}.
+        :rtype: generator
+        :raises ElementTree.ParseError: If the XML is not well-formed.
+        """
 
-        :arg list records: The list of QSO records to write.
-        :arg str path: The desired path of the ADIF file to write to.
-        :returns: None
+        logging.debug("Parsing XML from the ADX file...")
+
+        merge_comment = self.preferences.getboolean("import_export", "merge_comment", fallback=False)
+
+        # The RECORDS element, whose children (the RECORD elements) are removed once they have been parsed.
+        parent = None
+        depth = 0
+        for (event, element) in ElementTree.iterparse(stream, events=("start", "end")):
+            if(event == "start"):
+                depth += 1
+                if(depth == 2 and element.tag.upper() == "RECORDS"):
+                    parent = element
+                continue
+            depth -= 1
+            if(depth == 2 and parent is not None):
+                # The end of a RECORD element. Each of its children holds the data of one field (unless it is a user-defined or application-defined field, which are not standard ADIF fields).
+                if(element.tag.upper() == "RECORD"):
+                    yield self._build_record([(child.tag.upper(), child.text or "") for child in element], merge_comment)
+                parent.clear()
+            elif(depth == 1 and element.tag.upper() == "HEADER"):
+                element.clear()
+
+        logging.debug("Finished parsing XML.")
+
+    def _build_record(self, fields_and_data, merge_comment):
+        """ Create a dictionary from the field-value pairs of a single record, keeping only the standard ADIF fields that hold valid data.
+
+        :arg list fields_and_data: The (field name, data) tuples that make up the record.
+        :arg bool merge_comment: True if the COMMENT field should be merged with the NOTES field, and False otherwise.
+        :returns: A dictionary of field-value pairs.
+        :rtype: dict
+        """
+        fields_and_data_dictionary = {}
+        comment = None
+        for (field_name, field_data) in fields_and_data:
+            # Combo boxes are used later on and these are case sensitive,
+            # so adjust the field data accordingly.
+            if(field_name == "BAND"):
+                field_data = field_data.lower()
+            elif(field_name == "CALL" or field_name == "MODE" or field_name == "SUBMODE"):
+                field_data = field_data.upper()
+            elif(field_name == "COMMENT"):
+                # Keep a copy of the COMMENT field data, in case we want to merge
+                # it with the NOTES field.
+                comment = field_data
+            validator = FIELD_VALIDATORS.get(field_name)
+            if(validator is not None and (not field_data or validator(field_data))):
+                # Only add the field if it is a standard ADIF field and it holds valid data.
+                fields_and_data_dictionary[field_name] = field_data
+
+        # Merge the COMMENT field with the NOTES field, if desired and applicable.
+        if(merge_comment):
+            if("NOTES" in fields_and_data_dictionary and comment):
+                logging.debug("Merging COMMENT field with NOTES field...")
+                fields_and_data_dictionary["NOTES"] += "\n" + comment
+                logging.debug("Merged fields.")
+            elif(comment):
+                # Create the NOTES entry, but only store the contents of the COMMENT field.
+                logging.debug("The COMMENT field is present, but not the NOTES field. The NOTES field will be created and will only hold the COMMENT.")
+                fields_and_data_dictionary["NOTES"] = comment
+
+        return fields_and_data_dictionary
+
+    def write(self, records, path):
+        """ Write an ADIF file containing all the QSOs in 'records'. The records are written as they are iterated over, so they can be streamed straight from a database cursor
+        (e.g. via Log.iter_records) without ever holding the whole log in memory. If the number of records is not known in advance, it is filled in once all the records have been written
+        (or omitted from the header, if the file is compressed).
+
+        :arg records: An iterable of QSO records to write (e.g. a list of dictionaries, or sqlite.Row objects). Only the standard ADIF fields are written, and empty fields are skipped.
+        :arg str path: The desired path of the ADIF file to write to. If it ends in '.adx' (or '.adx.gz'), the file is written as ADX (the XML version of ADIF). If it ends in '.gz', the file is compressed with gzip.
+        :returns: The number of records written.
+        :rtype: int
         :raises IOError: If the ADIF file cannot be written (e.g. due to lack of write permissions).
         """
 
         logging.debug("Writing records to an ADIF file...")
 
-        with open(path, mode="w", errors="replace") as f:  # Open file for writing
+        try:
+            count = len(records)
+        except TypeError:
+            count = None  # The records are being streamed from a generator or cursor.
+
+        adx = is_adx(path)
+        with open_file(path, mode="w", buffer_size=WRITE_BUFFER_SIZE, encoding="utf-8" if adx else None) as f:
 
             # First write a header containing program version, number of records, etc.
             dt = datetime.now()
-
-            f.write("""Amateur radio log file. Generated on %s. Contains %d record(s).
+            count_position = None
+            if(adx):
+                f.write("""<?xml version="1.0" encoding="UTF-8"?>
+<ADX>
+<HEADER>
+<ADIF_VER>%s</ADIF_VER>
+<PROGRAMID>PyQSO</PROGRAMID>
+<PROGRAMVERSION>1.1.0</PROGRAMVERSION>
+<CREATED_TIMESTAMP>%s</CREATED_TIMESTAMP>
+</HEADER>
+<RECORDS>\n""" % (ADIF_VERSION, dt.strftime("%Y%m%d %H%M%S")))
+            else:
+                f.write("Amateur radio log file. Generated on %s." % dt)
+                if(count is not None):
+                    f.write(" Contains %d record(s)." % count)
+                elif(not is_compressed(path)):
+                    # Leave room for the number of records, and fill it in later. This is not possible in a compressed file, so the number is simply omitted.
+                    f.write(" Contains ")
+                    count_position = f.tell()
+                    f.write(" " * RECORD_COUNT_WIDTH)
+                f.write("""
 
 <adif_ver:%d>%s
 <programid:5>PyQSO
 <programversion:5>1.1.0
-<eoh>\n""" % (dt, len(records), len(str(ADIF_VERSION)), ADIF_VERSION))
+<eoh>\n""" % (len(str(ADIF_VERSION)), ADIF_VERSION))
 
-            # Then write each record to the file.
+            # Then write each record to the file, a batch at a time.
+            n_record = 0
+            keys = None
+            batch = []
             for r in records:
-                for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
-                    if(not(field_name.lower() in list(r.keys()) or field_name.upper() in list(r.keys()))):
-                        # If the field_name does not exist in the record, then skip past it.
-                        # Only write out the fields that exist and that have some data in them.
-                        continue
-                    else:
-                        if((r[field_name] != "NULL") and (r[field_name] != "")):
-                            f.write("<%s:%d>%s\n" % (field_name.lower(), len(r[field_name]), r[field_name]))
-                f.write("<eor>\n")
+                if(keys is None or r.keys() != keys):
+                    # Work out which of the record's keys hold the standard ADIF fields (and the order to write them in) whenever a record has different keys to the previous one.
+                    keys = r.keys()
+                    columns = get_write_columns(keys)
+                    if(not isinstance(r, dict)):
+                        # Looking up the fields of an sqlite.Row object by position is much faster than looking them up by name.
+                        positions = dict([(key, i) for (i, key) in enumerate(keys)])
+                        columns = [(positions[key], field_name) for (key, field_name) in columns]
+                    if(not adx):
+                        columns = [(key, "<%s:" % field_name.lower()) for (key, field_name) in columns]
+                # Only write out the fields that have some data in them.
+                if(adx):
+                    batch.append("<RECORD>\n")
+                    for (key, field_name) in columns:
+                        data = r[key]
+                        if(data and data != "NULL"):
+                            batch.append("<%s>%s</%s>\n" % (field_name, escape(data), field_name))
+                    batch.append("</RECORD>\n")
+                else:
+                    for (key, specifier) in columns:
+                        data = r[key]
+                        if(data and data != "NULL"):
+                            batch.append("%s%d>%s\n" % (specifier, len(data), data))
+                    batch.append("<eor>\n")
+                n_record += 1
+                if(n_record % WRITE_BATCH_SIZE == 0):
+                    f.write("".join(batch))
+                    batch = []
+            f.write("".join(batch))
+
+            if(adx):
+                f.write("</RECORDS>\n</ADX>\n")
+            elif(count_position is not None):
+                f.seek(count_position)
+                f.write(("%d record(s)." % n_record).ljust(RECORD_COUNT_WIDTH))
 
             logging.debug("Finished writing records to the ADIF file.")
-            f.close()
 
-            logging.info("Wrote %d QSOs to %s in ADIF format." % (len(records), path))
+        logging.info("Wrote %d QSOs to %s in %s format." % (n_record, path, "ADX" if adx else "ADIF"))
 
-        return
+        return n_record
 
     def is_valid(self, field_name, data, data_type):
         """ Validate the data in a field with respect to the ADIF specification.
@@ -379,156 +721,10 @@ class ADIF:
         :returns: True or False to indicate whether the data is valid or not.
         :rtype: bool
         """
-
-        logging.debug("Validating the following data in field '%s': %s" % (field_name, data))
-
         # Allow an empty string or None, in case the user doesn't want
         # to fill in this field.
         if(not data):
             return True
-
-        if(data_type == "N"):
-            # Allow a decimal point before and/or after any numbers,
-            # but don't allow a decimal point on its own.
-            m = re.match(r"-?(([0-9]+\.?[0-9]*)|([0-9]*\.?[0-9]+))", data)
-            if(m is None):
-                # Did not match anything.
-                return False
-            else:
-                # Make sure we match the whole string,
-                # otherwise there may be an invalid character after the match.
-                return (m.group(0) == data)
-
-        elif(data_type == "B"):
-            # Boolean
-            m = re.match(r"(Y|N)", data)
-            if(m is None):
-                return False
-            else:
-                return (m.group(0) == data)
-
-        elif(data_type == "D"):
-            # Date
-            pattern = re.compile(r"([0-9]{4})")
-            m_year = pattern.match(data, 0)
-            if((m_year is None) or (int(m_year.group(0)) < 1930)):
-                # Did not match anything.
-                return False
-            else:
-                pattern = re.compile(r"([0-9]{2})")
-                m_month = pattern.match(data, 4)
-                if((m_month is None) or int(m_month.group(0)) > 12 or int(m_month.group(0)) < 1):
-                    # Did not match anything.
-                    return False
-                else:
-                    pattern = re.compile(r"([0-9]{2})")
-                    m_day = pattern.match(data, 6)
-                    days_in_month = calendar.monthrange(int(m_year.group(0)), int(m_month.group(0)))
-                    if((m_day is None) or int(m_day.group(0)) > days_in_month[1] or int(m_day.group(0)) < 1):
-                        # Did not match anything.
-                        return False
-                    else:
-                        # Make sure we match the whole string,
-                        # otherwise there may be an invalid character after the match.
-                        return (len(data) == 8)
-
-        elif(data_type == "T"):
-            # Time
-            pattern = re.compile(r"([0-9]{2})")
-            m_hour = pattern.match(data, 0)
-            if((m_hour is None) or (int(m_hour.group(0)) < 0) or (int(m_hour.group(0)) > 23)):
-                # Did not match anything.
-                return False
-            else:
-                pattern = re.compile(r"([0-9]{2})")
-                m_minutes = pattern.match(data, 2)
-                if((m_minutes is None) or int(m_minutes.group(0)) < 0 or int(m_minutes.group(0)) > 59):
-                    # Did not match anything.
-                    return False
-                else:
-                    if(len(data) == 4):
-                        # HHMM format
-                        return True
-                    pattern = re.compile(r"([0-9]{2})")
-                    m_seconds = pattern.match(data, 4)
-                    if((m_seconds is None) or int(m_seconds.group(0)) < 0 or int(m_seconds.group(0)) > 59):
-                        # Did not match anything.
-                        return False
-                    else:
-                        # Make sure we match the whole string,
-                        # otherwise there may be an invalid character after the match.
-                        return (len(data) == 6)  # HHMMSS format
-
-        # FIXME: Need to make sure that the "S" and "M" data types accept ASCII-only characters
-        # in the range 32-126 inclusive.
-        elif(data_type == "S"):
-            # String
-            m = re.match(r"(.+)", data)
-            if(m is None):
-                return False
-            else:
-                return (m.group(0) == data)
-
-        elif(data_type == "I"):
-            # IntlString
-            m = re.match(r"(.+)", data, re.UNICODE)
-            if(m is None):
-                return False
-            else:
-                return (m.group(0) == data)
-
-        elif(data_type == "G"):
-            # IntlMultilineString
-            m = re.match(r"(.+(\r\n)*.*)", data, re.UNICODE)
-            if(m is None):
-                return False
-            else:
-                return (m.group(0) == data)
-
-        elif(data_type == "M"):
-            # MultilineString
-            # m = re.match(r"(.+(\r\n)*.*)", data)
-            # if(m is None):
-            #   return False
-            # else:
-            #   return (m.group(0) == data)
-            return True
-
-        elif(data_type == "L"):
-            # Location
-            pattern = re.compile(r"([EWNS]{1})", re.IGNORECASE)
-            m_directional = pattern.match(data, 0)
-            if(m_directional is None):
-                # Did not match anything.
-                return False
-            else:
-                pattern = re.compile(r"([0-9]{3})")
-                m_degrees = pattern.match(data, 1)
-                if((m_degrees is None) or int(m_degrees.group(0)) < 0 or int(m_degrees.group(0)) > 180):
-                    # Did not match anything.
-                    return False
-                else:
-                    pattern = re.compile(r"([0-9]{2}\.[0-9]{3})")
-                    m_minutes = pattern.match(data, 4)
-                    if((m_minutes is None) or float(m_minutes.group(0)) < 0 or float(m_minutes.group(0)) > 59.999):
-                        # Did not match anything.
-                        return False
-                    else:
-                        # Make sure we match the whole string,
-                        # otherwise there may be an invalid character after the match.
-                        return (len(data) == 10)
-
-        elif(data_type == "E" or data_type == "A"):
-            # Enumeration, AwardList.
-            if(field_name == "MODE"):
-                return (data in list(MODES.keys()))
-            elif(field_name == "SUBMODE"):
-                submodes = [submode for mode in list(MODES.keys()) for submode in MODES[mode]]
-                return (data in submodes)
-            elif(field_name == "BAND"):
-                return (data in BANDS)
-            else:
-                return True
-
-        else:
-            return True
+        if(AVAILABLE_FIELD_NAMES_TYPES.get(field_name) == data_type):
+            return FIELD_VALIDATORS[field_name](data)
+        return get_validator(field_name, data_type)(data)
@@ -19,13 +19,61 @@
 
 from gi.repository import Gtk
 import logging
+import re
 import sqlite3 as sqlite
 
+from pyqso.dx_spots import PHONE_MODES
+from pyqso.task_runner import Task, TaskCancelled
+
+# The DXCC entity code at the start of a DXCC field, in the same way as CAST(dxcc AS INTEGER) finds it in get_counts.
+ENTITY_CODE = re.compile(r"[ \t\n\v\f\r]*\+?([0-9]+)")
+
+
+def get_entity(dxcc):
+    """ Identify the DXCC entity of a QSO from its DXCC field, in the same way as get_counts does.
+
+    :arg str dxcc: The data in the DXCC field.
+    :returns: The DXCC entity code, or None if it is not known (or is 0, which means that the QSO is not with any DXCC entity).
+    :rtype: int
+    """
+    m = ENTITY_CODE.match(dxcc or "")
+    if(m is None):
+        return None
+    code = int(m.group(1))
+    return code if code > 0 else None
+
+
+def get_counts(connection, log_names):
+    """ Count the QSOs in several logs at once, for each band, mode and DXCC entity. Only the DXCC entity code identifies an entity, since a country name may refer to the same entity
+    as a code (or to none at all). QSOs whose DXCC field is not filled in (see the callsign enrichment tool) are counted with an entity of None.
+
+    :arg connection: The connection to the logbook.
+    :arg list log_names: The names of the logs.
+    :returns: A list of (band, mode, entity, number of QSOs) tuples, with lower case bands and upper case modes. QSOs without a band or mode are not counted.
+    :rtype: list
+    :raises sqlite.Error: If the QSOs could not be counted.
+    """
+    if(len(log_names) == 0):
+        return []
+    query = " UNION ALL ".join(["SELECT band, mode, dxcc FROM %s" % log_name for log_name in log_names])
+    query = """SELECT lower(band), upper(mode), CASE WHEN CAST(dxcc AS INTEGER) > 0 THEN CAST(dxcc AS INTEGER) END, Count(*)
+FROM (%s)
+WHERE band IS NOT NULL AND mode IS NOT NULL AND mode != ''
+GROUP BY 1, 2, 3""" % query
+    with connection:
+        c = connection.cursor()
+        c.row_factory = None
+        c.execute(query)
+        return c.fetchall()
+
 
 class Awards:
 
     """ A tool for tracking progress towards an award. Currently this only supports the DXCC award.
-    For more information visit http://www.arrl.org/dxcc """
+    For more information visit http://www.arrl.org/dxcc
+
+    For each band and class of mode, the number of QSOs and the number of distinct DXCC entities worked are counted. The counts are built from scratch with a single aggregate query
+    (see the count method, or count_in_background for large logbooks), and are then kept up-to-date as records are added, edited and deleted by listening to the signals emitted by each Log. """
 
     def __init__(self, application):
         """ Set up a table for progress tracking purposes.
@@ -41,7 +89,18 @@ class Awards:
         self.bands = ["70cm", "2m", "6m", "10m", "12m", "15m", "17m", "20m", "30m", "40m", "80m", "160m"]
         self.modes = ["Phone", "CW", "Digital", "Mixed"]
 
-        data_types = [str] + [int]*len(self.bands)
+        # The number of QSOs for each mode and band.
+        self.qsos = []
+        # The number of QSOs with each DXCC entity, for each mode and band.
+        self.entities = []
+        # The logs whose records are being counted, and the IDs of the signal handlers connected to each one.
+        self.handlers = []
+        # The task which is counting the QSOs in the background (if any), and whether the QSOs need counting again once it has finished because records were changed in the meantime.
+        self.counting = None
+        self.recount = False
+
+        # Each cell shows the number of QSOs, followed by the number of distinct DXCC entities in brackets.
+        data_types = [str] + [str]*len(self.bands)
         self.awards = Gtk.ListStore(*data_types)
 
         # The main table for the awards.
@@ -59,6 +118,7 @@ class Awards:
             column.set_min_width(40)
             column.set_clickable(False)
             self.treeview.append_column(column)
+        self.treeview.set_tooltip_text("QSOs (DXCC entities)")
 
         # Show the table in the Awards tab.
         self.builder.get_object("awards").add(self.treeview)
@@ -69,7 +129,7 @@ class Awards:
         self.count(self.application.logbook)
 
     def count(self, logbook):
-        """ Update the table for progress tracking.
+        """ Count the band/mode combinations from scratch and update the table for progress tracking. The logs in the logbook are also monitored for any subsequent changes.
 
         :arg logbook: The logbook containing logs which in turn contain QSOs.
         :returns: A list of lists containing the QSO counts for different modes and bands.
@@ -78,38 +138,183 @@ class Awards:
 
         logging.debug("Counting the band/mode combinations for the awards table...")
 
+        self.monitor(logbook.logs)
+
+        # Count the QSOs in all the logs at once.
+        try:
+            counts = get_counts(logbook.connection, [log.name for log in logbook.logs])
+        except sqlite.Error as e:
+            logging.error("Could not update the awards table because of a database error.")
+            logging.exception(e)
+            counts = []
+        self.update(counts)
+
+        logging.debug("Awards table updated.")
+        return [list(qsos) for qsos in self.qsos]
+
+    def count_in_background(self, logbook):
+        """ Count the band/mode combinations from scratch like the count method, but in a worker thread (using the logbook's task runner) so that a large logbook does not hold up the user interface. The table is updated once the counting has finished.
+
+        :arg logbook: The logbook containing logs which in turn contain QSOs.
+        """
+        runner = logbook.runner
+        if(runner is None):
+            self.count(logbook)
+            return
+
+        self.monitor(logbook.logs)
+
+        if(self.is_counting(runner)):
+            # The records may have changed since the counting started, so count them again once it has finished.
+            self.recount = True
+            return
+        self.recount = False
+
+        def on_complete(counts):
+            self.counting = None
+            if(self.recount):
+                self.count_in_background(logbook)
+            else:
+                self.update(counts)
+                logging.debug("Awards table updated.")
+            return
+
+        def on_error(e):
+            self.counting = None
+            if(not isinstance(e, TaskCancelled)):
+                logging.error("Could not update the awards table because of a database error.")
+            return
+
+        logging.debug("Counting the band/mode combinations for the awards table in the background...")
+        log_names = [log.name for log in logbook.logs]
+        self.counting = runner.submit(Task("Counting the QSOs for the awards table", lambda task, connection: get_counts(connection, log_names), on_complete=on_complete, on_error=on_error))
+        return
+
+    def is_counting(self, runner):
+        """ Return True if the QSOs are being counted in the background by a given task runner.
+
+        :arg TaskRunner runner: The task runner.
+        :rtype: bool
+        """
+        return (self.counting is not None and self.counting in runner.tasks)
+
+    def update(self, counts):
+        """ Replace the counts with new ones, and show them in the awards table.
+
+        :arg list counts: The (band, mode, entity, number of QSOs) tuples, as returned by get_counts.
+        """
         # Wipe everything and start again.
-        self.awards.clear()
+        self.qsos = [[0]*len(self.bands) for i in range(0, len(self.modes))]
+        self.entities = [[{} for j in range(0, len(self.bands))] for i in range(0, len(self.modes))]
+        for (band, mode, entity, n) in counts:
+            self.tally(band, mode, entity, n)
+        self.refresh()
+        return
 
-        # For each mode, add a new list for holding the totals, and initialise the values to zero.
-        count = []
-        for i in range(0, len(self.bands)):
-            count.append([0]*len(self.bands))
-
-        for log in logbook.logs:
-            try:
-                records = log.records
-                for r in records:
-                    if r["BAND"] is not None and r["MODE"] is not None:
-                        if r["BAND"].lower() in self.bands and r["MODE"] != "":
-                            band = self.bands.index(r["BAND"].lower())
-                            # Phone modes
-                            if r["MODE"].upper() in ["FM", "AM", "SSB", "SSTV"]:
-                                count[0][band] += 1
-                            elif r["MODE"].upper() == "CW":
-                                count[1][band] += 1
-                            else:
-                                # FIXME: This assumes that all the other modes in the ADIF list are digital modes. Is this the case?
-                                count[2][band] += 1
-                            count[3][band] += 1  # Keep the total of each column in the "Mixed" mode.
-
-            except sqlite.Error as e:
-                logging.error("Could not update the awards table for '%s' because of a database error." % log.name)
-                logging.exception(e)
-
-        # Insert the rows containing the totals.
+    def monitor(self, logs):
+        """ Listen for changes to the records in a list of logs, and stop listening to any other logs.
+
+        :arg list logs: The logs to monitor.
+        """
+        for (log, handler_ids) in self.handlers:
+            if(log not in logs):
+                for handler_id in handler_ids:
+                    log.disconnect(handler_id)
+        monitored = [log for (log, handler_ids) in self.handlers if log in logs]
+        self.handlers = [(log, handler_ids) for (log, handler_ids) in self.handlers if log in logs]
+
+        for log in logs:
+            if(log not in monitored):
+                handler_ids = [log.connect("record-added", self.on_record_added),
+                               log.connect("record-edited", self.on_record_edited),
+                               log.connect("record-deleted", self.on_record_deleted),
+                               log.connect("records-changed", self.on_records_changed)]
+                self.handlers.append((log, handler_ids))
+        return
+
+    def get_mode_index(self, mode):
+        """ Return the index of the row (in the awards table) for a given mode, not including the Mixed row.
+
+        :arg str mode: The (upper case) name of the mode.
+        :returns: The index of the Phone, CW or Digital row.
+        :rtype: int
+        """
+        if(mode in PHONE_MODES):
+            return 0
+        elif(mode == "CW"):
+            return 1
+        else:
+            # FIXME: This assumes that all the other modes in the ADIF list are digital modes. Is this the case?
+            return 2
+
+    def tally(self, band, mode, entity, n):
+        """ Add to (or subtract from) the counts for a given band, mode and DXCC entity. QSOs with unknown bands and modes are ignored.
+
+        :arg str band: The band.
+        :arg str mode: The mode.
+        :arg int entity: The DXCC entity code. This is None if the DXCC entity is not known.
+        :arg int n: The number of QSOs to add to the counts. Use a negative number to subtract from the counts.
+        """
+        if(band is None or mode is None or mode == ""):
+            return
+        band = band.lower()
+        if(band not in self.bands):
+            return
+        b = self.bands.index(band)
+        for m in [self.get_mode_index(mode.upper()), len(self.modes)-1]:  # Keep the total of each column in the "Mixed" mode.
+            self.qsos[m][b] += n
+            if(entity):
+                entities = self.entities[m][b]
+                entities[entity] = entities.get(entity, 0) + n
+                if(entities[entity] <= 0):
+                    del entities[entity]
+        return
+
+    def tally_record(self, record, n):
+        """ Add a record to (or subtract a record from) the counts.
+
+        :arg dict record: The record, with upper case field names.
+        :arg int n: Use 1 to add the record to the counts, or -1 to subtract it.
+        """
+        self.tally(record.get("BAND"), record.get("MODE"), get_entity(record.get("DXCC")), n)
+        return
+
+    def refresh(self):
+        """ Show the current counts in the awards table. """
+        self.awards.clear()
         for i in range(0, len(self.modes)):
-            self.awards.append([self.modes[i]] + count[i])
+            cells = ["%d (%d)" % (self.qsos[i][j], len(self.entities[i][j])) for j in range(0, len(self.bands))]
+            self.awards.append([self.modes[i]] + cells)
+        return
 
-        logging.debug("Awards table updated.")
-        return count
+    def on_record_added(self, log, record):
+        """ Add a new record to the counts. """
+        if(self.counting is not None):
+            self.recount = True
+        self.tally_record(record, 1)
+        self.refresh()
+        return
+
+    def on_record_edited(self, log, old_record, new_record):
+        """ Update the counts if a record's band, mode or DXCC entity has changed. """
+        fields = ["BAND", "MODE", "DXCC"]
+        if([old_record.get(f) for f in fields] != [new_record.get(f) for f in fields]):
+            if(self.counting is not None):
+                self.recount = True
+            self.tally_record(old_record, -1)
+            self.tally_record(new_record, 1)
+            self.refresh()
+        return
+
+    def on_record_deleted(self, log, record):
+        """ Remove a deleted record from the counts. """
+        if(self.counting is not None):
+            self.recount = True
+        self.tally_record(record, -1)
+        self.refresh()
+        return
+
+    def on_records_changed(self, log):
+        """ Count everything from scratch, since many records have changed. """
+        self.count_in_background(self.application.logbook)
+        return
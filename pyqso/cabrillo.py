@@ -34,9 +34,9 @@ class Cabrillo:
         return
 
     def write(self, records, path, contest="", mycall=""):
-        """ Write a list of QSO records to a file in the Cabrillo format.
+        """ Write QSO records to a file in the Cabrillo format.
 
-        :arg list records: The list of QSO records to write.
+        :arg records: An iterable (e.g. a list, or a generator such as Log.iter_records) of the QSO records to write.
         :arg str path: The desired path of the Cabrillo file to write to.
         :arg str contest: The name of the contest.
         :arg str mycall: The callsign used during the contest.
@@ -54,6 +54,7 @@ class Cabrillo:
             f.write("""CONTEST: %s\n""" % (contest))
 
             # Write each record to the file.
+            n_record = 0
             for r in records:
 
                 # Frequency. Note that this must be in kHz. The frequency is stored in MHz in the database, so it's converted to kHz here.
@@ -96,10 +97,11 @@ class Cabrillo:
                 t = "0"
 
                 f.write("""QSO: %s %s %s %s %s %s %s %s %s\n""" % (freq, mo, date, time, call_sent, exch_sent, call_rcvd, exch_rcvd, t))
+                n_record += 1
 
             # Footer
             f.write("END-OF-LOG:")
 
-            logging.info("Wrote %d QSOs to %s in Cabrillo format." % (len(records), path))
+            logging.info("Wrote %d QSOs to %s in Cabrillo format." % (n_record, path))
 
         return
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2013-2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import json
+import time
+import hashlib
+import threading
+import sqlite3 as sqlite
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from pyqso.callsign_lookup import strip
+
+# The fields which are filled in by an enrichment job (if they are empty).
+ENRICHED_FIELD_NAMES = ["NAME", "COUNTRY", "DXCC", "CQZ", "ITUZ", "IOTA"]
+# The directory in which the progress of interrupted enrichment jobs is stored, so that they can be resumed.
+ENRICHMENT_STATE_DIRECTORY = os.path.expanduser("~/.cache/pyqso/enrichment")
+# The maximum number of lookups sent to the callsign database's server per second (on average).
+LOOKUPS_PER_SECOND = 5
+# The maximum number of lookups in progress at any one time.
+MAXIMUM_CONCURRENT_LOOKUPS = 4
+# The number of records updated in the database at a time.
+BATCH_SIZE = 500
+# The number of consecutive failed lookups after which a job gives up (e.g. because the login details are wrong, or the server is unreachable).
+MAXIMUM_CONSECUTIVE_FAILURES = 10
+
+
+class TokenBucket:
+
+    """ A token bucket rate limiter, which allows short bursts of requests while limiting the average request rate. This is thread-safe. """
+
+    def __init__(self, rate, capacity=None):
+        """ Set up a full token bucket.
+
+        :arg float rate: The number of tokens added to the bucket per second.
+        :arg float capacity: The maximum number of tokens in the bucket (i.e. the maximum size of a burst). By default, this is the same as the rate.
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        return
+
+    def acquire(self):
+        """ Take a token from the bucket, waiting until one is available if necessary. """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated)*self.rate)
+                self.updated = now
+                if(self.tokens >= 1):
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens)/self.rate
+            time.sleep(delay)
+
+
+class CallsignEnrichment:
+
+    """ A batch job which fills in the empty NAME, COUNTRY, DXCC, CQZ, ITUZ and IOTA fields of all the records in a log using an online callsign database.
+
+    Each distinct callsign (after removing any prefix/suffix) is only looked up once, however many QSOs were made with it. The lookups are performed concurrently
+    (up to a limit) and rate-limited, and repeated lookups are served from the lookup service's cache. The records are updated in batches, and only empty fields are
+    ever filled in. The callsigns that have been dealt with are recorded after each batch, so that an interrupted job carries on where it left off when it is run again. """
+
+    def __init__(self, path, log_name, service, field_names=ENRICHED_FIELD_NAMES, ignore_prefix_suffix=True, rate=LOOKUPS_PER_SECOND,
+                 maximum_concurrent=MAXIMUM_CONCURRENT_LOOKUPS, batch_size=BATCH_SIZE, state_path=None, write_lock=None):
+        """ Set up a new enrichment job.
+
+        :arg str path: The path to the logbook's database file. The job uses its own connection to the database, so that it can be run in a separate thread.
+        :arg str log_name: The name of the log (i.e. the database table name).
+        :arg CallsignLookupService service: The callsign lookup service.
+        :arg list field_names: The names of the fields to fill in.
+        :arg bool ignore_prefix_suffix: True if callsign prefixes/suffixes should be removed prior to looking up the callsigns, False otherwise.
+        :arg float rate: The maximum number of lookups sent to the server per second (on average). Lookups served from the cache are not limited.
+        :arg int maximum_concurrent: The maximum number of lookups in progress at any one time.
+        :arg int batch_size: The number of records updated in the database at a time.
+        :arg str state_path: The path to the file in which the job's progress is stored. By default, this is determined from the logbook's path, the log's name and the callsign database.
+        :arg write_lock: An optional lock which is held while each batch of records is updated, so that the updates wait for (rather than fail because of) any other writes to the logbook, e.g. by the logbook's TaskRunner.
+        """
+        self.path = path
+        self.connection = None
+        self.log_name = log_name
+        self.service = service
+        self.field_names = field_names
+        self.ignore_prefix_suffix = ignore_prefix_suffix
+        self.bucket = TokenBucket(rate)
+        self.maximum_concurrent = maximum_concurrent
+        self.batch_size = batch_size
+        self.write_lock = write_lock
+        if(state_path is None):
+            state_path = self.get_state_path()
+        self.state_path = state_path
+
+        self.cancelled = threading.Event()
+        # The error that stopped the job (if any).
+        self.error_message = None
+        return
+
+    def get_state_path(self):
+        """ Determine the path to the file in which the job's progress is stored.
+
+        :returns: The path to the file.
+        :rtype: str
+        """
+        key = "%s\n%s\n%s" % (os.path.abspath(self.path), self.log_name, self.service.database)
+        return os.path.join(ENRICHMENT_STATE_DIRECTORY, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def load_state(self):
+        """ Load the callsigns which have been dealt with already by an interrupted run of the job.
+
+        :returns: The set of callsigns.
+        :rtype: set
+        """
+        try:
+            with open(self.state_path) as f:
+                return set(json.load(f))
+        except (OSError, ValueError):
+            return set()
+
+    def save_state(self, done):
+        """ Record the callsigns which have been dealt with so far.
+
+        :arg set done: The set of callsigns.
+        """
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            # Write to a temporary file first, so that the state is not lost if PyQSO is interrupted part-way through writing it.
+            with open(self.state_path + ".tmp", "w") as f:
+                json.dump(sorted(done), f)
+            os.replace(self.state_path + ".tmp", self.state_path)
+        except OSError as e:
+            logging.warning("Could not save the progress of the callsign enrichment job.")
+            logging.exception(e)
+        return
+
+    def clear_state(self):
+        """ Forget about the progress of the job (e.g. once the job is complete). """
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+        return
+
+    def get_pending(self):
+        """ Find the records which have at least one empty field that could be filled in, and group their ids by callsign.
+
+        :returns: The field names which can be filled in (i.e. those which have a column in the log's database table), and a dictionary of lists of record ids keyed by callsign.
+        :rtype: tuple
+        :raises sqlite.Error: If the records could not be retrieved from the database.
+        """
+        column_names = [row[1].lower() for row in self.connection.execute("PRAGMA table_info(%s)" % self.log_name)]
+        field_names = [field_name for field_name in self.field_names if field_name.lower() in column_names]
+        if(not field_names):
+            return field_names, {}
+        condition = " OR ".join(["IFNULL(%s, '')=''" % field_name.lower() for field_name in field_names])
+        c = self.connection.cursor()
+        c.row_factory = None
+        c.execute("SELECT id, call FROM %s WHERE IFNULL(call, '')!='' AND (%s)" % (self.log_name, condition))
+        pending = {}
+        for (index, full_callsign) in c:
+            callsign = (strip(full_callsign) if self.ignore_prefix_suffix else full_callsign).upper()
+            pending.setdefault(callsign, []).append(index)
+        return field_names, pending
+
+    def lookup(self, callsign):
+        """ Look up a callsign, waiting for the rate limiter if the result is not cached. This is called from the job's worker threads.
+
+        :arg str callsign: The callsign (after any prefix/suffix stripping).
+        :returns: The field data found by the lookup, and an error message if the lookup failed (otherwise None). If the job was cancelled before the lookup could be made, None is returned instead.
+        :rtype: tuple
+        """
+        if(self.service.cache is None or self.service.cache.get(self.service.database, callsign) is None):
+            self.bucket.acquire()
+        if(self.cancelled.is_set()):
+            return None
+        return self.service.lookup(callsign, ignore_prefix_suffix=False)
+
+    def run(self, progress=None):
+        """ Run the job. This blocks until the job is complete (or is cancelled), so it should usually be run in a separate thread.
+
+        :arg progress: An optional function which is called with the number of callsigns dealt with so far, the total number of callsigns, and the number of records updated so far, after each lookup.
+        :returns: The number of records that were updated.
+        :rtype: int
+        :raises sqlite.Error: If the records could not be retrieved or updated.
+        """
+        self.connection = sqlite.connect(self.path, timeout=30)
+        try:
+            return self.enrich(progress)
+        finally:
+            self.connection.close()
+            self.connection = None
+
+    def enrich(self, progress=None):
+        """ Look up the callsigns and update the records. This is called by the run method, once the job's database connection has been opened.
+
+        :arg progress: An optional function which is called with the number of callsigns dealt with so far, the total number of callsigns, and the number of records updated so far, after each lookup.
+        :returns: The number of records that were updated.
+        :rtype: int
+        :raises sqlite.Error: If the records could not be retrieved or updated.
+        """
+        (field_names, pending) = self.get_pending()
+        done = self.load_state()
+        callsigns = sorted(set(pending.keys()) - done)
+        total = len(callsigns) + len(done & set(pending.keys()))
+        logging.debug("Enriching %d callsign(s) in log '%s'..." % (len(callsigns), self.log_name))
+
+        # Only fill in empty fields, and only with non-empty data.
+        assignments = ", ".join(["{0}=COALESCE(NULLIF({0}, ''), NULLIF(?, ''), {0})".format(field_name.lower()) for field_name in field_names])
+        query = "UPDATE %s SET %s WHERE id=?" % (self.log_name, assignments)
+
+        count = total - len(callsigns)
+        updated = 0
+        failures = 0  # The number of consecutive failed lookups.
+        failed = 0
+        batch = []
+        batch_done = set()
+
+        def flush():
+            if(batch):
+                with (self.write_lock if(self.write_lock is not None) else nullcontext()), self.connection:
+                    self.connection.executemany(query, batch)
+            done.update(batch_done)
+            self.save_state(done)
+            del batch[:]
+            batch_done.clear()
+
+        remaining = iter(callsigns)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.maximum_concurrent) as executor:
+            while True:
+                # Keep a bounded number of lookups in flight, rather than queuing up every callsign at once.
+                while(len(running) < 2*self.maximum_concurrent and not self.cancelled.is_set()):
+                    callsign = next(remaining, None)
+                    if(callsign is None):
+                        break
+                    running[executor.submit(self.lookup, callsign)] = callsign
+                if(not running):
+                    break
+
+                (finished, unfinished) = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    callsign = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logging.exception(e)
+                        result = ({}, str(e))
+                    if(result is None):
+                        continue
+                    (fields_and_data, error_message) = result
+
+                    if(error_message and "not found" not in error_message.lower()):
+                        # Try this callsign again next time the job is run.
+                        failures += 1
+                        failed += 1
+                        if(failures >= MAXIMUM_CONSECUTIVE_FAILURES):
+                            logging.error("Giving up on the callsign enrichment job after %d failed lookups." % failures)
+                            self.error_message = error_message
+                            self.cancelled.set()
+                        continue
+                    failures = 0
+
+                    values = [fields_and_data.get(field_name, "") or "" for field_name in field_names]
+                    if(any(values)):
+                        for index in pending[callsign]:
+                            batch.append(values + [index])
+                        updated += len(pending[callsign])
+                    batch_done.add(callsign)
+                    count += 1
+                    if(len(batch) >= self.batch_size or len(batch_done) >= self.batch_size):
+                        flush()
+                    if(progress):
+                        progress(count, total, updated)
+
+        flush()
+        if(self.cancelled.is_set()):
+            logging.debug("Callsign enrichment of log '%s' stopped. %d record(s) updated." % (self.log_name, updated))
+        elif(failed):
+            logging.warning("%d callsign(s) in log '%s' could not be looked up. These will be looked up again the next time the job is run." % (failed, self.log_name))
+        else:
+            self.clear_state()
+            logging.debug("Callsign enrichment of log '%s' complete. %d record(s) updated." % (self.log_name, updated))
+        return updated
+
+    def cancel(self):
+        """ Stop the job as soon as possible. Any lookups in progress are completed, and their results are kept, so the job can be resumed later. """
+        self.cancelled.set()
+        return
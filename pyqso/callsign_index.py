@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2013-2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+
+
+class CallsignIndex:
+
+    """ An in-memory index of the callsigns in a log, used to quickly find the records whose callsign contains a given (case-insensitive) expression.
+
+    Each distinct callsign is indexed by the trigrams (i.e. the substrings of three characters) that it contains. An expression of three or more characters
+    only needs to be checked against the callsigns that contain all of its trigrams. """
+
+    def __init__(self):
+        """ Set up an empty index. """
+        # The callsign of each record, keyed by the record's index.
+        self.callsigns = {}
+        # The indices of the records with a given callsign.
+        self.indices = {}
+        # The distinct callsigns containing a given trigram.
+        self.trigrams = {}
+        return
+
+    def __len__(self):
+        return len(self.callsigns)
+
+    def build(self, records):
+        """ Index a collection of records from scratch.
+
+        :arg records: An iterable of (index, callsign) pairs.
+        """
+        self.callsigns.clear()
+        self.indices.clear()
+        self.trigrams.clear()
+        for (index, callsign) in records:
+            self.add(index, callsign)
+        logging.debug("Indexed %d callsigns." % len(self.indices))
+        return
+
+    def add(self, index, callsign):
+        """ Add a record's callsign to the index.
+
+        :arg int index: The index of the record.
+        :arg str callsign: The record's callsign.
+        """
+        callsign = (callsign or "").upper()
+        self.callsigns[index] = callsign
+        indices = self.indices.get(callsign)
+        if(indices is None):
+            # This is a new callsign, so index its trigrams.
+            self.indices[callsign] = set([index])
+            for trigram in self.get_trigrams(callsign):
+                self.trigrams.setdefault(trigram, set()).add(callsign)
+        else:
+            indices.add(index)
+        return
+
+    def remove(self, index):
+        """ Remove a record's callsign from the index. Nothing happens if the record is not in the index.
+
+        :arg int index: The index of the record.
+        """
+        callsign = self.callsigns.pop(index, None)
+        if(callsign is None):
+            return
+        indices = self.indices[callsign]
+        indices.discard(index)
+        if(len(indices) == 0):
+            # No other records have this callsign.
+            del self.indices[callsign]
+            for trigram in self.get_trigrams(callsign):
+                callsigns = self.trigrams[trigram]
+                callsigns.discard(callsign)
+                if(len(callsigns) == 0):
+                    del self.trigrams[trigram]
+        return
+
+    def update(self, index, callsign):
+        """ Change the callsign of a record in the index.
+
+        :arg int index: The index of the record.
+        :arg str callsign: The record's new callsign.
+        """
+        self.remove(index)
+        self.add(index, callsign)
+        return
+
+    def matches(self, index, expression):
+        """ Determine whether a record's callsign contains a given expression.
+
+        :arg int index: The index of the record.
+        :arg str expression: The (case-insensitive) expression to look for.
+        :returns: True if the callsign contains the expression. Otherwise returns False.
+        :rtype: bool
+        """
+        return expression.upper() in self.callsigns.get(index, "")
+
+    def search(self, expression):
+        """ Find the records whose callsign contains a given expression.
+
+        :arg str expression: The (case-insensitive) expression to look for.
+        :returns: The set of indices of the matching records.
+        :rtype: set
+        """
+        expression = expression.upper()
+        trigrams = self.get_trigrams(expression)
+        if(trigrams):
+            # Only the callsigns containing all of the expression's trigrams can contain the expression itself.
+            candidates = sorted([self.trigrams.get(trigram, set()) for trigram in trigrams], key=len)
+            callsigns = candidates[0].intersection(*candidates[1:])
+        else:
+            callsigns = self.indices.keys()
+
+        result = set()
+        for callsign in callsigns:
+            if(expression in callsign):
+                result.update(self.indices[callsign])
+        return result
+
+    @staticmethod
+    def get_trigrams(s):
+        """ Return the substrings of three characters in a given string.
+
+        :arg str s: The string.
+        :returns: The set of trigrams. This is empty if the string is shorter than three characters.
+        :rtype: set
+        """
+        return set([s[i:i+3] for i in range(len(s)-2)])
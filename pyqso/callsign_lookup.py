@@ -18,74 +18,173 @@
 #    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import os
+import json
+import time
+import threading
 try:
     import http.client as http_client
 except ImportError:
     import httplib as http_client
-from xml.dom import minidom
+from xml.etree import ElementTree
 try:
     from urllib.parse import quote
 except ImportError:
     from urllib import quote
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import sqlite3 as sqlite
+import base64
+from concurrent.futures import ThreadPoolExecutor, Future
 
 from pyqso.auxiliary_dialogs import error
-
-
-class CallsignLookupQRZ:
-
-    """ Use qrz.com to lookup details about a particular callsign. """
-
-    def __init__(self, parent):
+from pyqso.preferences import get_preferences
+
+# The database in which the results of callsign lookups are cached.
+CALLSIGN_LOOKUP_CACHE_FILE = os.path.expanduser("~/.cache/pyqso/callsign_lookup.db")
+# The default number of seconds for which the result of a callsign lookup is cached.
+TIME_TO_LIVE = 30*86400
+# The maximum number of connections that are kept open to each callsign database server.
+MAXIMUM_CONNECTIONS = 4
+# The number of seconds to wait for a callsign database server to respond.
+TIMEOUT = 10
+
+
+def parse(data, tags):
+    """ Extract the text of the first element with each of the given tag names from an XML document, in a single pass with a streaming parser.
+    Any XML namespaces are ignored.
+
+    :arg bytes data: The XML document.
+    :arg set tags: The names of the tags of interest.
+    :returns: The text of the first element with each tag name that was found (keyed by tag name), and the set of all the tag names found in the document.
+    :rtype: tuple
+    :raises ElementTree.ParseError: If the XML document is malformed.
+    """
+    parser = ElementTree.XMLPullParser(events=("end",))
+    parser.feed(data)
+    parser.close()
+    found = {}
+    seen = set()
+    for (event, element) in parser.read_events():
+        tag = element.tag.rsplit("}", 1)[-1]  # Remove the namespace.
+        seen.add(tag)
+        if(tag in tags and tag not in found):
+            found[tag] = element.text or ""
+        element.clear()
+    return found, seen
+
+
+class CallsignLookup:
+
+    """ The base class of the callsign lookup handlers. Each handler keeps a persistent (keep-alive) connection to the callsign database's XML server,
+    and re-uses its session key for every lookup. The session is renewed automatically if it expires. """
+
+    # The callsign database's name, server, and whether HTTPS is used to connect to the server. These are overridden by each handler.
+    DATABASE = None
+    SERVER = None
+    SECURE = False
+
+    def __init__(self, parent, server=None, secure=None):
         """ Initialise a new callsign lookup handler.
 
-        :arg parent: The parent Gtk dialog.
+        :arg parent: The parent Gtk dialog, used to display any errors. If None, errors are only logged (and are available via the error_message attribute), which allows the handler to be used from a worker thread.
+        :arg str server: The address (host[:port]) of the XML server. By default, the callsign database's own server is used.
+        :arg bool secure: True if HTTPS should be used to connect to the server. By default, this depends on the callsign database.
         """
         self.parent = parent
+        self.server = server if server is not None else self.SERVER
+        self.secure = secure if secure is not None else self.SECURE
         self.connection = None
         self.session_key = None
+        self.username = None
+        self.password = None
+        self.error_message = None
+        return
+
+    def report_error(self, message):
+        """ Report an error to the user (or just log it, if there is no parent dialog).
+
+        :arg str message: The error message.
+        """
+        self.error_message = message
+        if(self.parent is not None):
+            error(parent=self.parent, message=message)
+        else:
+            logging.error(message)
+        return
+
+    def request(self, path):
+        """ Send a GET request to the XML server over the persistent connection, opening the connection first if necessary. If the server has closed the connection in the meantime, the request is sent again over a new connection.
+
+        :arg str path: The path (including the query string) to request.
+        :returns: The body of the response.
+        :rtype: bytes
+        :raises http_client.HTTPException, OSError: If the request could not be completed.
+        """
+        for attempt in range(2):
+            if(self.connection is None):
+                if(self.secure):
+                    self.connection = http_client.HTTPSConnection(self.server, timeout=TIMEOUT)
+                else:
+                    self.connection = http_client.HTTPConnection(self.server, timeout=TIMEOUT)
+            try:
+                self.connection.request("GET", path)
+                response = self.connection.getresponse()
+                return response.read()  # The whole response must be read before the connection can be re-used.
+            except (http_client.HTTPException, OSError) as e:
+                self.close()
+                if(attempt > 0):
+                    raise e
+                logging.debug("The connection to %s was closed. Re-connecting..." % self.server)
+
+    def close(self):
+        """ Close the connection to the XML server. """
+        if(self.connection is not None):
+            self.connection.close()
+            self.connection = None
+        return
 
     def connect(self, username, password):
-        """ Initiate a session with the qrz.com server. Hopefully this will provide a session key.
+        """ Initiate a session with the server. Hopefully this will provide a session key.
 
-        :arg str username: The username of the qrz.com user account.
-        :arg str password: The password of the qrz.com user account.
+        :arg str username: The username of the user account.
+        :arg str password: The password of the user account.
         :returns: True if a successful connection was made to the server, and False otherwise.
         :rtype: bool
         """
-        logging.debug("Connecting to the qrz.com server...")
+        logging.debug("Connecting to the %s server..." % self.DATABASE)
+        self.username = username
+        self.password = password
 
         # Connect to the server.
         try:
-            self.connection = http_client.HTTPConnection("xmldata.qrz.com")
-            request = "/xml/current/?username=%s;password=%s;agent=pyqso" % (username, quote(password))  # Percent-escape the password in case there are reserved characters present.
-            self.connection.request("GET", request)
-            response = self.connection.getresponse()
+            data = self.request(self.get_session_request(username, quote(password)))  # Percent-escape the password in case there are reserved characters present.
+            (found, seen) = parse(data, set([self.SESSION_KEY_TAG, self.SESSION_ERROR_TAG]))
         except Exception as e:
             logging.exception(e)
-            error(parent=self.parent, message="Could not connect to the qrz.com server. Check connection to the internets?")
+            self.report_error("Could not connect to the %s server. Check connection to the internets?" % self.DATABASE)
             return False
 
         # Get the session key.
-        xml_data = minidom.parseString(response.read())
-        session_node = xml_data.getElementsByTagName("Session")[0]  # There should only be one Session element.
-        session_key_node = session_node.getElementsByTagName("Key")
-        if(session_key_node):
-            self.session_key = session_key_node[0].firstChild.nodeValue
-            logging.debug("Successfully connected to the qrz.com server. Session key is: %s." % self.session_key)
+        if(found.get(self.SESSION_KEY_TAG)):
+            self.session_key = found[self.SESSION_KEY_TAG]
+            logging.debug("Successfully connected to the %s server. Session key is: %s." % (self.DATABASE, self.session_key))
             connected = True
         else:
+            self.session_key = None
             connected = False
 
         # If there are any errors or warnings, print them out.
-        session_error_node = session_node.getElementsByTagName("Error")
-        if(session_error_node):
-            session_error = session_error_node[0].firstChild.nodeValue
-            error(parent=self.parent, message="qrz.com session error: %s" % session_error)
+        if(self.SESSION_ERROR_TAG in found):
+            self.report_error("%s session error: %s" % (self.DATABASE, found[self.SESSION_ERROR_TAG]))
 
         return connected
 
     def lookup(self, full_callsign, ignore_prefix_suffix=True):
-        """ Parse the XML tree that is returned from the qrz.com XML server to obtain the NAME, ADDRESS, STATE, COUNTRY, DXCC, CQZ, ITUZ, and IOTA field data (if present).
+        """ Parse the XML document that is returned from the XML server to obtain the NAME, ADDRESS, STATE, COUNTRY, DXCC, CQZ, ITUZ, and IOTA field data (if present).
+        If the session has expired, a new session is started and the lookup is attempted again.
 
         :arg str full_callsign: The callsign to look up (without any prefix/suffix stripping).
         :arg bool ignore_prefix_suffix: True if callsign prefixes/suffixes should be removed prior to querying the server, False otherwise.
@@ -94,6 +193,7 @@ class CallsignLookupQRZ:
         """
 
         logging.debug("Looking up callsign. The full callsign (with a prefix and/or suffix) is %s." % full_callsign)
+        self.error_message = None
 
         # Remove any prefix or suffix from the callsign before performing the lookup.
         if(ignore_prefix_suffix):
@@ -103,187 +203,375 @@ class CallsignLookupQRZ:
 
         # Commence lookup.
         fields_and_data = {"NAME": "", "ADDRESS": "", "STATE": "", "COUNTRY": "", "DXCC": "", "CQZ": "", "ITUZ": "", "IOTA": ""}
-        if(self.session_key):
-            request = "/xml/current/?s=%s;callsign=%s" % (self.session_key, callsign)
-            self.connection.request("GET", request)
-            response = self.connection.getresponse()
-
-            xml_data = minidom.parseString(response.read())
-            callsign_node = xml_data.getElementsByTagName("Callsign")
-            if(callsign_node):
-                callsign_node = callsign_node[0]  # There should only be a maximum of one Callsign element.
-
-                callsign_fname_node = callsign_node.getElementsByTagName("fname")
-                callsign_name_node = callsign_node.getElementsByTagName("name")
-                if(callsign_fname_node):
-                    fields_and_data["NAME"] = callsign_fname_node[0].firstChild.nodeValue
-                if(callsign_name_node):  # Add the surname, if present.
-                    fields_and_data["NAME"] = fields_and_data["NAME"] + " " + callsign_name_node[0].firstChild.nodeValue
-
-                callsign_addr1_node = callsign_node.getElementsByTagName("addr1")
-                callsign_addr2_node = callsign_node.getElementsByTagName("addr2")
-                if(callsign_addr1_node):
-                    fields_and_data["ADDRESS"] = callsign_addr1_node[0].firstChild.nodeValue
-                if(callsign_addr2_node):  # Add the second line of the address, if present.
-                    fields_and_data["ADDRESS"] = (fields_and_data["ADDRESS"] + ", " if callsign_addr1_node else "") + callsign_addr2_node[0].firstChild.nodeValue
-
-                callsign_state_node = callsign_node.getElementsByTagName("state")
-                if(callsign_state_node):
-                    fields_and_data["STATE"] = callsign_state_node[0].firstChild.nodeValue
-
-                callsign_country_node = callsign_node.getElementsByTagName("country")
-                if(callsign_country_node):
-                    fields_and_data["COUNTRY"] = callsign_country_node[0].firstChild.nodeValue
-
-                callsign_ccode_node = callsign_node.getElementsByTagName("ccode")
-                if(callsign_ccode_node):
-                    fields_and_data["DXCC"] = callsign_ccode_node[0].firstChild.nodeValue
-
-                callsign_cqzone_node = callsign_node.getElementsByTagName("cqzone")
-                if(callsign_cqzone_node):
-                    fields_and_data["CQZ"] = callsign_cqzone_node[0].firstChild.nodeValue
-
-                callsign_ituzone_node = callsign_node.getElementsByTagName("ituzone")
-                if(callsign_ituzone_node):
-                    fields_and_data["ITUZ"] = callsign_ituzone_node[0].firstChild.nodeValue
-
-                callsign_iota_node = callsign_node.getElementsByTagName("iota")
-                if(callsign_iota_node):
-                    fields_and_data["IOTA"] = callsign_iota_node[0].firstChild.nodeValue
+        for attempt in range(2):
+            if(not self.session_key):
+                break
+            try:
+                data = self.request(self.get_lookup_request(callsign))
+                (found, seen) = parse(data, set(self.FIELD_TAGS) | set([self.SESSION_ERROR_TAG]))
+            except Exception as e:
+                logging.exception(e)
+                self.report_error("Could not look up the callsign on the %s server. Check connection to the internets?" % self.DATABASE)
+                break
+
+            if(self.RESULT_TAG in seen):
+                fields_and_data.update(self.get_fields_and_data(found))
+                break
+            elif(self.SESSION_ERROR_TAG in found):
+                # If there is no result element, then print out the error message in the session element (unless the session has just expired, in which case a new session is started).
+                session_error = found[self.SESSION_ERROR_TAG]
+                if(attempt == 0 and self.username and self.is_session_expired(session_error)):
+                    logging.debug("The %s session has expired. Renewing the session..." % self.DATABASE)
+                    self.session_key = None
+                    if(self.connect(self.username, self.password)):
+                        continue
+                self.report_error(session_error)
+                break
             else:
-                # If there is no Callsign element, then print out the error message in the Session element.
-                session_node = xml_data.getElementsByTagName("Session")
-                if(session_node):
-                    session_error_node = session_node[0].getElementsByTagName("Error")
-                    if(session_error_node):
-                        session_error = session_error_node[0].firstChild.nodeValue
-                        error(parent=self.parent, message=session_error)
                 # Return empty strings for the field data.
-            logging.debug("Callsign lookup complete. Returning data...")
+                break
+        logging.debug("Callsign lookup complete. Returning data...")
         return fields_and_data
 
+    @staticmethod
+    def is_session_expired(session_error):
+        """ Determine whether a session error means that the session has expired (or that the session key is no longer valid).
+
+        :arg str session_error: The error message from the server.
+        :returns: True if the session has expired, and False otherwise.
+        :rtype: bool
+        """
+        session_error = session_error.lower()
+        return ("session" in session_error) and any([word in session_error for word in ["timeout", "expired", "invalid", "does not exist"]])
+
+
+class CallsignLookupQRZ(CallsignLookup):
+
+    """ Use qrz.com to lookup details about a particular callsign. """
 
-class CallsignLookupHamQTH:
+    DATABASE = "qrz.com"
+    SERVER = "xmldata.qrz.com"
+    SECURE = False
+
+    SESSION_KEY_TAG = "Key"
+    SESSION_ERROR_TAG = "Error"
+    RESULT_TAG = "Callsign"
+    FIELD_TAGS = ["fname", "name", "addr1", "addr2", "state", "country", "ccode", "cqzone", "ituzone", "iota"]
+
+    def get_session_request(self, username, password):
+        return "/xml/current/?username=%s;password=%s;agent=pyqso" % (username, password)
+
+    def get_lookup_request(self, callsign):
+        return "/xml/current/?s=%s;callsign=%s" % (self.session_key, quote(callsign))
+
+    def get_fields_and_data(self, found):
+        """ Convert the data found in a lookup response into field data.
+
+        :arg dict found: The text of each element found in the response, keyed by tag name.
+        :returns: The field data.
+        :rtype: dict
+        """
+        fields_and_data = {}
+        fields_and_data["NAME"] = found.get("fname", "")
+        if("name" in found):  # Add the surname, if present.
+            fields_and_data["NAME"] = fields_and_data["NAME"] + " " + found["name"]
+        fields_and_data["ADDRESS"] = found.get("addr1", "")
+        if("addr2" in found):  # Add the second line of the address, if present.
+            fields_and_data["ADDRESS"] = (fields_and_data["ADDRESS"] + ", " if "addr1" in found else "") + found["addr2"]
+        for (field_name, tag) in [("STATE", "state"), ("COUNTRY", "country"), ("DXCC", "ccode"), ("CQZ", "cqzone"), ("ITUZ", "ituzone"), ("IOTA", "iota")]:
+            fields_and_data[field_name] = found.get(tag, "")
+        return fields_and_data
+
+
+class CallsignLookupHamQTH(CallsignLookup):
 
     """ Use hamqth.com to lookup details about a particular callsign. """
 
-    def __init__(self, parent):
-        self.parent = parent
-        self.connection = None
-        self.session_id = None
+    DATABASE = "hamqth.com"
+    SERVER = "www.hamqth.com"
+    SECURE = True
 
-    def connect(self, username, password):
-        """ Initiate a session with the hamqth.com server. Hopefully this will provide a session key.
+    SESSION_KEY_TAG = "session_id"
+    SESSION_ERROR_TAG = "error"
+    RESULT_TAG = "search"
+    FIELD_TAGS = ["nick", "adr_street1", "adr_street2", "us_state", "country", "cq", "itu", "iota"]
 
-        :arg str username: The username of the hamqth.com user account.
-        :arg str password: The password of the hamqth.com user account.
-        :returns: True if a successful connection was made to the server, and False otherwise.
-        :rtype: bool
+    def get_session_request(self, username, password):
+        return "/xml.php?u=%s&p=%s" % (username, password)
+
+    def get_lookup_request(self, callsign):
+        return "/xml.php?id=%s&callsign=%s&prg=pyqso" % (self.session_key, quote(callsign))
+
+    @property
+    def session_id(self):
+        """ The hamqth.com session ID (i.e. the session key). """
+        return self.session_key
+
+    @session_id.setter
+    def session_id(self, value):
+        self.session_key = value
+
+    def get_fields_and_data(self, found):
+        """ Convert the data found in a lookup response into field data.
+
+        :arg dict found: The text of each element found in the response, keyed by tag name.
+        :returns: The field data.
+        :rtype: dict
         """
+        fields_and_data = {}
+        fields_and_data["NAME"] = found.get("nick", "")
+        fields_and_data["ADDRESS"] = found.get("adr_street1", "")
+        if("adr_street2" in found):  # Add the second line of the address, if present.
+            fields_and_data["ADDRESS"] = (fields_and_data["ADDRESS"] + ", " if "adr_street1" in found else "") + found["adr_street2"]
+        for (field_name, tag) in [("STATE", "us_state"), ("COUNTRY", "country"), ("CQZ", "cq"), ("ITUZ", "itu"), ("IOTA", "iota")]:
+            fields_and_data[field_name] = found.get(tag, "")
+        return fields_and_data
 
-        logging.debug("Connecting to the hamqth.com server...")
 
-        # Connect to the server.
-        try:
-            self.connection = http_client.HTTPSConnection("www.hamqth.com")
-            request = "/xml.php?u=%s&p=%s" % (username, quote(password))  # Percent-escape the password in case there are reserved characters present.
-            self.connection.request("GET", request)
-            response = self.connection.getresponse()
-        except Exception as e:
-            logging.exception(e)
-            error(parent=self.parent, message="Could not connect to the hamqth.com server. Check connection to the internets?")
-            return False
+class CallsignLookupCache:
 
-        # Get the session ID.
-        xml_data = minidom.parseString(response.read())
-        session_node = xml_data.getElementsByTagName("session")[0]  # There should only be one Session element.
-        session_id_node = session_node.getElementsByTagName("session_id")
-        if(session_id_node):
-            self.session_id = session_id_node[0].firstChild.nodeValue
-            logging.debug("Successfully connected to the hamqth.com server. Session ID is: %s." % self.session_id)
-            connected = True
-        else:
-            connected = False
+    """ A cache of the results of callsign lookups. Recently-used results are kept in memory, and all results are stored in an SQLite database so that they persist between sessions.
+    The results expire after a configurable time. """
 
-        # If there are any errors or warnings, print them out.
-        session_error_node = session_node.getElementsByTagName("error")
-        if(session_error_node):
-            session_error = session_error_node[0].firstChild.nodeValue
-            error(parent=self.parent, message="hamqth.com session error: %s" % session_error)
+    def __init__(self, path=CALLSIGN_LOOKUP_CACHE_FILE, time_to_live=TIME_TO_LIVE):
+        """ Open (and, if necessary, create) the cache.
 
-        return connected
+        :arg str path: The path to the cache's database file. Use ":memory:" for a cache that is not persistent.
+        :arg float time_to_live: The number of seconds for which the result of a lookup is cached.
+        :raises sqlite.Error: If the cache could not be opened.
+        """
+        self.time_to_live = time_to_live
+        self.memory = {}
+        if(path != ":memory:"):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The cache is used by the lookup service's worker threads as well as the main thread.
+        self.lock = threading.Lock()
+        self.connection = sqlite.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS lookups (database TEXT, callsign TEXT, data TEXT, expires REAL, PRIMARY KEY (database, callsign))")
+        return
+
+    def get(self, database, callsign):
+        """ Return the cached result of a callsign lookup.
+
+        :arg str database: The name of the callsign database.
+        :arg str callsign: The callsign (after any prefix/suffix stripping).
+        :returns: The field data found by the lookup, or None if the callsign is not in the cache (or its entry has expired).
+        :rtype: dict
+        """
+        key = (database, callsign.upper())
+        now = time.time()
+        with self.lock:
+            if(key in self.memory):
+                (expires, fields_and_data) = self.memory[key]
+            else:
+                row = self.connection.execute("SELECT expires, data FROM lookups WHERE database=? AND callsign=?", key).fetchone()
+                if(row is None):
+                    return None
+                (expires, fields_and_data) = (row[0], json.loads(row[1]))
+                self.memory[key] = (expires, fields_and_data)
+            if(expires <= now):
+                return None
+            return dict(fields_and_data)
+
+    def set(self, database, callsign, fields_and_data):
+        """ Cache the result of a callsign lookup.
+
+        :arg str database: The name of the callsign database.
+        :arg str callsign: The callsign (after any prefix/suffix stripping).
+        :arg dict fields_and_data: The field data found by the lookup.
+        """
+        key = (database, callsign.upper())
+        expires = time.time() + self.time_to_live
+        with self.lock:
+            self.memory[key] = (expires, dict(fields_and_data))
+            with self.connection:
+                self.connection.execute("INSERT OR REPLACE INTO lookups VALUES (?, ?, ?, ?)", key + (json.dumps(fields_and_data), expires))
+                self.connection.execute("DELETE FROM lookups WHERE expires<=?", (time.time(),))
+        return
+
+    def close(self):
+        """ Close the cache's database connection. """
+        with self.lock:
+            self.connection.close()
+        return
+
+
+class CallsignLookupService:
+
+    """ Looks up callsigns in a callsign database without blocking the caller. Lookups are performed by a pool of worker threads, each of which uses its own
+    persistent connection to the database's server; the session key is shared between them, so that only one session needs to be started. The results are cached. """
+
+    HANDLERS = {"qrz.com": CallsignLookupQRZ, "hamqth.com": CallsignLookupHamQTH}
+
+    def __init__(self, database, username, password, cache=None, maximum_connections=MAXIMUM_CONNECTIONS, server=None, secure=None):
+        """ Set up the lookup service.
+
+        :arg str database: The name of the callsign database (either "qrz.com" or "hamqth.com").
+        :arg str username: The username of the user account.
+        :arg str password: The password of the user account.
+        :arg CallsignLookupCache cache: The cache of lookup results, or None if the results should not be cached.
+        :arg int maximum_connections: The maximum number of lookups (and connections to the server) at any one time.
+        :arg str server: The address (host[:port]) of the XML server. By default, the callsign database's own server is used.
+        :arg bool secure: True if HTTPS should be used to connect to the server. By default, this depends on the callsign database.
+        :raises ValueError: If the callsign database is unknown.
+        """
+        if(database not in self.HANDLERS):
+            raise ValueError("Unknown callsign database: %s" % database)
+        self.database = database
+        self.username = username
+        self.password = password
+        self.cache = cache
+        self.server = server
+        self.secure = secure
+
+        # The lookup handlers (and their connections) which are not currently in use.
+        self.handlers = queue.LifoQueue()
+        self.session_key = None
+        self.session_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=maximum_connections)
+        return
+
+    def acquire(self):
+        """ Take a lookup handler from the pool (or create a new one), making sure that it has a session key.
+
+        :returns: The lookup handler, and an error message if a session could not be started (otherwise None).
+        :rtype: tuple
+        """
+        try:
+            handler = self.handlers.get_nowait()
+        except queue.Empty:
+            handler = self.HANDLERS[self.database](parent=None, server=self.server, secure=self.secure)
+            handler.username = self.username
+            handler.password = self.password
+
+        with self.session_lock:
+            if(self.session_key is None):
+                if(not handler.connect(self.username, self.password)):
+                    return handler, handler.error_message or "Could not start a %s session." % self.database
+                self.session_key = handler.session_key
+            handler.session_key = self.session_key
+        return handler, None
 
     def lookup(self, full_callsign, ignore_prefix_suffix=True):
-        """ Parse the XML tree that is returned from the hamqth.com XML server to obtain the NAME, ADDRESS, STATE, COUNTRY, DXCC, CQZ, ITUZ, and IOTA field data (if present),
+        """ Look up a callsign, using the cached result if there is one. This blocks until the lookup is complete, but is safe to call from several threads at once.
 
         :arg str full_callsign: The callsign to look up (without any prefix/suffix stripping).
         :arg bool ignore_prefix_suffix: True if callsign prefixes/suffixes should be removed prior to querying the server, False otherwise.
-        :returns: The data in a dictionary called fields_and_data.
-        :rtype: dict
+        :returns: The field data found by the lookup, and an error message if the lookup failed (otherwise None).
+        :rtype: tuple
         """
+        callsign = strip(full_callsign) if ignore_prefix_suffix else full_callsign
+        if(self.cache is not None):
+            fields_and_data = self.cache.get(self.database, callsign)
+            if(fields_and_data is not None):
+                return fields_and_data, None
+
+        (handler, error_message) = self.acquire()
+        if(error_message is None):
+            fields_and_data = handler.lookup(callsign, ignore_prefix_suffix=False)
+            error_message = handler.error_message
+            if(handler.session_key != self.session_key):
+                # The handler has renewed the session, so share the new session key with the other handlers.
+                with self.session_lock:
+                    self.session_key = handler.session_key
+            if(self.cache is not None and error_message is None and any(fields_and_data.values())):
+                self.cache.set(self.database, callsign, fields_and_data)
+        else:
+            fields_and_data = {"NAME": "", "ADDRESS": "", "STATE": "", "COUNTRY": "", "DXCC": "", "CQZ": "", "ITUZ": "", "IOTA": ""}
+            with self.session_lock:
+                self.session_key = None
+        self.handlers.put(handler)
+        return fields_and_data, error_message
 
-        logging.debug("Looking up callsign. The full callsign (with a prefix and/or suffix) is %s." % full_callsign)
+    def lookup_async(self, full_callsign, callback, ignore_prefix_suffix=True):
+        """ Look up a callsign without blocking. If the result is cached, the callback is called straight away; otherwise, it is called from a worker thread once the lookup is complete.
 
-        # Remove any prefix or suffix from the callsign before performing the lookup.
-        if(ignore_prefix_suffix):
-            callsign = strip(full_callsign)
+        :arg str full_callsign: The callsign to look up (without any prefix/suffix stripping).
+        :arg callback: The function to call with the field data found by the lookup and an error message (or None).
+        :arg bool ignore_prefix_suffix: True if callsign prefixes/suffixes should be removed prior to querying the server, False otherwise.
+        :returns: The future result of the lookup, i.e. a (fields_and_data, error_message) tuple. This can be cancelled if the lookup has not started yet.
+        :rtype: concurrent.futures.Future
+        """
+        callsign = strip(full_callsign) if ignore_prefix_suffix else full_callsign
+        fields_and_data = self.cache.get(self.database, callsign) if self.cache is not None else None
+        if(fields_and_data is not None):
+            future = Future()
+            future.set_result((fields_and_data, None))
         else:
-            callsign = full_callsign
+            future = self.executor.submit(self.lookup, full_callsign, ignore_prefix_suffix)
+        # The callback is not called if the lookup is cancelled before it starts (e.g. when the dialog it was for is closed).
+        future.add_done_callback(lambda f: None if f.cancelled() else callback(*f.result()))
+        return future
+
+    def close(self):
+        """ Wait for any lookups to finish, and then close all the connections to the server. """
+        self.executor.shutdown(wait=True)
+        while True:
+            try:
+                self.handlers.get_nowait().close()
+            except queue.Empty:
+                break
+        return
+
+
+_services = {}
+
+
+def get_lookup_service(database, username, password, time_to_live=TIME_TO_LIVE):
+    """ Return the callsign lookup service for a given callsign database and user account. The service (and therefore its connections, session and cache) is shared by the whole application.
+
+    :arg str database: The name of the callsign database (either "qrz.com" or "hamqth.com").
+    :arg str username: The username of the user account.
+    :arg str password: The password of the user account.
+    :arg float time_to_live: The number of seconds for which the result of a lookup is cached.
+    :returns: The shared lookup service.
+    :rtype: CallsignLookupService
+    :raises ValueError: If the callsign database is unknown.
+    """
+    key = (database, username, password)
+    if(key not in _services):
+        try:
+            cache = CallsignLookupCache(time_to_live=time_to_live)
+        except (OSError, sqlite.Error) as e:
+            logging.warning("Could not open the callsign lookup cache. Lookup results will not be cached.")
+            logging.exception(e)
+            cache = None
+        _services[key] = CallsignLookupService(database, username, password, cache=cache)
+    service = _services[key]
+    if(service.cache is not None):
+        service.cache.time_to_live = time_to_live
+    return service
 
-        # Commence lookup.
-        fields_and_data = {"NAME": "", "ADDRESS": "", "STATE": "", "COUNTRY": "", "DXCC": "", "CQZ": "", "ITUZ": "", "IOTA": ""}
-        if(self.session_id):
-            request = "/xml.php?id=%s&callsign=%s&prg=pyqso" % (self.session_id, callsign)
-            self.connection.request("GET", request)
-            response = self.connection.getresponse()
-
-            xml_data = minidom.parseString(response.read())
-            search_node = xml_data.getElementsByTagName("search")
-            if(search_node):
-                search_node = search_node[0]  # There should only be a maximum of one Callsign element.
-
-                search_name_node = search_node.getElementsByTagName("nick")
-                if(search_name_node):
-                    fields_and_data["NAME"] = search_name_node[0].firstChild.nodeValue
-
-                search_addr1_node = search_node.getElementsByTagName("adr_street1")
-                search_addr2_node = search_node.getElementsByTagName("adr_street2")
-                if(search_addr1_node):
-                    fields_and_data["ADDRESS"] = search_addr1_node[0].firstChild.nodeValue
-                if(search_addr2_node):  # Add the second line of the address, if present.
-                    fields_and_data["ADDRESS"] = (fields_and_data["ADDRESS"] + ", " if search_addr1_node else "") + search_addr2_node[0].firstChild.nodeValue
-
-                search_state_node = search_node.getElementsByTagName("us_state")
-                if(search_state_node):
-                    fields_and_data["STATE"] = search_state_node[0].firstChild.nodeValue
-
-                search_country_node = search_node.getElementsByTagName("country")
-                if(search_country_node):
-                    fields_and_data["COUNTRY"] = search_country_node[0].firstChild.nodeValue
-
-                search_cqzone_node = search_node.getElementsByTagName("cq")
-                if(search_cqzone_node):
-                    fields_and_data["CQZ"] = search_cqzone_node[0].firstChild.nodeValue
-
-                search_ituzone_node = search_node.getElementsByTagName("itu")
-                if(search_ituzone_node):
-                    fields_and_data["ITUZ"] = search_ituzone_node[0].firstChild.nodeValue
-
-                search_iota_node = search_node.getElementsByTagName("iota")
-                if(search_iota_node):
-                    fields_and_data["IOTA"] = search_iota_node[0].firstChild.nodeValue
-            else:
-                # If there is no Callsign element, then print out the error message in the Session element.
-                session_node = xml_data.getElementsByTagName("session")
-                if(session_node):
-                    session_error_node = session_node[0].getElementsByTagName("error")
-                    if(session_error_node):
-                        session_error = session_error_node[0].firstChild.nodeValue
-                        error(parent=self.parent, message=session_error)
-                # Return empty strings for the field data.
 
-            logging.debug("Callsign lookup complete. Returning data...")
-        return fields_and_data
+def get_preferred_lookup_service():
+    """ Return the shared callsign lookup service for the callsign database and user account given in the preferences.
+
+    :returns: The shared lookup service.
+    :rtype: CallsignLookupService
+    :raises ValueError: If the callsign database or the user account's details have not been given in the preferences, or the callsign database is unknown.
+    """
+    config = get_preferences()
+    have_config = config.exists
+
+    # Get the database name.
+    database = config.get("records", "callsign_database", fallback="") if have_config else ""
+    if(not database):
+        raise ValueError("To perform a callsign lookup, please specify the name of the callsign database in the Preferences.")
+
+    # Get username and password from configuration file.
+    if(have_config and config.has_option("records", "callsign_database_username") and config.has_option("records", "callsign_database_password")):
+        username = config.get("records", "callsign_database_username")
+        password = base64.b64decode(config.get("records", "callsign_database_password")).decode("utf-8")
+    else:
+        username = password = None
+    if(not username or not password):
+        raise ValueError("To perform a callsign lookup, please specify your username and password in the Preferences.")
+
+    # The number of days for which lookup results are cached.
+    cache_days = config.getfloat("records", "callsign_lookup_cache_days", fallback=TIME_TO_LIVE/86400)
+
+    return get_lookup_service(database, username, password, time_to_live=cache_days*86400)
 
 
 def strip(full_callsign):
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2013-2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import asyncio
+import codecs
+import random
+import threading
+import time
+from collections import deque
+
+from pyqso.dx_spots import SpotParser, parse_spot
+
+# The time (in seconds) to wait before the first attempt to reconnect to a DX cluster. This is doubled after each failed attempt, up to the maximum.
+MINIMUM_BACKOFF = 1
+MAXIMUM_BACKOFF = 300
+# A connection which stays up for this long (in seconds) is considered to be stable, and the time to wait before reconnecting goes back to the minimum.
+STABLE_CONNECTION = 60
+# The time (in seconds) after which a keepalive is sent, if nothing else has been sent to the DX cluster.
+KEEPALIVE_INTERVAL = 120
+# The time (in seconds) allowed for connecting to a DX cluster.
+CONNECT_TIMEOUT = 30
+# The maximum number of bytes read from a DX cluster at once.
+READ_SIZE = 4096
+# The time (in seconds) for which a spot is remembered, so that the same spot received from other DX clusters can be ignored.
+DUPLICATE_WINDOW = 600
+
+# Telnet commands (see RFC 854).
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+NOP = 241
+SE = 240
+
+# The states of a connection.
+CONNECTING = "connecting"
+CONNECTED = "connected"
+DISCONNECTED = "disconnected"
+CLOSED = "closed"
+FAILED = "failed"
+
+
+class TelnetFilter:
+
+    """ Removes the Telnet commands from the data received from a Telnet server, and refuses any options that the server asks for.
+    DX clusters are line-based, so none of the Telnet options are needed. The commands may be split across several chunks of data. """
+
+    def __init__(self):
+        """ Set up a new filter, with no data received so far. """
+        self.command = bytearray()
+        self.subnegotiation = False
+        return
+
+    def feed(self, data):
+        """ Filter some data received from the server.
+
+        :arg bytes data: The data.
+        :returns: The data with the Telnet commands removed, and the replies to any option negotiations (which should be sent to the server).
+        :rtype: tuple
+        """
+        text = bytearray()
+        replies = bytearray()
+        for byte in data:
+            if(self.command):
+                self.command.append(byte)
+                command = self.command[1]
+                if(command == IAC):
+                    # An escaped 0xFF data byte.
+                    if(not self.subnegotiation):
+                        text.append(IAC)
+                    self.command.clear()
+                elif(command == SE):
+                    self.subnegotiation = False
+                    self.command.clear()
+                elif(command == SB):
+                    self.subnegotiation = True
+                    self.command.clear()
+                elif(command in (DO, DONT, WILL, WONT)):
+                    if(len(self.command) == 3):
+                        if(command == DO):
+                            replies.extend(bytes([IAC, WONT, byte]))
+                        elif(command == WILL):
+                            replies.extend(bytes([IAC, DONT, byte]))
+                        self.command.clear()
+                else:
+                    # Any other command (e.g. NOP) is two bytes long, and is ignored.
+                    self.command.clear()
+            elif(byte == IAC):
+                self.command.append(byte)
+            elif(not self.subnegotiation):
+                text.append(byte)
+        return bytes(text), bytes(replies)
+
+
+class SpotDeduplicator:
+
+    """ Remembers the spots received recently, so that the same spot received from several DX clusters (which relay each other's spots) is only used once.
+    Spots are considered to be the same if they have the same spotter, callsign, time and frequency (to the nearest kHz). """
+
+    def __init__(self, window=DUPLICATE_WINDOW):
+        """ Set up a new deduplicator with no spots remembered.
+
+        :arg float window: The time (in seconds) for which each spot is remembered.
+        """
+        self.window = window
+        self.seen = {}
+        # The keys of the spots in the order they were seen, with the time at which each one was seen, so that they can be forgotten in the same order.
+        self.order = deque()
+        self.lock = threading.Lock()
+        return
+
+    def is_duplicate(self, spot):
+        """ Check whether a spot has been seen recently, and remember it.
+
+        :arg Spot spot: The spot.
+        :returns: True if the spot has been seen within the window, and False otherwise.
+        :rtype: bool
+        """
+        key = (spot.spotter, spot.callsign, spot.time, round(spot.frequency))
+        now = spot.received
+        with self.lock:
+            while(self.order and self.order[0][1] < now - self.window):
+                (old, seen) = self.order.popleft()
+                if(self.seen.get(old) == seen):
+                    del self.seen[old]
+            if(key in self.seen):
+                return True
+            self.seen[key] = now
+            self.order.append((key, now))
+        return False
+
+
+class ClusterConnection:
+
+    """ A connection to a single DX cluster, which is reconnected automatically (after an increasing delay) if it is lost.
+    If the connection cannot be made in the first place (e.g. because of a wrong hostname or port), it is not retried. Instead, the connection is removed from the manager and its state becomes FAILED. """
+
+    def __init__(self, manager, name, host, port=23, username=None, password=None):
+        """ Set up a new connection. The connection is made when it is run by the manager.
+
+        :arg ClusterManager manager: The manager running the connection.
+        :arg str name: The name which identifies the connection.
+        :arg str host: The DX cluster's hostname.
+        :arg int port: The DX cluster's port number.
+        :arg str username: The user's username, which is sent when the DX cluster asks for it. This is an optional argument.
+        :arg str password: The user's password, which is sent when the DX cluster asks for it. This is an optional argument.
+        """
+        self.manager = manager
+        self.name = name
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+
+        self.state = DISCONNECTED
+        # The reason why the connection could not be made, if its state is FAILED.
+        self.error = None
+        self.writer = None
+        self.task = None
+        self.last_sent = 0
+
+        # Throughput metrics. The totals are kept across reconnections, along with the totals when the connection was last (re)made.
+        self.connections = 0
+        self.connected_since = None
+        self.received_at_connection = (0, 0)
+        self.bytes_received = 0
+        self.lines_received = 0
+        self.spots_received = 0
+        self.duplicate_spots = 0
+        self.last_received = None
+        return
+
+    def set_state(self, state):
+        """ Change the state of the connection, and let the manager know.
+
+        :arg str state: The new state.
+        """
+        self.state = state
+        self.manager.on_state(self, state)
+        return
+
+    def write(self, text):
+        """ Send some text to the DX cluster, if connected. This must be called from the manager's event loop.
+
+        :arg str text: The text.
+        """
+        if(self.writer is not None and not self.writer.is_closing()):
+            self.writer.write(text.replace("\xff", "\xff\xff").encode("latin-1", errors="replace"))
+            self.last_sent = time.monotonic()
+        return
+
+    def get_metrics(self):
+        """ Return the throughput of the connection since it was last (re)connected, along with the totals since the connection was first made.
+
+        :returns: The metrics, keyed by name.
+        :rtype: dict
+        """
+        uptime = time.monotonic() - self.connected_since if self.state == CONNECTED else 0
+        (bytes_received, spots_received) = self.received_at_connection
+        return {"state": self.state, "connections": self.connections, "uptime": uptime,
+                "bytes_received": self.bytes_received, "lines_received": self.lines_received,
+                "spots_received": self.spots_received, "duplicate_spots": self.duplicate_spots,
+                "bytes_per_second": (self.bytes_received - bytes_received)/uptime if uptime > 0 else 0.0,
+                "spots_per_minute": 60*(self.spots_received - spots_received)/uptime if uptime > 0 else 0.0,
+                "last_received": self.last_received}
+
+    async def run(self):
+        """ Connect to the DX cluster and receive text from it, reconnecting whenever the connection is lost, until the connection is closed (or the first attempt to connect fails). """
+        backoff = self.manager.minimum_backoff
+        try:
+            while True:
+                self.set_state(CONNECTING)
+                started = time.monotonic()
+                try:
+                    logging.debug("Attempting connection to Telnet server %s:%d..." % (self.host, self.port))
+                    (reader, self.writer) = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT)
+                    logging.debug("Connection to %s:%d established." % (self.host, self.port))
+                    self.connections += 1
+                    self.connected_since = started = time.monotonic()
+                    self.received_at_connection = (self.bytes_received, self.spots_received)
+                    self.set_state(CONNECTED)
+                    await self.receive(reader)
+                except asyncio.CancelledError:
+                    raise
+                except (OSError, asyncio.TimeoutError, EOFError) as e:
+                    logging.warning("Connection to the Telnet server %s:%d failed or was lost: %s" % (self.host, self.port, e))
+                    failure = e
+                except Exception as e:
+                    # Anything else (e.g. a bug in handling the text received) must not stop the connection from being made again.
+                    logging.error("Unexpected error on the connection to the Telnet server %s:%d." % (self.host, self.port))
+                    logging.exception(e)
+                    failure = e
+                self.close_writer()
+
+                if(self.connections == 0):
+                    # The connection details are probably wrong, so there is no point in trying again.
+                    self.error = str(failure) or failure.__class__.__name__
+                    self.manager.discard(self)
+                    self.set_state(FAILED)
+                    return
+
+                self.set_state(DISCONNECTED)
+                if(time.monotonic() - started >= STABLE_CONNECTION):
+                    backoff = self.manager.minimum_backoff
+                # Randomise the delay a little, so that several connections which are lost at the same time are not all made again at the same time.
+                delay = backoff*random.uniform(0.5, 1)
+                logging.debug("Reconnecting to %s:%d in %.1f seconds..." % (self.host, self.port, delay))
+                await asyncio.sleep(delay)
+                backoff = min(2*backoff, self.manager.maximum_backoff)
+        except asyncio.CancelledError:
+            self.write("quit\n")
+            self.close_writer()
+            self.set_state(CLOSED)
+            raise
+
+    async def receive(self, reader):
+        """ Receive text from the DX cluster until the connection is lost, sending keepalives whenever nothing else has been sent for a while.
+
+        :arg asyncio.StreamReader reader: The stream from which the text is read.
+        """
+        telnet = TelnetFilter()
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        parser = SpotParser()
+        self.last_sent = time.monotonic()
+        keepalive = asyncio.ensure_future(self.keepalive())
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if(not data):
+                    raise EOFError("The connection was closed by the server.")
+                self.bytes_received += len(data)
+                self.last_received = time.time()
+                (data, replies) = telnet.feed(data)
+                if(replies):
+                    self.writer.write(replies)
+                text = decoder.decode(data)
+
+                lines = parser.feed(text)
+                partial = parser.partial
+                if(partial.rstrip().endswith((":", ">")) and not partial.upper().startswith("DX DE")):
+                    # Prompts (e.g. "login: ") are not followed by a new line, but should be shown straight away.
+                    lines.append(parser.flush())
+                self.lines_received += len(lines)
+                received = []
+                for line in lines:
+                    spot = parse_spot(line, received=self.last_received)
+                    if(spot is not None):
+                        self.spots_received += 1
+                        if(self.manager.deduplicator.is_duplicate(spot)):
+                            self.duplicate_spots += 1
+                            continue
+                    received.append((line, spot))
+                if(received):
+                    self.manager.on_receive(self, received)
+
+                # Responses to login/password prompts.
+                prompt = text.lower()
+                if(self.username and ("login: " in prompt or "call: " in prompt)):
+                    self.write(self.username + "\n")
+                if(self.password and "password: " in prompt):
+                    self.write(self.password + "\n")
+        finally:
+            keepalive.cancel()
+
+    async def keepalive(self):
+        """ Send a Telnet NOP command whenever nothing has been sent to the DX cluster for a while, so that the connection is not dropped for being idle. """
+        interval = self.manager.keepalive_interval
+        while True:
+            await asyncio.sleep(max(interval - (time.monotonic() - self.last_sent), 0.01))
+            if(time.monotonic() - self.last_sent >= interval and self.writer is not None):
+                self.writer.write(bytes([IAC, NOP]))
+                self.last_sent = time.monotonic()
+
+    def close_writer(self):
+        """ Close the connection to the DX cluster, if there is one. """
+        if(self.writer is not None):
+            self.writer.close()
+            self.writer = None
+        return
+
+
+class ClusterManager:
+
+    """ Runs any number of connections to DX clusters at once, all on a single asyncio event loop in a separate thread.
+    Each connection is reconnected automatically if it is lost, and spots which are received from more than one DX cluster are only passed on once.
+
+    The text received is passed on, a chunk at a time, to the on_receive callback as a list of (line, spot) pairs, where spot is None if the line is not a spot.
+    Changes to the state of each connection are passed on to the on_state callback. Note that both callbacks are called from the manager's thread. """
+
+    def __init__(self, on_receive=None, on_state=None, keepalive_interval=KEEPALIVE_INTERVAL, minimum_backoff=MINIMUM_BACKOFF, maximum_backoff=MAXIMUM_BACKOFF):
+        """ Set up a new manager with no connections. The event loop is started when the first connection is added.
+
+        :arg on_receive: The function called with the connection and the lines received whenever text is received.
+        :arg on_state: The function called with the connection and its new state whenever the state of a connection changes.
+        :arg float keepalive_interval: The time (in seconds) after which a keepalive is sent, if nothing else has been sent.
+        :arg float minimum_backoff: The time (in seconds) to wait before the first attempt to reconnect.
+        :arg float maximum_backoff: The maximum time (in seconds) to wait before an attempt to reconnect.
+        """
+        self.receive_callback = on_receive
+        self.state_callback = on_state
+        self.keepalive_interval = keepalive_interval
+        self.minimum_backoff = minimum_backoff
+        self.maximum_backoff = maximum_backoff
+
+        self.deduplicator = SpotDeduplicator()
+        # The connections, keyed by name.
+        self.connections = {}
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+        return
+
+    def start(self):
+        """ Start the event loop in a separate thread, if it is not already running. """
+        with self.lock:
+            if(self.loop is None):
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)  # Allows the thread to be stopped when the main Gtk thread is stopped.
+                self.thread.start()
+        return
+
+    def stop(self):
+        """ Close all the connections and stop the event loop. """
+        self.remove_all()
+        with self.lock:
+            if(self.loop is not None):
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self.thread.join()
+                self.loop.close()
+                self.loop = None
+                self.thread = None
+        return
+
+    def run(self, coroutine):
+        """ Run a coroutine on the event loop (starting it if necessary), and wait for its result.
+
+        :arg coroutine: The coroutine.
+        :returns: The result of the coroutine.
+        """
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def add(self, host, port=23, username=None, password=None, name=None):
+        """ Connect to a DX cluster. The connection is made (and remade, whenever it is lost) in the background.
+
+        :arg str host: The DX cluster's hostname.
+        :arg int port: The DX cluster's port number.
+        :arg str username: The user's username. This is an optional argument.
+        :arg str password: The user's password. This is an optional argument.
+        :arg str name: The name which identifies the connection. By default, this is "host:port".
+        :returns: The connection.
+        :rtype: ClusterConnection
+        :raises ValueError: If there is already a connection with the same name.
+        """
+        if(name is None):
+            name = "%s:%d" % (host, port)
+        connection = ClusterConnection(self, name, host, port, username, password)
+        with self.lock:
+            if(name in self.connections):
+                raise ValueError("Already connected to the DX cluster '%s'." % name)
+            self.connections[name] = connection
+
+        async def schedule():
+            connection.task = asyncio.ensure_future(connection.run())
+        self.run(schedule())
+        return connection
+
+    def remove(self, name):
+        """ Disconnect from a DX cluster, and stop reconnecting to it.
+
+        :arg str name: The name of the connection.
+        """
+        with self.lock:
+            connection = self.connections.pop(name, None)
+        if(connection is not None and connection.task is not None):
+            async def cancel():
+                connection.task.cancel()
+                try:
+                    await connection.task
+                except asyncio.CancelledError:
+                    pass
+            self.run(cancel())
+        return
+
+    def discard(self, connection):
+        """ Forget about a connection which has stopped by itself (e.g. because it could not be made), without cancelling it.
+
+        :arg ClusterConnection connection: The connection.
+        """
+        with self.lock:
+            if(self.connections.get(connection.name) is connection):
+                del self.connections[connection.name]
+        return
+
+    def remove_all(self):
+        """ Disconnect from all the DX clusters. """
+        for name in list(self.connections.keys()):
+            self.remove(name)
+        return
+
+    def send(self, text, name=None):
+        """ Send some text to a DX cluster.
+
+        :arg str text: The text.
+        :arg str name: The name of the connection, or None to send the text to all the DX clusters.
+        """
+        with self.lock:
+            connections = list(self.connections.values()) if name is None else [self.connections[name]]
+        if(self.loop is not None):
+            for connection in connections:
+                self.loop.call_soon_threadsafe(connection.write, text)
+        return
+
+    def get_metrics(self):
+        """ Return the throughput metrics of each connection.
+
+        :returns: The metrics of each connection (see ClusterConnection.get_metrics), keyed by name.
+        :rtype: dict
+        """
+        with self.lock:
+            return dict([(name, connection.get_metrics()) for (name, connection) in self.connections.items()])
+
+    def is_connected(self):
+        """ Check whether any of the DX clusters are connected.
+
+        :returns: True if at least one connection is up, and False otherwise.
+        :rtype: bool
+        """
+        with self.lock:
+            return any([connection.state == CONNECTED for connection in self.connections.values()])
+
+    def on_receive(self, connection, lines):
+        """ Pass on the lines received from a DX cluster. """
+        if(self.receive_callback is not None):
+            self.receive_callback(connection, lines)
+        return
+
+    def on_state(self, connection, state):
+        """ Pass on a change to the state of a connection. """
+        if(self.state_callback is not None):
+            self.state_callback(connection, state)
+        return
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2013-2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import re
+import csv
+from collections import namedtuple
+
+# The default location of the country file (in the cty.dat/BigCTY format, or the cty.csv format), which can be downloaded from http://www.country-files.com
+COUNTRY_FILE = os.path.expanduser("~/.config/pyqso/cty.dat")
+
+# Suffixes which do not change the DXCC entity of a callsign (e.g. portable or mobile operation).
+PORTABLE_SUFFIXES = ["P", "M", "A", "PM", "QRP"]
+# Suffixes for maritime mobile and aeronautical mobile operation, which do not count for any DXCC entity.
+MOBILE_SUFFIXES = ["MM", "AM"]
+# The maximum number of callsigns whose entities are remembered.
+MAXIMUM_RESOLVED_CALLSIGNS = 1000000
+
+# A DXCC entity (or WAE entity), or the details of a particular prefix or callsign within it.
+# Note that the longitude is positive to the east (unlike in the country file itself), and the DXCC entity code is only known if the country file is in the cty.csv format.
+Entity = namedtuple("Entity", ["name", "prefix", "continent", "cq_zone", "itu_zone", "latitude", "longitude", "utc_offset", "dxcc"])
+
+# The overrides which may follow a prefix (or callsign) in the country file.
+OVERRIDES = [("cq_zone", re.compile(r"\((\d+)\)"), int),
+             ("itu_zone", re.compile(r"\[(\d+)\]"), int),
+             ("continent", re.compile(r"\{(\w+)\}"), str),
+             ("utc_offset", re.compile(r"~(-?[\d.]+)~"), float)]
+COORDINATES_OVERRIDE = re.compile(r"<(-?[\d.]+)/(-?[\d.]+)>")
+
+
+def parse_prefix(token, entity):
+    """ Parse a prefix (or an exact callsign, if it begins with "=") and its overrides from the country file.
+
+    :arg str token: The prefix and its overrides, e.g. "=KH6ABC(31)[61]".
+    :arg Entity entity: The entity that the prefix belongs to.
+    :returns: The prefix, True if it is an exact callsign (and False otherwise), and the details of the entity that apply to the prefix.
+    :rtype: tuple
+    """
+    exact = token.startswith("=")
+    prefix = re.match(r"=?([A-Z0-9/]*)", token.upper()).group(1)
+    overrides = {}
+    for (name, expression, convert) in OVERRIDES:
+        match = expression.search(token)
+        if(match):
+            overrides[name] = convert(match.group(1))
+    match = COORDINATES_OVERRIDE.search(token)
+    if(match):
+        overrides["latitude"] = float(match.group(1))
+        overrides["longitude"] = -float(match.group(2))
+    return prefix, exact, entity._replace(**overrides) if overrides else entity
+
+
+def iter_dat(f):
+    """ Read the entities and their prefixes from a country file in the cty.dat (or BigCTY) format.
+
+    :arg f: The country file.
+    :returns: A generator of (entity, prefixes) pairs, where prefixes is a list of the entity's prefixes (with their overrides).
+    :raises ValueError: If the country file is malformed.
+    """
+    entity = None
+    prefixes = ""
+    for line in f:
+        if(not line.strip()):
+            continue
+        if(entity is None):
+            # Each entity starts with a line of colon-separated fields: the name, CQ zone, ITU zone, continent, latitude, longitude (positive to the west), UTC offset and primary prefix.
+            fields = [field.strip() for field in line.split(":")]
+            if(len(fields) < 8):
+                raise ValueError("Malformed entity line in country file: %s" % line.strip())
+            entity = Entity(name=fields[0], prefix=fields[7].lstrip("*"), continent=fields[3], cq_zone=int(fields[1]), itu_zone=int(fields[2]),
+                            latitude=float(fields[4]), longitude=-float(fields[5]), utc_offset=float(fields[6]), dxcc=None)
+            prefixes = ""
+        else:
+            # The entity's prefixes are separated by commas, and may span several lines. The last one is followed by a semi-colon.
+            prefixes += line.strip()
+            if(prefixes.endswith(";")):
+                yield entity, [prefix.strip() for prefix in prefixes[:-1].split(",") if prefix.strip()]
+                entity = None
+    if(entity is not None):
+        raise ValueError("The prefixes of '%s' are not terminated in the country file." % entity.name)
+
+
+def iter_csv(f):
+    """ Read the entities and their prefixes from a country file in the cty.csv format, which also includes the DXCC entity codes.
+
+    :arg f: The country file.
+    :returns: A generator of (entity, prefixes) pairs, where prefixes is a list of the entity's prefixes (with their overrides).
+    :raises ValueError: If the country file is malformed.
+    """
+    for row in csv.reader(f):
+        if(not row):
+            continue
+        if(len(row) < 10):
+            raise ValueError("Malformed line in country file: %s" % ",".join(row))
+        entity = Entity(name=row[1], prefix=row[0].lstrip("*"), continent=row[3], cq_zone=int(row[4]), itu_zone=int(row[5]),
+                        latitude=float(row[6]), longitude=-float(row[7]), utc_offset=float(row[8]), dxcc=int(row[2]) if row[2] else None)
+        yield entity, row[9].rstrip(";").split()
+
+
+class CountryFile:
+
+    """ Resolves callsigns to their DXCC entities (along with their CQ/ITU zones and continents) offline, using a country file in the cty.dat/BigCTY or cty.csv format.
+
+    The prefixes are held in a trie, so that the entity of a callsign is found by its longest matching prefix in a single walk along the callsign.
+    Exact callsigns in the country file (e.g. "=VP2V/KB1ABC") override the prefixes. The results for each distinct callsign are remembered, so resolving the
+    callsigns of a whole log (in which most callsigns appear many times) with resolve_many is very cheap. """
+
+    def __init__(self, path=None):
+        """ Set up an empty country file, and optionally load it from a file.
+
+        :arg str path: The path to the country file.
+        :raises IOError, ValueError: If the country file could not be read or is malformed.
+        """
+        # The prefix trie. Each node is a dictionary of child nodes keyed by character, and the entity of the prefix that ends at the node (if any) is keyed by None.
+        self.trie = {}
+        # The entities of callsigns that are listed individually in the country file.
+        self.exact = {}
+        # The entities, keyed by primary prefix.
+        self.entities = {}
+        # The results of previous resolutions, keyed by callsign.
+        self.resolved = {}
+        if(path is not None):
+            self.load(path)
+        return
+
+    def __len__(self):
+        return len(self.entities)
+
+    def load(self, path):
+        """ Load the entities and their prefixes from a country file. The format of the file (cty.dat or cty.csv) is determined from its contents.
+
+        :arg str path: The path to the country file.
+        :raises IOError, ValueError: If the country file could not be read or is malformed.
+        """
+        with open(path, mode="r", errors="replace") as f:
+            first = f.readline()
+            f.seek(0)
+            entities = iter_dat(f) if ":" in first else iter_csv(f)
+            count = 0
+            for (entity, prefixes) in entities:
+                self.add(entity, prefixes)
+                count += 1
+        logging.debug("Loaded %d entities from the country file %s." % (count, path))
+        return
+
+    def add(self, entity, prefixes):
+        """ Add an entity and its prefixes.
+
+        :arg Entity entity: The entity.
+        :arg list prefixes: The entity's prefixes (and exact callsigns, which begin with "="), with any overrides.
+        """
+        self.entities[entity.prefix] = entity
+        for token in prefixes:
+            (prefix, exact, details) = parse_prefix(token, entity)
+            if(not prefix):
+                continue
+            if(exact):
+                self.exact[prefix] = details
+            else:
+                node = self.trie
+                for character in prefix:
+                    node = node.setdefault(character, {})
+                node[None] = details
+        self.resolved.clear()
+        return
+
+    def match(self, prefix):
+        """ Find the entity of the longest prefix in the trie which matches the start of a string.
+
+        :arg str prefix: The string (e.g. a callsign, or the prefix part of a callsign).
+        :returns: The entity, or None if no prefix matches.
+        :rtype: Entity
+        """
+        node = self.trie
+        entity = None
+        for character in prefix:
+            node = node.get(character)
+            if(node is None):
+                break
+            entity = node.get(None, entity)
+        return entity
+
+    def resolve(self, full_callsign):
+        """ Determine the entity of a callsign.
+
+        Suffixes for portable/mobile operation (e.g. "/P") are ignored, and callsigns with a maritime or aeronautical mobile suffix ("/MM" or "/AM") do not have an entity.
+        If the callsign has a prefix (e.g. "F/" in "F/MYCALL") then the prefix determines the entity, and a single-digit suffix (e.g. "/6" in "W1ABC/6") replaces the call area.
+
+        :arg str full_callsign: The callsign (with any prefix and/or suffix).
+        :returns: The entity, or None if the entity could not be determined.
+        :rtype: Entity
+        """
+        if(not full_callsign):
+            return None
+        callsign = full_callsign.strip().upper()
+        if(callsign in self.exact):
+            return self.exact[callsign]
+
+        components = [component for component in callsign.split("/") if component]
+        while(len(components) > 1 and components[-1] in PORTABLE_SUFFIXES):
+            components.pop()
+        if(len(components) > 1 and components[-1] in MOBILE_SUFFIXES):
+            return None
+        if(not components):
+            return None
+        base = "/".join(components)
+        if(base in self.exact):
+            return self.exact[base]
+
+        if(len(components) == 1):
+            prefix = components[0]
+        elif(len(components[-1]) == 1 and components[-1].isdigit()):
+            # Replace the call area (i.e. the first digit) of the callsign.
+            prefix = re.sub(r"\d", components[-1], components[0], count=1)
+        elif(len(components) == 2 and len(components[1]) < len(components[0])):
+            # The prefix is usually the shorter part of the callsign (e.g. "KH6" in "MYCALL/KH6").
+            prefix = components[1]
+        else:
+            prefix = components[0]
+        return self.match(prefix)
+
+    def resolve_many(self, callsigns):
+        """ Determine the entities of many callsigns at once (e.g. all the callsigns in a log). Each distinct callsign is only resolved once.
+
+        :arg callsigns: An iterable of callsigns.
+        :returns: The entity of each callsign (or None if the entity could not be determined), in the same order as the callsigns.
+        :rtype: list
+        """
+        resolved = self.resolved
+        entities = []
+        append = entities.append
+        for callsign in callsigns:
+            try:
+                append(resolved[callsign])
+            except KeyError:
+                if(len(resolved) >= MAXIMUM_RESOLVED_CALLSIGNS):
+                    resolved.clear()
+                entity = resolved[callsign] = self.resolve(callsign)
+                append(entity)
+        return entities
+
+
+_country_files = {}
+
+
+def get_country_file(path=COUNTRY_FILE):
+    """ Return the country file that is shared by the whole application, loading it the first time it is needed.
+
+    :arg str path: The path to the country file.
+    :returns: The country file, or None if it could not be loaded (e.g. because it has not been downloaded).
+    :rtype: CountryFile
+    """
+    if(path not in _country_files):
+        try:
+            _country_files[path] = CountryFile(path)
+        except (IOError, ValueError) as e:
+            logging.warning("Could not load the country file %s. Callsigns will not be resolved to DXCC entities offline." % path)
+            logging.debug(e)
+            _country_files[path] = None
+    return _country_files[path]
@@ -19,16 +19,24 @@
 
 from gi.repository import Gtk, GObject, Gdk, GLib
 import logging
-import telnetlib3
-import asyncio
-from threading import Thread
+from threading import Lock
+from collections import deque
 import configparser
 import os.path
 
 from pyqso.telnet_connection_dialog import TelnetConnectionDialog
 from pyqso.auxiliary_dialogs import error
+from pyqso.dx_spots import SpotStore, NeededSpotMatcher, NEW_ENTITY, NEW_BAND, NEW_MODE, NEW_GRID
+from pyqso.cluster_manager import ClusterManager, FAILED
+from pyqso.cty import get_country_file
 
 BOOKMARKS_FILE = os.path.expanduser('~/.config/pyqso/bookmarks.ini')
+# The time (in milliseconds) between updates of the text received from the DX cluster.
+FRAME_INTERVAL = 100
+# The maximum number of lines of text shown. The oldest lines are removed first.
+MAXIMUM_LINES = 1000
+# The colours used to highlight needed spots. Spots which are only needed because of a new callsign are not highlighted.
+HIGHLIGHTS = {NEW_ENTITY: "red", NEW_BAND: "orange", NEW_MODE: "blue", NEW_GRID: "purple"}
 
 
 class DXCluster:
@@ -45,9 +53,17 @@ class DXCluster:
 
         self.application = application
         self.builder = self.application.builder
-        self.thread = None
-        self.telnet_reader = None
-        self.telnet_writer = None
+        # Any number of Telnet servers can be connected at once. The connections are all run by the manager in a single thread.
+        self.manager = ClusterManager(on_receive=self.receive, on_state=self.on_connection_state)
+
+        # The text received from the Telnet servers is split into lines by the manager, and any spots are stored.
+        self.spots = SpotStore()
+        # Each spot is checked against what has been worked in the logbook (see the count_worked method).
+        self.matcher = NeededSpotMatcher(get_country_file())
+        # The lines waiting to be rendered, each with the name of the text tag used to highlight it (or None). These are rendered all at once, a few times per second, rather than as soon as they are received.
+        self.pending = deque(maxlen=MAXIMUM_LINES)
+        self.pending_lock = Lock()
+        self.frame_timeout = None
 
         # Connect signals.
         self.builder.get_object('mitem_new').connect('activate', self.connect_to_new_server)
@@ -58,6 +74,10 @@ class DXCluster:
         # Get the text renderer and its buffer.
         self.renderer = self.builder.get_object('renderer')
         self.buffer = self.renderer.get_buffer()
+        # This mark stays at the end of the buffer as text is inserted, and is used for autoscrolling.
+        self.end_mark = self.buffer.create_mark('end', self.buffer.get_end_iter(), False)
+        for (tag_name, colour) in HIGHLIGHTS.items():
+            self.buffer.create_tag(tag_name, foreground=colour, weight=700)
 
         # Items whose sensitivity may change.
         self.items = {}
@@ -202,66 +222,114 @@ class DXCluster:
             logging.error("Could not connect to Telnet server '%s'." % name)
             logging.exception(e)
 
-    def render(self, data):
-        """ Add the text received from the Telnet server to the
-        text buffer, and perform autoscrolling. """
-        end_iter = self.buffer.get_end_iter()
-        self.buffer.insert(end_iter, data)
-        end_mark = self.buffer.create_mark('end', end_iter)
-        self.renderer.scroll_mark_onscreen(end_mark)
-
-    async def telnet_shell(self, host, port, username, password):
-        """ Receive and render text from the Telnet server. """
-        while True:
-            # Wait for data from the Telnet server.
-            data = await self.telnet_reader.read(4096)
-            if not data:
-                break
-            else:
-                # Call the rendering method in the main Gtk loop,
-                # rather than the asyncio loop.
-                GLib.idle_add(self.render, data)
+    def receive(self, connection, lines):
+        """ Store any spots received from a Telnet server, and queue the lines to be rendered. This is called from the connection manager's thread.
 
-            # Responses to login/password prompts.
-            if username and ("login: " in data):
-                self.telnet_writer.write(username + '\n')
-            if password and ("password: " in data):
-                self.telnet_writer.write(password + '\n')
+        :arg ClusterConnection connection: The connection to the Telnet server.
+        :arg list lines: The lines of text received, each with the spot that was parsed from it (or None if the line is not a spot).
+        """
+        highlighted = []
+        for (line, spot) in lines:
+            tag_name = None
+            if spot is not None:
+                self.spots.add(spot)
+                needed = self.matcher.match(spot)
+                if needed and needed[0] in HIGHLIGHTS:
+                    tag_name = needed[0]
+            highlighted.append((line, tag_name))
+        with self.pending_lock:
+            self.pending.extend(highlighted)
+
+    def on_connection_state(self, connection, state):
+        """ Report a change to the state of a connection. This is called from the connection manager's thread.
+
+        :arg ClusterConnection connection: The connection to the Telnet server.
+        :arg str state: The new state of the connection.
+        """
+        logging.debug("Connection to Telnet server %s is now %s." % (connection.name, state))
+        if state == FAILED:
+            GLib.idle_add(self.on_connection_failed, connection)
+        else:
+            GLib.idle_add(self.update_items_sensitive)
 
-    def send_command(self, widget=None):
-        """ Send the user-specified command in the Gtk.Entry box to the Telnet server. """
-        command = self.builder.get_object('command')
-        self.telnet_writer.write(command.get_text() + '\n')
-        command.set_text("")
+    def on_connection_failed(self, connection):
+        """ Let the user know that a connection to a Telnet server could not be made. This is called in the main thread.
 
-    def start_telnet(self, host, port, username, password):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        :arg ClusterConnection connection: The connection to the Telnet server, which has been removed from the connection manager.
+        :returns: False, so that this is only called once by GLib.idle_add.
+        :rtype: bool
+        """
+        if not self.manager.connections:
+            self.stop_rendering()
+        self.update_items_sensitive()
+        message = "Could not create a connection to the Telnet server %s:%d. Check connection to the internet. Check connection details. (%s)" % (connection.host, connection.port, connection.error)
+        error(parent=self.application.window, message=message)
+        return False
+
+    def render(self):
+        """ Add the lines received from the Telnet server since the last update to the
+        text buffer in one go, remove the oldest lines if there are too many, and perform autoscrolling.
+
+        :returns: True if the text should continue to be updated (i.e. while connected to the Telnet server), and False otherwise.
+        :rtype: bool
+        """
+        with self.pending_lock:
+            lines = list(self.pending)
+            self.pending.clear()
+        if lines:
+            # Consecutive lines without highlighting are inserted together.
+            plain = []
+            for (line, tag_name) in lines:
+                if tag_name is None:
+                    plain.append(line)
+                    continue
+                if plain:
+                    self.buffer.insert(self.buffer.get_end_iter(), "\n".join(plain) + "\n")
+                    plain = []
+                self.buffer.insert_with_tags_by_name(self.buffer.get_end_iter(), line + "\n", tag_name)
+            if plain:
+                self.buffer.insert(self.buffer.get_end_iter(), "\n".join(plain) + "\n")
+            excess = self.buffer.get_line_count() - MAXIMUM_LINES
+            if excess > 0:
+                self.buffer.delete(self.buffer.get_start_iter(), self.buffer.get_iter_at_line(excess))
+            self.renderer.scroll_mark_onscreen(self.end_mark)
+        return self.frame_timeout is not None
+
+    def start_rendering(self):
+        """ Start updating the text received from the Telnet server at a fixed rate.
+
+        :returns: False, so that this is only called once by GLib.idle_add.
+        :rtype: bool
+        """
+        if self.frame_timeout is None:
+            self.frame_timeout = GLib.timeout_add(FRAME_INTERVAL, self.render)
+        return False
 
-        # Attempt connection to Telnet server.
-        try:
-            logging.debug("Attempting connection to Telnet server %s:%d..." % (host, port))
-            self.telnet_reader, self.telnet_writer = loop.run_until_complete(telnetlib3.open_connection(host, port))
-            logging.debug("Connection to %s:%d established." % (host, port))
-        except Exception as e:
-            logging.exception(e)
-            message = "Could not create a connection to the Telnet server %s:%d. Check connection to the internet. Check connection details." % (host, port)
-            GLib.idle_add(error, self.application.window, message)
-            return
+    def stop_rendering(self):
+        """ Render any remaining text received from the Telnet server, and stop updating the text.
 
-        # When successfully connected, disable the option to connect.
-        GLib.idle_add(self.set_items_sensitive, False)
+        :returns: False, so that this is only called once by GLib.idle_add.
+        :rtype: bool
+        """
+        if self.frame_timeout is not None:
+            GLib.source_remove(self.frame_timeout)
+            self.frame_timeout = None
+        self.render()
+        return False
 
-        # Run interactive shell.
-        try:
-            loop.run_until_complete(self.telnet_shell(host, port, username, password))
-        except Exception as e:
-            logging.exception(e)
-            GLib.idle_add(error, self.application.window, "Exception occurred in Telnet shell.")
+    def count_worked(self, logbook):
+        """ Count the callsigns, DXCC entities and grid squares worked in a logbook, so that needed spots can be highlighted.
+        The logs in the logbook are also monitored for any subsequent changes.
 
-        # Clean up and re-enable the option to connect again.
-        GLib.idle_add(self.set_items_sensitive, True)
-        loop.close()
+        :arg logbook: The logbook containing logs which in turn contain QSOs.
+        """
+        self.matcher.count(logbook)
+
+    def send_command(self, widget=None):
+        """ Send the user-specified command in the Gtk.Entry box to all the connected Telnet servers. """
+        command = self.builder.get_object('command')
+        self.manager.send(command.get_text() + '\n')
+        command.set_text("")
 
     def connect(self, host, port=23, username=None, password=None):
         """ Connect to a user-specified Telnet server.
@@ -281,25 +349,38 @@ class DXCluster:
             port = 23  # Use the default Telnet port.
 
         try:
-            self.thread = Thread(target=self.start_telnet, args=(host, port, username, password))
-            self.thread.setDaemon(True)  # Allows the thread to be stopped when the main Gtk thread is stopped.
-            self.thread.start()
+            self.manager.add(host, port, username, password)
+        except ValueError as e:
+            error(parent=self.application.window, message=str(e))
+            return
         except Exception as e:
             logging.exception(e)
             error(parent=self.application.window, message="Could not start Telnet.")
             return
+        self.start_rendering()
+        self.update_items_sensitive()
 
     def disconnect(self, widget=None):
-        """ Disconnect from a Telnet server. """
-        self.telnet_writer.write("quit\n")
-        self.telnet_writer.close()
-        self.set_items_sensitive(True)
+        """ Disconnect from all the Telnet servers. """
+        self.manager.remove_all()
+        self.stop_rendering()
+        self.update_items_sensitive()
+
+    def update_items_sensitive(self):
+        """ Enable/disable the relevant buttons depending on whether PyQSO is connected to any Telnet servers.
+
+        :returns: False, so that this is only called once by GLib.idle_add.
+        :rtype: bool
+        """
+        self.set_items_sensitive(not self.manager.connections)
+        return False
 
     def set_items_sensitive(self, sensitive):
-        """ Enable/disable the relevant buttons for connecting/disconnecting from a DX cluster, so that users cannot click the connect button if PyQSO is already connected.
+        """ Enable/disable the relevant buttons for disconnecting from a DX cluster and sending commands, so that users cannot click them if PyQSO is not connected.
+        The Connect button is always enabled, since PyQSO can be connected to several DX clusters at once.
 
-        :arg bool sensitive: If True, enable the Connect button and disable the Disconnect button. If False, vice versa.
+        :arg bool sensitive: If True, disable the Disconnect and Send buttons. If False, enable them.
         """
-        self.items['CONNECT'].set_sensitive(sensitive)
+        self.items['CONNECT'].set_sensitive(True)
         self.items['DISCONNECT'].set_sensitive(not sensitive)
         self.items['SEND'].set_sensitive(not sensitive)
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2013-2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import re
+import time
+import bisect
+import threading
+import sqlite3 as sqlite
+from collections import namedtuple, deque
+
+from pyqso.adif import BANDS, BANDS_RANGES
+
+# The maximum number of spots kept in a SpotStore.
+MAXIMUM_SPOTS = 10000
+
+# A spot from a DX cluster. The frequency is in kHz (as it is given by the cluster), the time is the UTC time of the spot as "HHMM", and the received time is a Unix timestamp.
+# The band and mode are determined from the frequency and the comment, and are empty if they are not known.
+Spot = namedtuple("Spot", ["spotter", "frequency", "callsign", "comment", "time", "locator", "band", "mode", "received"])
+
+# A spot line, e.g. "DX de W3LPL:     14025.0  JA1ABC       CW 599 TNX QSO               1234Z FN20"
+SPOT_LINE = re.compile(r"^DX de\s+([A-Z0-9/#\-]+?)-?#?:?\s+(\d+(?:\.\d*)?)\s+([A-Z0-9/]+)\s*(.*?)\s*(\d{4})Z(?:\s+([A-R]{2}\d{2}(?:[A-X]{2})?))?\s*$", re.IGNORECASE)
+
+# The modes that may be given in a spot's comment, and the (ADIF) mode that each one corresponds to.
+COMMENT_MODES = {"CW": "CW", "SSB": "SSB", "USB": "SSB", "LSB": "SSB", "AM": "AM", "FM": "FM", "RTTY": "RTTY", "FT8": "FT8", "FT4": "FT4",
+                 "JT65": "JT65", "JT9": "JT9", "PSK31": "PSK", "PSK63": "PSK", "PSK": "PSK", "SSTV": "SSTV", "OLIVIA": "OLIVIA", "MSK144": "MSK144"}
+# The dial frequencies (in kHz) commonly used for the digital modes. Spots within a few kHz of these are assumed to be for the given mode.
+DIGITAL_FREQUENCIES = [(1840.0, "FT8"), (3573.0, "FT8"), (3575.0, "FT4"), (7047.5, "FT4"), (7074.0, "FT8"), (10136.0, "FT8"), (10140.0, "FT4"), (14074.0, "FT8"),
+                       (14080.0, "FT4"), (18100.0, "FT8"), (18104.0, "FT4"), (21074.0, "FT8"), (21140.0, "FT4"), (24915.0, "FT8"), (24919.0, "FT4"),
+                       (28074.0, "FT8"), (28180.0, "FT4"), (50313.0, "FT8"), (50318.0, "FT4")]
+# The segments of the HF bands (in kHz) which are used (almost) exclusively for CW. The rest of each band (apart from the digital frequencies) is assumed to be used for SSB.
+CW_SEGMENTS = [(1800.0, 1838.0), (3500.0, 3570.0), (7000.0, 7040.0), (10100.0, 10130.0), (14000.0, 14070.0), (18068.0, 18095.0), (21000.0, 21070.0),
+               (24890.0, 24915.0), (28000.0, 28070.0), (50000.0, 50100.0)]
+
+# A grid square (e.g. "IO91" or "IO91WM") given in a spot's comment.
+COMMENT_LOCATOR = re.compile(r"\b([A-R]{2}\d{2})(?:[A-X]{2})?\b")
+
+# Modes that are counted as Phone modes (as in the awards table). CW is a class of its own, and all the other modes are assumed to be Digital modes.
+PHONE_MODES = ["FM", "AM", "SSB", "SSTV"]
+
+# The ways in which a spot can be needed, in order of importance, and the kind of key that is checked against what has been worked for each one.
+NEW_ENTITY = "new-entity"
+NEW_BAND = "new-band"
+NEW_MODE = "new-mode"
+NEW_GRID = "new-grid"
+NEW_CALL = "new-call"
+NEEDED = [(NEW_ENTITY, "entity"), (NEW_BAND, "band"), (NEW_MODE, "mode"), (NEW_GRID, "grid"), (NEW_CALL, "call")]
+
+# The lower bounds of the bands (in kHz), in ascending order, for finding a spot's band by bisection.
+_band_lower_bounds = [BANDS_RANGES[i][0]*1000 for i in range(1, len(BANDS))]
+
+
+def get_band(frequency):
+    """ Determine the band of a frequency.
+
+    :arg float frequency: The frequency in kHz.
+    :returns: The band (e.g. "20m"), or an empty string if the frequency is not within any band.
+    :rtype: str
+    """
+    i = bisect.bisect_right(_band_lower_bounds, frequency)
+    if(i > 0 and frequency <= BANDS_RANGES[i][1]*1000):
+        return BANDS[i]
+    return ""
+
+
+def get_mode(frequency, comment):
+    """ Determine the mode of a spot, from its comment if possible, and otherwise from its frequency.
+
+    :arg float frequency: The frequency in kHz.
+    :arg str comment: The spot's comment.
+    :returns: The mode (e.g. "CW"), or an empty string if the mode could not be determined.
+    :rtype: str
+    """
+    for word in comment.upper().split():
+        if(word in COMMENT_MODES):
+            return COMMENT_MODES[word]
+    for (dial_frequency, mode) in DIGITAL_FREQUENCIES:
+        if(dial_frequency <= frequency <= dial_frequency + 3):
+            return mode
+    for (lower, upper) in CW_SEGMENTS:
+        if(lower <= frequency <= upper):
+            return "CW"
+    if(frequency < 30000 or (50000 <= frequency <= 54000)):
+        return "SSB"
+    return ""
+
+
+def get_mode_class(mode):
+    """ Determine the class of a mode, as used for the DXCC award.
+
+    :arg str mode: The (upper case) name of the mode.
+    :returns: "Phone", "CW" or "Digital".
+    :rtype: str
+    """
+    if(mode in PHONE_MODES):
+        return "Phone"
+    elif(mode == "CW"):
+        return "CW"
+    else:
+        return "Digital"
+
+
+def parse_spot(line, received=None):
+    """ Parse a spot line (i.e. a line beginning with "DX de") from a DX cluster.
+
+    :arg str line: The line of text.
+    :arg float received: The time at which the spot was received (as a Unix timestamp). By default, the current time is used.
+    :returns: The spot, or None if the line is not a spot line.
+    :rtype: Spot
+    """
+    if(not line.startswith("DX de") and not line.startswith("DX DE")):
+        return None
+    match = SPOT_LINE.match(line)
+    if(match is None):
+        return None
+    (spotter, frequency, callsign, comment, utc, locator) = match.groups()
+    frequency = float(frequency)
+    return Spot(spotter=spotter.upper(), frequency=frequency, callsign=callsign.upper(), comment=comment, time=utc, locator=(locator or "").upper(),
+                band=get_band(frequency), mode=get_mode(frequency, comment), received=received if received is not None else time.time())
+
+
+class SpotParser:
+
+    """ Splits the text received from a DX cluster into complete lines, however the text is split up into chunks by the connection. """
+
+    def __init__(self):
+        """ Set up a new parser, with no text received so far. """
+        self.partial = ""
+        return
+
+    def feed(self, data):
+        """ Add some text received from the DX cluster.
+
+        :arg str data: The text.
+        :returns: The lines of text which have been completed (without their line endings).
+        :rtype: list
+        """
+        lines = (self.partial + data).replace("\r", "").split("\n")
+        self.partial = lines.pop()
+        return lines
+
+    def flush(self):
+        """ Return any text received after the last complete line (e.g. a login prompt), and forget about it.
+
+        :returns: The text after the last complete line.
+        :rtype: str
+        """
+        partial = self.partial
+        self.partial = ""
+        return partial
+
+
+class SpotStore:
+
+    """ A bounded store of the most recent spots from one or more DX clusters. Once the store is full, the oldest spot is discarded whenever a new one is added.
+
+    The spots are indexed by band, mode and callsign, so that (for example) all the recent spots on a given band can be found without checking every spot.
+    Spots may be added by one thread (e.g. the thread receiving the spots) while being queried by another. """
+
+    def __init__(self, capacity=MAXIMUM_SPOTS):
+        """ Set up an empty spot store.
+
+        :arg int capacity: The maximum number of spots in the store.
+        """
+        self.capacity = capacity
+        self.spots = deque()
+        # The spots with each band, mode and callsign, oldest first.
+        self.indices = {"band": {}, "mode": {}, "callsign": {}}
+        self.lock = threading.Lock()
+        return
+
+    def __len__(self):
+        return len(self.spots)
+
+    def add(self, spot):
+        """ Add a spot to the store, discarding the oldest spot if the store is full.
+
+        :arg Spot spot: The spot.
+        """
+        with self.lock:
+            if(len(self.spots) >= self.capacity):
+                oldest = self.spots.popleft()
+                for (field_name, index) in self.indices.items():
+                    key = getattr(oldest, field_name)
+                    spots = index[key]
+                    spots.popleft()  # The oldest spot is also the oldest spot with its band/mode/callsign.
+                    if(not spots):
+                        del index[key]
+            self.spots.append(spot)
+            for (field_name, index) in self.indices.items():
+                key = getattr(spot, field_name)
+                if(key not in index):
+                    index[key] = deque()
+                index[key].append(spot)
+        return
+
+    def clear(self):
+        """ Remove all the spots from the store. """
+        with self.lock:
+            self.spots.clear()
+            for index in self.indices.values():
+                index.clear()
+        return
+
+    def find(self, band=None, mode=None, callsign=None, limit=None):
+        """ Find the spots with a given band, mode and/or callsign.
+
+        :arg str band: The band of the spots (e.g. "20m"), or None for any band.
+        :arg str mode: The mode of the spots (e.g. "CW"), or None for any mode.
+        :arg str callsign: The callsign of the spotted station (in upper case), or None for any callsign.
+        :arg int limit: The maximum number of spots to return, or None to return all the spots found.
+        :returns: The most recent spots found, newest first.
+        :rtype: list
+        """
+        criteria = [(field_name, value) for (field_name, value) in [("band", band), ("mode", mode), ("callsign", callsign)] if value is not None]
+        with self.lock:
+            if(criteria):
+                # Start with the smallest set of spots that meets one of the criteria, and check the others.
+                candidates = min([self.indices[field_name].get(value, ()) for (field_name, value) in criteria], key=len)
+            else:
+                candidates = self.spots
+            spots = []
+            for spot in reversed(candidates):
+                if(all([getattr(spot, field_name) == value for (field_name, value) in criteria])):
+                    spots.append(spot)
+                    if(limit is not None and len(spots) >= limit):
+                        break
+        return spots
+
+    def get_counts(self, field_name):
+        """ Count the spots with each band, mode or callsign.
+
+        :arg str field_name: Either "band", "mode" or "callsign".
+        :returns: The number of spots, keyed by band, mode or callsign.
+        :rtype: dict
+        """
+        with self.lock:
+            return dict([(key, len(spots)) for (key, spots) in self.indices[field_name].items()])
+
+
+class NeededSpotMatcher:
+
+    """ Determines whether each spot from a DX cluster is needed, i.e. whether the spotted station would be a new DXCC entity, a new band or mode for an entity,
+    a new grid square or a new callsign, given the QSOs in the logbook.
+
+    The callsigns, entities, band/mode slots and grid squares that have been worked are counted once from scratch with a single query (see the count method),
+    and are then kept up-to-date as records are added, edited and deleted by listening to the signals emitted by each Log (in the same way as the awards table).
+    Checking a spot is then just a few dictionary lookups, so that spots can be checked as quickly as they arrive without querying the database.
+    The DXCC entities of the callsigns (in both the logbook and the spots) are determined with the country file, so no entity-based checks are made without one. """
+
+    def __init__(self, country_file=None):
+        """ Set up a matcher with nothing worked.
+
+        :arg CountryFile country_file: The country file used to determine the DXCC entity of each callsign, or None if entities should not be considered.
+        """
+        self.country_file = country_file
+        self.logbook = None
+        # The logs whose records are being counted, and the IDs of the signal handlers connected to each one.
+        self.handlers = []
+        self.lock = threading.Lock()
+        self.clear()
+        return
+
+    def clear(self):
+        """ Forget everything that has been worked. """
+        with self.lock:
+            # The number of QSOs with each callsign, entity, (entity, band) pair, (entity, band, mode class) triple and (grid square, band) pair.
+            self.worked = {"call": {}, "entity": {}, "band": {}, "mode": {}, "grid": {}}
+        return
+
+    def reset(self):
+        """ Forget everything that has been worked, and stop listening for changes to the records in any logs (e.g. when the logbook is closed). """
+        self.monitor([])
+        self.logbook = None
+        self.clear()
+        return
+
+    def get_entity(self, callsign):
+        """ Determine the DXCC entity of a callsign.
+
+        :arg str callsign: The callsign.
+        :returns: The primary prefix of the entity, which identifies it, or None if the entity could not be determined.
+        :rtype: str
+        """
+        if(self.country_file is None or not callsign):
+            return None
+        entity = self.country_file.resolve_many((callsign,))[0]
+        return entity.prefix if entity is not None else None
+
+    def get_keys(self, callsign, band, mode, gridsquare):
+        """ Return the keys under which a QSO (or a spot) is counted.
+
+        :arg str callsign: The callsign, in upper case.
+        :arg str band: The band, in lower case.
+        :arg str mode: The mode, in upper case.
+        :arg str gridsquare: The grid square (only the first four characters are used), in upper case.
+        :returns: A list of (kind, key) pairs, where kind is one of the keys of the worked dictionary. Keys that cannot be determined are not included.
+        :rtype: list
+        """
+        keys = []
+        if(callsign):
+            keys.append(("call", callsign))
+        entity = self.get_entity(callsign)
+        if(entity is not None):
+            keys.append(("entity", entity))
+            if(band):
+                keys.append(("band", (entity, band)))
+                if(mode):
+                    keys.append(("mode", (entity, band, get_mode_class(mode))))
+        if(gridsquare and len(gridsquare) >= 4 and band):
+            keys.append(("grid", (gridsquare[:4], band)))
+        return keys
+
+    def tally(self, callsign, band, mode, gridsquare, n):
+        """ Add to (or subtract from) the counts of what has been worked.
+
+        :arg str callsign: The callsign.
+        :arg str band: The band.
+        :arg str mode: The mode.
+        :arg str gridsquare: The grid square.
+        :arg int n: The number of QSOs to add to the counts. Use a negative number to subtract from the counts.
+        """
+        keys = self.get_keys((callsign or "").strip().upper(), (band or "").lower(), (mode or "").upper(), (gridsquare or "").upper())
+        with self.lock:
+            for (kind, key) in keys:
+                worked = self.worked[kind]
+                worked[key] = worked.get(key, 0) + n
+                if(worked[key] <= 0):
+                    del worked[key]
+        return
+
+    def tally_record(self, record, n):
+        """ Add a record to (or subtract a record from) the counts.
+
+        :arg dict record: The record, with upper case field names.
+        :arg int n: Use 1 to add the record to the counts, or -1 to subtract it.
+        """
+        self.tally(record.get("CALL"), record.get("BAND"), record.get("MODE"), record.get("GRIDSQUARE"), n)
+        return
+
+    def count(self, logbook):
+        """ Count what has been worked from scratch. The logs in the logbook are also monitored for any subsequent changes.
+
+        :arg logbook: The logbook containing logs which in turn contain QSOs.
+        """
+        logging.debug("Counting the callsigns, entities and grid squares worked...")
+        self.logbook = logbook
+        self.monitor(logbook.logs)
+        self.clear()
+        if(len(logbook.logs) > 0):
+            # Count the QSOs in all the logs at once. Each distinct callsign/band/mode/grid square combination only needs to be tallied once.
+            query = " UNION ALL ".join(["SELECT call, band, mode, gridsquare FROM %s" % log.name for log in logbook.logs])
+            query = """SELECT upper(trim(call)), lower(band), upper(mode), upper(substr(gridsquare, 1, 4)), Count(*)
+FROM (%s)
+GROUP BY 1, 2, 3, 4""" % query
+            try:
+                with logbook.connection:
+                    c = logbook.connection.cursor()
+                    c.execute(query)
+                    for (callsign, band, mode, gridsquare, n) in c:
+                        self.tally(callsign, band, mode, gridsquare, n)
+            except sqlite.Error as e:
+                logging.error("Could not count the callsigns, entities and grid squares worked because of a database error.")
+                logging.exception(e)
+        logging.debug("Counted %d callsigns and %d entities worked." % (len(self.worked["call"]), len(self.worked["entity"])))
+        return
+
+    def monitor(self, logs):
+        """ Listen for changes to the records in some logs, and stop listening to any other logs.
+
+        :arg list logs: The logs to monitor.
+        """
+        for (log, handler_ids) in self.handlers:
+            if(log not in logs):
+                for handler_id in handler_ids:
+                    log.disconnect(handler_id)
+        monitored = [log for (log, handler_ids) in self.handlers if log in logs]
+        self.handlers = [(log, handler_ids) for (log, handler_ids) in self.handlers if log in logs]
+        for log in logs:
+            if(log not in monitored):
+                handler_ids = [log.connect("record-added", self.on_record_added),
+                               log.connect("record-edited", self.on_record_edited),
+                               log.connect("record-deleted", self.on_record_deleted),
+                               log.connect("records-changed", self.on_records_changed)]
+                self.handlers.append((log, handler_ids))
+        return
+
+    def match(self, spot):
+        """ Determine whether a spot is needed.
+
+        :arg Spot spot: The spot.
+        :returns: The ways in which the spot is needed (see NEEDED), in order of importance. This is empty if the spot is not needed at all.
+        :rtype: list
+        """
+        # Use the last grid square in the comment, e.g. "JN48 <ES> IO91" is a spot of a station in IO91.
+        gridsquares = COMMENT_LOCATOR.findall(spot.comment.upper())
+        gridsquare = gridsquares[-1] if gridsquares else ""
+        keys = dict(self.get_keys(spot.callsign, spot.band, spot.mode, gridsquare))
+        with self.lock:
+            worked = self.worked
+            needed = [tag for (tag, kind) in NEEDED if kind in keys and keys[kind] not in worked[kind]]
+        # A new entity is also new on every band, and a new band for an entity is also a new mode, so there is no need to say so.
+        if(NEW_ENTITY in needed):
+            needed = [tag for tag in needed if tag not in (NEW_BAND, NEW_MODE)]
+        elif(NEW_BAND in needed):
+            needed = [tag for tag in needed if tag != NEW_MODE]
+        return needed
+
+    def on_record_added(self, log, record):
+        """ Add a new record to the counts. """
+        self.tally_record(record, 1)
+        return
+
+    def on_record_edited(self, log, old_record, new_record):
+        """ Update the counts if a record's callsign, band, mode or grid square has changed. """
+        fields = ["CALL", "BAND", "MODE", "GRIDSQUARE"]
+        if([old_record.get(f) for f in fields] != [new_record.get(f) for f in fields]):
+            self.tally_record(old_record, -1)
+            self.tally_record(new_record, 1)
+        return
+
+    def on_record_deleted(self, log, record):
+        """ Remove a deleted record from the counts. """
+        self.tally_record(record, -1)
+        return
+
+    def on_records_changed(self, log):
+        """ Count everything from scratch, since many records have changed. """
+        if(self.logbook is not None):
+            self.count(self.logbook)
+        return
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2013-2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import sqlite3 as sqlite
+import os
+import csv
+import time
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    import geocoder
+    have_geocoder = True
+except ImportError:
+    logging.warning("Could not import the geocoder module!")
+    have_geocoder = False
+
+# The database in which the coordinates of previously geocoded locations are cached.
+GEOCODING_CACHE_FILE = os.path.expanduser("~/.cache/pyqso/geocoding.db")
+# The bundled table of the approximate coordinates of the centre of each country/DXCC entity.
+COUNTRY_CENTROIDS_FILE = os.path.join(os.path.dirname(__file__), "res", "country_centroids.csv")
+# The number of seconds for which a location's coordinates are cached.
+TIME_TO_LIVE = 90*86400
+# The number of seconds for which a location that could not be found is remembered (so that it is not looked up again).
+NOT_FOUND_TIME_TO_LIVE = 86400
+# The maximum number of locations in the cache. The least-recently-used locations are discarded first.
+MAXIMUM_CACHED_LOCATIONS = 10000
+
+
+def normalise(name):
+    """ Normalise the name of a location, so that differences in case and whitespace do not matter.
+
+    :arg str name: The name of the location.
+    :returns: The normalised name.
+    :rtype: str
+    """
+    return " ".join(name.split()).upper()
+
+
+def load_country_centroids(path=COUNTRY_CENTROIDS_FILE):
+    """ Load the table of country/DXCC entity centroids.
+
+    :arg str path: The path to the CSV file containing the table.
+    :returns: The (latitude, longitude) coordinates of each country, keyed by the country's normalised name. The dictionary is empty if the table could not be read.
+    :rtype: dict
+    """
+    centroids = {}
+    try:
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                centroids[normalise(row["name"])] = (float(row["latitude"]), float(row["longitude"]))
+    except (OSError, KeyError, ValueError) as e:
+        logging.error("Could not read the table of country centroids from %s." % path)
+        logging.exception(e)
+    return centroids
+
+
+class GeocodingCache:
+
+    """ A persistent cache of the latitude-longitude coordinates of locations that have been geocoded, stored in an SQLite database.
+    Entries expire after a certain time, and the least-recently-used entries are discarded once the cache is full. Locations which could not be found are cached too. """
+
+    def __init__(self, path=GEOCODING_CACHE_FILE, time_to_live=TIME_TO_LIVE, not_found_time_to_live=NOT_FOUND_TIME_TO_LIVE, maximum_size=MAXIMUM_CACHED_LOCATIONS):
+        """ Open (and, if necessary, create) the cache.
+
+        :arg str path: The path to the cache's database file. Use ":memory:" for a cache that is not persistent.
+        :arg float time_to_live: The number of seconds for which a location's coordinates are cached.
+        :arg float not_found_time_to_live: The number of seconds for which a location that could not be found is cached.
+        :arg int maximum_size: The maximum number of locations in the cache.
+        :raises sqlite.Error: If the cache could not be opened.
+        """
+        self.time_to_live = time_to_live
+        self.not_found_time_to_live = not_found_time_to_live
+        self.maximum_size = maximum_size
+        if(path != ":memory:"):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The cache is written to by the Geocoder's worker thread as well as the main thread.
+        self.lock = threading.Lock()
+        self.connection = sqlite.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS locations (name TEXT PRIMARY KEY, latitude REAL, longitude REAL, expires REAL, accessed REAL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS locations_accessed_index ON locations (accessed)")
+        return
+
+    def get(self, name):
+        """ Return the cached coordinates of a location.
+
+        :arg str name: The name of the location.
+        :returns: The (latitude, longitude) coordinates of the location, (None, None) if the location is known not to be found, or None if the location is not in the cache (or its entry has expired).
+        :rtype: tuple
+        """
+        name = normalise(name)
+        now = time.time()
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT latitude, longitude FROM locations WHERE name=? AND expires>?", (name, now)).fetchone()
+            if(row is not None):
+                self.connection.execute("UPDATE locations SET accessed=? WHERE name=?", (now, name))
+                return tuple(row)
+        return None
+
+    def set(self, name, latitude, longitude):
+        """ Cache the coordinates of a location.
+
+        :arg str name: The name of the location.
+        :arg float latitude: The latitude of the location, or None if the location could not be found.
+        :arg float longitude: The longitude of the location, or None if the location could not be found.
+        """
+        self.set_many([(name, latitude, longitude)])
+        return
+
+    def set_many(self, locations):
+        """ Cache the coordinates of several locations at once, and then discard any expired or least-recently-used entries.
+
+        :arg list locations: A list of (name, latitude, longitude) tuples. The latitude and longitude are None for locations which could not be found.
+        """
+        now = time.time()
+        entries = []
+        for (name, latitude, longitude) in locations:
+            time_to_live = self.not_found_time_to_live if latitude is None else self.time_to_live
+            entries.append((normalise(name), latitude, longitude, now + time_to_live, now))
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO locations VALUES (?, ?, ?, ?, ?)", entries)
+            self.connection.execute("DELETE FROM locations WHERE expires<=?", (now,))
+            self.connection.execute("DELETE FROM locations WHERE name IN (SELECT name FROM locations ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.maximum_size,))
+        return
+
+    def close(self):
+        """ Close the cache's database connection. """
+        with self.lock:
+            self.connection.close()
+        return
+
+
+class Geocoder:
+
+    """ Determines the latitude-longitude coordinates of locations (e.g. the COUNTRY of a QSO).
+
+    Locations are first looked up in the table of country centroids, and then in the geocoding cache. Only the remaining locations are looked up with an online geocoding service,
+    in a separate worker thread so that the caller (e.g. the GTK main loop) is never blocked. Requests for the same location are combined, and the results are added to the cache. """
+
+    def __init__(self, cache=None, centroids=None, lookup=None):
+        """ Set up the geocoder.
+
+        :arg GeocodingCache cache: The cache of geocoded locations. By default, the cache in the user's cache directory is used (if it can be opened).
+        :arg dict centroids: The coordinates of each country, keyed by normalised name. By default, the bundled table of country centroids is used.
+        :arg lookup: The function used to look up a location online. It is given the name of the location, and should return its (latitude, longitude) coordinates, or None if the location could not be found. By default, the Google geocoding service is used (if the geocoder module is available).
+        """
+        if(cache is None):
+            try:
+                cache = GeocodingCache()
+            except (OSError, sqlite.Error) as e:
+                logging.warning("Could not open the geocoding cache. Geocoded locations will not be cached.")
+                logging.exception(e)
+        self.cache = cache
+        self.centroids = centroids if centroids is not None else load_country_centroids()
+        if(lookup is None and have_geocoder):
+            lookup = self.lookup_google
+        self.lookup = lookup
+
+        # The locations waiting to be looked up online, and the callbacks to call for each one once it has been found.
+        self.requests = queue.Queue()
+        self.callbacks = {}
+        self.callbacks_lock = threading.Lock()
+        self.worker = None
+        return
+
+    @staticmethod
+    def lookup_google(name):
+        """ Look up a location with the Google geocoding service.
+
+        :arg str name: The name of the location.
+        :returns: The (latitude, longitude) coordinates of the location, or None if the location could not be found.
+        :rtype: tuple
+        """
+        g = geocoder.google(name)
+        if(g.latlng):
+            latitude, longitude = g.latlng
+            return (latitude, longitude)
+        return None
+
+    def get(self, name):
+        """ Return the coordinates of a location if they are known already, without looking the location up online.
+
+        :arg str name: The name of the location.
+        :returns: The (latitude, longitude) coordinates of the location, (None, None) if the location is known not to be found, or None if the location needs to be looked up online.
+        :rtype: tuple
+        """
+        key = normalise(name)
+        if(key in self.centroids):
+            return self.centroids[key]
+        if(self.cache is not None):
+            return self.cache.get(key)
+        return None
+
+    def request(self, name, callback):
+        """ Find the coordinates of a location. If the coordinates are not known already, the location is looked up online in the worker thread.
+
+        :arg str name: The name of the location.
+        :arg callback: The function to call with the location's name and (latitude, longitude) coordinates once they have been found. Note that this is called from the worker thread if the location had to be looked up online.
+        :returns: True if the coordinates were known already (in which case the callback has been called already), or False otherwise.
+        :rtype: bool
+        """
+        coordinates = self.get(name)
+        if(coordinates is not None):
+            if(coordinates[0] is not None):
+                callback(name, coordinates)
+            return True
+        if(self.lookup is None):
+            logging.warning("Unable to look up the coordinates of '%s' because there is no geocoding service available." % name)
+            return True
+
+        key = normalise(name)
+        with self.callbacks_lock:
+            if(key in self.callbacks):
+                # The location is being looked up already.
+                self.callbacks[key].append((name, callback))
+                return False
+            self.callbacks[key] = [(name, callback)]
+        self.requests.put(key)
+        if(self.worker is None):
+            self.worker = threading.Thread(target=self.work, daemon=True)
+            self.worker.start()
+        return False
+
+    def work(self):
+        """ Look up the requested locations online, a batch at a time. This runs in the (daemon) worker thread, waiting for new requests, until PyQSO exits. """
+        while True:
+            batch = [self.requests.get()]
+            # Collect together all the requests that have been made in the meantime.
+            while True:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            self.resolve(batch)
+
+    def resolve(self, keys):
+        """ Look up a batch of (normalised) location names online, cache the results, and call the callbacks of the locations that were found.
+
+        :arg list keys: The normalised names of the locations.
+        """
+        logging.debug("Geocoding %d location(s)..." % len(keys))
+        results = []
+        for key in keys:
+            try:
+                coordinates = self.lookup(key)
+            except Exception as e:
+                # Don't cache the failure, since it might be temporary (e.g. if there is no network connection).
+                logging.error("Unable to lookup the coordinates of '%s'. Check connection to the internets? Lookup limit reached?" % key)
+                logging.exception(e)
+                coordinates = False
+            if(coordinates is None):
+                logging.warning("The coordinates of '%s' could not be found." % key)
+                results.append((key, None, None))
+            elif(coordinates):
+                results.append((key, coordinates[0], coordinates[1]))
+
+        if(self.cache is not None and results):
+            try:
+                self.cache.set_many(results)
+            except sqlite.Error as e:
+                logging.exception(e)
+
+        found = dict([(key, (latitude, longitude)) for (key, latitude, longitude) in results if latitude is not None])
+        for key in keys:
+            # Any locations that were not found are forgotten about here too, so that they can be requested again.
+            with self.callbacks_lock:
+                callbacks = self.callbacks.pop(key, [])
+            if(key in found):
+                for (name, callback) in callbacks:
+                    callback(name, found[key])
+        return
@@ -17,16 +17,61 @@
 #    You should have received a copy of the GNU General Public License
 #    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
 
-from gi.repository import Gtk
+from gi.repository import Gtk, GObject
 import logging
 import sqlite3 as sqlite
+from array import array
+from collections import OrderedDict
+from datetime import date
 
-from pyqso.adif import AVAILABLE_FIELD_NAMES_ORDERED
+from pyqso.adif import AVAILABLE_FIELD_NAMES_ORDERED, AVAILABLE_FIELD_NAMES_TYPES
+from pyqso.callsign_index import CallsignIndex
+from pyqso.schema import SHADOW_FUNCTIONS, rename_log_table
 
+# The number of rows fetched from the database at a time.
+PAGE_SIZE = 256
+# The maximum number of pages of rows that are kept in memory.
+MAXIMUM_CACHED_PAGES = 64
 
-class Log(Gtk.ListStore):
 
-    """ A single log inside of the whole logbook. A Log object can store multiple records. This is """
+def get_minutes(qso_date, time_on):
+    """ Convert the date and time of a QSO into the number of minutes since the start of the (proleptic Gregorian) calendar, so that QSOs on different days can be compared.
+
+    :arg str qso_date: The date of the QSO, in the ADIF format YYYYMMDD.
+    :arg str time_on: The time of the QSO, in the ADIF format HHMM or HHMMSS.
+    :returns: The number of minutes, or None if the date or time is not valid.
+    :rtype: int
+    """
+    try:
+        days = date(int(qso_date[0:4]), int(qso_date[4:6]), int(qso_date[6:8])).toordinal()
+        (hours, minutes) = (int(time_on[0:2]), int(time_on[2:4]))
+    except (TypeError, ValueError):
+        return None
+    if(len(qso_date) != 8 or len(time_on) not in (4, 6) or hours > 23 or minutes > 59):
+        return None
+    return days*1440 + hours*60 + minutes
+
+
+class Log(GObject.Object, Gtk.TreeModel):
+
+    """ A single log inside of the whole logbook. A Log object can store multiple records.
+
+    The Log is a Gtk.TreeModel whose rows are backed by the log's database table. Only the ids of the records are held in memory (in display order);
+    the rows themselves are fetched from the database a page at a time when they are needed (e.g. when a row is scrolled into view), and only the most recently-used pages are kept.
+
+    Other parts of PyQSO (e.g. the awards table) can keep track of changes to the records via the following signals. The records passed to the handlers are dictionaries of field-value pairs (with upper case field names):
+
+    * record-added (record): emitted after a record has been added with add_record.
+    * record-edited (old_record, new_record): emitted after a field of a record has been edited.
+    * record-deleted (record): emitted after a record has been deleted.
+    * records-changed (): emitted after many records have been added at once with add_records. Handlers should assume that any of the records may have changed. """
+
+    __gsignals__ = {
+        "record-added": (GObject.SignalFlags.RUN_FIRST, None, (object,)),
+        "record-edited": (GObject.SignalFlags.RUN_FIRST, None, (object, object)),
+        "record-deleted": (GObject.SignalFlags.RUN_FIRST, None, (object,)),
+        "records-changed": (GObject.SignalFlags.RUN_FIRST, None, ()),
+    }
 
     def __init__(self, connection, name):
         """ Set up a new Log object.
@@ -35,74 +80,437 @@ class Log(Gtk.ListStore):
         :arg str name: The name of the log (i.e. the database table name).
         """
 
-        # The ListStore constructor needs to know the data types of the columns.
+        GObject.Object.__init__(self)
+
         # The index is always an integer. We will assume the fields are strings.
-        data_types = [int] + [str]*len(AVAILABLE_FIELD_NAMES_ORDERED)
-        # Call the constructor of the super class (Gtk.ListStore).
-        Gtk.ListStore.__init__(self, *data_types)
+        self.column_types = [int] + [str]*len(AVAILABLE_FIELD_NAMES_ORDERED)
 
         self.connection = connection
         self.name = name
 
+        # The ids of the records, in the order in which they are displayed.
+        self.ids = array('q')
+        # The position of each record's row, keyed by the record's id. This is built when it is first needed, and discarded (by setting it to None) whenever rows are removed or re-ordered.
+        self.positions = None
+        # The least-recently-used cache of pages of rows, keyed by page number.
+        self.pages = OrderedDict()
+        # The fields that are fetched with each page. The others are fetched one at a time, if and when they are needed.
+        self.fetched_field_names = list(AVAILABLE_FIELD_NAMES_ORDERED)
+        # The names of the columns in the database table. These are determined when they are first needed.
+        self.column_names = None
+        # The field that the records are sorted by (None means that they are sorted by their index), and the direction of sorting.
+        self.sort_field_name = None
+        self.sort_descending = False
+        # An index of the records' callsigns, used for filtering.
+        self.callsign_index = CallsignIndex()
+        # The expression that the callsigns are currently filtered by, and the indices of the records that match it (None if there is no filter).
+        self.callsign_filter = None
+        self.visible_ids = None
+
         return
 
     def populate(self):
-        """ Remove everything in the Gtk.ListStore that is rendered already (via the TreeView), and start afresh. """
+        """ Remove everything in the Log that is rendered already (via the TreeView), and start afresh. Only the ids of the records are retrieved here. """
 
         logging.debug("Populating '%s'..." % self.name)
         self.add_missing_db_columns()
-        self.clear()
 
         try:
-            records = self.records
-
-            for r in records:
-                liststore_entry = [r["id"]]
-                for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
-                    # Note: r may contain column names that are not in AVAILABLE_FIELD_NAMES_ORDERED,
-                    # so we need to loop over and only select those that are, since the ListStore will
-                    # expect a specific number of columns.
-                    liststore_entry.append(r[field_name])
-                self.append(liststore_entry)
-            logging.debug("Finished populating '%s'." % self.name)
-
+            ids = self.get_sorted_ids()
+            with self.connection:
+                c = self.connection.cursor()
+                c.execute("SELECT id, call FROM %s" % self.name)
+                self.callsign_index.build(c)
         except sqlite.Error as e:
             logging.error("Could not populate '%s' because of a database error." % self.name)
             logging.exception(e)
+            return
+
+        self.set_callsign_filter(self.callsign_filter)
+        self.reset(ids)
+        logging.debug("Finished populating '%s'." % self.name)
+
+        return
+
+    def reset(self, ids):
+        """ Replace all the rows in the Log.
+
+        :arg array.array ids: The ids of the records that the new rows represent, in display order.
+        """
+        self.clear()
+        if(self.has_views()):
+            for index in ids:
+                self.ids.append(index)
+                self.emit_row_inserted(len(self.ids)-1)
+        else:
+            self.ids = ids
+            self.positions = None
+        return
+
+    def clear(self):
+        """ Remove all the rows from the Log. The records themselves remain in the database. """
+        if(self.has_views()):
+            # Remove the rows from the end, so that the paths of the remaining rows do not change.
+            for position in range(len(self.ids)-1, -1, -1):
+                del self.ids[position]
+                self.row_deleted(Gtk.TreePath(position))
+        else:
+            self.ids = array('q')
+        self.positions = None
+        self.pages.clear()
+        return
+
+    def has_views(self):
+        """ Determine whether any views (or filter/sort models) are listening for changes to the Log's rows. If not, there is no need to signal every single change.
+
+        :returns: True if there is a handler connected to the row-inserted signal. Otherwise returns False.
+        :rtype: bool
+        """
+        return GObject.signal_has_handler_pending(self, GObject.signal_lookup("row-inserted", Gtk.TreeModel), 0, True)
+
+    def emit_row_inserted(self, position):
+        """ Signal that a row has been inserted at a given position.
+
+        :arg int position: The position of the new row.
+        """
+        iter = Gtk.TreeIter()
+        iter.user_data = position
+        self.row_inserted(Gtk.TreePath(position), iter)
+        return
+
+    def emit_row_changed(self, position):
+        """ Signal that the data in the row at a given position has changed.
+
+        :arg int position: The position of the row.
+        """
+        iter = Gtk.TreeIter()
+        iter.user_data = position
+        self.row_changed(Gtk.TreePath(position), iter)
+        return
+
+    def invalidate(self, position=0):
+        """ Remove the cached pages that contain the row at a given position, and all the rows after it.
+
+        :arg int position: The position of the first row whose cached page should be discarded.
+        """
+        first = position // PAGE_SIZE
+        for number in [n for n in self.pages if n >= first]:
+            del self.pages[number]
+        return
+
+    def set_fetched_field_names(self, field_names):
+        """ Set the fields whose data is fetched along with each page of rows (typically the fields whose columns are visible).
+        The CALL field is always fetched, since it is used for filtering.
+
+        :arg list field_names: The names of the fields to fetch.
+        """
+        self.fetched_field_names = [f for f in AVAILABLE_FIELD_NAMES_ORDERED if f in field_names or f == "CALL"]
+        self.pages.clear()
+        return
+
+    def get_column_names(self, connection=None):
+        """ Return the (lower case) names of the columns in the log's database table.
+
+        :arg connection: An optional connection to the logbook to use instead of the Log's own, if the names are not already known.
+        :returns: The names of the columns in the database table.
+        :rtype: list
+        :raises sqlite.Error: If the column names could not be retrieved.
+        """
+        if(self.column_names is None):
+            if(connection is None):
+                connection = self.connection
+            with connection:
+                c = connection.cursor()
+                c.execute("PRAGMA table_info(%s)" % self.name)
+                self.column_names = [str(t[1]).lower() for t in c.fetchall()]
+        return self.column_names
+
+    def get_page(self, number):
+        """ Return a page of rows, fetching it from the database if it is not already cached.
+
+        :arg int number: The page number.
+        :returns: The rows in the page. Each row is a tuple containing the record's id followed by the data in each of the fetched fields.
+        :rtype: list
+        :raises sqlite.Error: If the rows could not be retrieved from the database.
+        """
+        page = self.pages.get(number)
+        if(page is not None):
+            self.pages.move_to_end(number)
+            return page
+
+        ids = self.ids[number*PAGE_SIZE:(number+1)*PAGE_SIZE].tolist()
+        column_names = self.get_column_names()
+        # Fields that are not in the database table (yet) are treated as empty.
+        columns = ", ".join([f.lower() if f.lower() in column_names else "''" for f in self.fetched_field_names])
+        with self.connection:
+            c = self.connection.cursor()
+            c.execute("SELECT id, %s FROM %s WHERE id IN (%s)" % (columns, self.name, ",".join("?"*len(ids))), ids)
+            rows = dict([(r[0], tuple(r)) for r in c])
+        empty = tuple([""]*len(self.fetched_field_names))
+        page = [rows.get(index, (index,) + empty) for index in ids]
+
+        self.pages[number] = page
+        if(len(self.pages) > MAXIMUM_CACHED_PAGES):
+            self.pages.popitem(last=False)
+        return page
+
+    def get_sort_keys(self, field_name):
+        """ Return the SQL expressions that the records are ordered by when sorting with respect to a given field.
+
+        :arg str field_name: The name of the field to sort by. If None, the records are sorted by their index.
+        :returns: A list of SQL expressions.
+        :rtype: list
+        """
+        if(field_name is None):
+            return ["id"]
+        elif(field_name == "QSO_DATE"):
+            # Also sort by the TIME_ON field so we get the correct chronological order.
+            return ["qso_date", "time_on"]
+        elif(field_name == "FREQ" and "freq_mhz" in self.get_column_names()):
+            # Use the FREQ field's typed shadow column (see pyqso.schema) if the log has one.
+            return ["freq_mhz"]
+        elif(AVAILABLE_FIELD_NAMES_TYPES[field_name] == "N"):
+            # Numbers are stored as text, so compare them as numbers (e.g. so that 7.1 comes before 14.2).
+            return ["CAST(%s AS REAL)" % field_name.lower()]
+        else:
+            return [field_name.lower()]
+
+    def create_sort_index(self, field_name):
+        """ Create an index on the database table (if one does not already exist) so that the records can be sorted quickly with respect to a given field.
+
+        :arg str field_name: The name of the field to sort by.
+        """
+        keys = self.get_sort_keys(field_name)
+        try:
+            with self.connection:
+                c = self.connection.cursor()
+                c.execute("CREATE INDEX IF NOT EXISTS %s_%s_index ON %s (%s)" % (self.name, field_name.lower(), self.name, ", ".join(keys)))
+        except sqlite.Error as e:
+            # The records can still be sorted without an index, just more slowly.
+            logging.warning("Could not create an index on the '%s' field of log '%s'." % (field_name, self.name))
+            logging.exception(e)
+        return
+
+    def get_sorted_ids(self):
+        """ Return the ids of all the records in the log, in the current sort order.
 
+        :returns: The ids of the records.
+        :rtype: array.array
+        :raises sqlite.Error: If the ids could not be retrieved from the database.
+        """
+        direction = "DESC" if self.sort_descending else "ASC"
+        order = ", ".join(["%s %s" % (key, direction) for key in self.get_sort_keys(self.sort_field_name)])
+        if(self.sort_field_name is not None):
+            order += ", id ASC"  # Keep records with the same value in a consistent order.
+        with self.connection:
+            c = self.connection.cursor()
+            c.execute("SELECT id FROM %s ORDER BY %s" % (self.name, order))
+            return array('q', [r[0] for r in c])
+
+    def sort(self, field_name=None, descending=False):
+        """ Sort the records with respect to a given field. The sorting is performed by the database, and the rows are then re-ordered in one go.
+
+        :arg str field_name: The name of the field to sort by. If None, the records are sorted by their index.
+        :arg bool descending: If True, sort in descending order. Otherwise sort in ascending order.
+        :raises sqlite.Error: If the records could not be sorted.
+        """
+        logging.debug("Sorting '%s' by %s..." % (self.name, field_name if field_name else "index"))
+        if(field_name is not None):
+            self.create_sort_index(field_name)
+
+        (previous_field_name, previous_descending) = (self.sort_field_name, self.sort_descending)
+        (self.sort_field_name, self.sort_descending) = (field_name, descending)
+        try:
+            ids = self.get_sorted_ids()
+        except sqlite.Error:
+            (self.sort_field_name, self.sort_descending) = (previous_field_name, previous_descending)
+            raise
+
+        if(len(ids) != len(self.ids)):
+            # The records in the database no longer match the rows, so start afresh.
+            self.reset(ids)
+        else:
+            if(len(ids) > 0 and self.has_views()):
+                # new_order[i] is the old position of the row that is now at position i.
+                new_order = [self.get_position(index) for index in ids]
+                self.ids = ids
+                self.positions = None
+                self.pages.clear()
+                self.rows_reordered(Gtk.TreePath(), None, new_order)
+            else:
+                self.ids = ids
+                self.positions = None
+                self.pages.clear()
+        logging.debug("Finished sorting '%s'." % self.name)
         return
 
+    def is_sorted(self):
+        """ Determine whether the records are sorted by anything other than their index (in ascending order).
+
+        :returns: True if the records are sorted by a field, or in descending order.
+        :rtype: bool
+        """
+        return self.sort_field_name is not None or self.sort_descending
+
+    def set_callsign_filter(self, expression):
+        """ Determine which records have a callsign containing a given expression. Note that this does not re-filter any views; it only determines the result of is_visible.
+
+        :arg str expression: The (case-insensitive) expression to filter the callsigns by. If None or empty, all records are visible.
+        """
+        if(expression):
+            self.callsign_filter = expression
+            self.visible_ids = self.callsign_index.search(expression)
+        else:
+            self.callsign_filter = None
+            self.visible_ids = None
+        return
+
+    def is_visible(self, index):
+        """ Determine whether a record passes the callsign filter.
+
+        :arg int index: The index of the record in the SQL database.
+        :returns: True if the record's callsign contains the filter expression, or if there is no filter. Otherwise returns False.
+        :rtype: bool
+        """
+        return self.visible_ids is None or index in self.visible_ids
+
+    def index_callsign(self, index, callsign):
+        """ Add (or update) a record's callsign in the callsign index, and update whether the record passes the callsign filter.
+
+        :arg int index: The index of the record in the SQL database.
+        :arg str callsign: The record's callsign.
+        """
+        self.callsign_index.update(index, callsign)
+        if(self.visible_ids is not None):
+            if(self.callsign_index.matches(index, self.callsign_filter)):
+                self.visible_ids.add(index)
+            else:
+                self.visible_ids.discard(index)
+        return
+
+    def get_position(self, index):
+        """ Return the position of a record in the Log.
+
+        :arg int index: The index of the record in the SQL database.
+        :returns: The position of the record's row, or None if the record is not in the Log.
+        :rtype: int
+        """
+        if(self.positions is None):
+            self.positions = dict(zip(self.ids, range(len(self.ids))))
+        return self.positions.get(index)
+
+    def do_get_flags(self):
+        return Gtk.TreeModelFlags.LIST_ONLY
+
+    def do_get_n_columns(self):
+        return len(self.column_types)
+
+    def do_get_column_type(self, column):
+        return self.column_types[column]
+
+    def do_get_iter(self, path):
+        position = path.get_indices()[0]
+        if(position < 0 or position >= len(self.ids)):
+            return (False, None)
+        iter = Gtk.TreeIter()
+        iter.user_data = position
+        return (True, iter)
+
+    def do_get_path(self, iter):
+        return Gtk.TreePath([iter.user_data])
+
+    def do_get_value(self, iter, column):
+        position = iter.user_data
+        if(column == 0):
+            return self.ids[position]
+
+        field_name = AVAILABLE_FIELD_NAMES_ORDERED[column-1]
+        try:
+            if(field_name in self.fetched_field_names):
+                row = self.get_page(position // PAGE_SIZE)[position % PAGE_SIZE]
+                value = row[self.fetched_field_names.index(field_name)+1]
+            elif(field_name.lower() in self.get_column_names()):
+                with self.connection:
+                    c = self.connection.cursor()
+                    c.execute("SELECT %s FROM %s WHERE id=?" % (field_name.lower(), self.name), [self.ids[position]])
+                    value = c.fetchone()[0]
+            else:
+                value = ""
+        except (sqlite.Error, TypeError) as e:
+            logging.exception(e)
+            value = ""
+
+        if(value is None):
+            value = ""
+        return value
+
+    def do_iter_next(self, iter):
+        position = iter.user_data + 1
+        if(position >= len(self.ids)):
+            return False
+        iter.user_data = position
+        return True
+
+    def do_iter_previous(self, iter):
+        position = iter.user_data - 1
+        if(position < 0):
+            return False
+        iter.user_data = position
+        return True
+
+    def do_iter_children(self, parent):
+        if(parent is None and len(self.ids) > 0):
+            iter = Gtk.TreeIter()
+            iter.user_data = 0
+            return (True, iter)
+        return (False, None)
+
+    def do_iter_has_child(self, iter):
+        return False
+
+    def do_iter_n_children(self, iter):
+        if(iter is None):
+            return len(self.ids)
+        return 0
+
+    def do_iter_nth_child(self, parent, n):
+        if(parent is not None or n < 0 or n >= len(self.ids)):
+            return (False, None)
+        iter = Gtk.TreeIter()
+        iter.user_data = n
+        return (True, iter)
+
+    def do_iter_parent(self, child):
+        return (False, None)
+
     def add_missing_db_columns(self):
         """ Check whether each field name in AVAILABLE_FIELD_NAMES_ORDERED is in the database table. If not, add it
-        (with all entries being set to an empty string initially).
+        (with all entries being set to an empty string initially). All the missing columns are added in a single transaction.
+        Note that logbooks are brought up-to-date when they are opened (see the schema module), so there is usually nothing to add.
 
         :raises sqlite.Error, IndexError: If the existing database column names could not be obtained, or missing column names could not be added.
         """
         logging.debug("Adding any missing database columns...")
 
         # Get all the column names in the current database table.
-        column_names = []
         try:
-            with self.connection:
-                c = self.connection.cursor()
-                c.execute("PRAGMA table_info(%s)" % self.name)
-                result = c.fetchall()
-            for t in result:
-                column_names.append(t[1].upper())
+            column_names = self.get_column_names()
         except (sqlite.Error, IndexError) as e:
             logging.exception(e)
             logging.error("Could not obtain the database column names.")
             return
 
-        for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
-            if(not(field_name in column_names)):
-                try:
-                    with self.connection:
+        missing = [field_name for field_name in AVAILABLE_FIELD_NAMES_ORDERED if field_name.lower() not in column_names]
+        if(missing):
+            try:
+                with self.connection:
+                    c = self.connection.cursor()
+                    for field_name in missing:
                         c.execute("ALTER TABLE %s ADD COLUMN %s TEXT DEFAULT \"\"" % (self.name, field_name.lower()))
-                except sqlite.Error as e:
-                    logging.exception(e)
-                    logging.error("Could not add the missing database column '%s'." % field_name)
-                    pass
+            except sqlite.Error as e:
+                logging.exception(e)
+                logging.error("Could not add the missing database columns %s." % ", ".join(missing))
+            self.column_names = None
         logging.debug("Finished adding any missing database columns.")
         return
 
@@ -121,8 +529,7 @@ class Log(Gtk.ListStore):
             c = self.connection.cursor()
 
             # Get all the column names in the current database table.
-            c.execute("PRAGMA table_info(%s)" % self.name)
-            column_names = c.fetchall()
+            (query, column_names) = self.get_insert_query(c)
 
             # Get the index/rowid of the last inserted record in the database.
             c.execute("SELECT max(id) FROM %s" % self.name)
@@ -132,27 +539,7 @@ class Log(Gtk.ListStore):
                 last_index = 0
 
         # A list of all the database entries, to be inserted in one go into the database.
-        database_entries = []
-
-        # Construct the SQL query.
-        query = "INSERT INTO %s VALUES (NULL" % self.name
-        for i in range(len(column_names)-1):  # -1 here because we don't want to count the database's 'id' column, since this is autoincremented.
-            query = query + ",?"
-        query = query + ")"
-
-        # Gather all the records (making sure that the entries of each record are in the correct order).
-        for r in range(len(fields_and_data)):
-            # What if the database columns are not necessarily in the same order as (or even exist in) AVAILABLE_FIELD_NAMES_ORDERED?
-            # PyQSO handles this here, but needs a separate list (called database_entry) to successfully perform the SQL query.
-            database_entry = []
-            for t in column_names:
-                column_name = str(t[1])  # 't' here is a tuple
-                if((column_name.upper() in AVAILABLE_FIELD_NAMES_ORDERED) and (column_name.upper() in list(fields_and_data[r].keys()))):
-                    database_entry.append(fields_and_data[r][column_name.upper()])
-                else:
-                    if(column_name != "id"):  # Ignore the index/rowid field. This is a special case since it's not in AVAILABLE_FIELD_NAMES_ORDERED.
-                        database_entry.append("")
-            database_entries.append(database_entry)
+        database_entries = [self.get_database_entry(r, column_names) for r in fields_and_data]
 
         # Insert records in the database.
         with self.connection:
@@ -167,38 +554,151 @@ class Log(Gtk.ListStore):
             # Check that the number of records we wanted to insert is the same as the number of records successfully inserted.
             assert(len(inserted) == len(database_entries))
 
-            # Add the records to the ListStore as well.
-            for r in range(len(fields_and_data)):
-                liststore_entry = [inserted[r]["id"]]  # Add the record's index.
-                field_names = AVAILABLE_FIELD_NAMES_ORDERED
-                for i in range(0, len(field_names)):
-                    if(field_names[i] in list(fields_and_data[r].keys())):
-                        liststore_entry.append(fields_and_data[r][field_names[i]])
-                    else:
-                        liststore_entry.append("")
-                self.append(liststore_entry)
+        # Add the records to the end of the Log as well.
+        for (r, record) in zip(inserted, fields_and_data):
+            self.index_callsign(r["id"], record.get("CALL"))
+        self.invalidate(len(self.ids))
+        has_views = self.has_views()
+        for r in inserted:
+            self.ids.append(r["id"])
+            if(self.positions is not None):
+                self.positions[r["id"]] = len(self.ids)-1
+            if(has_views):
+                self.emit_row_inserted(len(self.ids)-1)
+        if(self.is_sorted()):
+            # Move the new rows to their correct positions.
+            self.sort(self.sort_field_name, self.sort_descending)
+
+        for (r, record) in zip(inserted, fields_and_data):
+            record = dict([(field_name, record.get(field_name, "")) for field_name in AVAILABLE_FIELD_NAMES_ORDERED])
+            record["ID"] = r["id"]
+            self.emit("record-added", record)
 
         logging.debug("Successfully added the record(s) to the log.")
         return
 
+    def add_records(self, records, batch_size=1000, progress=None, connection=None):
+        """ Add a potentially very large number of records to the log (e.g. when importing a log).
+        The records are inserted into the database in batches within a single transaction, and the Log's rows are only re-populated once at the end.
+
+        :arg records: An iterable (e.g. a list or a generator) of dictionaries, with each dictionary representing a single QSO.
+        :arg int batch_size: The number of records to insert into the database at a time.
+        :arg progress: An optional function which is called with the total number of records inserted so far after each batch has been inserted.
+        :arg connection: An optional connection to the logbook to insert the records with, instead of the Log's own (e.g. when the records are added by a task in a worker thread). In this case the Log's rows are not re-populated, and no signal is emitted, so the caller must do this afterwards in the main thread.
+        :returns: The number of records added to the log.
+        :rtype: int
+        :raises sqlite.Error: If the records could not be added. In this case none of the records are added, since the transaction is rolled back.
+        """
+        logging.debug("Adding records to log '%s' in batches of %d..." % (self.name, batch_size))
+
+        own_connection = (connection is None)
+        if(own_connection):
+            connection = self.connection
+        c = connection.cursor()
+        (query, column_names) = self.get_insert_query(c)
+
+        # There is no need to wait for every page to be synced to disk while bulk inserting (the logbook uses write-ahead logging, see schema.enable_write_ahead_logging).
+        # This setting only applies to this connection, and is restored afterwards.
+        c.execute("PRAGMA synchronous")
+        synchronous = c.fetchone()[0]
+        c.execute("PRAGMA synchronous=NORMAL")
+
+        count = 0
+        try:
+            with connection:
+                batch = []
+                for r in records:
+                    batch.append(self.get_database_entry(r, column_names))
+                    if(len(batch) >= batch_size):
+                        c.executemany(query, batch)
+                        count += len(batch)
+                        batch = []
+                        if(progress):
+                            progress(count)
+                if(batch):
+                    c.executemany(query, batch)
+                    count += len(batch)
+                    if(progress):
+                        progress(count)
+        finally:
+            c.execute("PRAGMA synchronous=%d" % synchronous)
+
+        if(own_connection):
+            # Refresh the Log's rows in one go.
+            self.populate()
+            self.emit("records-changed")
+
+        logging.debug("Successfully added %d records to log '%s'." % (count, self.name))
+        return count
+
+    def get_insert_query(self, cursor):
+        """ Construct the SQL query used to insert a record into the log's database table.
+
+        :arg cursor: The database cursor to use when retrieving the table's column names.
+        :returns: The SQL query, and the names of the database table's columns.
+        :rtype: tuple
+        :raises sqlite.Error: If the column names could not be retrieved.
+        """
+        cursor.execute("PRAGMA table_info(%s)" % self.name)
+        column_names = [str(t[1]) for t in cursor.fetchall()]  # 't' here is a tuple
+
+        query = "INSERT INTO %s VALUES (NULL" % self.name
+        for i in range(len(column_names)-1):  # -1 here because we don't want to count the database's 'id' column, since this is autoincremented.
+            query = query + ",?"
+        query = query + ")"
+        return (query, column_names)
+
+    def get_database_entry(self, fields_and_data, column_names):
+        """ Gather the data of a record in the same order as the columns of the log's database table.
+
+        :arg dict fields_and_data: The record, represented by a dictionary of field-value pairs.
+        :arg list column_names: The names of the database table's columns.
+        :returns: The data to be inserted into each (non-index) column.
+        :rtype: list
+        """
+        # What if the database columns are not necessarily in the same order as (or even exist in) AVAILABLE_FIELD_NAMES_ORDERED?
+        # PyQSO handles this here, but needs a separate list (called database_entry) to successfully perform the SQL query.
+        database_entry = []
+        for column_name in column_names:
+            if((column_name.upper() in AVAILABLE_FIELD_NAMES_ORDERED) and (column_name.upper() in fields_and_data)):
+                database_entry.append(fields_and_data[column_name.upper()])
+            elif(column_name.lower() in SHADOW_FUNCTIONS):
+                # The shadow columns are computed here rather than by a trigger, so that each record is only written once.
+                database_entry.append(SHADOW_FUNCTIONS[column_name.lower()](fields_and_data))
+            else:
+                if(column_name != "id"):  # Ignore the index/rowid field. This is a special case since it's not in AVAILABLE_FIELD_NAMES_ORDERED.
+                    database_entry.append("")
+        return database_entry
+
     def delete_record(self, index, iter=None):
-        """ Delete a specified record from the log. The corresponding record is also deleted from the Gtk.ListStore data structure.
+        """ Delete a specified record from the log. The corresponding row is also removed from the Log.
 
         :arg int index: The index of the record in the SQL database.
-        :arg iter: The iterator pointing to the record to be deleted in the Gtk.ListStore. If the default value of None is used, only the database entry is deleted and the corresponding Gtk.ListStore is left alone.
+        :arg iter: This argument is no longer used, since the row is found using the record's index.
         :raises sqlite.Error, IndexError: If the record could not be deleted.
         """
         logging.debug("Deleting record from log...")
 
         # Delete the selected row in database.
+        record = self.get_record_by_index(index)
         with self.connection:
             c = self.connection.cursor()
             query = "DELETE FROM %s" % self.name
             c.execute(query+" WHERE id=?", [index])
 
-        # Delete the selected row in the Gtk.ListStore.
-        if(iter is not None):
-            self.remove(iter)
+        # Remove the corresponding row.
+        self.callsign_index.remove(index)
+        if(self.visible_ids is not None):
+            self.visible_ids.discard(index)
+        position = self.get_position(index)
+        if(position is not None):
+            del self.ids[position]
+            self.positions = None
+            self.invalidate(position)
+            self.row_deleted(Gtk.TreePath(position))
+
+        if(record is not None):
+            self.emit("record-deleted", self.as_dict(record))
 
         logging.debug("Successfully deleted the record from the log.")
         return
@@ -209,46 +709,115 @@ class Log(Gtk.ListStore):
         :arg int index: The index of the record in the SQL database.
         :arg str field_name: The name of the field whose data should be modified.
         :arg str data: The data that should replace the current data in the field.
-        :arg iter: The iterator pointing to the record to be edited in the Gtk.ListStore. If the default value of None is used, only the database entry is edited and the corresponding Gtk.ListStore is left alone.
-        :arg column_index: The index of the column in the Gtk.ListStore to be edited. If the default value of None is used, only the database entry is edited and the corresponding Gtk.ListStore is left alone.
+        :arg iter: This argument is no longer used, since the row is found using the record's index.
+        :arg column_index: This argument is no longer used, since the row's data is re-fetched from the database.
         :raises sqlite.Error, IndexError: If the record could not be edited.
         """
         logging.debug("Editing field '%s' in record %d..." % (field_name, index))
+        record = self.get_record_by_index(index)
         with self.connection:
             c = self.connection.cursor()
             query = "UPDATE %s SET %s" % (self.name, field_name)
             query = query + "=? WHERE id=?"
             c.execute(query, [data, index])  # First update the SQL database...
-        if(iter is not None and column_index is not None):
-            self.set(iter, column_index, data)  # ...and then the ListStore.
+        if(field_name.upper() == "CALL"):
+            self.index_callsign(index, data)
+        position = self.get_position(index)
+        if(position is not None):
+            # ...and then discard the cached copy of the row.
+            self.pages.pop(position // PAGE_SIZE, None)
+            self.emit_row_changed(position)
+
+        if(record is not None):
+            old_record = self.as_dict(record)
+            new_record = dict(old_record)
+            new_record[field_name.upper()] = data
+            self.emit("record-edited", old_record, new_record)
+
         logging.debug("Successfully edited field '%s' in record %d in the log." % (field_name, index))
         return
 
-    def remove_duplicates(self):
-        """ Remove any duplicate records from the log.
+    def remove_duplicates(self, time_window=0, match_band_mode=False):
+        """ Remove any duplicate records from the log. The duplicates are all deleted at once (see delete_records).
 
+        :arg int time_window: The number of minutes either side of a QSO within which another QSO with the same callsign is a duplicate of it (see get_duplicates).
+        :arg bool match_band_mode: If True, QSOs are only duplicates if they also have the same band and mode.
         :returns: The total number of duplicates, and the number of duplicates that were successfully removed. Hopefully these will be the same.
         :rtype: tuple
         """
-        duplicates = self.get_duplicates()
+        duplicates = self.get_duplicates(time_window, match_band_mode)
         if(len(duplicates) == 0):
             return (0, 0)  # Nothing to do here.
 
-        removed = 0  # Count the number of records that are removed. Hopefully this will be the same as len(duplicates).
-        iter = self.get_iter_first()  # Start with the first row in the log.
-        prev = iter  # Keep track of the previous iter (initially this will be the same as the first row in the log).
-        while iter is not None:
-            row_index = self.get_value(iter, 0)  # Get the index.
-            if(row_index in duplicates):  # Is this a duplicate row? If so, delete it.
-                self.delete_record(row_index, iter)
-                removed += 1
-                iter = prev  # Go back to the iter before the record that was just removed and continue from there.
-                continue
-            prev = iter
-            iter = self.iter_next(iter)  # Move on to the next row, until iter_next returns None.
+        try:
+            removed = self.delete_records(duplicates)
+        except sqlite.Error as e:
+            logging.exception(e)
+            removed = 0
 
         return (len(duplicates), removed)
 
+    def delete_records(self, indices):
+        """ Delete many records from the log at once, in a single transaction. The corresponding rows are also removed from the Log in a single pass.
+        Rather than a record-deleted signal for each record, a single records-changed signal is emitted.
+
+        :arg list indices: The indices of the records in the SQL database.
+        :returns: The number of records deleted.
+        :rtype: int
+        :raises sqlite.Error: If the records could not be deleted, in which case none of them are.
+        """
+        deleted = self.delete_database_records(indices)
+        self.remove_rows(indices)
+        self.emit("records-changed")
+        return deleted
+
+    def delete_database_records(self, indices, connection=None):
+        """ Delete many records from the log's database table at once, in a single transaction, without removing the corresponding rows from the Log (see remove_rows).
+
+        :arg list indices: The indices of the records in the SQL database.
+        :arg connection: An optional connection to the logbook to use instead of the Log's own (e.g. when the records are deleted by a task in a worker thread).
+        :returns: The number of records deleted.
+        :rtype: int
+        :raises sqlite.Error: If the records could not be deleted, in which case none of them are.
+        """
+        logging.debug("Deleting %d records from log..." % len(indices))
+        if(connection is None):
+            connection = self.connection
+        with connection:
+            c = connection.cursor()
+            # The indices are put in a temporary table (which is not part of the logbook itself) rather than the query, since there may be too many for a single query.
+            c.execute("CREATE TEMP TABLE IF NOT EXISTS deleted_ids (id INTEGER PRIMARY KEY)")
+            c.execute("DELETE FROM temp.deleted_ids")
+            c.executemany("INSERT OR IGNORE INTO temp.deleted_ids (id) VALUES (?)", [(index,) for index in indices])
+            c.execute("DELETE FROM %s WHERE id IN (SELECT id FROM temp.deleted_ids)" % self.name)
+            deleted = c.rowcount
+            c.execute("DELETE FROM temp.deleted_ids")
+        logging.debug("Successfully deleted %d records from the log." % deleted)
+        return deleted
+
+    def remove_rows(self, indices):
+        """ Remove the rows of records that have been deleted from the database from the Log.
+        If no views are attached to the Log (see Logbook.remove_rows, which detaches them while many rows are removed), the ids are rebuilt in a single pass.
+        Otherwise each row is removed and signalled in turn, from the end, so that the paths of the remaining rows do not change.
+
+        :arg list indices: The indices of the deleted records.
+        """
+        indices = set(indices)
+        for index in indices:
+            self.callsign_index.remove(index)
+        if(self.visible_ids is not None):
+            self.visible_ids.difference_update(indices)
+        if(self.has_views()):
+            positions = sorted([self.get_position(index) for index in indices if self.get_position(index) is not None], reverse=True)
+            for position in positions:
+                del self.ids[position]
+                self.row_deleted(Gtk.TreePath(position))
+        else:
+            self.ids = array('q', [index for index in self.ids if index not in indices])
+        self.positions = None
+        self.pages.clear()
+        return
+
     def rename(self, new_name):
         """ Rename the log.
 
@@ -257,11 +826,8 @@ class Log(Gtk.ListStore):
         :rtype: bool
         """
         try:
-            with self.connection:
-                # First try to alter the table name in the database.
-                c = self.connection.cursor()
-                query = "ALTER TABLE %s RENAME TO %s" % (self.name, new_name)
-                c.execute(query)
+            # First try to alter the table name in the database (along with the names of its triggers and indexes).
+            rename_log_table(self.connection, self.name, new_name)
             # If the table name change was successful, then change the name attribute of the Log object too.
             self.name = new_name
             success = True
@@ -270,25 +836,74 @@ class Log(Gtk.ListStore):
             success = False
         return success
 
-    def get_duplicates(self):
-        """ Find the duplicates in the log, based on the CALL, QSO_DATE, and TIME_ON fields.
+    def create_duplicates_index(self, connection=None):
+        """ Create an index on the CALL, QSO_DATE and TIME_ON fields (if one does not already exist), so that duplicate records can be found without scanning the whole log for each record.
+
+        :arg connection: An optional connection to the logbook to use instead of the Log's own.
+        """
+        if(connection is None):
+            connection = self.connection
+        try:
+            with connection:
+                c = connection.cursor()
+                c.execute("CREATE INDEX IF NOT EXISTS %s_duplicates_index ON %s (call, qso_date, time_on)" % (self.name, self.name))
+        except sqlite.Error as e:
+            # The duplicates can still be found without an index, just more slowly.
+            logging.warning("Could not create an index for finding the duplicates in log '%s'." % self.name)
+            logging.exception(e)
+        return
 
+    def get_duplicates(self, time_window=0, match_band_mode=False, connection=None):
+        """ Find the duplicates in the log. By default, records are duplicates if they have the same CALL, QSO_DATE and TIME_ON fields, and the record with the lowest index is kept.
+
+        When merging logs from several operators, the times of the same QSO may differ slightly, and the case of the callsigns may differ. So if a time window is given,
+        a record is a duplicate if it has the same (case-insensitive) callsign as a QSO that is kept and is within the given number of minutes of it.
+        The earliest QSO in each group of duplicates is kept. Records whose date or time is not valid are only duplicates of records with exactly the same date and time.
+
+        :arg int time_window: The number of minutes either side of a QSO within which another QSO with the same callsign is a duplicate of it.
+        :arg bool match_band_mode: If True, records are only duplicates if they also have the same (case-insensitive) BAND and MODE fields.
+        :arg connection: An optional connection to the logbook to use instead of the Log's own (e.g. when the duplicates are found by a task in a worker thread).
         :returns: A list of indices/ids corresponding to the duplicate records.
         :rtype: list
         """
+        if(connection is None):
+            connection = self.connection
         duplicates = []
+        self.create_duplicates_index(connection)
         try:
-            with self.connection:
-                c = self.connection.cursor()
-                c.execute(
-                    """SELECT id FROM %s WHERE id NOT IN
+            with connection:
+                c = connection.cursor()
+                c.row_factory = None
+                if(time_window <= 0):
+                    # Each record is a duplicate if there is an identical one with a lower index. The index means that each record is only compared with the records it might duplicate.
+                    same_band_mode = "AND b.band IS a.band AND b.mode IS a.mode" if match_band_mode else ""
+                    c.execute("""SELECT id FROM {0} AS a WHERE EXISTS
    (
-   SELECT MIN(id) FROM %s GROUP BY call, qso_date, time_on
-   )""" % (self.name, self.name))
-                result = c.fetchall()
-            for index in result:
-                duplicates.append(index[0])  # Get the integer from inside the tuple.
-            duplicates.sort()  # These indices should monotonically increasing, but let's sort the list just in case.
+   SELECT 1 FROM {0} AS b WHERE b.call IS a.call AND b.qso_date IS a.qso_date AND b.time_on IS a.time_on {1} AND b.id < a.id
+   )""".format(self.name, same_band_mode))
+                    duplicates = [r[0] for r in c]
+                else:
+                    band_mode = "upper(band), upper(mode)" if match_band_mode else "'', ''"
+                    # Use the typed qso_timestamp column (see pyqso.schema) if the log has one, rather than parsing the date and time of every record.
+                    timestamp = "qso_timestamp" if "qso_timestamp" in self.get_column_names(connection) else "NULL"
+                    c.execute("SELECT id, upper(trim(call)), %s, qso_date, time_on, %s FROM %s ORDER BY 2, 3, 4, %s, qso_date, time_on, id" % (band_mode, timestamp, self.name, timestamp))
+                    kept = {}
+                    for (index, callsign, band, mode, qso_date, time_on, qso_timestamp) in c:
+                        if(timestamp == "NULL"):
+                            minutes = get_minutes(qso_date, time_on)
+                        else:
+                            minutes = qso_timestamp//60 if qso_timestamp is not None else None
+                        if(minutes is None):
+                            key = (callsign, band, mode, qso_date, time_on)
+                            minutes = 0
+                        else:
+                            key = (callsign, band, mode)
+                        # The rows are in chronological order within each group, so only the most recent QSO that is kept needs to be compared with.
+                        if(key in kept and minutes - kept[key] <= time_window):
+                            duplicates.append(index)
+                        else:
+                            kept[key] = minutes
+            duplicates.sort()
         except (sqlite.Error, IndexError) as e:
             logging.exception(e)
         return duplicates
@@ -307,6 +922,55 @@ class Log(Gtk.ListStore):
             c.execute(query, [index])
             return c.fetchone()
 
+    def get_field_values(self, field_name):
+        """ Return the values of a single field for all the records in the log which have that field set. This is much cheaper than retrieving whole records when only one field is of interest (e.g. the GRIDSQUARE field when shading the worked grid squares).
+
+        :arg str field_name: The name of the field.
+        :returns: A list of the non-empty values of the field.
+        :rtype: list
+        :raises sqlite.Error: If the values could not be retrieved from the database.
+        """
+        column_name = field_name.lower()
+        if(column_name not in self.get_column_names()):
+            return []
+        with self.connection:
+            c = self.connection.cursor()
+            c.execute("SELECT {0} FROM {1} WHERE {0} IS NOT NULL AND {0} != ''".format(column_name, self.name))
+            return [row[0] for row in c.fetchall()]
+
+    def get_fields(self, field_names, visible=False, connection=None):
+        """ Return the values of several fields for all the records in the log.
+
+        :arg list field_names: The names of the fields.
+        :arg bool visible: If True, only return the records which pass the callsign filter.
+        :arg connection: An optional connection to the logbook to use instead of the Log's own.
+        :returns: A list of tuples, one per record, containing the values of the fields in the same order as the field names. The values of any fields missing from the database are None.
+        :rtype: list
+        :raises sqlite.Error: If the values could not be retrieved from the database.
+        """
+        if(connection is None):
+            connection = self.connection
+        column_names = self.get_column_names(connection)
+        columns = ", ".join([field_name.lower() if field_name.lower() in column_names else "NULL" for field_name in field_names])
+        with connection:
+            c = connection.cursor()
+            c.row_factory = None  # Plain tuples are much cheaper to create than sqlite.Row objects.
+            c.execute("SELECT id, %s FROM %s" % (columns, self.name))
+            rows = c.fetchall()
+        if(visible and self.visible_ids is not None):
+            rows = [row for row in rows if row[0] in self.visible_ids]
+        return [row[1:] for row in rows]
+
+    @staticmethod
+    def as_dict(record):
+        """ Convert a record retrieved from the database into a dictionary with upper case field names.
+
+        :arg sqlite.Row record: The record.
+        :returns: The record, represented by a dictionary of field-value pairs. The index of the record is stored with the key "ID".
+        :rtype: dict
+        """
+        return dict([(key.upper(), record[key]) for key in record.keys()])
+
     @property
     def records(self):
         """ Return a list of all the records in the log.
@@ -320,6 +984,26 @@ class Log(Gtk.ListStore):
             c.execute("SELECT * FROM %s" % self.name)
             return c.fetchall()
 
+    def iter_records(self, batch_size=1000, connection=None):
+        """ Iterate over all the records in the log, in order of their index. The records are fetched from the database a batch at a time as they are needed, so the whole log is never held in memory (e.g. when it is exported).
+
+        :arg int batch_size: The number of records to fetch from the database at a time.
+        :arg connection: An optional connection to the logbook to use instead of the Log's own (e.g. when the log is exported by a task in a worker thread).
+        :returns: A generator which yields each record (as an sqlite.Row object).
+        :rtype: generator
+        :raises sqlite.Error: If the records could not be retrieved from the database.
+        """
+        if(connection is None):
+            connection = self.connection
+        c = connection.cursor()
+        c.execute("SELECT * FROM %s ORDER BY id" % self.name)
+        while True:
+            rows = c.fetchmany(batch_size)
+            if(not rows):
+                break
+            yield from rows
+        return
+
     @property
     def record_count(self):
         """ Return the total number of records in the log.
@@ -17,15 +17,13 @@
 #    You should have received a copy of the GNU General Public License
 #    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
 
-from gi.repository import Gtk
+from gi.repository import Gtk, GLib
 import logging
 import sqlite3 as sqlite
 import json
-from os.path import expanduser
-try:
-    import configparser
-except ImportError:
-    import ConfigParser as configparser
+import os
+import threading
+from contextlib import nullcontext
 
 from pyqso.adif import *
 from pyqso.cabrillo import *
@@ -37,7 +35,18 @@ from pyqso.cabrillo_export_dialog import CabrilloExportDialog
 from pyqso.summary import Summary
 from pyqso.blank import Blank
 from pyqso.printer import Printer
-from pyqso.compare import compare_date_and_time, compare_default
+from pyqso.preferences import get_preferences
+from pyqso.callsign_lookup import get_preferred_lookup_service
+from pyqso.callsign_enrichment import CallsignEnrichment, ENRICHED_FIELD_NAMES
+from pyqso.schema import create_log_table, enable_write_ahead_logging, get_schema_version, migrate, SCHEMA_VERSION
+from pyqso.parallel_import import ParallelImport
+from pyqso.task_runner import BUSY_TIMEOUT, LogbookBusy, Task, TaskCancelled, TaskRunner
+
+# The time (in milliseconds) to wait after the filter expression was last changed before re-filtering the logs.
+FILTER_DELAY = 250
+
+# The message shown when the logbook cannot be written to from the main thread, because a long-running operation is writing to it.
+BUSY_MESSAGE = "The logbook is being written to by another operation (see the status bar). Please wait for it to finish, or cancel it, and try again."
 
 
 class Logbook:
@@ -55,6 +64,19 @@ class Logbook:
         self.notebook = self.builder.get_object("logbook")
         self.connection = None
         self.logs = []
+        self.filter_timeout = None
+        # The callsign enrichment job that is currently running (if any).
+        self.enrichment = None
+
+        # Long-running operations (e.g. importing a log) are run in worker threads by the task runner, which is created when a logbook is opened.
+        # Their progress is shown in the statusbar, next to a button for cancelling them.
+        self.runner = None
+        self.task_context_id = self.application.statusbar.get_context_id("Tasks")
+        self.cancel_button = Gtk.Button(label="Cancel")
+        self.cancel_button.set_tooltip_text("Cancel the operations that are running")
+        self.cancel_button.set_no_show_all(True)
+        self.cancel_button.connect("clicked", self.cancel_tasks)
+        self.application.statusbar.get_message_area().pack_end(self.cancel_button, False, False, 0)
 
         return
 
@@ -121,11 +143,37 @@ class Logbook:
 
             self.path = path
 
+            # Allow the logs to be read while a worker thread is writing to the logbook (e.g. during an import). This is done before the task runner opens any other connections.
+            try:
+                enable_write_ahead_logging(self.connection)
+            except sqlite.Error as e:
+                logging.warning("Could not switch the logbook to write-ahead logging.")
+                logging.exception(e)
+
+            self.runner = TaskRunner(path, dispatch=GLib.idle_add, on_progress=self.on_task_progress, on_finished=self.on_task_finished)
+
+            # Bring the logbook's schema up-to-date. This only does anything the first time a logbook is opened with a newer version of PyQSO,
+            # but can take a while for a large logbook, so it is done in a worker thread while the user interface keeps running.
+            try:
+                if(get_schema_version(self.connection) < SCHEMA_VERSION):
+                    task = self.runner.submit(Task("Upgrading the logbook", lambda task, connection: migrate(connection), writes=True))
+                    self.runner.wait(task, Gtk.main_iteration)
+            except TaskCancelled:
+                self.close_runner()
+                info(parent=self.application.window, message="The logbook was not opened, since upgrading it was cancelled.")
+                return False
+            except sqlite.Error as e:
+                logging.exception(e)
+                self.close_runner()
+                error(parent=self.application.window, message="Could not open logbook. The logbook could not be upgraded to work with this version of PyQSO.")
+                return False
+
             logging.debug("Retrieving all the logs in the logbook...")
             try:
                 self.logs = self.get_logs()
             except (sqlite.Error, IndexError) as e:
                 logging.exception(e)
+                self.close_runner()
                 error(parent=self.application.window, message="Could not open logbook. Something went wrong when trying to retrieve the logs. Perhaps the logbook file is encrypted, corrupted, or in the wrong format?")
                 return False
 
@@ -135,7 +183,6 @@ class Logbook:
             # For rendering the logs. One treeview and one treeselection per Log.
             self.treeview = []
             self.treeselection = []
-            self.sorter = []
             self.filter = []
             self.summary = Summary(self.application)
             self.blank = Blank(self.application)
@@ -149,7 +196,8 @@ class Logbook:
             logging.debug("All logs rendered successfully.")
 
             self.summary.update()
-            self.application.toolbox.awards.count(self)
+            self.application.toolbox.awards.count_in_background(self)
+            self.application.toolbox.dx_cluster.count_worked(self)
 
             context_id = self.application.statusbar.get_context_id("Status")
             self.application.statusbar.push(context_id, "Logbook: %s" % self.path)
@@ -173,8 +221,20 @@ class Logbook:
         :rtype: bool
         """
 
+        # Stop any operations that are still running first, since they have their own connections to the logbook. Anything they were writing is rolled back.
+        self.close_runner()
+
         disconnected = self.db_disconnect()
         if(disconnected):
+            if(self.filter_timeout is not None):
+                GLib.source_remove(self.filter_timeout)
+                self.filter_timeout = None
+            if(self.enrichment is not None):
+                # Stop the job. It can be resumed the next time the logbook is opened.
+                self.enrichment.cancel()
+                self.enrichment = None
+            # Spots can no longer be checked against the logbook.
+            self.application.toolbox.dx_cluster.matcher.reset()
             logging.debug("Closing all logs in the logbook...")
             while(self.notebook.get_n_pages() > 0):
                 # Once a page is removed, the other pages get re-numbered,
@@ -204,7 +264,8 @@ class Logbook:
         # Try setting up the SQL database connection.
         try:
             self.db_disconnect()  # Destroy any existing connections first.
-            self.connection = sqlite.connect(path)
+            # Wait for any writes by the worker threads' connections to finish (see the TaskRunner class), rather than failing with a "database is locked" error.
+            self.connection = sqlite.connect(path, timeout=BUSY_TIMEOUT)
             self.connection.row_factory = sqlite.Row
         except sqlite.Error as e:
             # Cannot connect to the database.
@@ -233,6 +294,61 @@ class Logbook:
             logging.debug("Already disconnected. Nothing to do here.")
         return True
 
+    def writing(self):
+        """ Hold the task runner's write lock while writing to the logbook from the main thread, so that the write does not wait on (and then fail because of) a long-running operation's transaction.
+
+        :returns: A context manager which holds the write lock.
+        :raises LogbookBusy: If a long-running operation (e.g. an import) is still writing to the logbook after a short wait.
+        """
+        if(self.runner is None):
+            return nullcontext()
+        return self.runner.writing()
+
+    def close_runner(self):
+        """ Cancel any long-running operations, and wait for the worker threads to stop. """
+        if(self.runner is not None):
+            self.runner.close()
+            self.runner = None
+            self.application.statusbar.remove_all(self.task_context_id)
+            self.cancel_button.hide()
+        return
+
+    def cancel_tasks(self, widget=None):
+        """ Cancel all the long-running operations (e.g. an import or export) that have not yet finished. """
+        if(self.runner is not None):
+            logging.debug("Cancelling %d task(s)..." % len(self.runner.tasks))
+            self.runner.cancel_all()
+        return
+
+    def on_task_progress(self, task):
+        """ Show the progress of a long-running operation in the statusbar.
+
+        :arg Task task: The task that is running the operation.
+        """
+        if(task.total):
+            message = "%s: %d/%d QSOs..." % (task.description, task.count, task.total)
+        elif(task.count):
+            message = "%s: %d QSOs..." % (task.description, task.count)
+        else:
+            message = "%s..." % task.description
+        statusbar = self.application.statusbar
+        statusbar.remove_all(self.task_context_id)
+        statusbar.push(self.task_context_id, message)
+        self.cancel_button.show()
+        return
+
+    def on_task_finished(self, task):
+        """ Remove a finished operation from the statusbar, showing any other operation that is still running instead.
+
+        :arg Task task: The task that was running the operation.
+        """
+        self.application.statusbar.remove_all(self.task_context_id)
+        if(self.runner is not None and len(self.runner.tasks) > 0):
+            self.on_task_progress(self.runner.tasks[-1])
+        else:
+            self.cancel_button.hide()
+        return
+
     def on_switch_page(self, widget, label, new_page):
         """ Handle a tab/page change, and enable/disable the relevant Record-related buttons. """
 
@@ -268,16 +384,12 @@ class Logbook:
             if(response == Gtk.ResponseType.OK):
                 log_name = ln.name
                 try:
-                    with self.connection:
-                        c = self.connection.cursor()
-                        # NOTE: "id" is simply an alias for the "rowid" column here.
-                        query = "CREATE TABLE %s (id INTEGER PRIMARY KEY AUTOINCREMENT" % log_name
-                        for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
-                            s = ", %s TEXT" % field_name.lower()
-                            query = query + s
-                        query = query + ")"
-                        c.execute(query)
-                        exists = False
+                    with self.writing():
+                        create_log_table(self.connection, log_name)
+                    exists = False
+                except LogbookBusy:
+                    error(parent=ln.dialog, message=BUSY_MESSAGE)
+                    exists = True
                 except sqlite.Error as e:
                     logging.exception(e)
                     # Data is not valid - inform the user.
@@ -296,6 +408,8 @@ class Logbook:
         self.logs.append(l)
         self.render_log(self.log_count-1)
         self.summary.update()
+        self.application.toolbox.awards.count_in_background(self)
+        self.application.toolbox.dx_cluster.count_worked(self)
 
         self.notebook.set_current_page(self.log_count)
         return
@@ -330,9 +444,12 @@ class Logbook:
         response = question(parent=self.application.window, message="Are you sure you want to delete log %s?" % log.name)
         if(response == Gtk.ResponseType.YES):
             try:
-                with self.connection:
+                with self.writing(), self.connection:
                     c = self.connection.cursor()
                     c.execute("DROP TABLE %s" % log.name)
+            except LogbookBusy:
+                error(parent=self.application.window, message=BUSY_MESSAGE)
+                return
             except sqlite.Error as e:
                 logging.exception(e)
                 error(parent=self.application.window, message="Database error. Could not delete the log.")
@@ -342,41 +459,49 @@ class Logbook:
             # Remove the log from the renderers too.
             self.treeview.pop(log_index)
             self.treeselection.pop(log_index)
-            self.sorter.pop(log_index)
             self.filter.pop(log_index)
             # And finally remove the tab in the Logbook.
             self.notebook.set_current_page(page_index - 1)
             self.notebook.remove_page(page_index)
 
         self.summary.update()
-        self.application.toolbox.awards.count(self)
+        self.application.toolbox.awards.count_in_background(self)
+        self.application.toolbox.dx_cluster.count_worked(self)
         return
 
     def filter_logs(self, widget=None):
-        """ Re-filter all the logs when the user-defined expression is changed. """
+        """ Re-filter all the logs when the user-defined expression is changed.
+        The filtering is delayed slightly, so that the logs are only re-filtered once the user has stopped typing. """
+        if(self.filter_timeout is not None):
+            GLib.source_remove(self.filter_timeout)
+        self.filter_timeout = GLib.timeout_add(FILTER_DELAY, self.apply_filter)
+        return
+
+    def apply_filter(self):
+        """ Determine which records in each log match the user-defined expression, and then re-filter all the logs.
+
+        :returns: False, so that this method is only called once when used as a GLib timeout callback.
+        :rtype: bool
+        """
+        self.filter_timeout = None
+        callsign = self.application.toolbar.filter_source.get_text()
+        for log in self.logs:
+            log.set_callsign_filter(callsign)
         for i in range(0, len(self.filter)):
             self.filter[i].refilter()
-        return
+        return False
 
     def filter_by_callsign(self, model, iter, data):
         """ Filter all the logs in the logbook by the callsign field, based on a user-defined expression.
+        Note that the records matching the expression are determined beforehand by the apply_filter method.
 
         :arg Gtk.TreeModel model: The model used to filter the log data.
         :arg Gtk.TreeIter iter: A pointer to a particular row in the model.
-        :arg data: The user-defined expression to filter by.
+        :arg data: This argument is not used.
         :returns: True if a record matches the expression, or if there is nothing to filter. Otherwise, returns False.
         :rtype: bool
         """
-        value = model.get_value(iter, 1)
-        callsign = self.application.toolbar.filter_source.get_text()
-
-        if(callsign is None or callsign == ""):
-            # If there is nothing to filter with, then show all the records!
-            return True
-        else:
-            # This should be case insensitive.
-            # Also, we could use value[:][0:len(callsign))] if we wanted to match from the very start of each callsign.
-            return callsign.upper() in value or callsign.lower() in value
+        return model.is_visible(model.get_value(iter, 0))
 
     def render_log(self, index):
         """ Render a Log in the Gtk.Notebook.
@@ -386,10 +511,9 @@ class Logbook:
         self.filter.append(self.logs[index].filter_new(root=None))
         # Set the callsign column as the column we want to filter by.
         self.filter[index].set_visible_func(self.filter_by_callsign, data=None)
-        self.sorter.append(Gtk.TreeModelSort(model=self.filter[index]))
-        self.sorter[index].set_sort_column_id(0, Gtk.SortType.ASCENDING)
 
-        self.treeview.append(Gtk.TreeView(model=self.sorter[index]))
+        # Note: The records are sorted by the Log itself (see the sort_log method).
+        self.treeview.append(Gtk.TreeView(model=self.filter[index]))
         self.treeview[index].set_grid_lines(Gtk.TreeViewGridLines.BOTH)
         self.treeview[index].connect("row-activated", self.edit_record_callback)
         self.treeview[index].connect("button-release-event", self.on_button_release_event)
@@ -427,6 +551,8 @@ class Logbook:
 
         # Set up column names for each selected field
         field_names = AVAILABLE_FIELD_NAMES_ORDERED
+        visible_field_names = []
+        preferences = get_preferences()
         for i in range(0, len(field_names)):
             renderer = Gtk.CellRendererText()
 
@@ -449,16 +575,36 @@ class Logbook:
 
             column.connect("clicked", self.sort_log, i+1)
 
-            config = configparser.ConfigParser()
-            have_config = (config.read(expanduser('~/.config/pyqso/preferences.ini')) != [])
-            (section, option) = ("view", AVAILABLE_FIELD_NAMES_ORDERED[i].lower())
-            if(have_config and config.has_option(section, option)):
-                column.set_visible(config.getboolean(section, option))
+            column.set_visible(preferences.getboolean("view", field_names[i].lower(), fallback=True))
+            if(column.get_visible()):
+                visible_field_names.append(field_names[i])
             self.treeview[index].append_column(column)
 
+        # Only fetch the data that will actually be shown.
+        self.logs[index].set_fetched_field_names(visible_field_names)
+
         self.notebook.show_all()
         return
 
+    def remove_rows(self, log, indices):
+        """ Remove the rows of many deleted records from a Log in one go. The Log's view is detached while the rows are removed, and a new filter model is attached afterwards,
+        so that the view is refreshed once rather than being sent a row-deleted signal for every row.
+
+        :arg Log log: The Log containing the deleted records.
+        :arg list indices: The indices of the deleted records.
+        """
+        if(log not in self.logs):
+            log.remove_rows(indices)
+            return
+        index = self.logs.index(log)
+        self.treeview[index].set_model(None)
+        self.filter[index] = None  # Release the old filter model, so that it no longer listens for changes to the Log's rows.
+        log.remove_rows(indices)
+        self.filter[index] = log.filter_new(root=None)
+        self.filter[index].set_visible_func(self.filter_by_callsign, data=None)
+        self.treeview[index].set_model(self.filter[index])
+        return
+
     def sort_log(self, widget, column_index):
         """ Sort the log (that is currently selected) with respect to a given field.
 
@@ -466,41 +612,33 @@ class Logbook:
         """
 
         log_index = self.get_log_index()
+        log = self.logs[log_index]
         column = self.treeview[log_index].get_column(column_index)
 
-        if(AVAILABLE_FIELD_NAMES_ORDERED[column_index-1] == "QSO_DATE"):
-            # If the field being sorted is the QSO_DATE, then also sort by the TIME_ON field so we get the
-            # correct chronological order.
-            # Note: This assumes that the TIME_ON field is always immediately to the right of the QSO_DATE field.
-            self.sorter[log_index].set_sort_func(column_index, compare_date_and_time, user_data=[column_index, column_index+1])
+        # If we are operating on the currently-sorted column, then reverse the order of sorting.
+        # Otherwise, change to the new sorted column and default to ASCENDING order.
+        if(column.get_sort_indicator() and column.get_sort_order() == Gtk.SortType.ASCENDING):
+            order = Gtk.SortType.DESCENDING
         else:
-            self.sorter[log_index].set_sort_func(column_index, compare_default, user_data=column_index)
-
-        # If we are operating on the currently-sorted column...
-        if(self.sorter[log_index].get_sort_column_id()[0] == column_index):
-            order = column.get_sort_order()
-            # ...then check if we need to reverse the order of searching.
-            if(order == Gtk.SortType.ASCENDING):
-                self.sorter[log_index].set_sort_column_id(column_index, Gtk.SortType.DESCENDING)
-                column.set_sort_order(Gtk.SortType.DESCENDING)
-            else:
-                self.sorter[log_index].set_sort_column_id(column_index, Gtk.SortType.ASCENDING)
-                column.set_sort_order(Gtk.SortType.ASCENDING)
+            order = Gtk.SortType.ASCENDING
+
+        if(column_index == 0):
+            field_name = None  # Sort by the index.
         else:
-            # Otherwise, change to the new sorted column. Default to ASCENDING order.
-            self.sorter[log_index].set_sort_column_id(column_index, Gtk.SortType.ASCENDING)
-            column.set_sort_order(Gtk.SortType.ASCENDING)
-
-            # Show an arrow pointing in the direction of the sorting.
-            # (First we need to remove the arrow from the previously-sorted column.
-            # Since we don't know which one that was, just remove the arrow from all columns
-            # and start again. This only loops over a few dozen columns at most, so
-            # hopefully it won't take too much time.)
-            for i in range(0, len(AVAILABLE_FIELD_NAMES_ORDERED)):
-                column = self.treeview[log_index].get_column(i)
-                column.set_sort_indicator(False)
-            column = self.treeview[log_index].get_column(column_index)
-            column.set_sort_indicator(True)
+            field_name = AVAILABLE_FIELD_NAMES_ORDERED[column_index-1]
+
+        try:
+            log.sort(field_name, descending=(order == Gtk.SortType.DESCENDING))
+        except sqlite.Error as e:
+            logging.exception(e)
+            error(parent=self.application.window, message="Could not sort log '%s' because of a database error." % log.name)
+            return
+
+        # Show an arrow pointing in the direction of the sorting, and remove the arrow from any previously-sorted column.
+        for c in self.treeview[log_index].get_columns():
+            c.set_sort_indicator(False)
+        column.set_sort_order(order)
+        column.set_sort_indicator(True)
         return
 
     def rename_log(self, widget=None):
@@ -522,7 +660,12 @@ class Logbook:
             response = ln.dialog.run()
             if(response == Gtk.ResponseType.OK):
                 new_log_name = ln.name
-                success = self.logs[log_index].rename(new_log_name)
+                try:
+                    with self.writing():
+                        success = self.logs[log_index].rename(new_log_name)
+                except LogbookBusy:
+                    error(parent=ln.dialog, message=BUSY_MESSAGE)
+                    continue
                 if(success):
                     ln.dialog.destroy()
                 else:
@@ -549,20 +692,35 @@ class Logbook:
         return
 
     def import_log(self, widget=None):
-        """ Import a log from an ADIF file. """
+        """ Import a log from one or more ADIF files. If several files are selected, they are parsed in parallel and any duplicate records are skipped. """
 
-        # Get the path to the ADIF file.
+        # Get the path(s) to the ADIF file(s).
         dialog = Gtk.FileChooserDialog("Import ADIF Log File",
                                        self.application.window,
                                        Gtk.FileChooserAction.OPEN,
                                       (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
                                        Gtk.STOCK_OPEN, Gtk.ResponseType.OK))
+        dialog.set_select_multiple(True)
         filter = Gtk.FileFilter()
         filter.set_name("All ADIF files (*.adi, *.ADI)")
         filter.add_pattern("*.adi")
         filter.add_pattern("*.ADI")
         dialog.add_filter(filter)
 
+        filter = Gtk.FileFilter()
+        filter.set_name("Compressed ADIF files (*.adi.gz, *.ADI.gz)")
+        filter.add_pattern("*.adi.gz")
+        filter.add_pattern("*.ADI.gz")
+        dialog.add_filter(filter)
+
+        filter = Gtk.FileFilter()
+        filter.set_name("All ADX files (*.adx, *.ADX, *.adx.gz, *.ADX.gz)")
+        filter.add_pattern("*.adx")
+        filter.add_pattern("*.ADX")
+        filter.add_pattern("*.adx.gz")
+        filter.add_pattern("*.ADX.gz")
+        dialog.add_filter(filter)
+
         filter = Gtk.FileFilter()
         filter.set_name("All files")
         filter.add_pattern("*")
@@ -570,26 +728,23 @@ class Logbook:
 
         response = dialog.run()
         if(response == Gtk.ResponseType.OK):
-            path = dialog.get_filename()
+            paths = dialog.get_filenames()
         else:
-            path = None
+            paths = []
         dialog.destroy()
 
-        if(path is None):
+        if(not paths):
             logging.debug("No file path specified.")
             return
 
-        # Read the records.
-        adif = ADIF()
-        try:
-            records = adif.read(path)
-        except IOError as e:
-            error(parent=self.application.window, message="Could not import the log. I/O error %d: %s" % (e.errno, e.strerror))
-            return
-        except Exception as e:
-            error(parent=self.application.window, message="Could not import the log.")
-            logging.exception(e)
-            return
+        # Check that the files can be read before asking for a log name. The records themselves are read later on, in a streaming fashion.
+        for path in paths:
+            try:
+                with open(path, mode='r', errors="replace"):
+                    pass
+            except IOError as e:
+                error(parent=self.application.window, message="Could not import the log. I/O error %d: %s" % (e.errno, e.strerror))
+                return
 
         # Get the new log's name (or the name of the existing log the user wants to import into).
         ln = LogNameDialog(self.application, title="Import Log")
@@ -617,16 +772,12 @@ class Logbook:
                 else:
                     # Create a new log with the name the user supplies.
                     try:
-                        with self.connection:
-                            c = self.connection.cursor()
-                            query = "CREATE TABLE %s (id INTEGER PRIMARY KEY AUTOINCREMENT" % log_name
-                            for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
-                                s = ", %s TEXT" % field_name.lower()
-                                query = query + s
-                            query = query + ")"
-                            c.execute(query)
-                            l = Log(self.connection, log_name)
-                            break
+                        with self.writing():
+                            create_log_table(self.connection, log_name)
+                        l = Log(self.connection, log_name)
+                        break
+                    except LogbookBusy:
+                        error(parent=ln.dialog, message=BUSY_MESSAGE)
                     except sqlite.Error as e:
                         logging.exception(e)
                         # Data is not valid - inform the user.
@@ -637,20 +788,56 @@ class Logbook:
 
         ln.dialog.destroy()
 
-        # Update new or existing Log object.
-        l.add_record(records)
-        l.populate()
-
         if(not exists):
             self.logs.append(l)
             self.render_log(self.log_count-1)
 
-        # Update statistics, etc.
-        self.summary.update()
-        self.application.toolbox.awards.count(self)
+        # Stream the records from the file(s) into the new or existing log in a worker thread, reporting progress in the status bar.
+        importer = ParallelImport(paths) if(len(paths) > 1) else None
+        description = "Importing into log '%s'" % l.name
+
+        def job(task, connection):
+            if(importer):
+                def progress(count):
+                    task.description = "%s (%d of %d files)" % (description, importer.files_added, len(paths))
+                    task.report(count)
+                return importer.run(l, progress=progress, connection=connection)
+            else:
+                adif = ADIF()
+                return l.add_records(adif.iter_read(paths[0]), progress=task.report, connection=connection)
+
+        def on_complete(count):
+            # The records were added through the worker thread's connection, so the log's rows are refreshed here (see Log.add_records).
+            l.populate()
+            l.emit("records-changed")
 
-        info(parent=self.application.window, message="Imported %d QSOs into log '%s'." % (len(records), l.name))
+            # Update statistics, etc. Note that the awards table is updated by the log itself if the records were imported into an existing log.
+            self.summary.update()
+            if(not exists):
+                self.application.toolbox.awards.count_in_background(self)
+                self.application.toolbox.dx_cluster.count_worked(self)
+
+            if(importer):
+                message = "Imported %d QSOs into log '%s' from %d files, skipping %d duplicates." % (count, l.name, importer.files_added, importer.duplicates)
+                if(importer.failed):
+                    message += " The following files could not be imported: %s" % ", ".join([path for (path, e) in importer.failed])
+                info(parent=self.application.window, message=message)
+            else:
+                info(parent=self.application.window, message="Imported %d QSOs into log '%s'." % (count, l.name))
+            return
+
+        def on_error(e):
+            if(isinstance(e, TaskCancelled)):
+                info(parent=self.application.window, message="The import was cancelled. No QSOs were imported into log '%s'." % l.name)
+            elif(isinstance(e, IOError)):
+                error(parent=self.application.window, message="Could not import the log. I/O error %d: %s" % (e.errno, e.strerror))
+            elif(isinstance(e, sqlite.Error)):
+                error(parent=self.application.window, message="Database error. Could not import the log.")
+            else:
+                error(parent=self.application.window, message="Could not import the log.")
+            return
 
+        self.runner.submit(Task(description, job, on_complete=on_complete, on_error=on_error, writes=True))
         return
 
     def export_log_adif(self, widget=None):
@@ -678,6 +865,20 @@ class Logbook:
         filter.add_pattern("*.ADI")
         dialog.add_filter(filter)
 
+        filter = Gtk.FileFilter()
+        filter.set_name("Compressed ADIF files (*.adi.gz, *.ADI.gz)")
+        filter.add_pattern("*.adi.gz")
+        filter.add_pattern("*.ADI.gz")
+        dialog.add_filter(filter)
+
+        filter = Gtk.FileFilter()
+        filter.set_name("All ADX files (*.adx, *.ADX, *.adx.gz, *.ADX.gz)")
+        filter.add_pattern("*.adx")
+        filter.add_pattern("*.ADX")
+        filter.add_pattern("*.adx.gz")
+        filter.add_pattern("*.ADX.gz")
+        dialog.add_filter(filter)
+
         filter = Gtk.FileFilter()
         filter.set_name("All files")
         filter.add_pattern("*")
@@ -693,25 +894,8 @@ class Logbook:
         if(path is None):
             logging.debug("No file path specified.")
         else:
-
-            # Retrieve the log's records from the database.
-            try:
-                records = log.records
-            except sqlite.Error as e:
-                logging.exception(e)
-                error(parent=self.application.window, message="Could not retrieve the records from the SQL database. No records have been exported.")
-                return
-
-            # Write the records.
             adif = ADIF()
-            try:
-                adif.write(records, path)
-                info(parent=self.application.window, message="Exported %d QSOs to %s in ADIF format." % (len(records), path))
-            except IOError as e:
-                error(parent=self.application.window, message="Could not export the records. I/O error %d: %s" % (e.errno, e.strerror))
-            except Exception as e:  # All other exceptions.
-                logging.exception(e)
-                error(parent=self.application.window, message="Could not export the records.")
+            self.export_records(log, path, adif.write, "ADIF")
 
         return
 
@@ -766,25 +950,45 @@ class Logbook:
                 return
             ced.dialog.destroy()
 
-            # Retrieve the log's records from the database.
-            try:
-                records = log.records
-            except sqlite.Error as e:
-                logging.exception(e)
-                error(parent=self.application.window, message="Could not retrieve the records from the SQL database. No records have been exported.")
-                return
-
-            # Write the records.
             cabrillo = Cabrillo()
+            self.export_records(log, path, lambda records, path: cabrillo.write(records, path, contest=contest, mycall=mycall), "Cabrillo")
+
+        return
+
+    def export_records(self, log, path, write, format_name):
+        """ Export all the records in a log to a file in a worker thread, reporting progress in the status bar. The records are streamed from the database as they are written.
+
+        :arg Log log: The log to export.
+        :arg str path: The path to the file.
+        :arg write: The function which writes an iterable of records to a file at a given path (e.g. ADIF.write).
+        :arg str format_name: The name of the file format, for the message shown once the records have been exported.
+        """
+        def job(task, connection):
             try:
-                cabrillo.write(records, path, contest=contest, mycall=mycall)
-                info(parent=self.application.window, message="Exported %d QSOs to %s in Cabrillo format." % (len(records), path))
-            except IOError as e:
+                write(task.track(log.iter_records(connection=connection)), path)
+            except Exception:
+                if(task.cancelled.is_set() and os.path.exists(path)):
+                    # Don't leave a partially-written file behind.
+                    os.remove(path)
+                raise
+            return task.count
+
+        def on_complete(count):
+            info(parent=self.application.window, message="Exported %d QSOs to %s in %s format." % (count, path, format_name))
+            return
+
+        def on_error(e):
+            if(isinstance(e, TaskCancelled)):
+                info(parent=self.application.window, message="The export was cancelled. No records have been exported.")
+            elif(isinstance(e, sqlite.Error)):
+                error(parent=self.application.window, message="Could not retrieve the records from the SQL database. No records have been exported.")
+            elif(isinstance(e, IOError)):
                 error(parent=self.application.window, message="Could not export the records. I/O error %d: %s" % (e.errno, e.strerror))
-            except Exception as e:  # All other exceptions.
-                logging.exception(e)
+            else:
                 error(parent=self.application.window, message="Could not export the records.")
+            return
 
+        self.runner.submit(Task("Exporting log '%s' to %s" % (log.name, os.path.basename(path)), job, on_complete=on_complete, on_error=on_error))
         return
 
     def print_log(self, widget=None):
@@ -801,18 +1005,15 @@ class Logbook:
             return
         log = self.logs[log_index]
 
-        # Retrieve the records.
+        # Print the records, which are streamed from the database (see Log.iter_records) rather than all being fetched at once.
+        printer = Printer(self.application)
         try:
-            records = log.records
+            printer.print_records(log.iter_records(), title="Log: %s" % log.name)
         except sqlite.Error as e:
             logging.exception(e)
             error(parent=self.application.window, message="Could not retrieve the records from the SQL database. No records have been printed.")
             return
 
-        # Print the records.
-        printer = Printer(self.application)
-        printer.print_records(records, title="Log: %s" % log.name)
-
         return
 
     def add_record_callback(self, widget):
@@ -828,15 +1029,7 @@ class Logbook:
         log = self.logs[log_index]
 
         # Keep the dialog open after adding a record?
-        config = configparser.ConfigParser()
-        have_config = (config.read(expanduser('~/.config/pyqso/preferences.ini')) != [])
-        (section, option) = ("general", "keep_open")
-        if(have_config and config.has_option(section, option)):
-            keep_open = config.getboolean("general", "keep_open")
-        else:
-            keep_open = False
-
-        adif = ADIF()
+        keep_open = get_preferences().getboolean("general", "keep_open", fallback=False)
 
         exit = False
         while not exit:
@@ -857,21 +1050,25 @@ class Logbook:
                 all_valid = True
                 response = rd.dialog.run()
                 if(response == Gtk.ResponseType.OK):
-                    fields_and_data = {}
                     field_names = AVAILABLE_FIELD_NAMES_ORDERED
-                    for i in range(0, len(field_names)):
-                        # Validate user input.
-                        fields_and_data[field_names[i]] = rd.get_data(field_names[i])
-                        if(not(adif.is_valid(field_names[i], fields_and_data[field_names[i]], AVAILABLE_FIELD_NAMES_TYPES[field_names[i]]))):
-                            # Data is not valid - inform the user.
-                            error(parent=rd.dialog, message="The data in field \"%s\" is not valid!" % field_names[i])
-                            all_valid = False
-                            break  # Don't check the other data until the user has fixed the current one.
+                    fields_and_data = {field_name: rd.get_data(field_name) for field_name in field_names}
+                    # Validate user input.
+                    invalid_field_names = get_invalid_field_names(validate_record(fields_and_data))
+                    if(invalid_field_names):
+                        # Data is not valid - inform the user about the first invalid field only, until they have fixed it.
+                        error(parent=rd.dialog, message="The data in field \"%s\" is not valid!" % invalid_field_names[0])
+                        all_valid = False
 
                     if(all_valid):
                         # All data has been validated, so we can go ahead and add the new record.
                         try:
-                            log.add_record(fields_and_data)
+                            with self.writing():
+                                log.add_record(fields_and_data)
+                        except LogbookBusy:
+                            # Keep the dialog open, so that the record is not lost.
+                            error(parent=rd.dialog, message=BUSY_MESSAGE)
+                            all_valid = False
+                            continue
                         except (sqlite.Error, IndexError) as e:
                             logging.exception(e)
                             error(parent=self.application.window, message="Could not add the record to the log.")
@@ -886,7 +1083,6 @@ class Logbook:
 
                         # Update summary, etc.
                         self.summary.update()
-                        self.application.toolbox.awards.count(self)
 
                 else:
                     exit = True
@@ -907,11 +1103,10 @@ class Logbook:
             return
         log = self.logs[log_index]
 
-        (sort_model, path) = self.treeselection[log_index].get_selected_rows()  # Get the selected row in the log
+        (filter_model, path) = self.treeselection[log_index].get_selected_rows()  # Get the selected row in the log
         try:
-            sort_iter = sort_model.get_iter(path[0])
-            filter_iter = self.sorter[log_index].convert_iter_to_child_iter(sort_iter)
-            # ...and the ListStore model (i.e. the log) is a child of the filter model.
+            filter_iter = filter_model.get_iter(path[0])
+            # The Log model is a child of the filter model.
             child_iter = self.filter[log_index].convert_iter_to_child_iter(filter_iter)
             row_index = log.get_value(child_iter, 0)
         except IndexError:
@@ -920,17 +1115,19 @@ class Logbook:
 
         response = question(parent=self.application.window, message="Are you sure you want to delete record %d?" % row_index)
         if(response == Gtk.ResponseType.YES):
-            # Deletes the record with index 'row_index' from the Records list.
-            # 'iter' is needed to remove the record from the ListStore itself.
+            # Deletes the record with index 'row_index' from the log.
             try:
-                log.delete_record(row_index, iter=child_iter)
+                with self.writing():
+                    log.delete_record(row_index)
+            except LogbookBusy:
+                error(parent=self.application.window, message=BUSY_MESSAGE)
+                return
             except (sqlite.Error, IndexError) as e:
                 logging.exception(e)
                 error(parent=self.application.window, message="Could not delete the record from the log.")
 
             # Update summary, etc.
             self.summary.update()
-            self.application.toolbox.awards.count(self)
 
         return
 
@@ -950,11 +1147,10 @@ class Logbook:
             return
         log = self.logs[log_index]
 
-        (sort_model, path) = self.treeselection[log_index].get_selected_rows()  # Get the selected row in the log.
+        (filter_model, path) = self.treeselection[log_index].get_selected_rows()  # Get the selected row in the log.
         try:
-            sort_iter = sort_model.get_iter(path[0])
-            filter_iter = self.sorter[log_index].convert_iter_to_child_iter(sort_iter)
-            # ...and the ListStore model (i.e. the log) is a child of the filter model.
+            filter_iter = filter_model.get_iter(path[0])
+            # The Log model is a child of the filter model.
             child_iter = self.filter[log_index].convert_iter_to_child_iter(filter_iter)
             row_index = log.get_value(child_iter, 0)
         except IndexError:
@@ -964,7 +1160,6 @@ class Logbook:
         rd = RecordDialog(application=self.application, log=self.logs[log_index], index=row_index)
         all_valid = False  # Are all the field entries valid?
 
-        adif = ADIF()
         while(not all_valid):
             # This while loop gives the user infinite attempts at giving valid data.
             # The add/edit record window will stay open until the user gives valid data,
@@ -972,41 +1167,45 @@ class Logbook:
             all_valid = True
             response = rd.dialog.run()
             if(response == Gtk.ResponseType.OK):
-                fields_and_data = {}
                 field_names = AVAILABLE_FIELD_NAMES_ORDERED
-                for i in range(0, len(field_names)):
-                    # Validate user input.
-                    fields_and_data[field_names[i]] = rd.get_data(field_names[i])
-                    if(not(adif.is_valid(field_names[i], fields_and_data[field_names[i]], AVAILABLE_FIELD_NAMES_TYPES[field_names[i]]))):
-                        # Data is not valid - inform the user.
-                        error(parent=rd.dialog, message="The data in field \"%s\" is not valid!" % field_names[i])
-                        all_valid = False
-                        break  # Don't check the other fields until the user has fixed the current field's data.
+                fields_and_data = {field_name: rd.get_data(field_name) for field_name in field_names}
+                # Validate user input.
+                invalid_field_names = get_invalid_field_names(validate_record(fields_and_data))
+                if(invalid_field_names):
+                    # Data is not valid - inform the user about the first invalid field only, until they have fixed it.
+                    error(parent=rd.dialog, message="The data in field \"%s\" is not valid!" % invalid_field_names[0])
+                    all_valid = False
 
                 if(all_valid):
                     try:
-                        # Get the record in its current state from the database.
-                        record = log.get_record_by_index(row_index)
-                        # Iterate over all fields and check whether the data has actually changed. Database updates can be expensive.
-                        for i in range(0, len(field_names)):
-                            if(record[field_names[i].lower()] != fields_and_data[field_names[i]]):
-                                # Update the record in the database and then in the ListStore.
-                                # We add 1 onto the column_index here because we don't want to consider the index column.
-                                log.edit_record(row_index, field_names[i], fields_and_data[field_names[i]], iter=child_iter, column_index=i+1)
+                        with self.writing():
+                            # Get the record in its current state from the database.
+                            record = log.get_record_by_index(row_index)
+                            # Iterate over all fields and check whether the data has actually changed. Database updates can be expensive.
+                            for i in range(0, len(field_names)):
+                                if(record[field_names[i].lower()] != fields_and_data[field_names[i]]):
+                                    # Update the record in the database and then in the Log model.
+                                    log.edit_record(row_index, field_names[i], fields_and_data[field_names[i]])
+                    except LogbookBusy:
+                        # Keep the dialog open, so that the changes are not lost.
+                        error(parent=rd.dialog, message=BUSY_MESSAGE)
+                        all_valid = False
+                        continue
                     except(sqlite.Error, IndexError) as e:
                         logging.exception(e)
                         error(parent=rd.dialog, message="Could not edit record %d." % row_index)
 
                     # Update summary, etc.
                     self.summary.update()
-                    self.application.toolbox.awards.count(self)
 
         rd.dialog.destroy()
         return
 
     def remove_duplicates_callback(self, widget=None):
         """ A callback function used to remove duplicate records in a log.
-        Detecting duplicate records is done based on the CALL, QSO_DATE, and TIME_ON fields. """
+        Detecting duplicate records is done based on the CALL, QSO_DATE, and TIME_ON fields. The QSO times can be allowed to differ by a few minutes
+        (e.g. when merging the logs of several operators) with the duplicate_time_window option in the records section of the preferences file,
+        and QSOs can be required to have the same band and mode with the duplicate_match_band_mode option. """
         logging.debug("Removing duplicate records...")
 
         # Get the log index.
@@ -1020,14 +1219,36 @@ class Logbook:
 
         log = self.logs[log_index]
 
-        (number_of_duplicates, number_of_duplicates_removed) = log.remove_duplicates()
-        info(parent=self.application.window, message="Found %d duplicate(s). Successfully removed %d duplicate(s)." % (number_of_duplicates, number_of_duplicates_removed))
+        config = get_preferences()
+        time_window = config.getint("records", "duplicate_time_window", fallback=0)
+        match_band_mode = config.getboolean("records", "duplicate_match_band_mode", fallback=False)
+
+        # The duplicates are found and deleted from the database in a worker thread, and the corresponding rows are then removed from the log in the main thread.
+        def job(task, connection):
+            duplicates = log.get_duplicates(time_window, match_band_mode, connection=connection)
+            task.check()
+            if(len(duplicates) == 0):
+                return (duplicates, 0)  # Nothing to do here.
+            return (duplicates, log.delete_database_records(duplicates, connection=connection))
+
+        def on_complete(result):
+            (duplicates, number_of_duplicates_removed) = result
+            if(number_of_duplicates_removed > 0):
+                self.remove_rows(log, duplicates)
+                log.emit("records-changed")
+                # Update statistics.
+                self.summary.update()
+            info(parent=self.application.window, message="Found %d duplicate(s). Successfully removed %d duplicate(s)." % (len(duplicates), number_of_duplicates_removed))
+            return
 
-        if(number_of_duplicates_removed > 0):
-            # Update statistics.
-            self.summary.update()
-            self.application.toolbox.awards.count(self)
+        def on_error(e):
+            if(isinstance(e, TaskCancelled)):
+                info(parent=self.application.window, message="Removing the duplicates was cancelled. No duplicates were removed.")
+            else:
+                error(parent=self.application.window, message="Database error. Could not remove the duplicates.")
+            return
 
+        self.runner.submit(Task("Removing the duplicates from log '%s'" % log.name, job, on_complete=on_complete, on_error=on_error, writes=True))
         return
 
     def record_count_callback(self, widget=None):
@@ -1053,6 +1274,92 @@ class Logbook:
 
         return
 
+    def enrich_callsigns_callback(self, widget=None):
+        """ A callback function used to fill in the empty NAME, COUNTRY, DXCC, CQZ, ITUZ and IOTA fields of all the records in the selected log using an online callsign database.
+        The lookups are performed in the background, with progress shown in the status bar. """
+
+        # Get the log index.
+        try:
+            log_index = self.get_log_index()
+            if(log_index is None):
+                raise ValueError("The log index could not be determined. Perhaps the Summary page is selected?")
+        except ValueError as e:
+            error(parent=self.application.window, message=e)
+            return
+        log = self.logs[log_index]
+
+        if(self.enrichment is not None):
+            error(parent=self.application.window, message="The callsigns in log '%s' are already being looked up. Please wait until this is complete." % self.enrichment.log_name)
+            return
+
+        try:
+            service = get_preferred_lookup_service()
+        except ValueError as e:
+            error(parent=self.application.window, message=str(e))
+            return
+
+        response = question(parent=self.application.window, message="Fill in any empty %s fields of the QSOs in log '%s' using %s? This may take a while for large logs." % (", ".join(ENRICHED_FIELD_NAMES), log.name, service.database))
+        if(response != Gtk.ResponseType.YES):
+            return
+
+        config = get_preferences()
+        ignore_prefix_suffix = config.getboolean("records", "ignore_prefix_suffix", fallback=True)
+
+        statusbar = self.application.statusbar
+        context_id = statusbar.get_context_id("Enrichment")
+
+        def progress(count, total, updated):
+            GLib.idle_add(self.on_enrichment_progress, context_id, log.name, count, total, updated)
+
+        def run(enrichment):
+            try:
+                updated = enrichment.run(progress=progress)
+                error_message = enrichment.error_message
+            except sqlite.Error as e:
+                logging.exception(e)
+                updated = None
+                error_message = "Database error. Could not look up the callsigns in log '%s'." % log.name
+            GLib.idle_add(self.on_enrichment_complete, enrichment, log, context_id, updated, error_message)
+
+        self.enrichment = CallsignEnrichment(self.path, log.name, service, ignore_prefix_suffix=ignore_prefix_suffix, write_lock=self.runner.write_lock if(self.runner is not None) else None)
+        statusbar.push(context_id, "Looking up the callsigns in log '%s'..." % log.name)
+        threading.Thread(target=run, args=(self.enrichment,), daemon=True).start()
+
+        return
+
+    def on_enrichment_progress(self, context_id, log_name, count, total, updated):
+        """ Show the progress of the callsign enrichment job in the status bar.
+
+        :returns: False, so that this is only called once by GLib.idle_add.
+        :rtype: bool
+        """
+        statusbar = self.application.statusbar
+        statusbar.pop(context_id)
+        statusbar.push(context_id, "Looking up the callsigns in log '%s': %d/%d callsigns, %d QSOs updated..." % (log_name, count, total, updated))
+        return False
+
+    def on_enrichment_complete(self, enrichment, log, context_id, updated, error_message):
+        """ Refresh the log once the callsign enrichment job has finished, and report the outcome.
+
+        :returns: False, so that this is only called once by GLib.idle_add.
+        :rtype: bool
+        """
+        self.application.statusbar.pop(context_id)
+        if(enrichment is not self.enrichment):
+            # The logbook has been closed in the meantime.
+            return False
+        self.enrichment = None
+
+        if(updated):
+            log.populate()
+            log.emit("records-changed")
+            self.summary.update()
+        if(error_message):
+            error(parent=self.application.window, message="Could not look up all the callsigns in log '%s': %s" % (log.name, error_message))
+        elif(updated is not None):
+            info(parent=self.application.window, message="Updated %d QSOs in log '%s'." % (updated, log.name))
+        return False
+
     def pinpoint_callback(self, widget=None, path=None):
         """ A callback function used to pinpoint the callsign on the world map. """
 
@@ -1070,6 +1377,18 @@ class Logbook:
 
         return
 
+    def pinpoint_all_callback(self, widget=None, path=None):
+        """ A callback function used to plot all the QSOs in the selected log (that pass the callsign filter) on the world map. """
+
+        log_index = self.get_log_index()
+        if(log_index is None):
+            logging.error("Could not determine the log index.")
+            return
+
+        self.application.toolbox.world_map.plot_log(self.logs[log_index])
+
+        return
+
     def copy_callback(self, widget=None, path=None):
         """ A callback function used to copy selected logs. """
 
@@ -1094,7 +1413,11 @@ class Logbook:
 
     def clipboard_text_received(self, clipboard, text, log):
         r = json.loads(text)
-        log.add_record(r)
+        try:
+            with self.writing():
+                log.add_record(r)
+        except LogbookBusy:
+            error(parent=self.application.window, message=BUSY_MESSAGE)
         return
 
     def paste_callback(self, widget=None, path=None):
@@ -1192,11 +1515,10 @@ class Logbook:
         log = self.logs[log_index]
 
         # Get the selected row in the log.
-        (sort_model, path) = self.treeselection[log_index].get_selected_rows()
+        (filter_model, path) = self.treeselection[log_index].get_selected_rows()
         try:
-            sort_iter = sort_model.get_iter(path[0])
-            filter_iter = self.sorter[log_index].convert_iter_to_child_iter(sort_iter)
-            # ...and the ListStore model (i.e. the log) is a child of the filter model.
+            filter_iter = filter_model.get_iter(path[0])
+            # The Log model is a child of the filter model.
             child_iter = self.filter[log_index].convert_iter_to_child_iter(filter_iter)
             row_index = log.get_value(child_iter, 0)
         except IndexError:
@@ -18,11 +18,8 @@
 #    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
 
 from gi.repository import Gtk
-try:
-    import configparser
-except ImportError:
-    import ConfigParser as configparser
-import os.path
+
+from pyqso.preferences import get_preferences
 
 
 class Menu:
@@ -109,10 +106,14 @@ class Menu:
         self.items["RECORD_COUNT"] = self.builder.get_object("mitem_record_count")
         self.items["RECORD_COUNT"].connect("activate", self.application.logbook.record_count_callback)
 
+        # Look up the callsigns of all the records
+        self.items["ENRICH_CALLSIGNS"] = self.builder.get_object("mitem_enrich_callsigns")
+        self.items["ENRICH_CALLSIGNS"].connect("activate", self.application.logbook.enrich_callsigns_callback)
+
         # View toolbox
         self.items["TOOLBOX"] = self.builder.get_object("mitem_toolbox")
-        config = configparser.ConfigParser()
-        have_config = (config.read(os.path.expanduser('~/.config/pyqso/preferences.ini')) != [])
+        config = get_preferences()
+        have_config = config.exists
         (section, option) = ("general", "show_toolbox")
         if have_config and config.has_option(section, option):
             self.items["TOOLBOX"].set_active(config.getboolean(section, option))
@@ -153,5 +154,5 @@ class Menu:
         :arg bool sensitive: If True, enable all the record-related menu items. If False, disable them all.
         """
 
-        for item_name in ["ADD_RECORD", "EDIT_RECORD", "DELETE_RECORD", "REMOVE_DUPLICATES", "RECORD_COUNT"]:
+        for item_name in ["ADD_RECORD", "EDIT_RECORD", "DELETE_RECORD", "REMOVE_DUPLICATES", "RECORD_COUNT", "ENRICH_CALLSIGNS"]:
             self.items[item_name].set_sensitive(sensitive)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2013-2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from collections import deque
+
+from pyqso.adif import ADIF, AVAILABLE_FIELD_NAMES_ORDERED
+
+# NOTE: This module is imported by each of the worker processes, so it must not import Gtk (or anything else that does).
+
+# The fields which identify a QSO when checking whether an imported record duplicates one that is already in the log (or one imported from an earlier file).
+DUPLICATE_FIELD_NAMES = ["CALL", "QSO_DATE", "TIME_ON"]
+
+# Held while the __main__ module is stood in for when the worker processes are started (see ParallelImport.start_workers), so that two imports never swap it at the same time.
+MAIN_MODULE_LOCK = threading.Lock()
+
+
+def parse_file(path):
+    """ Read, parse and validate an ADIF (or ADX) file. This is run in a worker process.
+
+    :arg str path: The path to the file.
+    :returns: The records in the file. To keep them compact while they are passed back to the main process, each record is a tuple of the data in each field, in the order given by AVAILABLE_FIELD_NAMES_ORDERED (with None for missing fields).
+    :rtype: list
+    :raises IOError: If the file cannot be read.
+    """
+    adif = ADIF()
+    return [tuple([record.get(field_name) for field_name in AVAILABLE_FIELD_NAMES_ORDERED]) for record in adif.iter_read(path)]
+
+
+def get_duplicate_key(call, qso_date, time_on):
+    """ Return the key which identifies a QSO when checking for duplicates, or None if the QSO does not have a callsign, date and time (in which case it is never considered a duplicate).
+
+    :arg str call: The data in the CALL field.
+    :arg str qso_date: The data in the QSO_DATE field.
+    :arg str time_on: The data in the TIME_ON field.
+    :returns: The key, with the callsign in upper case.
+    :rtype: tuple
+    """
+    if(not(call and qso_date and time_on)):
+        return None
+    return (call.upper(), qso_date, time_on)
+
+
+class ParallelImport:
+
+    """ Import several ADIF files into a log at once (e.g. the per-operator logs of a multi-operator contest station). The files are parsed and validated in parallel by a pool of worker processes,
+    while the main process adds the records to the log, one file after another in a single transaction, skipping any duplicates of the records already in the log on the way in. """
+
+    def __init__(self, paths, max_workers=None, skip_duplicates=True):
+        """ Set up a new import.
+
+        :arg list paths: The paths to the ADIF files. The records are added to the log in the same order as the files.
+        :arg int max_workers: The number of worker processes. If None, one worker is used per CPU (but no more than there are files).
+        :arg bool skip_duplicates: If True, records with the same CALL (ignoring case), QSO_DATE and TIME_ON as a record in the log (or in an earlier file) are not added.
+        """
+        self.paths = list(paths)
+        if(max_workers is None):
+            max_workers = os.cpu_count() or 1
+        self.max_workers = max(1, min(max_workers, len(self.paths)))
+        self.skip_duplicates = skip_duplicates
+
+        # The number of files added to the log so far, the number of duplicate records that were skipped, and the (path, exception) pairs of the files that could not be read.
+        self.files_added = 0
+        self.duplicates = 0
+        self.failed = []
+        return
+
+    def start_workers(self):
+        """ Start the pool of worker processes. The workers are started afresh, rather than forked from the main process (which may be running Gtk's threads),
+        and each one imports the __main__ module of the process that started it. So that this is not the script that started PyQSO (which imports Gtk and the rest of the user interface),
+        this module stands in for it while the workers are started.
+
+        This is the only place where __main__ is swapped. A multiprocessing pool starts all of its workers in its constructor, so the swap only lasts for that long, once per import,
+        rather than whenever a file is handed to a worker. The workers are only started again if one of them dies. The swap is made under MAIN_MODULE_LOCK, so that two imports cannot restore
+        each other's __main__. Nothing else in PyQSO looks up the __main__ module once it is running, so the main thread is not affected while the swap lasts.
+
+        :returns: The pool of worker processes.
+        :rtype: multiprocessing.pool.Pool
+        """
+        context = multiprocessing.get_context("spawn")
+        with MAIN_MODULE_LOCK:
+            main = sys.modules["__main__"]
+            sys.modules["__main__"] = sys.modules[__name__]
+            try:
+                return context.Pool(processes=self.max_workers)
+            finally:
+                sys.modules["__main__"] = main
+
+    def run(self, log, progress=None, connection=None):
+        """ Import the files into a log.
+
+        :arg Log log: The log to import the records into.
+        :arg progress: An optional function which is called with the total number of records added so far, whenever a batch of records has been added to the log.
+        :arg connection: An optional connection to the logbook to use instead of the Log's own (e.g. when the import is run by a task in a worker thread). See Log.add_records.
+        :returns: The number of records added to the log.
+        :rtype: int
+        :raises sqlite.Error: If the records could not be added to the log. In this case none of the records are added, since the transaction is rolled back.
+        """
+        logging.debug("Importing %d files into log '%s' with %d worker processes..." % (len(self.paths), log.name, self.max_workers))
+        self.files_added = 0
+        self.duplicates = 0
+        self.failed = []
+
+        keys = set()
+        if(self.skip_duplicates):
+            for fields in log.get_fields(DUPLICATE_FIELD_NAMES, connection=connection):
+                keys.add(get_duplicate_key(*fields))
+
+        # Leaving the with block terminates the workers, so that they are not left parsing files that are no longer needed (e.g. if the import is cancelled).
+        with self.start_workers() as pool:
+            count = log.add_records(self.iter_records(pool, deque(), keys), progress=progress, connection=connection)
+
+        logging.debug("Imported %d records from %d files into log '%s', skipping %d duplicates." % (count, self.files_added, log.name, self.duplicates))
+        return count
+
+    def iter_records(self, pool, pending, keys):
+        """ Yield the records parsed by the workers, one file after another, as dictionaries of field-value pairs.
+        Only a limited number of files are handed to the workers ahead of the one whose records are being yielded (one per worker), so that the records of
+        at most that many files are waiting in memory at any time, however many files are being imported.
+
+        :arg pool: The pool of worker processes.
+        :arg collections.deque pending: The (path, result) pairs of the files that have been handed to the workers but whose records have not yet been yielded, which is filled in here.
+        :arg set keys: The keys (see get_duplicate_key) of the records already in the log, which are skipped if duplicates are not wanted. The keys of the records yielded are added to it.
+        :returns: A generator which yields one dictionary per QSO.
+        :rtype: generator
+        """
+        for path in self.paths:
+            pending.append((path, pool.apply_async(parse_file, (path,))))
+            if(len(pending) > self.max_workers):
+                yield from self.iter_file(*pending.popleft(), keys=keys)
+        while(pending):
+            yield from self.iter_file(*pending.popleft(), keys=keys)
+        return
+
+    def iter_file(self, path, result, keys):
+        """ Yield the records of a single file once a worker has parsed it, skipping any duplicates.
+
+        :arg str path: The path to the file.
+        :arg multiprocessing.pool.AsyncResult result: The result of parse_file, once the worker has finished.
+        :arg set keys: The keys of the records already in the log (see iter_records).
+        :returns: A generator which yields one dictionary per QSO.
+        :rtype: generator
+        """
+        field_names = AVAILABLE_FIELD_NAMES_ORDERED
+        indices = [field_names.index(field_name) for field_name in DUPLICATE_FIELD_NAMES]
+        try:
+            records = result.get()
+        except Exception as e:
+            # Carry on with the other files.
+            logging.error("Could not import the records from %s." % path)
+            logging.exception(e)
+            self.failed.append((path, e))
+            return
+        for record in records:
+            if(self.skip_duplicates):
+                key = get_duplicate_key(*[record[i] for i in indices])
+                if(key is not None):
+                    if(key in keys):
+                        self.duplicates += 1
+                        continue
+                    keys.add(key)
+            yield dict([(field_name, data) for (field_name, data) in zip(field_names, record) if(data is not None)])
+        self.files_added += 1
+        return
@@ -37,6 +37,10 @@ class Popup:
         self.items["PINPOINT"] = self.builder.get_object("mitem_pinpoint")
         self.items["PINPOINT"].connect("activate", self.application.logbook.pinpoint_callback)
 
+        # Plot all the QSOs in the log (that pass the filter) on the world map.
+        self.items["PINPOINT_ALL"] = self.builder.get_object("mitem_pinpoint_all")
+        self.items["PINPOINT_ALL"].connect("activate", self.application.logbook.pinpoint_all_callback)
+
         self.items["COPY"] = self.builder.get_object("mitem_copy")
         self.items["COPY"].connect("activate", self.application.logbook.copy_callback)
 
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2013-2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+import os
+from threading import Lock
+
+PREFERENCES_FILE = os.path.expanduser("~/.config/pyqso/preferences.ini")
+
+
+class Preferences:
+
+    """ The user's preferences, as stored in the preferences (configuration) file.
+
+    The file is only parsed when a preference is first needed, and is parsed again only if the file has since been modified (as determined by its modification time and size) or if the preferences have been explicitly invalidated.
+    The getter methods mirror those of ConfigParser. """
+
+    def __init__(self, path=PREFERENCES_FILE):
+        """ Set up the preferences.
+
+        :arg str path: The path to the preferences file.
+        """
+        self.path = path
+        self.config = None
+        self.signature = None
+        self.lock = Lock()
+        return
+
+    def invalidate(self):
+        """ Force the preferences file to be parsed again the next time a preference is needed (e.g. after the file has been written to). """
+        with self.lock:
+            self.config = None
+        return
+
+    def load(self):
+        """ Parse the preferences file if it has not yet been parsed, or if it has changed since it was last parsed.
+
+        :returns: The parsed preferences.
+        :rtype: configparser.ConfigParser
+        """
+        try:
+            s = os.stat(self.path)
+            signature = (s.st_mtime_ns, s.st_size)
+        except OSError:
+            signature = None
+
+        with self.lock:
+            if(self.config is None or signature != self.signature):
+                logging.debug("Parsing the preferences file...")
+                config = configparser.ConfigParser()
+                try:
+                    if(signature is not None):
+                        config.read(self.path)
+                except configparser.Error as e:
+                    logging.error("Could not parse the preferences file.")
+                    logging.exception(e)
+                    config = configparser.ConfigParser()
+                    signature = None
+                self.config = config
+                self.signature = signature
+            return self.config
+
+    @property
+    def exists(self):
+        """ Determine whether the preferences file exists (and could be read).
+
+        :returns: True if the preferences file exists. Otherwise returns False.
+        :rtype: bool
+        """
+        self.load()
+        return self.signature is not None
+
+    def has_option(self, section, option):
+        """ Determine whether a preference has been set.
+
+        :arg str section: The section of the preferences file.
+        :arg str option: The name of the preference.
+        :returns: True if the preference has been set. Otherwise returns False.
+        :rtype: bool
+        """
+        return self.load().has_option(section, option)
+
+    def get(self, section, option, fallback=None):
+        """ Return the value of a preference.
+
+        :arg str section: The section of the preferences file.
+        :arg str option: The name of the preference.
+        :arg fallback: The value to return if the preference has not been set.
+        :returns: The value of the preference.
+        :rtype: str
+        """
+        return self.load().get(section, option, fallback=fallback)
+
+    def getboolean(self, section, option, fallback=None):
+        """ Return the value of a preference as a bool.
+
+        :arg str section: The section of the preferences file.
+        :arg str option: The name of the preference.
+        :arg fallback: The value to return if the preference has not been set, or is not a valid boolean value.
+        :returns: The value of the preference.
+        :rtype: bool
+        """
+        try:
+            return self.load().getboolean(section, option, fallback=fallback)
+        except ValueError:
+            logging.error("The '%s' preference in the '%s' section is not a valid boolean value." % (option, section))
+            return fallback
+
+    def getint(self, section, option, fallback=None):
+        """ Return the value of a preference as an int.
+
+        :arg str section: The section of the preferences file.
+        :arg str option: The name of the preference.
+        :arg fallback: The value to return if the preference has not been set, or is not a valid integer.
+        :returns: The value of the preference.
+        :rtype: int
+        """
+        try:
+            return self.load().getint(section, option, fallback=fallback)
+        except ValueError:
+            logging.error("The '%s' preference in the '%s' section is not a valid integer." % (option, section))
+            return fallback
+
+    def getfloat(self, section, option, fallback=None):
+        """ Return the value of a preference as a float.
+
+        :arg str section: The section of the preferences file.
+        :arg str option: The name of the preference.
+        :arg fallback: The value to return if the preference has not been set, or is not a valid floating-point number.
+        :returns: The value of the preference.
+        :rtype: float
+        """
+        try:
+            return self.load().getfloat(section, option, fallback=fallback)
+        except ValueError:
+            logging.error("The '%s' preference in the '%s' section is not a valid floating-point number." % (option, section))
+            return fallback
+
+
+_preferences = None
+
+
+def get_preferences():
+    """ Return the preferences object shared by the whole application.
+
+    :returns: The shared preferences.
+    :rtype: Preferences
+    """
+    global _preferences
+    if(_preferences is None):
+        _preferences = Preferences()
+    return _preferences
@@ -40,8 +40,7 @@ except ImportError:
 
 from pyqso.adif import AVAILABLE_FIELD_NAMES_ORDERED, MODES
 from pyqso.auxiliary_dialogs import error
-
-PREFERENCES_FILE = os.path.expanduser("~/.config/pyqso/preferences.ini")
+from pyqso.preferences import PREFERENCES_FILE, get_preferences
 
 
 class PreferencesDialog:
@@ -113,6 +112,9 @@ class PreferencesDialog:
         with open(os.path.expanduser(PREFERENCES_FILE), 'w') as f:
             config.write(f)
 
+        # Make sure that the new preferences are used from now on.
+        get_preferences().invalidate()
+
 
 class GeneralPage:
 
@@ -127,8 +129,8 @@ class GeneralPage:
 
         # Remember that the have_config conditional in the PyQSO class may be out-of-date the next time the user opens up the preferences dialog
         # because a configuration file may have been created after launching the application. Let's check to see if one exists again...
-        config = configparser.ConfigParser()
-        have_config = (config.read(PREFERENCES_FILE) != [])
+        config = get_preferences()
+        have_config = config.exists
 
         # Show toolbox.
         self.sources["SHOW_TOOLBOX"] = self.builder.get_object("general_show_toolbox_checkbutton")
@@ -224,8 +226,8 @@ class ViewPage:
         self.builder = builder
         self.sources = {}
 
-        config = configparser.ConfigParser()
-        have_config = (config.read(PREFERENCES_FILE) != [])
+        config = get_preferences()
+        have_config = config.exists
 
         # Visible fields
         for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
@@ -257,8 +259,8 @@ class RecordsPage:
 
         # Remember that the have_config conditional in the PyQSO class may be out-of-date the next time the user opens up the preferences dialog
         # because a configuration file may have been created after launching the application. Let's check to see if one exists again...
-        config = configparser.ConfigParser()
-        have_config = (config.read(PREFERENCES_FILE) != [])
+        config = get_preferences()
+        have_config = config.exists
 
         # Autocomplete
         self.sources["AUTOCOMPLETE_BAND"] = self.builder.get_object("records_autocomplete_band_checkbutton")
@@ -389,8 +391,8 @@ class ImportExportPage:
 
         # Remember that the have_config conditional in the PyQSO class may be out-of-date the next time the user opens up the preferences dialog
         # because a configuration file may have been created after launching the application. Let's check to see if one exists again...
-        config = configparser.ConfigParser()
-        have_config = (config.read(PREFERENCES_FILE) != [])
+        config = get_preferences()
+        have_config = config.exists
 
         # Import
         self.sources["MERGE_COMMENT"] = self.builder.get_object("adif_import_merge_comment_checkbutton")
@@ -419,8 +421,8 @@ class HamlibPage:
         self.builder = builder
         self.sources = {}
 
-        config = configparser.ConfigParser()
-        have_config = (config.read(PREFERENCES_FILE) != [])
+        config = get_preferences()
+        have_config = config.exists
 
         self.sources["AUTOFILL"] = self.builder.get_object("hamlib_support_checkbutton")
         (section, option) = ("hamlib", "autofill")
@@ -479,8 +481,8 @@ class WorldMapPage:
 
         # Remember that the have_config conditional in the PyQSO class may be out-of-date the next time the user opens up the preferences dialog
         # because a configuration file may have been created after launching the application. Let's check to see if one exists again...
-        config = configparser.ConfigParser()
-        have_config = (config.read(PREFERENCES_FILE) != [])
+        config = get_preferences()
+        have_config = config.exists
 
         # Option to pinpoint QTH on grey line map.
         self.sources["SHOW_QTH"] = self.builder.get_object("world_map_show_qth_checkbutton")
@@ -48,7 +48,7 @@ class Printer(object):
     def print_records(self, records, title=None):
         """ Perform the print operation.
 
-        :arg dict records: The records to be printed.
+        :arg records: An iterable of the records to be printed (e.g. a list, or a generator from Log.iter_records).
         :arg str title: Optional title for the document. Default is None.
         :returns: The result of the print operation.
         :rtype: Gtk.PrintOperationResult
@@ -17,16 +17,10 @@
 #    You should have received a copy of the GNU General Public License
 #    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
 
-from gi.repository import Gtk, Gdk
+from gi.repository import Gtk, Gdk, GLib
 import logging
 import os
-try:
-    import configparser
-except ImportError:
-    import ConfigParser as configparser
 from datetime import datetime
-from os.path import expanduser
-import base64
 try:
     import Hamlib
     have_hamlib = True
@@ -38,6 +32,7 @@ from pyqso.adif import *
 from pyqso.callsign_lookup import *
 from pyqso.auxiliary_dialogs import *
 from pyqso.calendar_dialog import CalendarDialog
+from pyqso.preferences import get_preferences
 
 
 class RecordDialog:
@@ -60,6 +55,13 @@ class RecordDialog:
         self.builder.add_objects_from_file(glade_file_path, ("record_dialog",))
         self.dialog = self.builder.get_object("record_dialog")
         self.builder.get_object("record_dialog").connect("key-press-event", self.on_key_press)
+        self.dialog.connect("destroy", self.on_destroy)
+
+        # The callsign lookup that is in progress (if any), along with the callsign and the data in each field when it was started.
+        self.lookup = None
+        self.lookup_callsign = None
+        self.lookup_data = {}
+        self.destroyed = False
 
         # Set dialog title
         if(index is not None):
@@ -68,8 +70,8 @@ class RecordDialog:
             self.dialog.set_title("Add Record")
 
         # Check if a configuration file is present, since we might need it to set up the rest of the dialog.
-        config = configparser.ConfigParser()
-        have_config = (config.read(expanduser('~/.config/pyqso/preferences.ini')) != [])
+        config = get_preferences()
+        have_config = config.exists
 
         # Create label:entry pairs and store them in a dictionary
         self.sources = {}
@@ -393,46 +395,12 @@ class RecordDialog:
     def callsign_lookup_callback(self, widget=None):
         """ Get the callsign-related data from an online database and store it in the relevant Gtk.Entry boxes, but return None. """
 
-        # Get the database name.
-        config = configparser.ConfigParser()
-        have_config = (config.read(expanduser('~/.config/pyqso/preferences.ini')) != [])
+        config = get_preferences()
+        have_config = config.exists
         try:
-            if(have_config and config.has_option("records", "callsign_database")):
-                database = config.get("records", "callsign_database")
-                if(database == ""):
-                    raise ValueError
-            else:
-                raise ValueError
-        except ValueError:
-            error(parent=self.dialog, message="To perform a callsign lookup, please specify the name of the callsign database in the Preferences.")
-            return
-
-        try:
-            if(database == "qrz.com"):
-                # QRZ.com
-                callsign_lookup = CallsignLookupQRZ(parent=self.dialog)
-            elif(database == "hamqth.com"):
-                # HamQTH.com
-                callsign_lookup = CallsignLookupHamQTH(parent=self.dialog)
-            else:
-                raise ValueError("Unknown callsign database: %s" % database)
+            service = get_preferred_lookup_service()
         except ValueError as e:
-            logging.exception(e)
-            error(parent=self.dialog, message=e)
-            return
-
-        # Get username and password from configuration file.
-        if(have_config and config.has_option("records", "callsign_database_username") and config.has_option("records", "callsign_database_password")):
-            username = config.get("records", "callsign_database_username")
-            password = base64.b64decode(config.get("records", "callsign_database_password")).decode("utf-8")
-            if(not username or not password):
-                details_given = False
-            else:
-                details_given = True
-        else:
-            details_given = False
-        if(not details_given):
-            error(parent=self.dialog, message="To perform a callsign lookup, please specify your username and password in the Preferences.")
+            error(parent=self.dialog, message=str(e))
             return
 
         # Get the callsign from the CALL field.
@@ -442,20 +410,52 @@ class RecordDialog:
             error(parent=self.dialog, message="Please enter a callsign to lookup.")
             return
 
-        # Connect to the database.
-        connected = callsign_lookup.connect(username, password)
-        if(connected):
-            # Check whether we want to ignore any prefixes (e.g. "IA/") or suffixes "(e.g. "/M") in the callsign
-            # before performing the lookup.
-            if(have_config and config.has_option("records", "ignore_prefix_suffix")):
-                ignore_prefix_suffix = (config.getboolean("records", "ignore_prefix_suffix"))
-            else:
-                ignore_prefix_suffix = True
+        # Check whether we want to ignore any prefixes (e.g. "IA/") or suffixes "(e.g. "/M") in the callsign
+        # before performing the lookup.
+        if(have_config and config.has_option("records", "ignore_prefix_suffix")):
+            ignore_prefix_suffix = (config.getboolean("records", "ignore_prefix_suffix"))
+        else:
+            ignore_prefix_suffix = True
 
-            # Perform the lookup.
-            fields_and_data = callsign_lookup.lookup(full_callsign, ignore_prefix_suffix=ignore_prefix_suffix)
+        # Perform the lookup in the background, so that the dialog remains responsive. The results are filled in from the GTK main loop once they are available.
+        self.builder.get_object("callsign_lookup").set_sensitive(False)
+        self.lookup_callsign = full_callsign
+        self.lookup_data = dict([(field_name, self.get_data(field_name)) for field_name in self.sources])
+        self.lookup = service.lookup_async(full_callsign, lambda fields_and_data, error_message: GLib.idle_add(self.on_callsign_lookup_complete, fields_and_data, error_message), ignore_prefix_suffix=ignore_prefix_suffix)
+        return
+
+    def on_callsign_lookup_complete(self, fields_and_data, error_message):
+        """ Store the data found by a callsign lookup in the relevant Gtk.Entry boxes, or report the error that occurred.
+
+        :arg dict fields_and_data: The data found by the lookup.
+        :arg str error_message: The error that occurred during the lookup, or None if the lookup was successful.
+        :returns: False, so that this is only called once by GLib.idle_add.
+        :rtype: bool
+        """
+        self.lookup = None
+        if(self.destroyed):
+            # The dialog was closed while the lookup was in progress, so there is nowhere to put the data.
+            return False
+        self.builder.get_object("callsign_lookup").set_sensitive(True)
+        if(self.sources["CALL"].get_text() != self.lookup_callsign):
+            # The callsign has been changed since the lookup was started, so the data is for the wrong callsign.
+            logging.debug("Discarding the result of the lookup of callsign %s, since the callsign has been changed." % self.lookup_callsign)
+            return False
+        if(error_message):
+            error(parent=self.dialog, message=error_message)
+        else:
             for field_name in list(fields_and_data.keys()):
-                self.sources[field_name].set_text(fields_and_data[field_name])
+                # Don't overwrite anything that the user has typed into a field while the lookup was in progress.
+                if(self.get_data(field_name) == self.lookup_data.get(field_name)):
+                    self.sources[field_name].set_text(fields_and_data[field_name])
+        return False
+
+    def on_destroy(self, widget):
+        """ Cancel any callsign lookup that is in progress when the dialog is destroyed, and make sure that the result of one that has already finished is ignored. """
+        self.destroyed = True
+        if(self.lookup is not None):
+            self.lookup.cancel()
+            self.lookup = None
         return
 
     def calendar_callback(self, widget):
@@ -471,8 +471,8 @@ class RecordDialog:
         """ Insert the current date and time. """
 
         # Check if a configuration file is present.
-        config = configparser.ConfigParser()
-        have_config = (config.read(expanduser('~/.config/pyqso/preferences.ini')) != [])
+        config = get_preferences()
+        have_config = config.exists
 
         # Do we want to use UTC or the computer's local time?
         (section, option) = ("records", "use_utc")
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2013-2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import re
+import sqlite3 as sqlite
+
+from pyqso.adif import AVAILABLE_FIELD_NAMES_ORDERED
+
+# The data of each ADIF field is stored as text, exactly as it was entered or imported. Alongside these, each log table has "shadow" columns which hold typed, normalised copies
+# of some of the fields, so that they can be compared, sorted and indexed as numbers: freq_mhz is the FREQ field as a number (or NULL if it is not a positive number),
+# and qso_timestamp is the QSO_DATE and TIME_ON fields as a Unix timestamp (or NULL if they are not a valid date and time). When a record is added, the shadow columns are
+# computed in Python and inserted along with the record (see SHADOW_FUNCTIONS), so that each record is only written once; when a record is edited, they are kept up-to-date by a trigger.
+# Each entry gives the column's name and type, and the SQL expression which computes it from the fields of a record (given by "{0}", e.g. "NEW").
+SHADOW_COLUMNS = [("freq_mhz", "REAL", "CASE WHEN CAST({0}.freq AS REAL) > 0 THEN CAST({0}.freq AS REAL) END"),
+                  ("qso_timestamp", "INTEGER", """CAST(strftime('%s', substr({0}.qso_date, 1, 4) || '-' || substr({0}.qso_date, 5, 2) || '-' || substr({0}.qso_date, 7, 2) || ' ' ||
+substr({0}.time_on, 1, 2) || ':' || substr({0}.time_on, 3, 2) || ':' || CASE WHEN length({0}.time_on) = 6 THEN substr({0}.time_on, 5, 2) ELSE '00' END) AS INTEGER)""")]
+# The fields that the shadow columns are computed from.
+SHADOWED_FIELD_NAMES = ["FREQ", "QSO_DATE", "TIME_ON"]
+# The leading number that CAST(... AS REAL) finds in a string, and the date and time that strftime accepts once the QSO_DATE and TIME_ON fields have been put together as in SHADOW_COLUMNS.
+CAST_REAL = re.compile(r"[ \t\n\v\f\r]*([+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?)")
+TIMESTAMP = re.compile(r"([0-9]{4})-([0-9]{2})-([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})")
+# The indexes on each log table, keyed by the suffix of their names. Note that the duplicates and qso_date indexes have the same names as the ones created by the Log class when needed.
+INDEXES = [("duplicates", "call, qso_date, time_on"),
+           ("qso_date", "qso_date, time_on"),
+           ("band_mode", "band, mode"),
+           ("dxcc", "dxcc")]
+
+
+def get_freq_mhz(freq):
+    """ Compute the freq_mhz shadow column in the same way as its SQL expression in SHADOW_COLUMNS.
+
+    :arg str freq: The data in the FREQ field.
+    :returns: The frequency as a number, or None if it is not a positive number.
+    :rtype: float
+    """
+    m = CAST_REAL.match(freq or "")
+    if(m is None):
+        return None
+    freq_mhz = float(m.group(1))
+    return freq_mhz if freq_mhz > 0 else None
+
+
+def get_qso_timestamp(qso_date, time_on):
+    """ Compute the qso_timestamp shadow column in the same way as its SQL expression in SHADOW_COLUMNS.
+
+    :arg str qso_date: The data in the QSO_DATE field.
+    :arg str time_on: The data in the TIME_ON field.
+    :returns: The date and time as a Unix timestamp, or None if they are not valid.
+    :rtype: int
+    """
+    (qso_date, time_on) = (qso_date or "", time_on or "")
+    m = TIMESTAMP.fullmatch("%s-%s-%s %s:%s:%s" % (qso_date[0:4], qso_date[4:6], qso_date[6:8], time_on[0:2], time_on[2:4], time_on[4:6] if len(time_on) == 6 else "00"))
+    if(m is None):
+        return None
+    (year, month, day, hours, minutes, seconds) = [int(group) for group in m.groups()]
+    if(not(1 <= month <= 12 and 1 <= day <= 31 and hours <= 24 and minutes <= 59 and seconds <= 59)):
+        return None
+    # Like SQLite, days beyond the end of the month (and the hour 24) carry over into the next month (or day).
+    if(month <= 2):
+        year -= 1
+    era = year // 400
+    year_of_era = year - era*400
+    day_of_year = (153*(month + (9 if month <= 2 else -3)) + 2)//5 + day - 1
+    days = era*146097 + year_of_era*365 + year_of_era//4 - year_of_era//100 + day_of_year - 719468
+    return days*86400 + hours*3600 + minutes*60 + seconds
+
+
+# The functions which compute each shadow column from a record (a dictionary of field-value pairs).
+SHADOW_FUNCTIONS = {"freq_mhz": lambda record: get_freq_mhz(record.get("FREQ")),
+                    "qso_timestamp": lambda record: get_qso_timestamp(record.get("QSO_DATE"), record.get("TIME_ON"))}
+
+
+def get_log_names(connection):
+    """ Return the names of the log tables in a logbook.
+
+    :arg connection: An sqlite database connection to the logbook.
+    :returns: The names of the log tables.
+    :rtype: list
+    :raises sqlite.Error: If the names could not be retrieved.
+    """
+    c = connection.cursor()
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT GLOB 'sqlite_*'")
+    return [row[0] for row in c.fetchall()]
+
+
+def create_log_table(connection, name):
+    """ Create a new (empty) log table with the current schema.
+
+    :arg connection: An sqlite database connection to the logbook.
+    :arg str name: The name of the log.
+    :raises sqlite.Error: If the table could not be created.
+    """
+    # NOTE: "id" is simply an alias for the "rowid" column here.
+    columns = ["id INTEGER PRIMARY KEY AUTOINCREMENT"]
+    columns += ["%s TEXT" % field_name.lower() for field_name in AVAILABLE_FIELD_NAMES_ORDERED]
+    columns += ["%s %s" % (column_name, column_type) for (column_name, column_type, expression) in SHADOW_COLUMNS]
+    with connection:
+        c = connection.cursor()
+        c.execute("CREATE TABLE %s (%s)" % (name, ", ".join(columns)))
+        create_triggers(c, name)
+        create_indexes(c, name)
+    return
+
+
+def upgrade_log_table(connection, name):
+    """ Bring an existing log table up-to-date with the current schema, by adding any missing columns (with the shadow columns computed from the existing records),
+    triggers and indexes. This is safe to run more than once.
+
+    :arg connection: An sqlite database connection to the logbook.
+    :arg str name: The name of the log.
+    :raises sqlite.Error: If the table could not be upgraded.
+    """
+    c = connection.cursor()
+    c.execute("PRAGMA table_info(%s)" % name)
+    column_names = [str(t[1]).lower() for t in c.fetchall()]
+    for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
+        if(field_name.lower() not in column_names):
+            c.execute("ALTER TABLE %s ADD COLUMN %s TEXT DEFAULT \"\"" % (name, field_name.lower()))
+    for (column_name, column_type, expression) in SHADOW_COLUMNS:
+        if(column_name not in column_names):
+            c.execute("ALTER TABLE %s ADD COLUMN %s %s" % (name, column_name, column_type))
+    # Compute the shadow columns for all the existing records at once.
+    c.execute("UPDATE %s SET %s" % (name, ", ".join(["%s = %s" % (column_name, expression.format(name)) for (column_name, column_type, expression) in SHADOW_COLUMNS])))
+    create_triggers(c, name)
+    create_indexes(c, name)
+    return
+
+
+def create_triggers(cursor, name):
+    """ Create the trigger which keeps the shadow columns of a log table up-to-date whenever the fields they are computed from are edited.
+
+    :arg cursor: A database cursor.
+    :arg str name: The name of the log.
+    """
+    assignments = ", ".join(["%s = %s" % (column_name, expression.format("NEW")) for (column_name, column_type, expression) in SHADOW_COLUMNS])
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS {0}_shadow_update AFTER UPDATE OF {1} ON {0}
+BEGIN UPDATE {0} SET {2} WHERE id = NEW.id; END""".format(name, ", ".join([field_name.lower() for field_name in SHADOWED_FIELD_NAMES]), assignments))
+    return
+
+
+def create_indexes(cursor, name):
+    """ Create the indexes on a log table, if they do not already exist.
+
+    :arg cursor: A database cursor.
+    :arg str name: The name of the log.
+    """
+    for (suffix, columns) in INDEXES:
+        cursor.execute("CREATE INDEX IF NOT EXISTS %s_%s_index ON %s (%s)" % (name, suffix, name, columns))
+    return
+
+
+def get_dependent_objects(cursor, name):
+    """ Return the triggers and indexes (other than those created automatically by SQLite) that belong to a log table.
+
+    :arg cursor: A database cursor.
+    :arg str name: The name of the log.
+    :returns: The (type, name, SQL) tuples of the objects.
+    :rtype: list
+    """
+    cursor.execute("SELECT type, name, sql FROM sqlite_master WHERE type IN ('trigger', 'index') AND sql IS NOT NULL AND tbl_name = ? COLLATE NOCASE", (name,))
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+def rename_log_table(connection, old_name, new_name):
+    """ Rename a log table. The triggers and indexes that belong to it (which are named after the log, e.g. "test_dxcc_index") are renamed too,
+    since they otherwise keep their old names and a new log with the old name would not get its own.
+
+    :arg connection: An sqlite database connection to the logbook.
+    :arg str old_name: The current name of the log.
+    :arg str new_name: The new name of the log.
+    :raises sqlite.Error: If the table could not be renamed, in which case nothing is changed.
+    """
+    with connection:
+        c = connection.cursor()
+        c.execute("ALTER TABLE %s RENAME TO %s" % (old_name, new_name))
+        for (object_type, object_name, sql) in get_dependent_objects(c, new_name):
+            prefix = "CREATE %s %s" % (object_type.upper(), object_name)
+            if(object_name.lower().startswith(old_name.lower() + "_") and sql.startswith(prefix)):
+                c.execute("DROP %s %s" % (object_type.upper(), object_name))
+                c.execute("CREATE %s %s%s%s" % (object_type.upper(), new_name, object_name[len(old_name):], sql[len(prefix):]))
+    return
+
+
+def migrate_1(connection):
+    """ Add the shadow columns, triggers and indexes to every log table (along with any missing ADIF fields).
+
+    :arg connection: An sqlite database connection to the logbook.
+    """
+    for name in get_log_names(connection):
+        logging.debug("Upgrading log '%s'..." % name)
+        upgrade_log_table(connection, name)
+    return
+
+
+def migrate_2(connection):
+    """ Replace the triggers and indexes of every log table, since the trigger which computed the shadow columns of each new record is no longer used
+    (and the sort index on the FREQ field is now on the freq_mhz column instead, and the unused index on the qso_timestamp column is no longer created). Any triggers and indexes left with the name of another log by renaming a log
+    are given the right names, and the shadow columns are recomputed in case a log was created without its triggers because of them.
+    The indexes which the Log class creates for sorting are dropped too, and are created again when they are next needed.
+
+    :arg connection: An sqlite database connection to the logbook.
+    """
+    c = connection.cursor()
+    names = get_log_names(connection)
+    # Drop the old objects of every log before creating any new ones, since the old objects of one log may have the names of another's.
+    for name in names:
+        for (object_type, object_name, sql) in get_dependent_objects(c, name):
+            c.execute("DROP %s %s" % (object_type.upper(), object_name))
+    for name in names:
+        logging.debug("Upgrading log '%s'..." % name)
+        upgrade_log_table(connection, name)
+    return
+
+
+# The migrations, in order. The version of a logbook's schema (stored in its user_version) is the number of migrations that have been applied to it, so each migration is only run once.
+MIGRATIONS = [migrate_1, migrate_2]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(connection):
+    """ Return the version of the schema of a logbook.
+
+    :arg connection: An sqlite database connection to the logbook.
+    :returns: The version of the schema, which is 0 for logbooks that have never been migrated.
+    :rtype: int
+    """
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def enable_write_ahead_logging(connection):
+    """ Switch a logbook to write-ahead logging, so that it can be read (e.g. by the main thread) while a worker thread is writing to it. The journal mode is stored in the
+    logbook itself, so this only changes anything the first time a logbook is opened with this version of PyQSO. It must be done before any other connection to the logbook is opened.
+
+    :arg connection: An sqlite database connection to the logbook.
+    :returns: The logbook's journal mode, which is "wal" unless the logbook does not support write-ahead logging (e.g. an in-memory database).
+    :rtype: str
+    :raises sqlite.Error: If the journal mode could not be changed.
+    """
+    journal_mode = connection.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+    if(journal_mode.lower() != "wal"):
+        logging.warning("The logbook does not support write-ahead logging, and uses the '%s' journal mode instead." % journal_mode)
+    return journal_mode
+
+
+def migrate(connection):
+    """ Bring the schema of a logbook up-to-date, by applying any migrations that have not been applied to it yet. Each migration is applied in its own transaction,
+    and the logbook's version is updated in the same transaction, so an interrupted migration is simply run again the next time.
+
+    :arg connection: An sqlite database connection to the logbook.
+    :returns: The number of migrations applied.
+    :rtype: int
+    :raises sqlite.Error: If a migration could not be applied, in which case the logbook is left at the version before it.
+    """
+    version = get_schema_version(connection)
+    if(version >= SCHEMA_VERSION):
+        return 0
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None  # Manage the transactions explicitly, so that the schema changes are part of them.
+    try:
+        for number in range(version, SCHEMA_VERSION):
+            logging.info("Migrating the logbook's schema to version %d..." % (number + 1))
+            connection.execute("BEGIN")
+            try:
+                MIGRATIONS[number](connection)
+                connection.execute("PRAGMA user_version = %d" % (number + 1))
+                connection.execute("COMMIT")
+            except sqlite.Error:
+                connection.execute("ROLLBACK")
+                raise
+    finally:
+        connection.isolation_level = isolation_level
+    return SCHEMA_VERSION - version
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2013-2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from datetime import datetime
+
+
+class Statistics:
+
+    """ Statistics about the QSOs across all the logs in a logbook (e.g. the number of QSOs made each month, and with each mode).
+
+    All the statistics are derived from a single aggregate query, which counts the QSOs in every log by year, month and mode. The result of the query is cached until
+    the records in any of the logs change (see the monitor method), or the logs in the logbook change. """
+
+    def __init__(self):
+        """ Set up an empty cache. """
+        # The cached result of the aggregate query, and the logbook connection and log names that it was computed for.
+        self.counts = None
+        self.key = None
+        # The logs being monitored, and the IDs of the signal handlers connected to each one.
+        self.handlers = []
+        return
+
+    def invalidate(self, *args):
+        """ Discard the cached statistics, so that they are re-computed the next time they are needed. """
+        self.counts = None
+        return
+
+    def monitor(self, logs):
+        """ Invalidate the cached statistics whenever the records in any of the given logs change, and stop listening to any other logs.
+
+        :arg list logs: The logs to monitor.
+        """
+        for (log, handler_ids) in self.handlers:
+            if(log not in logs):
+                for handler_id in handler_ids:
+                    log.disconnect(handler_id)
+        self.handlers = [(log, handler_ids) for (log, handler_ids) in self.handlers if log in logs]
+        monitored = [log for (log, handler_ids) in self.handlers]
+
+        for log in logs:
+            if(log not in monitored):
+                handler_ids = [log.connect("record-added", self.invalidate),
+                               log.connect("record-edited", self.on_record_edited),
+                               log.connect("record-deleted", self.invalidate),
+                               log.connect("records-changed", self.invalidate)]
+                self.handlers.append((log, handler_ids))
+        return
+
+    def on_record_edited(self, log, old_record, new_record):
+        """ Invalidate the cached statistics if the date or mode of a record has changed. """
+        for field_name in ["QSO_DATE", "MODE"]:
+            if(old_record.get(field_name) != new_record.get(field_name)):
+                self.invalidate()
+                break
+        return
+
+    def get_counts(self, logbook):
+        """ Count the QSOs in all the logs of a logbook by year, month and mode.
+
+        :arg logbook: The logbook containing the logs.
+        :returns: A list of (year, month, mode, count) tuples. The year and month are strings taken from the QSO_DATE field, and may be empty or None if the date is not specified.
+        :rtype: list
+        :raises sqlite.Error: If the QSOs could not be counted.
+        """
+        key = (id(logbook.connection), tuple([log.name for log in logbook.logs]))
+        if(self.counts is None or key != self.key):
+            logging.debug("Computing the logbook statistics...")
+            counts = []
+            if(len(logbook.logs) > 0):
+                query = " UNION ALL ".join(["SELECT qso_date, mode FROM %s" % log.name for log in logbook.logs])
+                query = "SELECT substr(qso_date, 1, 4), substr(qso_date, 5, 2), mode, Count(*) FROM (%s) GROUP BY 1, 2, 3" % query
+                c = logbook.connection.cursor()
+                c.execute(query)
+                counts = [tuple(row) for row in c.fetchall()]
+            self.counts = counts
+            self.key = key
+        return self.counts
+
+    def get_record_count(self, logbook):
+        """ Return the total number of QSOs/records in all the logs of a logbook.
+
+        :arg logbook: The logbook containing the logs.
+        :returns: The total number of QSOs.
+        :rtype: int
+        :raises sqlite.Error: If the QSOs could not be counted.
+        """
+        return sum([n for (year, month, mode, n) in self.get_counts(logbook)])
+
+    def get_year_bounds(self, logbook):
+        """ Find the years of the oldest and newest QSOs across all logs in the logbook.
+
+        :arg logbook: The logbook containing the logs.
+        :returns: The years of the oldest and newest QSOs. The tuple (None, None) is returned if no QSOs have been made or no QSO dates have been specified.
+        :rtype: tuple
+        :raises sqlite.Error: If the QSOs could not be counted.
+        """
+        years = [int(year) for (year, month, mode, n) in self.get_counts(logbook) if year and year.isdigit()]
+        if(len(years) == 0):
+            return None, None
+        else:
+            return min(years), max(years)
+
+    def get_annual_contact_count(self, logbook, year):
+        """ Find the total number of contacts made in each month in the specified year.
+
+        :arg logbook: The logbook containing the logs.
+        :arg int year: The year of interest.
+        :returns: The total number of contacts made in each month of a given year.
+        :rtype: dict
+        :raises sqlite.Error: If the QSOs could not be counted.
+        """
+        contact_count = {}
+        for (y, m, mode, n) in self.get_counts(logbook):
+            if(y == str(year) and m and m.isdigit() and 1 <= int(m) <= 12):
+                date = datetime(year, int(m), 1)  # Collect all contacts together by month.
+                contact_count[date] = contact_count.get(date, 0) + n
+        return contact_count
+
+    def get_annual_mode_count(self, logbook, year):
+        """ Find the total number of contacts made with each mode in a specified year.
+
+        :arg logbook: The logbook containing the logs.
+        :arg int year: The year of interest.
+        :returns: The total number of contacts made with each mode in a given year.
+        :rtype: dict
+        :raises sqlite.Error: If the QSOs could not be counted.
+        """
+        mode_count = {}
+        for (y, m, mode, n) in self.get_counts(logbook):
+            if(y == str(year)):
+                if(not mode):
+                    mode = "Unspecified"
+                mode_count[mode] = mode_count.get(mode, 0) + n
+        return mode_count
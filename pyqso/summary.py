@@ -19,12 +19,9 @@
 
 from gi.repository import Gtk
 import logging
-from os.path import basename, getmtime, expanduser, dirname, join, realpath
+import sqlite3 as sqlite
+from os.path import basename, getmtime, dirname, join, realpath
 from datetime import datetime, date
-try:
-    import configparser
-except ImportError:
-    import ConfigParser as configparser
 try:
     import matplotlib
     matplotlib.use('Agg')
@@ -38,6 +35,9 @@ except ImportError as e:
     logging.warning("Could not import matplotlib, so you will not be able to plot annual logbook statistics. Check that all the PyQSO dependencies are satisfied.")
     have_matplotlib = False
 
+from pyqso.preferences import get_preferences
+from pyqso.statistics import Statistics
+
 
 class Summary(object):
 
@@ -49,6 +49,7 @@ class Summary(object):
 
         self.application = application
         self.logbook = self.application.logbook
+        self.statistics = Statistics()
         self.builder = self.application.builder
         glade_file_path = join(realpath(dirname(__file__)), "res", "pyqso.glade")
         self.builder.add_objects_from_file(glade_file_path, ("summary_page",))
@@ -63,8 +64,8 @@ class Summary(object):
         self.items["DATE_MODIFIED"] = self.builder.get_object("date_modified")
 
         # Yearly statistics
-        config = configparser.ConfigParser()
-        have_config = (config.read(expanduser('~/.config/pyqso/preferences.ini')) != [])
+        config = get_preferences()
+        have_config = config.exists
         (section, option) = ("general", "show_yearly_statistics")
         if have_config and config.has_option(section, option):
             if config.getboolean("general", "show_yearly_statistics") and have_matplotlib:
@@ -79,6 +80,7 @@ class Summary(object):
                 year_select.append_text("")
                 year_select.connect("changed", self.on_year_changed)
                 hbox.pack_start(year_select, False, False, 6)
+                self.items["YEAR_SELECT"] = year_select
                 self.summary_page.pack_start(hbox, False, False, 4)
 
                 self.items["YEARLY_STATISTICS"] = Figure()
@@ -146,23 +148,7 @@ class Summary(object):
         :returns: The years of the oldest and newest QSOs. The tuple (None, None) is returned if no QSOs have been made or no QSO dates have been specified.
         :rtype: tuple
         """
-
-        c = self.logbook.connection.cursor()
-        max_years = []
-        min_years = []
-        for log in self.logbook.logs:
-            query = "SELECT min(QSO_DATE), max(QSO_DATE) FROM %s" % (log.name)
-            c.execute(query)
-            years = c.fetchone()
-            if years[0] and years[1]:
-                min_years.append(int(years[0][:4]))
-                max_years.append(int(years[1][:4]))
-
-        if len(min_years) == 0 or len(max_years) == 0:
-            return None, None
-        else:
-            # Return the min and max across all logs.
-            return min(min_years), max(max_years)
+        return self.statistics.get_year_bounds(self.logbook)
 
     def get_annual_contact_count(self, year):
         """ Find the total number of contacts made in each month in the specified year.
@@ -171,26 +157,7 @@ class Summary(object):
         :returns: The total number of contacts made in each month of a given year.
         :rtype: dict
         """
-
-        contact_count = {}
-        c = self.logbook.connection.cursor()
-
-        for log in self.logbook.logs:
-            query = "SELECT QSO_DATE, count(QSO_DATE) FROM %s WHERE QSO_DATE >= %d0101 AND QSO_DATE < %d0101 GROUP by QSO_DATE" % (log.name, year, year+1)
-            c.execute(query)
-            xy = c.fetchall()
-
-            for i in range(len(xy)):
-                date_str = xy[i][0]
-                y = int(date_str[0:4])
-                m = int(date_str[4:6])
-                date = datetime(y, m, 1)  # Collect all contacts together by month.
-                if date in contact_count.keys():
-                    contact_count[date] += xy[i][1]
-                else:
-                    contact_count[date] = xy[i][1]
-
-        return contact_count
+        return self.statistics.get_annual_contact_count(self.logbook, year)
 
     def get_annual_mode_count(self, year):
         """ Find the total number of contacts made with each mode in a specified year.
@@ -199,33 +166,21 @@ class Summary(object):
         :returns: The total number of contacts made with each mode in a given year.
         :rtype: dict
         """
-
-        mode_count = {}
-
-        for log in self.logbook.logs:
-            query = "SELECT MODE, count(MODE) FROM %s WHERE QSO_DATE >= %d0101 AND QSO_DATE < %d0101 GROUP by MODE" % (log.name, year, year+1)
-            c = self.logbook.connection.cursor()
-            c.execute(query)
-            xy = c.fetchall()
-
-            for i in range(len(xy)):
-                mode = xy[i][0]
-                if mode == "":
-                    mode = "Unspecified"
-
-                # Add to running total
-                if mode in mode_count.keys():
-                    mode_count[mode] += xy[i][1]
-                else:
-                    mode_count[mode] = xy[i][1]
-
-        return mode_count
+        return self.statistics.get_annual_mode_count(self.logbook, year)
 
     def update(self):
         """ Update the information presented on the summary page. """
 
+        self.statistics.monitor(self.logbook.logs)
+        changed = (self.statistics.counts is None)
         self.items["LOG_COUNT"].set_label(str(self.logbook.log_count))
-        self.items["QSO_COUNT"].set_label(str(self.logbook.record_count))
+        try:
+            self.items["QSO_COUNT"].set_label(str(self.statistics.get_record_count(self.logbook)))
+            if(changed and "YEARLY_STATISTICS" in self.items):
+                # Re-plot the statistics for the selected year, since the QSOs may have changed.
+                self.on_year_changed(self.items["YEAR_SELECT"])
+        except sqlite.Error as e:
+            logging.exception(e)
         try:
             t = datetime.fromtimestamp(getmtime(self.logbook.path)).strftime("%d %B %Y @ %H:%M")
             self.items["DATE_MODIFIED"].set_label(str(t))
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2013-2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import sqlite3 as sqlite
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# NOTE: This module does not import Gtk. The function used to pass the results of the tasks back to the main thread (GLib.idle_add in PyQSO itself) is given to the TaskRunner.
+
+# The number of seconds that a connection to the logbook waits for another connection to finish writing, before giving up with a "database is locked" error.
+BUSY_TIMEOUT = 30
+
+# The maximum number of tasks that are run at the same time.
+MAXIMUM_WORKERS = 2
+
+# The number of seconds that a write from the main thread waits for any other write to the logbook to finish (see TaskRunner.writing), so that the user interface is never frozen for long.
+MAIN_THREAD_WRITE_TIMEOUT = 2
+
+
+class TaskCancelled(Exception):
+
+    """ Raised in a task's worker thread when the task has been cancelled. """
+
+    pass
+
+
+class LogbookBusy(Exception):
+
+    """ Raised when the logbook cannot be written to, because a task (e.g. an import) is writing to it. """
+
+    pass
+
+
+class Task:
+
+    """ A long-running job (e.g. importing or exporting a log) which is run in a worker thread by a TaskRunner, with its own connection to the logbook's database.
+
+    The job is a function which is called with the task itself and the connection, and which should report its progress (see the report and track methods) every so often.
+    Once the task has been cancelled, reporting progress raises TaskCancelled so that the job stops, and any transaction it is in the middle of is rolled back.
+    The on_complete (or on_error) function is then called in the main thread. """
+
+    def __init__(self, description, job, on_complete=None, on_error=None, writes=False):
+        """ Set up a new task.
+
+        :arg str description: A description of the task for the statusbar, e.g. "Importing into log 'test'".
+        :arg job: The function to run in the worker thread. It is called with the task and a connection to the logbook, and its return value is passed to on_complete.
+        :arg on_complete: An optional function which is called in the main thread with the job's return value, if the job finishes successfully.
+        :arg on_error: An optional function which is called in the main thread with the exception raised by the job, if it fails or is cancelled (in which case the exception is a TaskCancelled).
+        :arg bool writes: True if the job writes to the logbook, in which case it is only run while no other writing task is running.
+        """
+        self.description = description
+        self.job = job
+        self.on_complete = on_complete
+        self.on_error = on_error
+        self.writes = writes
+
+        # The number of items (e.g. QSOs) dealt with so far, and the total number of items if it is known.
+        self.count = 0
+        self.total = None
+
+        self.cancelled = threading.Event()
+        self.runner = None
+        # The task's connection to the logbook while its job is running, which is only changed while holding the lock (so that it is not closed while it is being interrupted).
+        self.connection = None
+        self.lock = threading.Lock()
+        self.finished = False
+        self.result = None
+        self.error = None
+        # True while a progress update is waiting to be shown in the main thread, so that the main thread is not flooded with them.
+        self.progress_pending = False
+        return
+
+    def cancel(self):
+        """ Ask the task to stop. This can be called from any thread. Any database query that the job is in the middle of is interrupted. """
+        self.cancelled.set()
+        with self.lock:
+            if(self.connection is not None):
+                self.connection.interrupt()
+        return
+
+    def check(self):
+        """ Stop the job if the task has been cancelled.
+
+        :raises TaskCancelled: If the task has been cancelled.
+        """
+        if(self.cancelled.is_set()):
+            raise TaskCancelled("The task '%s' was cancelled." % self.description)
+        return
+
+    def report(self, count, total=None):
+        """ Report the job's progress, to be shown in the main thread. This is called by the job from the worker thread.
+
+        :arg int count: The number of items dealt with so far.
+        :arg int total: The total number of items, if known.
+        :raises TaskCancelled: If the task has been cancelled.
+        """
+        self.count = count
+        if(total is not None):
+            self.total = total
+        self.check()
+        if(self.runner is not None):
+            self.runner.report(self)
+        return
+
+    def track(self, items, interval=1000):
+        """ Count the items of an iterable as the job goes through them, reporting the progress every so often.
+
+        :arg items: The iterable (e.g. a generator of records).
+        :arg int interval: The number of items between progress reports.
+        :returns: A generator which yields each of the items.
+        :rtype: generator
+        :raises TaskCancelled: If the task is cancelled.
+        """
+        count = 0
+        for item in items:
+            yield item
+            count += 1
+            self.count = count
+            if(count % interval == 0):
+                self.report(count)
+        self.report(count)
+        return
+
+
+class TaskRunner:
+
+    """ Run long-running tasks (see the Task class) in a pool of worker threads, so that the user interface stays responsive.
+
+    Each task has its own connection to the logbook, since a connection cannot be shared between threads. Only one task that writes to the logbook is run at a time,
+    and every connection waits (for up to busy_timeout seconds) for any other connection's writes to finish rather than failing with a "database is locked" error.
+    Writes made outside the tasks (by the main thread, or by another background thread) take the same write lock (see the writing method), so that they never wait on a task's transaction.
+    Progress updates and the results of the tasks are passed back to the main thread with the dispatch function (GLib.idle_add in PyQSO itself). """
+
+    def __init__(self, path, dispatch, on_progress=None, on_finished=None, maximum_workers=MAXIMUM_WORKERS, busy_timeout=BUSY_TIMEOUT):
+        """ Set up a new task runner.
+
+        :arg str path: The path to the logbook's database file.
+        :arg dispatch: A function which arranges for a function to be called in the main thread, with any further arguments given. The function should return False.
+        :arg on_progress: An optional function which is called in the main thread with a task when it is submitted and whenever it reports its progress.
+        :arg on_finished: An optional function which is called in the main thread with a task once it has finished, after its on_complete or on_error function.
+        :arg int maximum_workers: The maximum number of tasks to run at the same time.
+        :arg float busy_timeout: The number of seconds that each task's connection waits for another connection's writes to finish.
+        """
+        self.path = path
+        self.dispatch = dispatch
+        self.on_progress = on_progress
+        self.on_finished = on_finished
+        self.busy_timeout = busy_timeout
+        self.executor = ThreadPoolExecutor(max_workers=maximum_workers, thread_name_prefix="pyqso-task")
+        self.write_lock = threading.Lock()
+
+        # The tasks that have been submitted but have not yet finished. This is only used in the main thread.
+        self.tasks = []
+        self.closed = False
+        return
+
+    def connect(self):
+        """ Open a new connection to the logbook for a task.
+
+        :returns: The connection.
+        :raises sqlite.Error: If the logbook could not be opened.
+        """
+        connection = sqlite.connect(self.path, timeout=self.busy_timeout)
+        connection.row_factory = sqlite.Row
+        return connection
+
+    def is_writing(self):
+        """ Determine whether anything (e.g. a task) is writing to the logbook at the moment.
+
+        :returns: True if the write lock is held.
+        :rtype: bool
+        """
+        return self.write_lock.locked()
+
+    @contextmanager
+    def writing(self, timeout=MAIN_THREAD_WRITE_TIMEOUT):
+        """ Hold the write lock while writing to the logbook from outside a task, e.g. when a record is edited in the main thread. A writing task's transaction can last for a long time
+        (e.g. an import), so rather than freezing the user interface until it has finished (and then failing with a "database is locked" error), this gives up after a short wait.
+
+        :arg float timeout: The number of seconds to wait for any other write to finish. Use -1 to wait for as long as it takes (e.g. in a background thread).
+        :raises LogbookBusy: If the logbook is still being written to after the timeout.
+        """
+        if(not self.write_lock.acquire(timeout=timeout)):
+            raise LogbookBusy("The logbook is being written to by another operation.")
+        try:
+            yield
+        finally:
+            self.write_lock.release()
+
+    def submit(self, task):
+        """ Start running a task in a worker thread (or once a worker thread is free).
+
+        :arg Task task: The task to run.
+        :returns: The task.
+        :rtype: Task
+        :raises RuntimeError: If the task runner has been closed.
+        """
+        if(self.closed):
+            raise RuntimeError("The task runner has been closed.")
+        logging.debug("Submitting task '%s'..." % task.description)
+        task.runner = self
+        self.tasks.append(task)
+        self.executor.submit(self.execute, task)
+        if(self.on_progress):
+            self.on_progress(task)
+        return task
+
+    def execute(self, task):
+        """ Run a task's job. This is called in a worker thread.
+
+        :arg Task task: The task to run.
+        """
+        result = None
+        error = None
+        connection = None
+        try:
+            task.check()
+            connection = self.connect()
+            with task.lock:
+                task.connection = connection
+            if(task.writes):
+                with self.write_lock:
+                    task.check()
+                    result = task.job(task, connection)
+            else:
+                result = task.job(task, connection)
+        except Exception as e:
+            if(task.cancelled.is_set() and not isinstance(e, TaskCancelled)):
+                # The task's connection was interrupted in the middle of a query.
+                e = TaskCancelled("The task '%s' was cancelled." % task.description)
+            if(isinstance(e, TaskCancelled)):
+                logging.debug("Task '%s' cancelled." % task.description)
+            else:
+                logging.error("Task '%s' failed." % task.description)
+                logging.exception(e)
+            error = e
+        finally:
+            if(connection is not None):
+                with task.lock:
+                    task.connection = None
+                connection.close()
+        self.dispatch(self.finish, task, result, error)
+        return
+
+    def report(self, task):
+        """ Pass a task's progress back to the main thread. This is called in the task's worker thread.
+
+        :arg Task task: The task.
+        """
+        if(self.on_progress and not task.progress_pending):
+            task.progress_pending = True
+            self.dispatch(self.show_progress, task)
+        return
+
+    def show_progress(self, task):
+        """ Show a task's progress. This is called in the main thread.
+
+        :arg Task task: The task.
+        :returns: Always returns False, so that the function is not called again by GLib.
+        :rtype: bool
+        """
+        task.progress_pending = False
+        if(not(self.closed or task.finished) and self.on_progress):
+            self.on_progress(task)
+        return False
+
+    def finish(self, task, result, error):
+        """ Finish a task by calling its on_complete or on_error function. This is called in the main thread. Nothing is called if the task runner has been closed in the meantime.
+
+        :arg Task task: The task.
+        :arg result: The return value of the task's job.
+        :arg Exception error: The exception raised by the task's job, or None if it finished successfully.
+        :returns: Always returns False, so that the function is not called again by GLib.
+        :rtype: bool
+        """
+        task.result = result
+        task.error = error
+        task.finished = True
+        if(task in self.tasks):
+            self.tasks.remove(task)
+        if(self.closed):
+            return False
+        try:
+            if(error is None):
+                if(task.on_complete):
+                    task.on_complete(result)
+            elif(task.on_error):
+                task.on_error(error)
+        finally:
+            if(self.on_finished):
+                self.on_finished(task)
+        return False
+
+    def wait(self, task, iterate):
+        """ Wait for a task to finish, while keeping the user interface responsive (e.g. when the task must finish before anything else can be done).
+
+        :arg Task task: The task.
+        :arg iterate: A function which handles any pending events in the main thread (including the functions passed to the dispatch function), blocking until there is one.
+        :returns: The return value of the task's job.
+        :raises Exception: Whatever exception the task's job raised (TaskCancelled if it was cancelled).
+        """
+        while(not task.finished):
+            iterate()
+        if(task.error is not None):
+            raise task.error
+        return task.result
+
+    def cancel_all(self):
+        """ Cancel all the tasks that have not yet finished. """
+        for task in list(self.tasks):
+            task.cancel()
+        return
+
+    def close(self):
+        """ Cancel all the tasks, and wait for the worker threads to stop. The results of the tasks are discarded. """
+        self.closed = True
+        self.cancel_all()
+        self.executor.shutdown(wait=True)
+        self.tasks = []
+        return
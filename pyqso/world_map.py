@@ -22,12 +22,8 @@ from importlib.metadata import version
 import logging
 import sqlite3 as sqlite
 import re
-from os.path import expanduser
+import os
 from datetime import datetime, timezone
-try:
-    import configparser
-except ImportError:
-    import ConfigParser as configparser
 try:
     import numpy
     logging.info("Using version %s of numpy." % (numpy.__version__))
@@ -35,19 +31,29 @@ try:
     logging.info("Using version %s of matplotlib." % (matplotlib.__version__))
     import cartopy
     logging.info("Using version %s of cartopy." % (cartopy.__version__))
-    from matplotlib.backends.backend_gtk3cairo import FigureCanvasGTK3Cairo as FigureCanvas
+    import matplotlib.image
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.backends.backend_gtk3agg import FigureCanvasGTK3Agg as FigureCanvas
     from matplotlib.backends.backend_gtk3 import NavigationToolbar2GTK3
     have_necessary_modules = True
 except ImportError as e:
     logging.warning(e)
     logging.warning("Could not import a non-standard Python module needed by the WorldMap class, or the version of the non-standard module is too old. Check that all the PyQSO dependencies are satisfied.")
     have_necessary_modules = False
-try:
-    import geocoder
-    have_geocoder = True
-except ImportError:
-    logging.warning("Could not import the geocoder module!")
-    have_geocoder = False
+
+from pyqso.preferences import get_preferences
+from pyqso.geocoding import Geocoder
+
+# The directory in which the rendered basemaps (see WorldMap.get_basemap) are cached.
+BASEMAP_CACHE_DIRECTORY = os.path.expanduser("~/.cache/pyqso/world_map")
+# The maximum number of rendered basemaps (one per map size/resolution) that are kept in the cache directory.
+MAXIMUM_CACHED_BASEMAPS = 8
+# The maximum number of QSOs, plotted with WorldMap.plot_log, that are shown individually in the visible part of the map. Any more than this are clustered together.
+CLUSTERING_THRESHOLD = 1000
+# The number of cells across the visible part of the map in which QSOs are clustered together.
+CLUSTER_GRID_SIZE = 64
+# The maximum number of labels shown for the QSOs plotted with WorldMap.plot_log.
+MAXIMUM_LABELS = 50
 
 if have_necessary_modules:
     class NavigationToolbar(NavigationToolbar2GTK3):
@@ -139,10 +145,149 @@ class Maidenhead:
     def longitude4(self, g):
         return 20*(ord(g[0]) - ord("A")) + 2*int(g[2])-180
 
+    def ll2gs_array(self, latitudes, longitudes, length=4):
+        """ Convert arrays of latitude-longitude coordinates to Maidenhead grid square locators, all at once.
+        The conversion is the same as that of the ll2gs method, but is vectorised with NumPy.
+
+        :arg latitudes: The latitudes (any array-like object).
+        :arg longitudes: The longitudes (any array-like object of the same shape as the latitudes).
+        :arg int length: The number of characters in each locator; either 4 (field and square), 6 (with the subsquare) or 8 (with the extended square).
+        :returns: An array of the Maidenhead grid square locators. The locators of any coordinates that are invalid (e.g. out of range or NaN) are empty strings.
+        :rtype: numpy.ndarray
+        :raises ValueError: If the length of the locators is not 4, 6 or 8.
+        """
+
+        if(length not in (4, 6, 8)):
+            raise ValueError("Maidenhead grid square locators must be 4, 6 or 8 characters long.")
+
+        latitudes = numpy.asarray(latitudes, dtype=float)
+        longitudes = numpy.asarray(longitudes, dtype=float)
+        shape = latitudes.shape
+        latitudes = latitudes.ravel()
+        longitudes = longitudes.ravel()
+
+        with numpy.errstate(invalid="ignore"):
+            valid = (latitudes >= -90) & (latitudes <= 90) & (longitudes >= -180) & (longitudes <= 180)
+        # Points on the north pole and the anti-meridian (at +180 degrees) belong in the last field.
+        adjusted_latitude = numpy.where(valid, numpy.minimum(latitudes + 90, numpy.nextafter(180, 0)), 0)
+        adjusted_longitude = numpy.where(valid, numpy.minimum(longitudes + 180, numpy.nextafter(360, 0)), 0)
+
+        codes = numpy.zeros((len(latitudes), length), dtype=numpy.uint32)
+        codes[:, 0] = ord("A") + (adjusted_longitude // 20)
+        codes[:, 1] = ord("A") + (adjusted_latitude // 10)
+        codes[:, 2] = ord("0") + ((adjusted_longitude / 2) % 10).astype(int)
+        codes[:, 3] = ord("0") + (adjusted_latitude % 10).astype(int)
+        if(length >= 6):
+            adjusted_latitude_remainder = (adjusted_latitude - numpy.floor(adjusted_latitude)) * 60
+            adjusted_longitude_remainder = (adjusted_longitude - numpy.floor(adjusted_longitude/2)*2) * 60
+            codes[:, 4] = ord("a") + (adjusted_longitude_remainder // 5)
+            codes[:, 5] = ord("a") + (adjusted_latitude_remainder // 2.5)
+            if(length == 8):
+                codes[:, 6] = ord("0") + ((adjusted_longitude_remainder % 5) // 0.5)
+                codes[:, 7] = ord("0") + ((adjusted_latitude_remainder % 2.5) // 0.25)
+        codes[~valid] = 0  # Null characters are stripped, leaving an empty string.
+
+        return codes.view("U%d" % length).reshape(shape)
+
+    def gs2ll_array(self, grid_squares):
+        """ Convert an array of Maidenhead grid square locators to latitude-longitude coordinates, all at once.
+        The locators may be 4, 6 or 8 characters long, in any combination and in either case. The coordinates returned are those of the centre of each locator's square/subsquare.
+
+        :arg grid_squares: The Maidenhead grid square locators (any array-like object containing strings, e.g. a list of GRIDSQUARE field values).
+        :returns: The latitudes, the longitudes, and a mask which is True wherever a locator is valid. The coordinates of invalid locators are NaN.
+        :rtype: tuple
+        """
+
+        grid_squares = numpy.asarray(grid_squares, dtype=str)
+        shape = grid_squares.shape
+        grid_squares = grid_squares.ravel()
+        lengths = numpy.char.str_len(grid_squares)
+        codes = self.get_character_codes(grid_squares, 8)
+
+        field_longitude, field_longitude_valid = self.get_letter_indices(codes[:, 0], len(self.upper))
+        field_latitude, field_latitude_valid = self.get_letter_indices(codes[:, 1], len(self.upper))
+        square_longitude, square_longitude_valid = self.get_digit_indices(codes[:, 2])
+        square_latitude, square_latitude_valid = self.get_digit_indices(codes[:, 3])
+        subsquare_longitude, subsquare_longitude_valid = self.get_letter_indices(codes[:, 4], len(self.lower))
+        subsquare_latitude, subsquare_latitude_valid = self.get_letter_indices(codes[:, 5], len(self.lower))
+        extended_longitude, extended_longitude_valid = self.get_digit_indices(codes[:, 6])
+        extended_latitude, extended_latitude_valid = self.get_digit_indices(codes[:, 7])
+
+        valid = (lengths == 4) | (lengths == 6) | (lengths == 8)
+        valid &= field_longitude_valid & field_latitude_valid & square_longitude_valid & square_latitude_valid
+        valid &= (lengths < 6) | (subsquare_longitude_valid & subsquare_latitude_valid)
+        valid &= (lengths < 8) | (extended_longitude_valid & extended_latitude_valid)
+
+        # The size of each locator's square/subsquare in degrees.
+        height = numpy.select([lengths == 4, lengths == 6], [1.0, 2.5/60.0], 0.25/60.0)
+        width = 2*height
+
+        latitudes = 10.0*field_latitude + square_latitude - 90 + 0.5*height
+        longitudes = 20.0*field_longitude + 2.0*square_longitude - 180 + 0.5*width
+        latitudes += numpy.where(lengths >= 6, subsquare_latitude*2.5/60.0, 0)
+        longitudes += numpy.where(lengths >= 6, subsquare_longitude*5.0/60.0, 0)
+        latitudes += numpy.where(lengths == 8, extended_latitude*0.25/60.0, 0)
+        longitudes += numpy.where(lengths == 8, extended_longitude*0.5/60.0, 0)
+
+        latitudes[~valid] = numpy.nan
+        longitudes[~valid] = numpy.nan
+        return latitudes.reshape(shape), longitudes.reshape(shape), valid.reshape(shape)
+
+    def get_field_indices(self, grid_squares):
+        """ Determine the (longitude, latitude) indices of the fields (i.e. the first two characters) of an array of Maidenhead grid square locators.
+
+        :arg grid_squares: The Maidenhead grid square locators (any array-like object containing strings).
+        :returns: The longitude indices, the latitude indices, and a mask which is True wherever the field is valid.
+        :rtype: tuple
+        """
+        codes = self.get_character_codes(numpy.asarray(grid_squares, dtype=str).ravel(), 2)
+        field_longitude, field_longitude_valid = self.get_letter_indices(codes[:, 0], len(self.upper))
+        field_latitude, field_latitude_valid = self.get_letter_indices(codes[:, 1], len(self.upper))
+        return field_longitude, field_latitude, field_longitude_valid & field_latitude_valid
+
+    @staticmethod
+    def get_character_codes(strings, width):
+        """ Return the Unicode code points of the first few characters of each string in an array.
+
+        :arg numpy.ndarray strings: A one-dimensional array of strings.
+        :arg int width: The number of characters to consider in each string. Shorter strings are padded with zeros.
+        :returns: A two-dimensional array of code points, with one row per string.
+        :rtype: numpy.ndarray
+        """
+        return numpy.ascontiguousarray(strings, dtype="U%d" % width).view(numpy.uint32).reshape(len(strings), width).astype(numpy.int64)
+
+    @staticmethod
+    def get_letter_indices(codes, n):
+        """ Convert the code points of letters (of either case) to their positions in the alphabet.
+
+        :arg numpy.ndarray codes: The code points.
+        :arg int n: The number of letters that are allowed (e.g. 18 for the letters A to R).
+        :returns: The positions in the alphabet, and a mask which is True wherever the letter is allowed.
+        :rtype: tuple
+        """
+        indices = numpy.where(codes >= ord("a"), codes - ord("a"), codes - ord("A"))
+        return indices, (indices >= 0) & (indices < n)
+
+    @staticmethod
+    def get_digit_indices(codes):
+        """ Convert the code points of digits to their values.
+
+        :arg numpy.ndarray codes: The code points.
+        :returns: The values of the digits, and a mask which is True wherever the code point is that of a digit.
+        :rtype: tuple
+        """
+        indices = codes - ord("0")
+        return indices, (indices >= 0) & (indices < 10)
+
 
 class WorldMap:
 
-    """ A tool for visualising the world map. """
+    """ A tool for visualising the world map.
+
+    The map is drawn in two layers. The static layer (the land, oceans, coastlines, borders, and the Maidenhead grid squares) is rendered once as a raster image,
+    which is cached on disk for each size and resolution of the map (see the get_basemap method). The raster image only fits the whole world, so while the map is zoomed in or panned
+    (e.g. with the navigation toolbar) the static layer is drawn from the vector features instead, at the resolution of the view. The dynamic layer (the grey line, the shading of the worked grid squares,
+    and the pinpointed QTHs) is drawn on top of a saved copy of the static layer with blitting, so that updating the grey line or pinpointing a callsign does not re-draw the whole map. """
 
     def __init__(self, application):
         """ Set up the drawing canvas and the timer which will re-plot the world map every 30 minutes.
@@ -155,17 +300,47 @@ class WorldMap:
         self.builder = self.application.builder
         self.points = []
 
+        # The map's axes (created when the map is first drawn), the key identifying the basemap drawn in them, and the artists in the dynamic layer.
+        self.ax = None
+        self.basemap_key = None
+        self.basemap_image = None
+        # Whether the static layer is drawn from the vector features (when the whole world is not in view), and the artists representing them.
+        self.zoomed = False
+        self.vector_artists = []
+        self.grey_line = None
+        self.worked_grid_squares_mesh = None
+        # The cached array of worked grid squares, and the logbook connection and log names that it was computed for. This is kept up-to-date by listening to the signals emitted by each Log
+        # (see the monitor method), so that re-drawing the map (e.g. when pinpointing a callsign) does not re-read the GRIDSQUARE field of every QSO.
+        self.worked_grid_squares = None
+        self.worked_grid_squares_key = None
+        # The logs being monitored, and the IDs of the signal handlers connected to each one.
+        self.handlers = []
+        self.point_artists = []
+        # The rendered figure without the dynamic layer, which the dynamic layer is blitted on top of.
+        self.background = None
+
+        # The callsigns, coordinates (NaN if not yet known) and countries of the QSOs plotted all at once with plot_log.
+        self.bulk_names = None
+        self.bulk_latitudes = None
+        self.bulk_longitudes = None
+        self.bulk_countries = None
+        # The artists representing these QSOs, and the limits of the view that they were clustered for.
+        self.bulk_collection = None
+        self.bulk_labels = []
+        self.bulk_limits = None
+
         if have_necessary_modules:
             self.fig = matplotlib.figure.Figure()
             self.canvas = FigureCanvas(self.fig)  # For embedding in the Gtk application
+            self.canvas.mpl_connect("draw_event", self.on_draw_event)
             self.builder.get_object("world_map").pack_start(self.canvas, True, True, 0)
             toolbar = NavigationToolbar(self.canvas)
             self.builder.get_object("world_map").pack_start(toolbar, False, False, 0)
             self.refresh_event = GObject.timeout_add(1800000, self.draw)  # Re-draw the world map automatically after 30 minutes (if the world map tool is visible).
 
         # Add the QTH coordinates for plotting, if available.
-        config = configparser.ConfigParser()
-        have_config = (config.read(expanduser('~/.config/pyqso/preferences.ini')) != [])
+        config = get_preferences()
+        have_config = config.exists
         (section, option) = ("world_map", "show_qth")
         if have_config and config.has_option(section, option):
             if config.getboolean(section, option):
@@ -177,6 +352,9 @@ class WorldMap:
                 except ValueError:
                     logging.warning("Unable to get the QTH name, latitude and/or longitude. The QTH will not be pinpointed on the world map. Check preferences?")
 
+        # The geocoder used to find the coordinates of QSOs without a GRIDSQUARE. This is created when it is first needed.
+        self.geocoder = None
+
         # Maidenhead grid squares.
         self.maidenhead = Maidenhead()
         self.show_grid_squares = False
@@ -192,7 +370,7 @@ class WorldMap:
         logging.debug("World map ready!")
 
     def add_point(self, name, latitude, longitude, style="yo"):
-        """ Add a point and re-draw the map.
+        """ Add a point and re-draw the map's dynamic layer.
 
         :arg str name: The name that identifies the point.
         :arg float latitude: The latitude of the point on the map.
@@ -201,6 +379,8 @@ class WorldMap:
         """
         p = Point(name, latitude, longitude, style)
         self.points.append(p)
+        if self.ax is not None:
+            self.point_artists.extend(self.plot_point(p))
         self.draw()
 
     def pinpoint(self, r):
@@ -209,59 +389,247 @@ class WorldMap:
         :arg r: The QSO record containing the location to pinpoint.
         """
 
-        if have_geocoder:
-            callsign = r["CALL"]
-            gridsquare = r["GRIDSQUARE"]
-            country = r["COUNTRY"]
+        callsign = r["CALL"]
+        gridsquare = r["GRIDSQUARE"]
+        country = r["COUNTRY"]
 
-            # Get the latitude-longitude coordinates. Use any GRIDSQUARE information first since this is likely to be more accurate than the COUNTRY field.
-            if gridsquare:
-                try:
-                    latitude, longitude = self.maidenhead.gs2ll(gridsquare)
-                    logging.debug("QTH coordinates found: (%s, %s)", str(latitude), str(longitude))
-                    self.add_point(callsign, latitude, longitude)
-                    return
-                except ValueError:
-                    logging.exception("Unable to lookup QTH coordinates.")
+        # Get the latitude-longitude coordinates. Use any GRIDSQUARE information first since this is likely to be more accurate than the COUNTRY field.
+        if gridsquare:
+            try:
+                latitude, longitude = self.maidenhead.gs2ll(gridsquare)
+                logging.debug("QTH coordinates found: (%s, %s)", str(latitude), str(longitude))
+                self.add_point(callsign, latitude, longitude)
+                return
+            except ValueError:
+                logging.exception("Unable to lookup QTH coordinates.")
+
+        if country:
+            if self.geocoder is None:
+                self.geocoder = Geocoder()
+            # The country might have to be looked up online, in which case the callback is called from the geocoder's worker thread. The point is always added in the GTK main loop.
+            self.geocoder.request(country, lambda name, coordinates: GObject.idle_add(self.on_geocoded, callsign, coordinates))
+
+    def plot_log(self, log):
+        """ Plot all the QSOs in a log (or only those which pass the log's callsign filter) on the world map, all at once.
+        The coordinates of the QSOs are determined from their GRIDSQUARE field if possible, and otherwise from their COUNTRY field.
+        When many QSOs are visible, nearby QSOs are clustered together, and only the largest clusters are labelled.
+
+        :arg log: The log containing the QSOs.
+        """
 
+        if not have_necessary_modules:
+            logging.warning("Could not plot the QSOs in log '%s', since the modules needed by the world map could not be imported." % log.name)
+            return
+
+        try:
+            rows = log.get_fields(["CALL", "GRIDSQUARE", "COUNTRY"], visible=True)
+        except sqlite.Error as e:
+            logging.error("Could not plot the QSOs in log '%s' because of a database error." % log.name)
+            logging.exception(e)
+            return
+        logging.debug("Plotting %d QSOs on the world map..." % len(rows))
+
+        names = numpy.array([call or "" for (call, gridsquare, country) in rows], dtype=str)
+        latitudes, longitudes, valid = self.maidenhead.gs2ll_array([gridsquare or "" for (call, gridsquare, country) in rows])
+        countries = numpy.array([country or "" for (call, gridsquare, country) in rows], dtype=str)
+        self.bulk_names = names.reshape(len(rows))
+        self.bulk_latitudes = latitudes
+        self.bulk_longitudes = longitudes
+        self.bulk_countries = numpy.where(valid, "", countries).reshape(len(rows))
+
+        # Use the COUNTRY of any QSOs without a (valid) GRIDSQUARE. Each distinct country is only looked up once.
+        if self.geocoder is None:
+            self.geocoder = Geocoder()
+        for country in numpy.unique(self.bulk_countries):
             if country:
-                try:
-                    g = geocoder.google(country)
-                    latitude, longitude = g.latlng
-                    logging.debug("QTH coordinates found: (%s, %s)", str(latitude), str(longitude))
-                    self.add_point(callsign, latitude, longitude)
-                    return
-                except ValueError:
-                    logging.exception("Unable to lookup QTH coordinates.")
-                except Exception:
-                    logging.exception("Unable to lookup QTH coordinates. Check connection to the internets? Lookup limit reached?")
+                coordinates = self.geocoder.get(country)
+                if coordinates is None:
+                    self.geocoder.request(country, lambda name, coordinates: GObject.idle_add(self.on_bulk_geocoded, name, coordinates))
+                elif coordinates[0] is not None:
+                    self.set_bulk_coordinates(country, coordinates)
+
+        self.remove_bulk_artists()
+        self.update_bulk_artists()
+        self.draw()
+        return
+
+    def set_bulk_coordinates(self, country, coordinates):
+        """ Set the coordinates of the QSOs plotted with plot_log which have no GRIDSQUARE and are in a given country.
+
+        :arg str country: The country.
+        :arg tuple coordinates: The latitude-longitude coordinates of the country.
+        """
+        mask = (self.bulk_countries == country)
+        self.bulk_latitudes[mask] = coordinates[0]
+        self.bulk_longitudes[mask] = coordinates[1]
+        return
+
+    def on_bulk_geocoded(self, country, coordinates):
+        """ Plot the QSOs in a given country once the country's coordinates have been found.
+
+        :arg str country: The country.
+        :arg tuple coordinates: The latitude-longitude coordinates of the country.
+        :returns: Always returns False so that this is only called once by the GObject idle event.
+        :rtype: bool
+        """
+        if self.bulk_countries is not None:
+            self.set_bulk_coordinates(country, coordinates)
+            self.remove_bulk_artists()
+            self.update_bulk_artists()
+            self.draw()
+        return False
+
+    def get_clusters(self, limits):
+        """ Cluster together the QSOs plotted with plot_log which are in the visible part of the map, if there are too many of them to show individually.
+        The visible part of the map is divided into a grid of cells, and all QSOs in the same cell are represented by a single cluster at their mean position.
+
+        :arg tuple limits: The limits (minimum longitude, maximum longitude, minimum latitude, maximum latitude) of the visible part of the map.
+        :returns: The longitudes, latitudes, sizes (i.e. the number of QSOs) and labels of the clusters. A cluster of one QSO is labelled with the QSO's callsign, and any other cluster is labelled with its size.
+        :rtype: tuple
+        """
+        (xmin, xmax, ymin, ymax) = limits
+        with numpy.errstate(invalid="ignore"):
+            visible = (self.bulk_longitudes >= xmin) & (self.bulk_longitudes <= xmax) & (self.bulk_latitudes >= ymin) & (self.bulk_latitudes <= ymax)
+        longitudes = self.bulk_longitudes[visible]
+        latitudes = self.bulk_latitudes[visible]
+        names = self.bulk_names[visible]
+
+        if len(longitudes) <= CLUSTERING_THRESHOLD:
+            return longitudes, latitudes, numpy.ones(len(longitudes), dtype=int), names
+
+        size = max(xmax - xmin, ymax - ymin)/CLUSTER_GRID_SIZE
+        columns = numpy.floor((longitudes - xmin)/size).astype(numpy.int64)
+        rows = numpy.floor((latitudes - ymin)/size).astype(numpy.int64)
+        cells = columns*(CLUSTER_GRID_SIZE + 1) + rows
+        cells, first, inverse, counts = numpy.unique(cells, return_index=True, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+        cluster_longitudes = numpy.bincount(inverse, weights=longitudes)/counts
+        cluster_latitudes = numpy.bincount(inverse, weights=latitudes)/counts
+        labels = numpy.where(counts == 1, names[first], counts.astype(str))
+        return cluster_longitudes, cluster_latitudes, counts, labels
+
+    def update_bulk_artists(self):
+        """ Plot the QSOs added with plot_log as a single collection of points, clustered for the current view of the map. The QSOs are only clustered again if the view has changed. """
+
+        if self.ax is None or self.bulk_names is None:
+            return
+        (xmin, xmax) = self.ax.get_xlim()
+        (ymin, ymax) = self.ax.get_ylim()
+        limits = (xmin, xmax, ymin, ymax)
+        if limits == self.bulk_limits:
+            return
+        self.remove_bulk_artists()
+        self.bulk_limits = limits
+
+        longitudes, latitudes, counts, labels = self.get_clusters(limits)
+        # The larger the cluster, the larger (and redder) its point.
+        sizes = 12*(1 + numpy.log10(counts))
+        self.bulk_collection = self.ax.scatter(longitudes, latitudes, s=sizes, c=numpy.log10(counts), cmap="autumn_r", vmin=0, vmax=4, edgecolors="black", linewidths=0.5, transform=cartopy.crs.PlateCarree(), animated=True, zorder=3)
+        # Only label the largest clusters.
+        for i in numpy.argsort(-counts, kind="stable")[:MAXIMUM_LABELS]:
+            self.bulk_labels.append(self.ax.annotate(labels[i], xy=(longitudes[i], latitudes[i]), xytext=(0, 2.5), textcoords="offset points", color="white", size="small", weight="bold", animated=True))
+        return
+
+    def remove_bulk_artists(self):
+        """ Remove the artists representing the QSOs plotted with plot_log from the map. """
+        if self.bulk_collection is not None:
+            self.bulk_collection.remove()
+        for label in self.bulk_labels:
+            label.remove()
+        self.bulk_collection = None
+        self.bulk_labels = []
+        self.bulk_limits = None
+        return
+
+    def on_geocoded(self, callsign, coordinates):
+        """ Add a point to the map once the coordinates of a QSO's location have been found.
+
+        :arg str callsign: The callsign to use as the point's name.
+        :arg tuple coordinates: The latitude-longitude coordinates of the QSO's location.
+        :returns: Always returns False so that this is only called once by the GObject idle event.
+        :rtype: bool
+        """
+        latitude, longitude = coordinates
+        logging.debug("QTH coordinates found: (%s, %s)", str(latitude), str(longitude))
+        self.add_point(callsign, latitude, longitude)
+        return False
+
+    def invalidate(self, *args):
+        """ Discard the cached array of worked grid squares, so that it is re-computed the next time it is needed. """
+        self.worked_grid_squares = None
+        return
+
+    def monitor(self, logs):
+        """ Keep the cached array of worked grid squares up-to-date whenever the records in any of the given logs change, and stop listening to any other logs.
+
+        :arg list logs: The logs to monitor.
+        """
+        for (log, handler_ids) in self.handlers:
+            if(log not in logs):
+                for handler_id in handler_ids:
+                    log.disconnect(handler_id)
+        self.handlers = [(log, handler_ids) for (log, handler_ids) in self.handlers if log in logs]
+        monitored = [log for (log, handler_ids) in self.handlers]
+
+        for log in logs:
+            if(log not in monitored):
+                handler_ids = [log.connect("record-added", self.on_record_added),
+                               log.connect("record-edited", self.on_record_edited),
+                               log.connect("record-deleted", self.invalidate),
+                               log.connect("records-changed", self.invalidate)]
+                self.handlers.append((log, handler_ids))
+        return
+
+    def on_record_added(self, log, record):
+        """ Mark the grid square of a new record as worked in the cached array (if there is one). """
+        if self.worked_grid_squares is not None and record.get("GRIDSQUARE"):
+            field_longitude, field_latitude, valid = self.maidenhead.get_field_indices([record["GRIDSQUARE"]])
+            self.worked_grid_squares[field_latitude[valid], field_longitude[valid]] = True
+        return
+
+    def on_record_edited(self, log, old_record, new_record):
+        """ Invalidate the cached array of worked grid squares if the GRIDSQUARE field of a record has changed. A grid square might no longer be worked, so the array is re-computed. """
+        if old_record.get("GRIDSQUARE") != new_record.get("GRIDSQUARE"):
+            self.invalidate()
+        return
 
     def get_worked_grid_squares(self, logbook):
-        """ Get the array of worked grid squares.
+        """ Get the array of worked grid squares. This is only computed from the logs when the cached array is out-of-date.
 
         :arg logbook: The logbook containing logs which in turn contain QSOs.
         :returns: A two-dimensional array of boolean values showing which grid squares have been worked.
         :rtype: numpy.array
         """
 
+        self.monitor(logbook.logs)
+        key = (id(logbook.connection), tuple([log.name for log in logbook.logs]))
+        if self.worked_grid_squares is not None and key == self.worked_grid_squares_key:
+            return self.worked_grid_squares
+
+        logging.debug("Determining the worked grid squares...")
         worked_grid_squares = numpy.zeros((len(self.maidenhead.upper), len(self.maidenhead.upper)), dtype=bool)
+        complete = True
 
         for log in logbook.logs:
             try:
-                records = log.records
-                for r in records:
-                    if r["GRIDSQUARE"]:
-                        grid_square = r["GRIDSQUARE"][0:2].upper()  # Only consider the field value (e.g. IO).
-                        worked_grid_squares[self.maidenhead.upper.index(grid_square[1]), self.maidenhead.upper.index(grid_square[0])] = True
+                grid_squares = log.get_field_values("GRIDSQUARE")
+                if grid_squares:
+                    # Only consider the field value (e.g. IO).
+                    field_longitude, field_latitude, valid = self.maidenhead.get_field_indices(grid_squares)
+                    worked_grid_squares[field_latitude[valid], field_longitude[valid]] = True
 
             except sqlite.Error as e:
                 logging.error("Could not update the array of worked grid squares for log '%s' because of a database error." % log.name)
                 logging.exception(e)
+                complete = False
 
+        if complete:
+            self.worked_grid_squares = worked_grid_squares
+            self.worked_grid_squares_key = key
         return worked_grid_squares
 
     def draw(self):
-        """ Draw the world map and the grey line on top of it.
+        """ Draw the world map and the grey line on top of it. The axes and the basemap are only set up the first time the map is drawn (or when the size of the map has changed); otherwise only the dynamic layer is re-drawn.
 
         :returns: Always returns True to satisfy the GObject timer, unless the necessary WorldMap dependencies are not satisfied (in which case, the method returns False so as to not re-draw the canvas).
         :rtype: bool
@@ -274,81 +642,272 @@ class WorldMap:
                 # Don't re-draw if the world map is not visible.
                 return True  # We need to return True in case this is method was called by a timer event.
             else:
-                # Set up the world map.
                 logging.debug("Drawing the world map...")
-                self.fig.clf()
-                ax = self.fig.add_subplot(111, projection=cartopy.crs.PlateCarree())
-                ax.set_extent([-180, 180, -90, 90])
-                ax.set_aspect("auto")
-
-                gl = ax.gridlines(draw_labels=True)
-                gl.top_labels = False
-                gl.right_labels = False
-                gl.xformatter = cartopy.mpl.gridliner.LONGITUDE_FORMATTER
-                gl.yformatter = cartopy.mpl.gridliner.LATITUDE_FORMATTER
-                ax.add_feature(cartopy.feature.LAND, facecolor="olivedrab")
-                ax.add_feature(cartopy.feature.OCEAN, facecolor="cornflowerblue")
-                ax.add_feature(cartopy.feature.COASTLINE)
-                ax.add_feature(cartopy.feature.BORDERS, alpha=0.4)
-
-                # Draw the grey line. This is based on the code from the Cartopy Aurora Forecast example (http://scitools.org.uk/cartopy/docs/latest/gallery/aurora_forecast.html) and used under the Open Government Licence (http://scitools.org.uk/cartopy/docs/v0.15/copyright.html).
-                logging.debug("Drawing the grey line...")
-                dt = datetime.now(timezone.utc)
-                axial_tilt = 23.5
-                reference_solstice = datetime(2016, 6, 21, 22, 22, tzinfo=timezone.utc)
-                days_per_year = 365.2425
-                seconds_per_day = 86400.0
-
-                days_since_reference = (dt - reference_solstice).total_seconds()/seconds_per_day
-                latitude = axial_tilt*numpy.cos(2*numpy.pi*days_since_reference/days_per_year)
-                seconds_since_midnight = (dt - datetime(dt.year, dt.month, dt.day, tzinfo=timezone.utc)).seconds
-                longitude = -(seconds_since_midnight/seconds_per_day - 0.5)*360
-
-                pole_longitude = longitude
-                if latitude > 0:
-                    pole_latitude = -90 + latitude
-                    central_rotated_longitude = 180
+                if self.ax is None or self.get_basemap_key() != self.basemap_key:
+                    # A full draw is needed. The dynamic layer is drawn by the draw event handler once the rest of the figure has been drawn.
+                    self.setup_axes()
+                    self.update_dynamic_artists()
+                    self.canvas.draw()
                 else:
-                    pole_latitude = 90 + latitude
-                    central_rotated_longitude = 0
-
-                rotated_pole = cartopy.crs.RotatedPole(pole_latitude=pole_latitude, pole_longitude=pole_longitude, central_rotated_longitude=central_rotated_longitude)
-
-                x = numpy.empty(360)
-                y = numpy.empty(360)
-                x[:180] = -90
-                y[:180] = numpy.arange(-90, 90.)
-                x[180:] = 90
-                y[180:] = numpy.arange(90, -90., -1)
-
-                ax.fill(x, y, transform=rotated_pole, color="black", alpha=0.5)
-
-                # Plot points on the map.
-                if self.points:
-                    logging.debug("Plotting QTHs on the map...")
-                    for p in self.points:
-                        ax.plot(p.longitude, p.latitude, p.style, transform=cartopy.crs.PlateCarree())
-                        projected_x, projected_y = ax.projection.transform_point(p.longitude, p.latitude, src_crs=cartopy.crs.PlateCarree())
-                        ax.annotate(p.name, xy=(projected_x, projected_y), xytext=(0, 2.5), textcoords="offset points", color="white", size="small", weight="bold")
-
-                # Draw Maidenhead grid squares and shade in the worked squares.
-                x = numpy.linspace(-180, 180, len(list(self.maidenhead.upper))+1)
-                y = numpy.linspace(-90, 90, len(list(self.maidenhead.upper))+1)
-                if self.show_grid_squares:
-                    if self.shade_worked_grid_squares:
-                        worked_grid_squares = self.get_worked_grid_squares(self.application.logbook)
-                        masked = numpy.ma.masked_array(worked_grid_squares, worked_grid_squares == 0)
+                    self.update_dynamic_artists()
+                    if self.background is None:
+                        # The figure has not been fully drawn yet.
+                        self.canvas.draw_idle()
                     else:
-                        z = numpy.zeros((len(self.maidenhead.upper), len(self.maidenhead.upper)), dtype=bool)
-                        masked = numpy.ma.masked_array(z, z == 0)
-                    ax.pcolormesh(x, y, masked, transform=cartopy.crs.PlateCarree(), cmap="Reds", vmin=0, vmax=1, edgecolors="k", linewidth=1.5, alpha=0.4)
-
-                    # Grid square labels.
-                    for i in range(len(self.maidenhead.upper)):
-                        for j in range(len(self.maidenhead.upper)):
-                            text = self.maidenhead.upper[i]+self.maidenhead.upper[j]
-                            ax.text((x[i]+x[i+1])/2.0, (y[j]+y[j+1])/2.0, text, ha="center", va="center", size="small", color="w", family="monospace", alpha=0.4)
-
+                        self.canvas.restore_region(self.background)
+                        self.draw_dynamic_artists()
+                        self.canvas.blit(self.fig.bbox)
                 return True
         else:
             return False  # Don't try to re-draw the canvas if the necessary modules to do so could not be imported.
+
+    def setup_axes(self):
+        """ Set up the map's axes, draw the basemap in them, and create the artists in the dynamic layer. """
+
+        self.fig.clf()
+        ax = self.fig.add_subplot(111, projection=cartopy.crs.PlateCarree())
+        ax.set_extent([-180, 180, -90, 90])
+        ax.set_aspect("auto")
+
+        gl = ax.gridlines(draw_labels=True)
+        gl.top_labels = False
+        gl.right_labels = False
+        gl.xformatter = cartopy.mpl.gridliner.LONGITUDE_FORMATTER
+        gl.yformatter = cartopy.mpl.gridliner.LATITUDE_FORMATTER
+
+        self.ax = ax
+        self.basemap_key = self.get_basemap_key()
+        self.basemap_image = ax.imshow(self.get_basemap(*self.basemap_key), origin="upper", extent=[-180, 180, -90, 90], transform=cartopy.crs.PlateCarree(), interpolation="nearest", aspect="auto", zorder=0)
+        self.zoomed = False
+        self.vector_artists = []
+
+        # The dynamic layer. Animated artists are left out of a full draw of the figure.
+        self.grey_line = None
+        n = len(self.maidenhead.upper)
+        self.worked_grid_squares_mesh = ax.pcolormesh(numpy.linspace(-180, 180, n+1), numpy.linspace(-90, 90, n+1), numpy.ma.masked_all((n, n)), transform=cartopy.crs.PlateCarree(), cmap="Reds", vmin=0, vmax=1, alpha=0.4, animated=True)
+        self.point_artists = []
+        for p in self.points:
+            self.point_artists.extend(self.plot_point(p))
+        # The old artists were removed along with the old axes.
+        self.bulk_collection = None
+        self.bulk_labels = []
+        self.bulk_limits = None
+        self.background = None
+        return
+
+    def get_basemap_key(self):
+        """ Return the key which identifies the basemap that fits the map's axes.
+
+        :returns: The width and height of the axes in pixels, the resolution of the figure in dots per inch, and whether the Maidenhead grid squares are shown.
+        :rtype: tuple
+        """
+        if self.ax is None:
+            return None
+        self.ax.apply_aspect()  # Determine the size that the axes will be drawn at.
+        return (int(round(self.ax.bbox.width)), int(round(self.ax.bbox.height)), int(round(self.fig.dpi)), self.show_grid_squares)
+
+    def get_basemap(self, width, height, dpi, show_grid_squares):
+        """ Return the static layer of the map (the land, oceans, coastlines, borders and, optionally, the Maidenhead grid squares) rendered as an image.
+        The image is rendered only once for each size and resolution, and is then cached on disk.
+
+        :arg int width: The width of the image in pixels.
+        :arg int height: The height of the image in pixels.
+        :arg int dpi: The resolution of the image in dots per inch.
+        :arg bool show_grid_squares: Whether to draw the Maidenhead grid squares and their labels.
+        :returns: The image, as an array of RGBA values.
+        :rtype: numpy.ndarray
+        """
+        path = os.path.join(BASEMAP_CACHE_DIRECTORY, "basemap-%dx%d-%d%s.png" % (width, height, dpi, "-grid" if show_grid_squares else ""))
+        try:
+            image = matplotlib.image.imread(path)
+            os.utime(path)  # Mark the basemap as recently-used.
+            logging.debug("Using the cached basemap %s." % path)
+            return image
+        except (OSError, ValueError, SyntaxError):
+            pass
+
+        logging.debug("Rendering the basemap...")
+        fig = matplotlib.figure.Figure(figsize=(max(width, 1)/dpi, max(height, 1)/dpi), dpi=dpi)
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_axes([0, 0, 1, 1], projection=cartopy.crs.PlateCarree())
+        ax.set_extent([-180, 180, -90, 90])
+        ax.set_aspect("auto")
+        ax.set_axis_off()
+        self.draw_static_layer(ax, show_grid_squares)
+
+        canvas.draw()
+        image = numpy.array(canvas.buffer_rgba())
+
+        try:
+            os.makedirs(BASEMAP_CACHE_DIRECTORY, exist_ok=True)
+            matplotlib.image.imsave(path, image)
+            # Only keep the most recently-used basemaps.
+            paths = [os.path.join(BASEMAP_CACHE_DIRECTORY, f) for f in os.listdir(BASEMAP_CACHE_DIRECTORY) if f.startswith("basemap-") and f.endswith(".png")]
+            paths.sort(key=os.path.getmtime, reverse=True)
+            for old_path in paths[MAXIMUM_CACHED_BASEMAPS:]:
+                os.remove(old_path)
+        except OSError as e:
+            logging.warning("Could not cache the basemap in %s." % BASEMAP_CACHE_DIRECTORY)
+            logging.exception(e)
+
+        return image
+
+    def draw_static_layer(self, ax, show_grid_squares):
+        """ Draw the static layer of the map (the land, oceans, coastlines, borders and, optionally, the Maidenhead grid squares) from the vector features.
+
+        :arg ax: The axes to draw in.
+        :arg bool show_grid_squares: Whether to draw the Maidenhead grid squares and their labels.
+        :returns: The artists representing the static layer.
+        :rtype: list
+        """
+        artists = [ax.add_feature(cartopy.feature.LAND, facecolor="olivedrab", zorder=0),
+                   ax.add_feature(cartopy.feature.OCEAN, facecolor="cornflowerblue", zorder=0),
+                   ax.add_feature(cartopy.feature.COASTLINE, zorder=0),
+                   ax.add_feature(cartopy.feature.BORDERS, alpha=0.4, zorder=0)]
+
+        if show_grid_squares:
+            # Draw the Maidenhead grid squares and their labels.
+            x = numpy.linspace(-180, 180, len(self.maidenhead.upper)+1)
+            y = numpy.linspace(-90, 90, len(self.maidenhead.upper)+1)
+            artists.append(ax.vlines(x, -90, 90, colors="k", linewidth=1.5, alpha=0.4, transform=cartopy.crs.PlateCarree()))
+            artists.append(ax.hlines(y, -180, 180, colors="k", linewidth=1.5, alpha=0.4, transform=cartopy.crs.PlateCarree()))
+            for i in range(len(self.maidenhead.upper)):
+                for j in range(len(self.maidenhead.upper)):
+                    text = self.maidenhead.upper[i]+self.maidenhead.upper[j]
+                    artists.append(ax.text((x[i]+x[i+1])/2.0, (y[j]+y[j+1])/2.0, text, ha="center", va="center", size="small", color="w", family="monospace", alpha=0.4, clip_on=True))
+        return artists
+
+    def is_zoomed(self):
+        """ Determine whether the view of the map has been changed (e.g. zoomed in or panned with the navigation toolbar) so that it no longer shows exactly the whole world.
+
+        :returns: True if the view does not match the extent of the basemap.
+        :rtype: bool
+        """
+        if self.ax is None:
+            return False
+        return not numpy.allclose(list(self.ax.get_xlim()) + list(self.ax.get_ylim()), [-180, 180, -90, 90])
+
+    def set_zoomed(self, zoomed):
+        """ Draw the static layer from the vector features while the view has been changed, since the raster basemap would be magnified (or shifted) along with the view. Otherwise show the raster basemap.
+
+        :arg bool zoomed: True if the view no longer shows exactly the whole world (see is_zoomed).
+        """
+        self.zoomed = zoomed
+        self.basemap_image.set_visible(not zoomed)
+        if zoomed and not self.vector_artists:
+            self.vector_artists = self.draw_static_layer(self.ax, self.show_grid_squares)
+        elif not zoomed:
+            for artist in self.vector_artists:
+                artist.remove()
+            self.vector_artists = []
+        return
+
+    def plot_point(self, p):
+        """ Plot a point (and its name) in the dynamic layer of the map.
+
+        :arg Point p: The point to plot.
+        :returns: The artists representing the point.
+        :rtype: list
+        """
+        ax = self.ax
+        artists = ax.plot(p.longitude, p.latitude, p.style, transform=cartopy.crs.PlateCarree(), animated=True)
+        projected_x, projected_y = ax.projection.transform_point(p.longitude, p.latitude, src_crs=cartopy.crs.PlateCarree())
+        artists.append(ax.annotate(p.name, xy=(projected_x, projected_y), xytext=(0, 2.5), textcoords="offset points", color="white", size="small", weight="bold", animated=True))
+        return artists
+
+    def update_dynamic_artists(self):
+        """ Update the grey line and the shading of the worked grid squares. """
+
+        if self.ax is None:
+            return
+
+        # Draw the grey line. This is based on the code from the Cartopy Aurora Forecast example (http://scitools.org.uk/cartopy/docs/latest/gallery/aurora_forecast.html) and used under the Open Government Licence (http://scitools.org.uk/cartopy/docs/v0.15/copyright.html).
+        logging.debug("Drawing the grey line...")
+        dt = datetime.now(timezone.utc)
+        axial_tilt = 23.5
+        reference_solstice = datetime(2016, 6, 21, 22, 22, tzinfo=timezone.utc)
+        days_per_year = 365.2425
+        seconds_per_day = 86400.0
+
+        days_since_reference = (dt - reference_solstice).total_seconds()/seconds_per_day
+        latitude = axial_tilt*numpy.cos(2*numpy.pi*days_since_reference/days_per_year)
+        seconds_since_midnight = (dt - datetime(dt.year, dt.month, dt.day, tzinfo=timezone.utc)).seconds
+        longitude = -(seconds_since_midnight/seconds_per_day - 0.5)*360
+
+        pole_longitude = longitude
+        if latitude > 0:
+            pole_latitude = -90 + latitude
+            central_rotated_longitude = 180
+        else:
+            pole_latitude = 90 + latitude
+            central_rotated_longitude = 0
+
+        rotated_pole = cartopy.crs.RotatedPole(pole_latitude=pole_latitude, pole_longitude=pole_longitude, central_rotated_longitude=central_rotated_longitude)
+
+        x = numpy.empty(360)
+        y = numpy.empty(360)
+        x[:180] = -90
+        y[:180] = numpy.arange(-90, 90.)
+        x[180:] = 90
+        y[180:] = numpy.arange(90, -90., -1)
+
+        if self.grey_line is not None:
+            self.grey_line.remove()
+        self.grey_line = self.ax.fill(x, y, transform=rotated_pole, color="black", alpha=0.5, animated=True)[0]
+
+        # Shade in the worked grid squares.
+        if self.show_grid_squares and self.shade_worked_grid_squares:
+            worked_grid_squares = self.get_worked_grid_squares(self.application.logbook)
+            self.worked_grid_squares_mesh.set_array(numpy.ma.masked_array(worked_grid_squares, worked_grid_squares == 0))
+            self.worked_grid_squares_mesh.set_visible(True)
+        else:
+            self.worked_grid_squares_mesh.set_visible(False)
+
+        self.update_bulk_artists()
+        return
+
+    def draw_dynamic_artists(self):
+        """ Draw the artists in the dynamic layer on top of whatever has already been drawn on the canvas. """
+        for artist in [self.grey_line, self.worked_grid_squares_mesh, self.bulk_collection] + self.bulk_labels + self.point_artists:
+            if artist is not None:
+                self.ax.draw_artist(artist)
+        return
+
+    def on_draw_event(self, event):
+        """ Save a copy of the rendered figure without the dynamic layer, and then draw the dynamic layer on top of it. This is called after every full draw of the figure
+        (including those due to resizing the map or using the navigation toolbar), since animated artists are left out of full draws.
+
+        :arg event: The Matplotlib draw event.
+        """
+        if self.ax is None:
+            return
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.update_bulk_artists()  # The view might have been zoomed or panned with the navigation toolbar.
+        self.draw_dynamic_artists()
+        if self.get_basemap_key() != self.basemap_key:
+            # The size of the map has changed, so a basemap of the new size is needed.
+            GObject.idle_add(self.on_resize)
+        elif self.is_zoomed() != self.zoomed:
+            # The view has been zoomed or panned, so the static layer is drawn differently.
+            GObject.idle_add(self.on_zoom)
+        return
+
+    def on_zoom(self):
+        """ Switch between the raster basemap and the vector features after the view of the map has been changed, and draw the map again.
+
+        :returns: Always returns False so that this is only called once by the GObject idle event.
+        :rtype: bool
+        """
+        if self.ax is not None and self.is_zoomed() != self.zoomed:
+            self.set_zoomed(not self.zoomed)
+            self.canvas.draw_idle()
+        return False
+
+    def on_resize(self):
+        """ Set up the axes again (with a basemap of the right size) after the size of the map has changed.
+
+        :returns: Always returns False so that this is only called once by the GObject idle event.
+        :rtype: bool
+        """
+        self.draw()
+        return False
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2013-2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compares the speed (and peak memory use) of writing and reading a large log in the ADI and ADX versions of ADIF (each with and without gzip compression).
+# Run from the base directory of PyQSO with: PYTHONPATH=. python3 tests/benchmark_adif.py [number of records]
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from pyqso.adif import ADIF
+from pyqso.preferences import Preferences
+
+
+def get_records(n):
+    """ Generate some realistic-looking records. """
+    bands = [("20m", "14.070", "PSK31"), ("40m", "7.025", "CW"), ("2m", "145.500", "FM")]
+    for i in range(n):
+        (band, freq, mode) = bands[i % len(bands)]
+        yield {"CALL": "TEST%d" % i, "QSO_DATE": "2013%02d%02d" % (i % 12 + 1, i % 28 + 1), "TIME_ON": "%02d%02d" % (i % 24, i % 60),
+               "FREQ": freq, "BAND": band, "MODE": mode, "RST_SENT": "59", "RST_RCVD": "57", "NAME": "Operator %d" % i,
+               "NOTES": "QSO number %d <& notes>" % i, "GRIDSQUARE": "IO91wm"}
+
+
+def measure(function):
+    """ Return the time taken to call a function. """
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def measure_memory(function):
+    """ Return the peak memory allocated while a function ran (in MB). Tracing the memory allocations slows things down, so this is measured separately from the time taken. """
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]/(1024.0*1024.0)
+    tracemalloc.stop()
+    return peak
+
+
+def consume(records):
+    """ Iterate over the records without keeping any of them. """
+    n = 0
+    for record in records:
+        n += 1
+    return n
+
+
+if(__name__ == '__main__'):
+    parser = argparse.ArgumentParser(description="Benchmark reading and writing ADI and ADX files.")
+    parser.add_argument("n", nargs="?", type=int, default=100000, help="The number of records.")
+    args = parser.parse_args()
+
+    # Use the default preferences, rather than the user's.
+    directory = tempfile.mkdtemp()
+    adif = ADIF(preferences=Preferences(os.path.join(directory, "preferences.ini")))
+    try:
+        print("%-12s %10s %14s %10s %14s %16s" % ("Format", "Write (s)", "Write (QSO/s)", "Read (s)", "Read (QSO/s)", "Read peak (MB)"))
+        for name in ["log.adi", "log.adx", "log.adi.gz", "log.adx.gz"]:
+            path = os.path.join(directory, name)
+            write_time = measure(lambda: adif.write(get_records(args.n), path))
+            read_time = measure(lambda: consume(adif.iter_read(path)))
+            read_peak = measure_memory(lambda: consume(adif.iter_read(path)))
+            print("%-12s %10.2f %14d %10.2f %14d %16.1f" % (name, write_time, args.n/write_time, read_time, args.n/read_time, read_peak))
+    finally:
+        shutil.rmtree(directory)
@@ -19,6 +19,10 @@
 
 import unittest
 import os
+import io
+import gzip
+import shutil
+import tempfile
 from pyqso.adif import *
 
 
@@ -96,6 +100,26 @@ class TestADIF(unittest.TestCase):
         assert(len(list(records[0].keys())) == len(list(expected_records[0].keys())))
         assert(records == expected_records)
 
+    def test_iter_read(self):
+        """ Check that the records in an ADIF file can be read one at a time. """
+        path = os.path.join(os.path.realpath(os.path.dirname(__file__)), "res", "ADIF.test_read_multiple.adi")
+        records = self.adif.iter_read(path)
+        assert(not isinstance(records, list))
+        first = next(records)
+        assert(first == {'TIME_ON': '1955', 'BAND': '40m', 'CALL': 'TEST', 'MODE': 'CW', 'QSO_DATE': '20130322'})
+        assert(len(list(records)) == 2)
+
+    def test_parse_adi_stream(self):
+        """ Check that the data lengths are honoured when parsing, and that data specifiers split across chunk boundaries are handled correctly. """
+        text = """Header text with a stray < character.<adif_ver:5>3.0.4<eoh>
+<call:6>TEST12<notes:12>Worked <5 W.<qso_date:8>20130322<eor>
+<call:5>HELLO<time_on:4>0832<eor>
+<call:4>LOST"""
+        for chunk_size in [1, 3, 7, 65536]:
+            records = list(self.adif.parse_adi_stream(io.StringIO(text), chunk_size=chunk_size))
+            print("Imported records: ", records)
+            assert(records == [{"CALL": "TEST12", "NOTES": "Worked <5 W.", "QSO_DATE": "20130322"}, {"CALL": "HELLO", "TIME_ON": "0832"}])
+
     def test_write(self):
         """ Check that records can be written to an ADIF file correctly. """
         records = [{"CALL": "TEST123", "QSO_DATE": "20120402", "TIME_ON": "1234", "FREQ": "145.500", "BAND": "2m", "MODE": "FM", "RST_SENT": "59", "RST_RCVD": "59"},
@@ -173,6 +197,61 @@ class TestADIF(unittest.TestCase):
 
         self.connection.close()
 
+    def test_write_stream(self):
+        """ Check that records can be streamed from a generator into an ADIF file (with the number of records filled in afterwards), and into a compressed ADIF file. """
+        records = [{"CALL": "TEST123", "QSO_DATE": "20120402", "NOTES": "", "NOT_A_FIELD": "?"}, {"call": "TEST456", "mode": "FM"}]
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "ADIF.test_write_stream.adi")
+            assert(self.adif.write((record for record in records), path) == 2)
+            with open(path) as f:
+                text = f.read()
+            assert(text.startswith("Amateur radio log file. Generated on ") and text.splitlines()[0].rstrip().endswith(" Contains 2 record(s)."))
+            assert(text.endswith("<eoh>\n<call:7>TEST123\n<qso_date:8>20120402\n<eor>\n<call:7>TEST456\n<mode:2>FM\n<eor>\n"))
+
+            path = os.path.join(directory, "ADIF.test_write_stream.adi.gz")
+            assert(self.adif.write(iter(records), path) == 2)
+            with gzip.open(path, "rt") as f:
+                assert("Contains" not in f.readline())
+            assert(list(self.adif.iter_read(path)) == [{"CALL": "TEST123", "QSO_DATE": "20120402"}, {"CALL": "TEST456", "MODE": "FM"}])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_read_adx(self):
+        """ Check that records can be read from an ADX file, ignoring the header, the user-defined and application-defined fields, and any fields with invalid data. """
+        path = os.path.join(os.path.realpath(os.path.dirname(__file__)), "res", "ADIF.test_read.adx")
+        records = self.adif.read(path)
+        assert(records == [{"CALL": "TEST", "BAND": "40m", "MODE": "CW", "QSO_DATE": "20130322", "TIME_ON": "1955", "NOTES": "Worked <5 W & 73.\nLine two."},
+                           {"CALL": "TEST2ABC", "FREQ": "14.250"}])
+
+    def test_write_adx(self):
+        """ Check that records written to an ADX file (compressed or not) are escaped correctly, and can be read back in. """
+        records = [{"CALL": "TEST123", "QSO_DATE": "20120402", "NOTES": "<5 W & \"73\"", "NOT_A_FIELD": "?"}, {"call": "TEST456", "mode": "FM"}]
+        directory = tempfile.mkdtemp()
+        try:
+            for name in ["ADIF.test_write.adx", "ADIF.test_write.adx.gz"]:
+                path = os.path.join(directory, name)
+                assert(self.adif.write(iter(records), path) == 2)
+                with open_file(path) as f:
+                    text = f.read()
+                assert(text.startswith('<?xml version="1.0" encoding="UTF-8"?>\n<ADX>\n<HEADER>\n<ADIF_VER>3.0.4</ADIF_VER>\n'))
+                assert(text.endswith("""<RECORDS>
+<RECORD>
+<CALL>TEST123</CALL>
+<QSO_DATE>20120402</QSO_DATE>
+<NOTES>&lt;5 W &amp; "73"</NOTES>
+</RECORD>
+<RECORD>
+<CALL>TEST456</CALL>
+<MODE>FM</MODE>
+</RECORD>
+</RECORDS>
+</ADX>
+"""))
+                assert(self.adif.read(path) == [{"CALL": "TEST123", "QSO_DATE": "20120402", "NOTES": "<5 W & \"73\""}, {"CALL": "TEST456", "MODE": "FM"}])
+        finally:
+            shutil.rmtree(directory)
+
     def test_is_valid(self):
         """ Check that ADIF field validation is working correctly for different data types. """
 
@@ -196,5 +275,15 @@ class TestADIF(unittest.TestCase):
         assert(self.adif.is_valid("MODE", "FM", "E"))
         assert(self.adif.is_valid("SUBMODE", "LSB", "E"))
 
+    def test_validate_record(self):
+        """ Check that the error masks of records have the bits of the invalid fields set, and that empty and non-standard fields are ignored. """
+        records = [{"CALL": "TEST123", "QSO_DATE": "20120402", "TIME_ON": "1230", "FREQ": "145.550", "BAND": "2m", "MODE": "FM", "SUBMODE": "", "MY_FIELD": "\n"},
+                   {"CALL": "TEST\n123", "QSO_DATE": "20130229", "TIME_ON": "2500", "FREQ": "145.5.50", "BAND": "2M", "MODE": "FM", "SUBMODE": "LSB", "DXCC": "A"}]
+        masks = validate_many(records)
+        assert(masks[0] == 0)
+        assert(masks[1] == FIELD_BITS["CALL"] | FIELD_BITS["QSO_DATE"] | FIELD_BITS["TIME_ON"] | FIELD_BITS["FREQ"] | FIELD_BITS["BAND"] | FIELD_BITS["DXCC"])
+        assert(get_invalid_field_names(masks[1]) == ["CALL", "QSO_DATE", "TIME_ON", "FREQ", "BAND", "DXCC"])
+        assert(get_invalid_field_names(validate_record({"MODE": "SSB", "SUBMODE": "FM", "NOTES": "TEST123\nHELLO_WORLD"})) == ["SUBMODE"])
+
 if(__name__ == '__main__'):
     unittest.main()
@@ -18,6 +18,7 @@
 #    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import queue
 import unittest
 try:
     import unittest.mock as mock
@@ -25,6 +26,8 @@ except ImportError:
     import mock
 from pyqso.awards import *
 from pyqso.logbook import Logbook
+from pyqso.log import *
+from pyqso.task_runner import TaskRunner
 
 
 class TestAwards(unittest.TestCase):
@@ -36,8 +39,8 @@ class TestAwards(unittest.TestCase):
         PyQSO = mock.MagicMock()
         self.awards = Awards(application=PyQSO())
         self.logbook = Logbook(application=PyQSO())
-        path_to_test_database = os.path.join(os.path.realpath(os.path.dirname(__file__)), "res", "test.db")
-        success = self.logbook.db_connect(path_to_test_database)
+        self.path = os.path.join(os.path.realpath(os.path.dirname(__file__)), "res", "test.db")
+        success = self.logbook.db_connect(self.path)
         assert(success)
         self.logbook.logs = self.logbook.get_logs()
         assert(self.logbook.logs is not None)
@@ -50,5 +53,67 @@ class TestAwards(unittest.TestCase):
         assert(sum(count[2]) == 1)  # Other modes
         assert(sum(count[3]) == 5)  # Mixed
 
+    def test_count_in_background(self):
+        """ Check that the QSOs can be counted in a worker thread, and that they are counted again if a record changes in the meantime. """
+        dispatched = queue.Queue()
+        self.logbook.runner = TaskRunner(self.path, dispatch=lambda function, *args: dispatched.put((function, args)))
+        self.addCleanup(self.logbook.runner.close)
+        self.awards.count_in_background(self.logbook)
+        assert(self.awards.counting is not None)
+
+        # The record is only added to the counts, not the logbook, so it should not survive the recount.
+        self.awards.on_record_added(self.logbook.logs[0], {"CALL": "TEST", "BAND": "20m", "MODE": "CW"})
+        assert(self.awards.recount)
+        while(self.awards.counting is not None):
+            (function, args) = dispatched.get(timeout=10)
+            function(*args)
+        assert(not self.awards.recount)
+        assert([sum(qsos) for qsos in self.awards.qsos] == [3, 1, 1, 5])
+
+    def test_incremental_count(self):
+        """ Check that the QSO and DXCC entity counts are kept up-to-date when records are added, edited and deleted. """
+        connection = sqlite.connect(":memory:")
+        connection.row_factory = sqlite.Row
+        c = connection.cursor()
+        c.execute("CREATE TABLE test (id INTEGER PRIMARY KEY AUTOINCREMENT, %s)" % ", ".join(["%s TEXT" % field_name.lower() for field_name in AVAILABLE_FIELD_NAMES_ORDERED]))
+        log = Log(connection, "test")
+        log.populate()
+        logbook = mock.MagicMock(logs=[log], connection=connection)
+        self.awards.application.logbook = logbook
+
+        log.add_record([{"CALL": "TEST1", "BAND": "20m", "MODE": "SSB", "DXCC": "223"},
+                        {"CALL": "TEST2", "BAND": "20m", "MODE": "SSB", "DXCC": "223"}])
+        count = self.awards.count(logbook)
+        assert(count[0][self.awards.bands.index("20m")] == 2)
+
+        # The new records should be counted without needing to call the count method.
+        log.add_record({"CALL": "TEST3", "BAND": "20m", "MODE": "CW", "COUNTRY": "Wales"})
+        band = self.awards.bands.index("20m")
+        assert(self.awards.qsos[1][band] == 1)
+        assert(self.awards.qsos[3][band] == 3)
+        assert(self.awards.entities[3][band] == {223: 2})  # The QSO with only a country name does not count as another entity.
+
+        # The same DXCC entity code should only be counted once, however it is written.
+        log.add_record({"CALL": "TEST4", "BAND": "20m", "MODE": "CW", "DXCC": "0223", "COUNTRY": "England"})
+        assert(self.awards.entities[3][band] == {223: 3})
+        assert(self.awards.count(logbook) == self.awards.qsos and self.awards.entities[3][band] == {223: 3})
+        log.delete_record(4)
+
+        log.edit_record(3, "BAND", "40m")
+        assert(self.awards.qsos[1][band] == 0)
+        assert(self.awards.qsos[1][self.awards.bands.index("40m")] == 1)
+
+        log.delete_record(1)
+        assert(self.awards.qsos[0][band] == 1)
+        assert(len(self.awards.entities[0][band]) == 1)
+        log.delete_record(2)
+        assert(len(self.awards.entities[0][band]) == 0)
+
+        # A full recount should give the same result.
+        assert(self.awards.count(logbook) == self.awards.qsos)
+        assert(sum(self.awards.qsos[3]) == 1)
+
+        connection.close()
+
 if(__name__ == '__main__'):
     unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+from pyqso.callsign_enrichment import *
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    """ The unit tests for the TokenBucket class. """
+
+    def test_acquire(self):
+        """ Check that a burst of requests is allowed, and that further requests are delayed until the bucket has been refilled. """
+        bucket = TokenBucket(rate=100, capacity=2)
+        start = time.monotonic()
+        bucket.acquire()
+        bucket.acquire()
+        assert(time.monotonic() - start < 0.01)
+        for i in range(3):
+            bucket.acquire()
+        assert(time.monotonic() - start >= 0.025)
+
+
+class TestCallsignEnrichment(unittest.TestCase):
+
+    """ The unit tests for the CallsignEnrichment class. """
+
+    def setUp(self):
+        """ Work on a copy of the test database, with a fake callsign lookup service. """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "test.db")
+        shutil.copy(os.path.join(os.path.realpath(os.path.dirname(__file__)), "res", "test.db"), self.path)
+        with sqlite.connect(self.path) as connection:
+            connection.execute("UPDATE test2 SET call='F/TEST123/P' WHERE id=3")
+            connection.execute("UPDATE test2 SET name='KEEP' WHERE id=1")
+
+        self.errors = {"TESTHELLO": "Not found: TESTHELLO"}
+
+        def lookup(callsign, ignore_prefix_suffix=True):
+            if(callsign in self.errors):
+                return {}, self.errors[callsign]
+            return {"NAME": callsign.lower(), "COUNTRY": "COUNTRY", "DXCC": "", "IOTA": "EU-005"}, None
+
+        self.service = mock.MagicMock(database="qrz.com", cache=None)
+        self.service.lookup.side_effect = lookup
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_enrichment(self, **kwargs):
+        return CallsignEnrichment(self.path, "test2", self.service, rate=1000, state_path=os.path.join(self.directory, "state.json"), **kwargs)
+
+    def get_records(self):
+        with sqlite.connect(self.path) as connection:
+            return connection.execute("SELECT call, name, country, dxcc, iota FROM test2 ORDER BY id").fetchall()
+
+    def test_run(self):
+        """ Check that each distinct callsign is looked up once, and that only the empty fields are filled in. """
+        progress = mock.MagicMock()
+        enrichment = self.get_enrichment()
+        assert(enrichment.run(progress=progress) == 3)
+        assert(sorted([c[0][0] for c in self.service.lookup.call_args_list]) == ["TEST123", "TEST456", "TESTHELLO"])
+        assert(self.get_records() == [("TEST123", "KEEP", "COUNTRY", "", "EU-005"),
+                                      ("TEST456", "test456", "COUNTRY", "", "EU-005"),
+                                      ("F/TEST123/P", "test123", "COUNTRY", "", "EU-005"),
+                                      ("TESTHELLO", "", "", "", "")])
+        progress.assert_called_with(3, 3, 3)
+        assert(not os.path.exists(enrichment.state_path))
+
+    def test_resume(self):
+        """ Check that callsigns which could not be looked up are tried again the next time the job is run, while the others are not. """
+        self.errors["TEST456"] = "Connection refused"
+        enrichment = self.get_enrichment(batch_size=1)
+        assert(enrichment.run() == 2)
+        assert(enrichment.load_state() == set(["TEST123", "TESTHELLO"]))
+
+        del self.errors["TEST456"]
+        self.service.lookup.reset_mock()
+        assert(enrichment.run() == 1)
+        self.service.lookup.assert_called_once_with("TEST456", ignore_prefix_suffix=False)
+        assert(self.get_records()[1][1] == "test456")
+        assert(not os.path.exists(enrichment.state_path))
+
+    def test_write_lock(self):
+        """ Check that the records are only updated while holding the write lock, so that the job waits for any other writes to the logbook to finish. """
+        write_lock = threading.Lock()
+        enrichment = self.get_enrichment(write_lock=write_lock)
+        results = []
+        with write_lock:
+            thread = threading.Thread(target=lambda: results.append(enrichment.run()))
+            thread.start()
+            thread.join(0.5)
+            assert(thread.is_alive())
+            assert(self.get_records()[1][1] == "")
+        thread.join(10)
+        assert(results == [3])
+        assert(self.get_records()[1][1] == "test456")
+
+    def test_give_up(self):
+        """ Check that the job stops if every lookup fails. """
+        with mock.patch("pyqso.callsign_enrichment.MAXIMUM_CONSECUTIVE_FAILURES", 2):
+            self.service.lookup.side_effect = lambda callsign, ignore_prefix_suffix=True: ({}, "Invalid session key")
+            enrichment = self.get_enrichment(maximum_concurrent=1)
+            assert(enrichment.run() == 0)
+        assert(enrichment.error_message == "Invalid session key")
+        assert(enrichment.load_state() == set())
+
+if(__name__ == '__main__'):
+    unittest.main()
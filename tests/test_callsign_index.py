@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from pyqso.callsign_index import *
+
+
+class TestCallsignIndex(unittest.TestCase):
+
+    """ The unit tests for the CallsignIndex class. """
+
+    def setUp(self):
+        """ Set up the index needed for the unit tests. """
+        self.index = CallsignIndex()
+        self.index.build([(1, "TEST123"), (2, "MYCALL"), (3, "test123"), (4, "M0ABC/P"), (5, None)])
+
+    def test_search(self):
+        """ Check that records are found by (case-insensitive) substrings of their callsigns. """
+        assert(self.index.search("TEST123") == set([1, 3]))
+        assert(self.index.search("est") == set([1, 3]))
+        assert(self.index.search("T") == set([1, 3]))  # Shorter than a trigram.
+        assert(self.index.search("M") == set([2, 4]))
+        assert(self.index.search("/P") == set([4]))
+        assert(self.index.search("ABC/") == set([4]))
+        assert(self.index.search("CALL1") == set())
+        assert(self.index.search("") == set([1, 2, 3, 4, 5]))
+
+    def test_add_remove_update(self):
+        """ Check that the index is kept up-to-date when records are added, removed and changed. """
+        self.index.add(6, "MYCALL")
+        assert(self.index.search("CALL") == set([2, 6]))
+
+        self.index.remove(2)
+        assert(self.index.search("CALL") == set([6]))
+        self.index.remove(6)
+        assert(self.index.search("CALL") == set())
+        assert("CAL" not in self.index.trigrams)  # No callsigns contain this trigram any more.
+        self.index.remove(6)  # Removing a record that is not in the index should do nothing.
+
+        self.index.update(1, "G0XYZ")
+        assert(self.index.search("TEST") == set([3]))
+        assert(self.index.search("0XY") == set([1]))
+        assert(self.index.matches(1, "g0x"))
+        assert(not self.index.matches(1, "TEST"))
+        assert(len(self.index) == 4)
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -18,12 +18,81 @@
 #    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
+import threading
 try:
     import unittest.mock as mock
 except ImportError:
     import mock
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
 from pyqso.callsign_lookup import *
 
+# Some of the unit tests replace the HTTP connection classes with mocks, so keep hold of the real ones in order to restore them afterwards.
+HTTPConnection = http_client.HTTPConnection
+HTTPSConnection = http_client.HTTPSConnection
+HTTPResponse = http_client.HTTPResponse
+
+
+class StubQRZServer(ThreadingMixIn, HTTPServer):
+
+    """ A local stand-in for the qrz.com XML server, which issues session keys, expires them on request, and counts the connections and lookups made. """
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), StubQRZRequestHandler)
+        self.lock = threading.Lock()
+        self.keys = 0
+        self.connections = 0
+        self.lookups = 0
+        return
+
+    @property
+    def address(self):
+        return "127.0.0.1:%d" % self.server_address[1]
+
+    def expire_session(self):
+        with self.lock:
+            self.keys += 1
+
+
+class StubQRZRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"  # Support keep-alive connections.
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        return
+
+    def do_GET(self):
+        parameters = dict([parameter.split("=", 1) for parameter in self.path.split("?", 1)[1].split(";")])
+        with self.server.lock:
+            key = "KEY%d" % self.server.keys
+            if("username" in parameters):
+                if(parameters["password"] == "world"):
+                    body = "<Session><Key>%s</Key></Session>" % key
+                else:
+                    body = "<Session><Error>Username/password incorrect</Error></Session>"
+            elif(parameters["s"] != key):
+                body = "<Session><Error>Session Timeout</Error></Session>"
+            else:
+                self.server.lookups += 1
+                body = "<Callsign><call>%s</call><fname>FIRST</fname><name>LAST</name><country>COUNTRY</country></Callsign><Session><Key>%s</Key></Session>" % (parameters["callsign"], key)
+        data = ('<?xml version="1.0" encoding="utf-8" ?>\n<QRZDatabase version="1.33" xmlns="http://xmldata.qrz.com">%s</QRZDatabase>' % body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
 
 class TestCallsignLookup(unittest.TestCase):
 
@@ -34,6 +103,12 @@ class TestCallsignLookup(unittest.TestCase):
         self.qrz = CallsignLookupQRZ(parent=None)
         self.hamqth = CallsignLookupHamQTH(parent=None)
 
+    def tearDown(self):
+        """ Restore the HTTP connection classes that are replaced with mocks in some of the unit tests. """
+        http_client.HTTPConnection = HTTPConnection
+        http_client.HTTPSConnection = HTTPSConnection
+        http_client.HTTPResponse = HTTPResponse
+
     def test_strip(self):
         """ Check that a callsign with a prefix and a suffix is stripped correctly. """
         assert strip("F/MYCALL/MM") == "MYCALL"
@@ -137,5 +212,109 @@ class TestCallsignLookup(unittest.TestCase):
         assert(fields_and_data["ITUZ"] == "ITU")
         assert(fields_and_data["IOTA"] == "IOTA")
 
+    def test_parse(self):
+        """ Check that the first occurrence of each tag of interest is found, regardless of namespaces, and that malformed documents are rejected. """
+        (found, seen) = parse(b'<a xmlns="http://example.com"><b>1</b><c><b>2</b><d/></c></a>', set(["b", "d", "e"]))
+        assert(found == {"b": "1", "d": ""})
+        assert(seen == set(["a", "b", "c", "d"]))
+        self.assertRaises(ElementTree.ParseError, parse, b"<a><b></a>", set(["b"]))
+
+
+class TestCallsignLookupServer(unittest.TestCase):
+
+    """ The unit tests for the callsign lookup functionality, using a local stub server in place of the callsign database's server. """
+
+    def setUp(self):
+        """ Start the stub server. """
+        self.server = StubQRZServer()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        """ Stop the stub server. """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        """ Check that the session key and the connection are re-used for each lookup. """
+        qrz = CallsignLookupQRZ(parent=None, server=self.server.address)
+        assert(qrz.connect("hello", "world"))
+        for callsign in ["MYCALL", "F/OTHERCALL/P"]:
+            fields_and_data = qrz.lookup(callsign)
+            assert(fields_and_data["NAME"] == "FIRST LAST")
+            assert(fields_and_data["COUNTRY"] == "COUNTRY")
+        assert(self.server.connections == 1)
+        qrz.close()
+
+    def test_session_renewal(self):
+        """ Check that an expired session is renewed automatically, and that login errors are reported. """
+        qrz = CallsignLookupQRZ(parent=None, server=self.server.address)
+        assert(qrz.connect("hello", "world"))
+        self.server.expire_session()
+        assert(qrz.lookup("MYCALL")["NAME"] == "FIRST LAST")
+        assert(qrz.session_key == "KEY1")
+        assert(qrz.error_message is None)
+        qrz.close()
+
+        assert(not qrz.connect("hello", "mars"))
+        assert(qrz.error_message == "qrz.com session error: Username/password incorrect")
+
+    def test_reconnect(self):
+        """ Check that the connection is re-opened if the server has closed it. """
+        qrz = CallsignLookupQRZ(parent=None, server=self.server.address)
+        assert(qrz.connect("hello", "world"))
+        qrz.connection.sock.close()
+        assert(qrz.lookup("MYCALL")["NAME"] == "FIRST LAST")
+        assert(self.server.connections == 2)
+        qrz.close()
+
+    def test_service(self):
+        """ Check that concurrent lookups share one session, and that repeated lookups are served from the cache without contacting the server. """
+        cache = CallsignLookupCache(":memory:")
+        service = CallsignLookupService("qrz.com", "hello", "world", cache=cache, maximum_connections=2, server=self.server.address)
+        results = []
+        futures = [service.lookup_async(callsign, lambda fields_and_data, error_message: results.append((fields_and_data, error_message))) for callsign in ["A1A", "B1B", "C1C", "D1D"]]
+        assert([future.result(5)[1] for future in futures] == [None]*4)
+        assert(len(results) == 4)
+        assert(self.server.lookups == 4)
+        assert(self.server.keys == 0)
+
+        callback = mock.MagicMock()
+        future = service.lookup_async("A1A/P", callback)
+        assert(future.done())
+        callback.assert_called_once_with(results[0][0], None)
+        assert(self.server.lookups == 4)
+        service.close()
+        assert(self.server.connections <= 2)
+
+    def test_service_error(self):
+        """ Check that a failed login is reported by the service, and that nothing is cached. """
+        cache = CallsignLookupCache(":memory:")
+        service = CallsignLookupService("qrz.com", "hello", "mars", cache=cache, server=self.server.address)
+        (fields_and_data, error_message) = service.lookup("MYCALL")
+        assert(error_message == "qrz.com session error: Username/password incorrect")
+        assert(not any(fields_and_data.values()))
+        assert(cache.get("qrz.com", "MYCALL") is None)
+        service.close()
+        self.assertRaises(ValueError, CallsignLookupService, "example.com", "hello", "world")
+
+
+class TestCallsignLookupCache(unittest.TestCase):
+
+    """ The unit tests for the CallsignLookupCache class. """
+
+    def test_expiry(self):
+        """ Check that cached results persist in the database, and expire after their time-to-live. """
+        cache = CallsignLookupCache(":memory:", time_to_live=100)
+        with mock.patch("time.time", return_value=1000.0):
+            cache.set("qrz.com", "mycall", {"NAME": "FIRST LAST"})
+        cache.memory.clear()
+        with mock.patch("time.time", return_value=1050.0):
+            assert(cache.get("qrz.com", "MYCALL") == {"NAME": "FIRST LAST"})
+            assert(cache.get("hamqth.com", "MYCALL") is None)
+        with mock.patch("time.time", return_value=1101.0):
+            assert(cache.get("qrz.com", "MYCALL") is None)
+        cache.close()
+
 if(__name__ == '__main__'):
     unittest.main()
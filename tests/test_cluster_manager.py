@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from pyqso.cluster_manager import *
+from pyqso.dx_spots import Spot
+
+SPOTS = ["DX de W3LPL:     14025.0  JA1ABC       CW 599 TNX QSO               1234Z FN20\r\n",
+         "DX de EA5WU-#:   7025.0  RA3XX        CW 20 dB 22 WPM CQ             2359Z\r\n"]
+
+
+class StubCluster:
+
+    """ A stub DX cluster, which runs on the manager's event loop. Each client is asked to log in, and is then sent some spots.
+    The server can be told to drop each client after sending the spots. """
+
+    def __init__(self, manager, spots, drop=False):
+        self.manager = manager
+        self.spots = spots
+        self.drop = drop
+        self.clients = 0
+        self.received = []
+        self.server = manager.run(asyncio.start_server(self.handle, "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader, writer):
+        self.clients += 1
+        # Ask the client to echo, which it should refuse, before asking it to log in.
+        writer.write(bytes([IAC, DO, 1]) + b"login: ")
+        self.received.append(await reader.readexactly(3))
+        writer.write("".join(self.spots).encode())
+        await writer.drain()
+        if(self.drop):
+            writer.close()
+            return
+        try:
+            while True:
+                data = await reader.read(100)
+                if(not data):
+                    break
+                self.received.append(data)
+        finally:
+            writer.close()
+
+    def close(self):
+        async def close():
+            self.server.close()
+        self.manager.run(close())
+
+
+class TestTelnetFilter(unittest.TestCase):
+
+    """ The unit tests for the TelnetFilter class. """
+
+    def test_feed(self):
+        """ Check that Telnet commands are removed from the data (even if they are split across chunks), and that any options asked for are refused. """
+        telnet = TelnetFilter()
+        assert(telnet.feed(bytes([IAC, DO, 1]) + b"login:" + bytes([IAC, WILL, 3, IAC, NOP])) == (b"login:", bytes([IAC, WONT, 1, IAC, DONT, 3])))
+        assert(telnet.feed(b"a" + bytes([IAC])) == (b"a", b""))
+        assert(telnet.feed(bytes([IAC]) + b"b") == (b"\xffb", b""))
+        assert(telnet.feed(bytes([IAC, SB]) + b"xyz" + bytes([IAC, SE]) + b"b") == (b"b", b""))
+        assert(telnet.feed(bytes([IAC, DONT])) == (b"", b""))
+        assert(telnet.feed(bytes([1]) + b"c") == (b"c", b""))
+
+
+class TestSpotDeduplicator(unittest.TestCase):
+
+    """ The unit tests for the SpotDeduplicator class. """
+
+    def test_is_duplicate(self):
+        """ Check that spots with the same spotter, callsign, time and frequency (to the nearest kHz) are duplicates, until they are forgotten. """
+        deduplicator = SpotDeduplicator(window=10)
+
+        def spot(spotter="W3LPL", frequency=14025.0, received=0.0):
+            return Spot(spotter=spotter, frequency=frequency, callsign="JA1ABC", comment="", time="1234", locator="", band="20m", mode="CW", received=received)
+        assert(not deduplicator.is_duplicate(spot()))
+        assert(deduplicator.is_duplicate(spot(frequency=14025.1, received=5.0)))
+        assert(not deduplicator.is_duplicate(spot(spotter="K1TTT", received=5.0)))
+        assert(not deduplicator.is_duplicate(spot(received=11.0)))
+        assert(len(deduplicator.seen) == 2)
+
+
+class TestClusterManager(unittest.TestCase):
+
+    """ The unit tests for the ClusterManager class, using stub DX clusters on the local machine. """
+
+    def setUp(self):
+        self.received = []
+        self.states = []
+        self.manager = ClusterManager(on_receive=lambda connection, lines: self.received.append((connection.name, lines)),
+                                      on_state=lambda connection, state: self.states.append((connection.name, state)),
+                                      keepalive_interval=0.2, minimum_backoff=0.05, maximum_backoff=0.1)
+
+    def tearDown(self):
+        self.manager.stop()
+
+    def wait_for(self, condition, timeout=5):
+        """ Wait until a condition is met (or the time runs out). """
+        start = time.monotonic()
+        while(not condition() and time.monotonic() - start < timeout):
+            time.sleep(0.01)
+        return condition()
+
+    def get_lines(self):
+        return [line for (name, lines) in self.received for (line, spot) in lines]
+
+    def test_receive(self):
+        """ Check that the user is logged in, and that the lines and spots received are passed on. """
+        cluster = StubCluster(self.manager, SPOTS)
+        connection = self.manager.add("127.0.0.1", cluster.port, username="M0ABC")
+        assert(self.wait_for(lambda: len(self.get_lines()) == 3))
+        assert(self.wait_for(lambda: cluster.received[:2] == [bytes([IAC, WONT, 1]), b"M0ABC\n"]))
+        assert(self.get_lines()[0] == "login: ")
+        spots = [spot for (name, lines) in self.received for (line, spot) in lines if spot is not None]
+        assert([spot.callsign for spot in spots] == ["JA1ABC", "RA3XX"])
+        assert(self.manager.is_connected())
+
+        metrics = self.manager.get_metrics()[connection.name]
+        assert((metrics["state"], metrics["connections"], metrics["lines_received"], metrics["spots_received"]) == (CONNECTED, 1, 3, 2))
+        assert(metrics["bytes_received"] == 10 + len("".join(SPOTS)) and metrics["bytes_per_second"] > 0)
+
+        self.manager.send("sh/dx\n")
+        assert(self.wait_for(lambda: b"sh/dx\n" in cluster.received))
+        self.manager.remove(connection.name)
+        assert(self.wait_for(lambda: b"quit\n" in cluster.received))
+        assert(self.states[-1] == (connection.name, CLOSED) and not self.manager.connections)
+        cluster.close()
+
+    def test_deduplication(self):
+        """ Check that a spot received from two DX clusters is only passed on once. """
+        clusters = [StubCluster(self.manager, SPOTS), StubCluster(self.manager, SPOTS[1:])]
+        for cluster in clusters:
+            self.manager.add("127.0.0.1", cluster.port)
+        assert(self.wait_for(lambda: sum([m["spots_received"] for m in self.manager.get_metrics().values()]) == 3))
+        spots = [spot.callsign for (name, lines) in self.received for (line, spot) in lines if spot is not None]
+        assert(sorted(spots) == ["JA1ABC", "RA3XX"])
+        assert(sum([m["duplicate_spots"] for m in self.manager.get_metrics().values()]) == 1)
+        with self.assertRaises(ValueError):
+            self.manager.add("127.0.0.1", clusters[0].port)
+        for cluster in clusters:
+            cluster.close()
+
+    def test_reconnect(self):
+        """ Check that a connection which is dropped by the DX cluster is made again. """
+        cluster = StubCluster(self.manager, SPOTS[:1], drop=True)
+        connection = self.manager.add("127.0.0.1", cluster.port)
+        assert(self.wait_for(lambda: cluster.clients >= 3))
+        assert(connection.connections >= 2 and (connection.name, DISCONNECTED) in self.states)
+        # The spot is sent again after each reconnection, but it is only passed on once.
+        assert(len([line for line in self.get_lines() if line.startswith("DX de")]) == 1)
+        cluster.close()
+
+    def test_reconnect_after_error(self):
+        """ Check that a connection is made again after an unexpected error, rather than being left in the connected state. """
+        def on_receive(connection, lines):
+            self.received.append((connection.name, lines))
+            if(len(self.received) == 1):
+                raise ValueError("Unexpected error.")
+        self.manager.receive_callback = on_receive
+        cluster = StubCluster(self.manager, SPOTS[:1])
+        connection = self.manager.add("127.0.0.1", cluster.port)
+        assert(self.wait_for(lambda: connection.connections >= 2 and connection.state == CONNECTED))
+        assert((connection.name, DISCONNECTED) in self.states)
+        cluster.close()
+
+    def test_connection_failed(self):
+        """ Check that a connection which cannot be made in the first place is not retried, and that the reason is reported. """
+        cluster = StubCluster(self.manager, SPOTS)
+        port = cluster.port
+        cluster.close()
+        connection = self.manager.add("127.0.0.1", port)
+        assert(self.wait_for(lambda: connection.state == FAILED))
+        assert(self.states == [(connection.name, CONNECTING), (connection.name, FAILED)])
+        assert(connection.error and connection.connections == 0 and not self.manager.connections)
+
+    def test_keepalive(self):
+        """ Check that a keepalive is sent when nothing else has been sent for a while. """
+        cluster = StubCluster(self.manager, SPOTS)
+        self.manager.add("127.0.0.1", cluster.port)
+        assert(self.wait_for(lambda: bytes([IAC, NOP]) in cluster.received))
+        cluster.close()
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+from pyqso.cty import *
+
+
+class TestCountryFile(unittest.TestCase):
+
+    """ The unit tests for the CountryFile class. """
+
+    def setUp(self):
+        """ Load the test country file (in the cty.dat format). """
+        self.path = os.path.join(os.path.realpath(os.path.dirname(__file__)), "res")
+        self.cty = CountryFile(os.path.join(self.path, "cty.dat"))
+
+    def get_name(self, callsign):
+        entity = self.cty.resolve(callsign)
+        return entity.name if entity is not None else None
+
+    def test_load(self):
+        """ Check the details of the entities in the country file. Note that longitudes are converted to be positive to the east. """
+        assert(len(self.cty) == 7)
+        england = self.cty.entities["G"]
+        assert(england == Entity(name="England", prefix="G", continent="EU", cq_zone=14, itu_zone=27, latitude=52.77, longitude=-1.47, utc_offset=0.0, dxcc=None))
+        assert(self.cty.entities["IG9"].name == "Sicily")
+
+    def test_resolve(self):
+        """ Check that callsigns are resolved using the longest matching prefix. """
+        assert(self.get_name("G4ABC") == "England")
+        assert(self.get_name("m0abc") == "England")
+        assert(self.get_name("EA1ABC") == "Spain")
+        assert(self.get_name("EA6ABC") == "Balearic Islands")
+        assert(self.get_name("KH6ABC") == "Hawaii")
+        assert(self.get_name("W1ABC") == "United States")
+        assert(self.get_name("TO6T") == "France")
+        assert(self.get_name("TO5A") is None)
+        assert(self.get_name("") is None)
+
+    def test_exact(self):
+        """ Check that callsigns listed individually in the country file override the prefixes, along with any zone/coordinate overrides. """
+        assert(self.get_name("K4XYZ") == "Hawaii")
+        assert(self.get_name("GB100LP") == "England")
+        assert(self.get_name("EA5XYZ/6") == "Balearic Islands")
+        entity = self.cty.resolve("W1HAW")
+        assert((entity.name, entity.cq_zone, entity.itu_zone, entity.latitude, entity.longitude) == ("Hawaii", 32, 62, 19.5, -155.6))
+        entity = self.cty.resolve("W6ABC")
+        assert((entity.name, entity.cq_zone, entity.itu_zone) == ("United States", 3, 6))
+
+    def test_prefixes_and_suffixes(self):
+        """ Check that portable prefixes determine the entity, that portable suffixes are ignored, and that maritime mobile stations do not have an entity. """
+        assert(self.get_name("F/G4ABC") == "France")
+        assert(self.get_name("F/G4ABC/P") == "France")
+        assert(self.get_name("G4ABC/P") == "England")
+        assert(self.get_name("G4ABC/QRP") == "England")
+        assert(self.get_name("W1ABC/KH6") == "Hawaii")
+        assert(self.get_name("G4ABC/MM") is None)
+        assert(self.get_name("G4ABC/AM") is None)
+        entity = self.cty.resolve("W1ABC/6")
+        assert((entity.name, entity.cq_zone) == ("United States", 3))
+
+    def test_resolve_many(self):
+        """ Check that many callsigns are resolved at once, and that the result of each distinct callsign is remembered. """
+        entities = self.cty.resolve_many(["G4ABC", "EA6ABC", "G4ABC", None, "G4ABC/MM"])
+        assert([entity.name if entity else None for entity in entities] == ["England", "Balearic Islands", "England", None, None])
+        assert(entities[0] is entities[2])
+        assert(len(self.cty.resolved) == 4)
+
+    def test_csv(self):
+        """ Check that a country file in the cty.csv format is loaded, along with the DXCC entity codes. """
+        cty = CountryFile(os.path.join(self.path, "cty.csv"))
+        assert(len(cty) == 3)
+        assert(cty.resolve("EA6ABC").dxcc == 21)
+        assert(cty.resolve("EA5XYZ/6").dxcc == 21)
+        assert(cty.resolve("M0ABC/P").dxcc == 223)
+        assert(cty.resolve("F/M0ABC") is None)
+
+    def test_parse_prefix(self):
+        """ Check that the overrides following a prefix are parsed. """
+        entity = self.cty.entities["K"]
+        (prefix, exact, details) = parse_prefix("=KH6ABC/P(31)[61]{OC}<21.3/157.9>~-10.0~", entity)
+        assert((prefix, exact) == ("KH6ABC/P", True))
+        assert(details == entity._replace(cq_zone=31, itu_zone=61, continent="OC", latitude=21.3, longitude=-157.9, utc_offset=-10.0))
+        assert(parse_prefix("W", entity) == ("W", False, entity))
+
+    def test_get_country_file(self):
+        """ Check that the country file is only loaded once, and that a missing country file is not an error. """
+        path = os.path.join(self.path, "cty.dat")
+        assert(get_country_file(path) is get_country_file(path))
+        assert(get_country_file(os.path.join(self.path, "missing.dat")) is None)
+
+if(__name__ == '__main__'):
+    unittest.main()
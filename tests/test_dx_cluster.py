@@ -23,6 +23,7 @@ try:
 except ImportError:
     import mock
 from pyqso.dx_cluster import *
+from pyqso.dx_spots import parse_spot, NEW_CALL
 
 
 class TestDXCluster(unittest.TestCase):
@@ -35,15 +36,26 @@ class TestDXCluster(unittest.TestCase):
         PyQSO = mock.MagicMock()
         self.dxcluster = DXCluster(application=PyQSO())
 
-    def test_on_telnet_io(self):
-        """ Check that the response from the Telnet server can be correctly decoded. """
-
-        telnetlib.Telnet = mock.Mock(spec=telnetlib.Telnet)
-        connection = telnetlib.Telnet("hello", "world")
-        connection.read_very_eager.return_value = b"Test message from the Telnet server."
-        self.dxcluster.connection = connection
-        result = self.dxcluster.on_telnet_io()
-        assert(result)
+    def tearDown(self):
+        self.dxcluster.manager.stop()
+
+    def test_receive(self):
+        """ Check that the spots received from a Telnet server are stored, and that the lines are queued to be rendered with any highlighting. """
+        lines = [("login: ", None), ("DX de W3LPL:     14025.0  JA1ABC       CW 599 TNX QSO               1234Z FN20", None)]
+        lines[1] = (lines[1][0], parse_spot(lines[1][0]))
+        self.dxcluster.matcher = mock.MagicMock()
+        self.dxcluster.matcher.match.return_value = [NEW_ENTITY, NEW_CALL]
+        self.dxcluster.receive(mock.MagicMock(), lines)
+        assert(len(self.dxcluster.spots) == 1)
+        assert(list(self.dxcluster.pending) == [("login: ", None), (lines[1][0], NEW_ENTITY)])
+
+    def test_connect(self):
+        """ Check that connecting to a Telnet server adds a connection to the manager, and that disconnecting removes all the connections. """
+        self.dxcluster.manager = mock.MagicMock(connections={})
+        self.dxcluster.connect("localhost", 7300, "M0ABC")
+        self.dxcluster.manager.add.assert_called_once_with("localhost", 7300, "M0ABC", None)
+        self.dxcluster.disconnect()
+        self.dxcluster.manager.remove_all.assert_called_once_with()
 
 if(__name__ == '__main__'):
     unittest.main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+from pyqso.dx_spots import *
+from pyqso.cty import CountryFile
+
+
+class TestDXSpots(unittest.TestCase):
+
+    """ The unit tests for the DX cluster spot parsing functions. """
+
+    def test_parse_spot(self):
+        """ Check that spot lines from different kinds of DX cluster (including CW skimmers) are parsed, and that other lines are ignored. """
+        spot = parse_spot("DX de W3LPL:     14025.0  JA1ABC       CW 599 TNX QSO               1234Z FN20", received=1.0)
+        assert(spot == Spot(spotter="W3LPL", frequency=14025.0, callsign="JA1ABC", comment="CW 599 TNX QSO", time="1234", locator="FN20", band="20m", mode="CW", received=1.0))
+
+        spot = parse_spot("DX de EA5WU-#:   7025.0  ra3xx        CW 20 dB 22 WPM CQ             2359Z")
+        assert((spot.spotter, spot.callsign, spot.band, spot.locator) == ("EA5WU", "RA3XX", "40m", ""))
+
+        spot = parse_spot("DX de M0ABC:    144300.0  G4XYZ                                       0001Z")
+        assert((spot.frequency, spot.comment, spot.band, spot.mode) == (144300.0, "", "2m", ""))
+
+        assert(parse_spot("WWV de VE7CC <18>:   SFI=70, A=4, K=1, No Storms -> No Storms") is None)
+        assert(parse_spot("DX de W3LPL: garbled") is None)
+
+    def test_get_band(self):
+        """ Check that the band of a frequency (in kHz) is found. """
+        assert(get_band(1800.0) == "160m")
+        assert(get_band(14350.0) == "20m")
+        assert(get_band(14351.0) == "")
+        assert(get_band(1000.0) == "")
+        assert(get_band(432200.0) == "70cm")
+
+    def test_get_mode(self):
+        """ Check that the mode is taken from the comment if possible, and otherwise from the frequency. """
+        assert(get_mode(14025.0, "tnx usb") == "SSB")
+        assert(get_mode(14074.5, "-12 dB") == "FT8")
+        assert(get_mode(14025.0, "") == "CW")
+        assert(get_mode(14250.0, "") == "SSB")
+        assert(get_mode(144300.0, "") == "")
+
+
+class TestSpotParser(unittest.TestCase):
+
+    """ The unit tests for the SpotParser class. """
+
+    def test_feed(self):
+        """ Check that the text is split into complete lines, however it is split into chunks. """
+        parser = SpotParser()
+        assert(parser.feed("DX de W3LPL:   14025.0  JA") == [])
+        assert(parser.feed("1ABC   CW   1234Z\r\nDX de K1TTT:") == ["DX de W3LPL:   14025.0  JA1ABC   CW   1234Z"])
+        assert(parser.feed("   7025.0  RA3XX  2359Z\r\n\r\nlogin: ") == ["DX de K1TTT:   7025.0  RA3XX  2359Z", ""])
+        assert(parser.flush() == "login: ")
+        assert(parser.flush() == "")
+
+
+class TestSpotStore(unittest.TestCase):
+
+    """ The unit tests for the SpotStore class. """
+
+    def setUp(self):
+        """ Set up a small spot store. """
+        self.store = SpotStore(capacity=3)
+        self.spots = [parse_spot(line, received=i) for (i, line) in enumerate(["DX de W3LPL:  14025.0  JA1ABC  CW  1234Z",
+                                                                               "DX de W3LPL:  14250.0  JA1ABC  SSB  1235Z",
+                                                                               "DX de W3LPL:   7025.0  RA3XX  CW  1236Z",
+                                                                               "DX de W3LPL:  14030.0  VK2ABC  CW  1237Z"])]
+
+    def test_find(self):
+        """ Check that the spots are found by band, mode and callsign, newest first. """
+        for spot in self.spots[:3]:
+            self.store.add(spot)
+        assert(self.store.find(band="20m") == [self.spots[1], self.spots[0]])
+        assert(self.store.find(band="20m", mode="CW") == [self.spots[0]])
+        assert(self.store.find(callsign="JA1ABC", limit=1) == [self.spots[1]])
+        assert(self.store.find(callsign="G4ABC") == [])
+        assert(self.store.find() == self.spots[2::-1])
+
+    def test_capacity(self):
+        """ Check that the oldest spots are discarded once the store is full, and removed from the indices. """
+        for spot in self.spots:
+            self.store.add(spot)
+        assert(len(self.store) == 3)
+        assert(self.store.find(band="20m") == [self.spots[3], self.spots[1]])
+        assert(self.store.get_counts("mode") == {"CW": 2, "SSB": 1})
+        assert(self.store.get_counts("callsign") == {"JA1ABC": 1, "RA3XX": 1, "VK2ABC": 1})
+        self.store.clear()
+        assert(len(self.store) == 0 and self.store.get_counts("band") == {})
+
+
+class TestNeededSpotMatcher(unittest.TestCase):
+
+    """ The unit tests for the NeededSpotMatcher class. """
+
+    def setUp(self):
+        """ Count what has been worked in a small logbook, using the test country file. """
+        path = os.path.join(os.path.realpath(os.path.dirname(__file__)), "res", "cty.dat")
+        self.matcher = NeededSpotMatcher(CountryFile(path))
+        self.logbook = mock.MagicMock()
+        self.logbook.connection = sqlite.connect(":memory:")
+        self.logbook.connection.execute("CREATE TABLE test (id INTEGER PRIMARY KEY AUTOINCREMENT, call TEXT, band TEXT, mode TEXT, gridsquare TEXT)")
+        self.logbook.connection.executemany("INSERT INTO test (call, band, mode, gridsquare) VALUES (?, ?, ?, ?)",
+                                            [("EA1ABC", "20m", "CW", ""), ("ea3xyz ", "20M", "ssb", "JN11"), ("W1ABC", "40m", "FT8", "FN42AB"), ("W1ABC", "40m", "FT8", None)])
+        log = mock.MagicMock()
+        log.name = "test"
+        self.logbook.logs = [log]
+        self.matcher.count(self.logbook)
+
+    def tearDown(self):
+        self.logbook.connection.close()
+
+    def match(self, callsign, frequency, comment=""):
+        return self.matcher.match(Spot(spotter="W3LPL", frequency=frequency, callsign=callsign, comment=comment, time="1234", locator="", band=get_band(frequency),
+                                       mode=get_mode(frequency, comment), received=0.0))
+
+    def test_count(self):
+        """ Check that the callsigns, entities, band/mode slots and grid squares are counted with a single query, and that the logs are monitored. """
+        assert(self.matcher.worked["call"] == {"EA1ABC": 1, "EA3XYZ": 1, "W1ABC": 2})
+        assert(self.matcher.worked["entity"] == {"EA": 2, "K": 2})
+        assert(self.matcher.worked["mode"] == {("EA", "20m", "CW"): 1, ("EA", "20m", "Phone"): 1, ("K", "40m", "Digital"): 2})
+        assert(self.matcher.worked["grid"] == {("JN11", "20m"): 1, ("FN42", "40m"): 1})
+        assert(self.logbook.logs[0].connect.call_count == 4)
+
+    def test_match(self):
+        """ Check that each spot is tagged with the ways in which it is needed, in order of importance. """
+        assert(self.match("EA1ABC", 14025.0) == [])
+        assert(self.match("EA1ABC", 14200.0) == [])
+        assert(self.match("EA5ABC", 14025.0) == [NEW_CALL])
+        assert(self.match("EA5ABC", 14074.0) == [NEW_MODE, NEW_CALL])
+        assert(self.match("EA1ABC", 7025.0) == [NEW_BAND])
+        assert(self.match("EA6ABC", 7025.0) == [NEW_ENTITY, NEW_CALL])
+        assert(self.match("W1ABC", 7074.0, "FT8 FN42") == [])
+        assert(self.match("W1ABC", 7074.0, "FT8 JN11 <TR> FN43") == [NEW_GRID])
+        assert(self.match("TO5A", 14025.0) == [NEW_CALL])
+
+    def test_monitor(self):
+        """ Check that the counts are updated incrementally as records are added, edited and deleted. """
+        record = {"CALL": "EA6ABC", "BAND": "40m", "MODE": "CW", "GRIDSQUARE": ""}
+        self.matcher.on_record_added(None, record)
+        assert(self.match("EA6XYZ", 7025.0) == [NEW_CALL])
+        self.matcher.on_record_edited(None, record, dict(record, MODE="SSB"))
+        assert(self.match("EA6XYZ", 7025.0) == [NEW_MODE, NEW_CALL])
+        self.matcher.on_record_deleted(None, dict(record, MODE="SSB"))
+        assert(self.match("EA6XYZ", 7025.0) == [NEW_ENTITY, NEW_CALL])
+        assert("EA6ABC" not in self.matcher.worked["call"])
+
+        self.matcher.reset()
+        assert(self.matcher.worked["call"] == {} and self.logbook.logs[0].disconnect.call_count == 4)
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import threading
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+from pyqso.geocoding import *
+
+
+class TestGeocodingCache(unittest.TestCase):
+
+    """ The unit tests for the GeocodingCache class. """
+
+    def setUp(self):
+        """ Set up an in-memory cache. """
+        self.cache = GeocodingCache(":memory:", maximum_size=3)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_get_set(self):
+        """ Check that coordinates are cached regardless of the case of the location's name, and that locations which could not be found are cached too. """
+        assert(self.cache.get("England") is None)
+        self.cache.set("England", 52.4, -1.5)
+        assert(self.cache.get("  england ") == (52.4, -1.5))
+        self.cache.set("Atlantis", None, None)
+        assert(self.cache.get("Atlantis") == (None, None))
+
+    def test_expiry(self):
+        """ Check that entries expire after their time-to-live. """
+        with mock.patch("time.time", return_value=1000.0):
+            self.cache.set("England", 52.4, -1.5)
+            self.cache.set("Atlantis", None, None)
+        with mock.patch("time.time", return_value=1000.0 + NOT_FOUND_TIME_TO_LIVE + 1):
+            assert(self.cache.get("England") == (52.4, -1.5))
+            assert(self.cache.get("Atlantis") is None)
+        with mock.patch("time.time", return_value=1000.0 + TIME_TO_LIVE + 1):
+            assert(self.cache.get("England") is None)
+
+    def test_eviction(self):
+        """ Check that the least-recently-used entries are discarded once the cache is full. """
+        with mock.patch("time.time", side_effect=range(1, 10)):
+            self.cache.set("A", 1, 1)
+            self.cache.set("B", 2, 2)
+            self.cache.set("C", 3, 3)
+            self.cache.get("A")  # A is now more recently-used than B.
+            self.cache.set("D", 4, 4)
+            assert(self.cache.get("B") is None)
+            for name in ["A", "C", "D"]:
+                assert(self.cache.get(name) is not None)
+
+
+class TestGeocoder(unittest.TestCase):
+
+    """ The unit tests for the Geocoder class. """
+
+    def setUp(self):
+        """ Set up a geocoder with an in-memory cache and a fake online lookup. """
+        self.cache = GeocodingCache(":memory:")
+        self.lookup = mock.MagicMock(side_effect=lambda name: {"ATLANTIS": None}.get(name, (10.0, 20.0)))
+        self.geocoder = Geocoder(cache=self.cache, lookup=self.lookup)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_country_centroids(self):
+        """ Check that the bundled table of country centroids is used without looking anything up online. """
+        assert(len(load_country_centroids()) > 200)
+        callback = mock.MagicMock()
+        assert(self.geocoder.request("England", callback))
+        callback.assert_called_once_with("England", (52.4, -1.5))
+        assert(self.geocoder.get("united states of america") == (39.8, -98.6))
+        self.lookup.assert_not_called()
+
+    def test_request(self):
+        """ Check that unknown locations are queued to be looked up online, that requests for the same location are combined, and that the results are cached. """
+        results = []
+
+        def callback(name, coordinates):
+            results.append((name, coordinates))
+
+        # Stop the worker thread from taking the requests off the queue, so that they can be resolved here instead.
+        self.geocoder.requests = mock.MagicMock(wraps=self.geocoder.requests)
+        with mock.patch.object(self.geocoder, "work"):
+            assert(not self.geocoder.request("Narnia", callback))
+            assert(not self.geocoder.request("NARNIA", callback))
+            assert(not self.geocoder.request("Atlantis", callback))
+        assert(self.geocoder.requests.put.call_count == 2)
+        self.geocoder.resolve([self.geocoder.requests.get(), self.geocoder.requests.get()])
+        assert(sorted(results) == [("NARNIA", (10.0, 20.0)), ("Narnia", (10.0, 20.0))])
+        assert(self.lookup.call_count == 2)
+
+        # Both results are now cached.
+        assert(self.geocoder.get("Narnia") == (10.0, 20.0))
+        assert(self.geocoder.get("Atlantis") == (None, None))
+        assert(self.geocoder.request("Atlantis", callback))
+        assert(self.lookup.call_count == 2)
+
+    def test_worker(self):
+        """ Check that the worker thread resolves requests and calls the callbacks. """
+        found = threading.Event()
+        assert(not self.geocoder.request("Narnia", lambda name, coordinates: found.set()))
+        assert(found.wait(5))
+        assert(self.geocoder.worker.daemon)
+
+    def test_failed_lookup(self):
+        """ Check that lookups which fail (e.g. because there is no network connection) are not cached. """
+        self.lookup.side_effect = IOError("No connection")
+        callback = mock.MagicMock()
+        self.geocoder.callbacks["NARNIA"] = [("Narnia", callback)]
+        self.geocoder.resolve(["NARNIA"])
+        callback.assert_not_called()
+        assert(self.geocoder.get("Narnia") is None)
+        assert("NARNIA" not in self.geocoder.callbacks)
+
+if(__name__ == '__main__'):
+    unittest.main()
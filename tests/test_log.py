@@ -17,8 +17,16 @@
 #    You should have received a copy of the GNU General Public License
 #    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import shutil
+import tempfile
 import unittest
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
 from pyqso.log import *
+from pyqso.schema import upgrade_log_table
 
 
 class TestLog(unittest.TestCase):
@@ -107,6 +115,148 @@ class TestLog(unittest.TestCase):
         records = c.fetchall()
         assert len(records) == 5
 
+    def test_add_records(self):
+        """ Check that records can be added in batches from a generator, and that progress is reported after each batch. """
+        progress = []
+        records = (dict(self.fields_and_data, CALL="TEST%d" % i) for i in range(5))
+        count = self.log.add_records(records, batch_size=2, progress=progress.append)
+        assert(count == 5)
+        assert(progress == [2, 4, 5])
+
+        c = self.connection.cursor()
+        c.execute("SELECT * FROM test ORDER BY id ASC")
+        records = c.fetchall()
+        assert(len(records) == 5)
+        assert([r["call"] for r in records] == ["TEST%d" % i for i in range(5)])
+
+        # The Gtk.ListStore should have been re-populated.
+        assert(len(self.log) == 5)
+        iter = self.log.get_iter_first()
+        assert(self.log.get_value(iter, 0) == records[0]["id"])
+
+    def test_add_records_journal_mode(self):
+        """ Check that adding records to a logbook on disk leaves its journal mode and the connection's synchronous setting as they were. """
+        directory = tempfile.mkdtemp()
+        try:
+            connection = sqlite.connect(os.path.join(directory, "logbook.db"))
+            connection.row_factory = sqlite.Row
+            with connection:
+                connection.execute("CREATE TABLE test (id INTEGER PRIMARY KEY AUTOINCREMENT, call TEXT)")
+            assert(Log(connection, "test").add_records([{"CALL": "TEST123"}, {"CALL": "TEST456"}]) == 2)
+            assert(connection.execute("PRAGMA journal_mode").fetchone()[0] == "delete")
+            assert(connection.execute("PRAGMA synchronous").fetchone()[0] == 2)
+            connection.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_lazy_loading(self):
+        """ Check that rows are fetched from the database a page at a time, and that only a limited number of pages are cached. """
+        n = PAGE_SIZE*(MAXIMUM_CACHED_PAGES+2)
+        self.log.add_records((dict(self.fields_and_data, CALL="TEST%d" % i) for i in range(n)), batch_size=PAGE_SIZE)
+        assert(len(self.log) == n)
+        assert(len(self.log.pages) == 0)  # Nothing is fetched until it is needed.
+
+        self.log.set_fetched_field_names(["FREQ"])
+        iter = self.log.get_iter(PAGE_SIZE+1)
+        assert(self.log.get_value(iter, 0) == PAGE_SIZE+2)
+        assert(self.log.get_value(iter, 1) == "TEST%d" % (PAGE_SIZE+1))  # The CALL field is always fetched.
+        assert(self.log.get_value(iter, AVAILABLE_FIELD_NAMES_ORDERED.index("FREQ")+1) == "145.500")
+        assert(self.log.get_value(iter, AVAILABLE_FIELD_NAMES_ORDERED.index("BAND")+1) == "2m")  # Fetched separately.
+        assert(self.log.get_value(iter, AVAILABLE_FIELD_NAMES_ORDERED.index("NOTES")+1) == "")  # Not in the database table.
+        assert(list(self.log.pages.keys()) == [1])
+
+        iter = self.log.get_iter_first()
+        while iter is not None:
+            self.log.get_value(iter, 1)
+            iter = self.log.iter_next(iter)
+        assert(len(self.log.pages) == MAXIMUM_CACHED_PAGES)
+
+        # Deleting and editing records should keep the rows consistent with the database.
+        self.log.delete_record(1)
+        self.log.edit_record(3, "CALL", "TEST456")
+        assert(len(self.log) == n-1)
+        iter = self.log.get_iter_first()
+        assert(self.log.get_value(iter, 0) == 2)
+        iter = self.log.iter_next(iter)
+        assert(self.log.get_value(iter, 1) == "TEST456")
+
+    def test_sort(self):
+        """ Check that records are sorted by the database, numerically where appropriate, and that indexes are created for the sorted fields. """
+        self.log.populate()
+        self.log.add_record([dict(self.fields_and_data, FREQ="14.250", QSO_DATE="20130312", TIME_ON="1200"),
+                             dict(self.fields_and_data, FREQ="7.100", QSO_DATE="20130311", TIME_ON="2359"),
+                             dict(self.fields_and_data, FREQ="145.500", QSO_DATE="20130312", TIME_ON="0900")])
+
+        def ids():
+            return [self.log.get_value(self.log.get_iter(i), 0) for i in range(len(self.log))]
+
+        self.log.sort("FREQ")
+        assert(ids() == [2, 1, 3])
+        self.log.sort("FREQ", descending=True)
+        assert(ids() == [3, 1, 2])
+        self.log.sort("QSO_DATE")
+        assert(ids() == [2, 3, 1])
+
+        # New records should be placed in their sorted position.
+        self.log.add_record(dict(self.fields_and_data, QSO_DATE="20130101", TIME_ON="0000"))
+        assert(ids() == [4, 2, 3, 1])
+
+        self.log.sort()
+        assert(ids() == [1, 2, 3, 4])
+
+        c = self.connection.cursor()
+        c.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='test'")
+        indexes = [r[0] for r in c.fetchall()]
+        assert("test_freq_index" in indexes)
+        assert("test_qso_date_index" in indexes)
+
+    def test_shadow_columns(self):
+        """ Check that the shadow columns of new records are filled in when the log has them, and that they are used to sort by frequency and to find the duplicates within a time window. """
+        upgrade_log_table(self.connection, "test")
+        self.log = Log(self.connection, "test")
+        self.log.add_record([dict(self.fields_and_data, FREQ="14.250", TIME_ON="1200"), dict(self.fields_and_data, FREQ="7.100 ", TIME_ON="1201"),
+                             dict(self.fields_and_data, FREQ="", QSO_DATE="2013", TIME_ON="1200")])
+        c = self.connection.cursor()
+        c.execute("SELECT freq_mhz, qso_timestamp FROM test ORDER BY id")
+        assert([tuple(r) for r in c.fetchall()] == [(14.25, 1363089600), (7.1, 1363089660), (None, None)])
+        assert(self.log.get_sort_keys("FREQ") == ["freq_mhz"])
+        self.log.populate()
+        self.log.sort("FREQ")
+        assert([self.log.get_value(self.log.get_iter(i), 0) for i in range(len(self.log))] == [3, 2, 1])
+        assert(self.log.get_duplicates(time_window=2) == [2])
+
+    def test_get_position(self):
+        """ Check that the positions of the rows are kept track of as records are added, sorted and deleted. """
+        self.log.add_record([dict(self.fields_and_data, FREQ=freq) for freq in ["14.250", "7.100", "145.500"]])
+        self.log.populate()
+        assert([self.log.get_position(index) for index in [1, 2, 3, 4]] == [0, 1, 2, None])
+        self.log.add_record(dict(self.fields_and_data, FREQ="3.500"))
+        assert(self.log.get_position(4) == 3)
+        self.log.sort("FREQ")
+        assert([self.log.get_position(index) for index in [1, 2, 3, 4]] == [2, 1, 3, 0])
+        self.log.delete_record(2)
+        assert([self.log.get_position(index) for index in [1, 2, 3, 4]] == [1, None, 2, 0])
+        self.log.delete_records([4])
+        assert([self.log.get_position(index) for index in [1, 2, 3, 4]] == [0, None, 1, None])
+
+    def test_callsign_filter(self):
+        """ Check that the records passing the callsign filter are kept up-to-date when records are added, edited and deleted. """
+        self.log.add_record([dict(self.fields_and_data, CALL="TEST123"), dict(self.fields_and_data, CALL="MYCALL")])
+        self.log.set_callsign_filter("test")
+        assert(self.log.is_visible(1) and not self.log.is_visible(2))
+
+        self.log.add_record(dict(self.fields_and_data, CALL="TEST456"))
+        assert(self.log.is_visible(3))
+        self.log.edit_record(2, "CALL", "TEST789")
+        assert(self.log.is_visible(2))
+        self.log.edit_record(1, "CALL", "MYCALL")
+        assert(not self.log.is_visible(1))
+        self.log.delete_record(3)
+        assert(not self.log.is_visible(3))
+
+        self.log.set_callsign_filter("")
+        assert(self.log.is_visible(1))
+
     def test_delete_record(self):
         """ Check that a record can be successfully deleted. """
         query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
@@ -159,6 +309,22 @@ class TestLog(unittest.TestCase):
                 assert(record[field_name.upper()] == self.fields_and_data[field_name.upper()])
         assert(len(record) == len(self.fields_and_data) + 1)
 
+    def test_get_field_values(self):
+        """ Check that the non-empty values of a single field can be retrieved. """
+        self.log.add_record([dict(self.fields_and_data, MODE="SSB"), dict(self.fields_and_data, MODE=""), dict(self.fields_and_data, MODE="CW")])
+        assert(sorted(self.log.get_field_values("MODE")) == ["CW", "SSB"])
+        assert(self.log.get_field_values("GRIDSQUARE") == [])  # No records have a GRIDSQUARE.
+        assert(self.log.get_field_values("NOT_A_FIELD") == [])
+
+    def test_get_fields(self):
+        """ Check that the values of several fields can be retrieved for all records, or only for those which pass the callsign filter. """
+        self.log.add_record([dict(self.fields_and_data, CALL="TEST1"), dict(self.fields_and_data, CALL="MYCALL", MODE="CW")])
+        self.log.populate()
+        assert(self.log.get_fields(["CALL", "MODE", "NOT_A_FIELD"]) == [("TEST1", "FM", None), ("MYCALL", "CW", None)])
+        self.log.set_callsign_filter("test")
+        assert(self.log.get_fields(["CALL"], visible=True) == [("TEST1",)])
+        assert(len(self.log.get_fields(["CALL"])) == 2)
+
     def test_records(self):
         """ Check that all records in a log can be successfully retrieved. """
         query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
@@ -174,6 +340,13 @@ class TestLog(unittest.TestCase):
             assert(records[0][field_name] == self.fields_and_data[field_name])
             assert(records[1][field_name] == self.fields_and_data[field_name])
 
+    def test_iter_records(self):
+        """ Check that all records in a log can be retrieved a batch at a time, in order of their index. """
+        self.log.add_records((dict(self.fields_and_data, CALL="TEST%d" % i) for i in range(5)))
+        records = self.log.iter_records(batch_size=2)
+        assert(not isinstance(records, list))
+        assert([record["CALL"] for record in records] == ["TEST%d" % i for i in range(5)])
+
     def test_record_count(self):
         """ Check that the total number of records in a log is calculated correctly. """
         query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
@@ -207,6 +380,36 @@ class TestLog(unittest.TestCase):
         assert(number_of_duplicates == 4)
         assert(self.log.record_count == 1)
 
+    def test_remove_duplicates_time_window(self):
+        """ Check that QSOs with the same callsign within a few minutes of each other (even across midnight) are duplicates when a time window is given,
+        and that the band and mode must also be the same if required. """
+        records = [("TEST123", "20130312", "1234", "2m", "FM"), ("test123", "20130312", "1236", "2m", "FM"), ("TEST123", "20130312", "1240", "2m", "FM"),
+                   ("TEST123", "20130312", "1236", "70cm", "FM"), ("TEST456", "20130312", "2359", "20m", "SSB"), ("TEST456", "20130313", "000130", "20m", "SSB"),
+                   ("TEST789", "2013", "1234", "20m", "CW"), ("TEST789", "2013", "1234", "20m", "CW")]
+        self.log.add_record([dict(zip(["CALL", "QSO_DATE", "TIME_ON", "BAND", "MODE"], r)) for r in records])
+        assert(self.log.get_duplicates() == [8])
+        assert(self.log.get_duplicates(time_window=2) == [2, 4, 6, 8])
+        assert(self.log.get_duplicates(time_window=2, match_band_mode=True) == [2, 6, 8])
+        assert(self.log.get_duplicates(time_window=10, match_band_mode=True) == [2, 3, 6, 8])
+        assert(self.log.remove_duplicates(time_window=2, match_band_mode=True) == (3, 3))
+        assert([r["id"] for r in self.log.records] == [1, 3, 4, 5, 7])
+
+    def test_delete_records(self):
+        """ Check that many records are deleted at once, that the rows are removed, and that a single signal is emitted. """
+        for i in range(0, 5):
+            self.log.add_record(dict(self.fields_and_data, CALL="TEST%d" % i))
+        self.log.populate()
+        self.log.set_callsign_filter("TEST")
+        handler = mock.MagicMock()
+        self.log.connect("records-changed", handler)
+        assert(self.log.delete_records([2, 4, 4, 10]) == 2)
+        assert(list(self.log.ids) == [1, 3, 5])
+        assert(self.log.visible_ids == set([1, 3, 5]))
+        assert(self.log.record_count == 3)
+        handler.assert_called_once_with(self.log)
+        assert(get_minutes("20130312", "1234") - get_minutes("20130311", "235959") == 755)
+        assert(get_minutes("20130230", "1234") is None and get_minutes("20130312", "") is None)
+
     def test_rename(self):
         """ Check that a log can be successfully renamed. """
         old_name = "test"
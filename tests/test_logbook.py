@@ -37,9 +37,12 @@ class TestLogbook(unittest.TestCase):
 
         self.logbook = Logbook(application=mock.MagicMock())
 
-        # Open the test database file.
+        # Open a copy of the test database file, since opening a logbook brings its schema up-to-date.
         path_to_test_database = os.path.join(os.path.realpath(os.path.dirname(__file__)), "res", "test.db")
-        opened = self.logbook.open(path=path_to_test_database)
+        self.path = "Logbook.test.db"
+        copyfile(path_to_test_database, self.path)
+        self.addCleanup(os.remove, self.path)
+        opened = self.logbook.open(path=self.path)
         assert(opened)
         assert(self.logbook.connection is not None)
 
@@ -119,21 +122,30 @@ class TestLogbook(unittest.TestCase):
         iter = model.get_iter(path)
 
         self.logbook.application.toolbar.filter_source.get_text.return_value = ""
+        self.logbook.apply_filter()
         present = self.logbook.filter_by_callsign(model, iter, data=None)
         assert(present)  # Show all the callsigns.
 
         self.logbook.application.toolbar.filter_source.get_text.return_value = "TEST123"
+        self.logbook.apply_filter()
         present = self.logbook.filter_by_callsign(model, iter, data=None)
         assert(present)  # "TEST123" is present.
 
         self.logbook.application.toolbar.filter_source.get_text.return_value = "TEST"
+        self.logbook.apply_filter()
         present = self.logbook.filter_by_callsign(model, iter, data=None)
         assert(present)  # "TEST" is present in "TEST123"
 
         self.logbook.application.toolbar.filter_source.get_text.return_value = "HELLOWORLD"
+        self.logbook.apply_filter()
         present = self.logbook.filter_by_callsign(model, iter, data=None)
         assert(not present)  # "HELLOWORLD" is not present in "TEST123"
 
+        self.logbook.application.toolbar.filter_source.get_text.return_value = "test1"
+        self.logbook.apply_filter()
+        present = self.logbook.filter_by_callsign(model, iter, data=None)
+        assert(present)  # The filter is case-insensitive.
+
     def test_get_log_index(self):
         """ Check that a log's index can be resolved using the log's name. """
         assert(self.logbook.get_log_index(name="test") == 0)
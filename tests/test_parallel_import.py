@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from collections import deque
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+from pyqso.parallel_import import *
+from pyqso.log import *
+from pyqso.schema import create_log_table
+
+
+class TestParallelImport(unittest.TestCase):
+
+    """ The unit tests for the ParallelImport class. """
+
+    def setUp(self):
+        """ Create a log in a temporary database, and some ADIF files to import into it. """
+        self.connection = sqlite.connect(":memory:")
+        self.connection.row_factory = sqlite.Row
+        create_log_table(self.connection, "test")
+        self.log = Log(self.connection, "test")
+        self.log.add_record({"CALL": "TEST1", "QSO_DATE": "20130312", "TIME_ON": "1234"})
+
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+        files = ["<call:5>test1<qso_date:8>20130312<time_on:4>1234<eor><call:5>TEST2<qso_date:8>20130312<time_on:4>1235<eor><call:5>TEST3<eor><call:5>TEST3<eor>",
+                 "<call:5>TEST2<qso_date:8>20130312<time_on:4>1235<eor><call:5>TEST4<qso_date:8>20130312<time_on:4>1236<freq:5>7.025<eor>"]
+        for (i, text) in enumerate(files):
+            path = os.path.join(self.directory, "operator%d.adi" % i)
+            with open(path, "w") as f:
+                f.write("<eoh>" + text)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.directory)
+
+    def test_run(self):
+        """ Check that the records in all the files are added to the log in order, skipping the duplicates of records in the log or in earlier files, and any files that cannot be read. """
+        importer = ParallelImport(self.paths + [os.path.join(self.directory, "missing.adi")], max_workers=2)
+        progress = []
+        assert(importer.run(self.log, progress=progress.append) == 4)
+        assert(progress == [4])
+        assert(self.log.get_fields(["CALL", "FREQ"]) == [("TEST1", ""), ("TEST2", ""), ("TEST3", ""), ("TEST3", ""), ("TEST4", "7.025")])
+        assert((importer.files_added, importer.duplicates) == (2, 2))
+        assert([os.path.basename(path) for (path, e) in importer.failed] == ["missing.adi"])
+
+        importer = ParallelImport(self.paths, skip_duplicates=False)
+        assert(importer.run(self.log) == 6)
+        assert(importer.duplicates == 0 and len(self.log) == 11)
+
+    def test_start_workers(self):
+        """ Check that this module stands in for __main__ only while the worker processes are started, and that __main__ is restored afterwards. """
+        importer = ParallelImport(self.paths, max_workers=2)
+        main = sys.modules["__main__"]
+
+        def Pool(processes):
+            assert(processes == 2)
+            assert(sys.modules["__main__"] is sys.modules["pyqso.parallel_import"])
+            return mock.sentinel.pool
+
+        with mock.patch("multiprocessing.get_context") as get_context:
+            get_context.return_value.Pool.side_effect = Pool
+            assert(importer.start_workers() is mock.sentinel.pool)
+        get_context.assert_called_with("spawn")
+        assert(sys.modules["__main__"] is main)
+
+    def test_files_in_flight(self):
+        """ Check that only one file per worker is handed to the workers ahead of the file whose records are being added. """
+        paths = self.paths*3
+        importer = ParallelImport(paths, max_workers=2, skip_duplicates=False)
+        in_flight = []
+
+        class Pool:
+            def apply_async(self, function, args):
+                result = mock.MagicMock()
+                result.get.return_value = function(*args)
+                return result
+
+        pending = deque()
+        for record in importer.iter_records(Pool(), pending, set()):
+            in_flight.append(len(pending))
+        assert(max(in_flight) == 2)
+        assert(importer.files_added == len(paths))
+
+if(__name__ == '__main__'):
+    unittest.main()
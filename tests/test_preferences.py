@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import tempfile
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+from pyqso.preferences import *
+
+
+class TestPreferences(unittest.TestCase):
+
+    """ The unit tests for the Preferences class. """
+
+    def setUp(self):
+        """ Set up a temporary preferences file. """
+        (handle, self.path) = tempfile.mkstemp(suffix=".ini")
+        os.close(handle)
+        self.write("[general]\nkeep_open = True\nname = test\n[world_map]\nqth_latitude = 51.5\n")
+        self.preferences = Preferences(self.path)
+
+    def tearDown(self):
+        """ Remove the temporary preferences file. """
+        if(os.path.exists(self.path)):
+            os.remove(self.path)
+
+    def write(self, text):
+        with open(self.path, "w") as f:
+            f.write(text)
+
+    def test_getters(self):
+        """ Check that preferences are returned with the correct types, and that fallback values are used for missing or invalid preferences. """
+        assert(self.preferences.exists)
+        assert(self.preferences.has_option("general", "keep_open"))
+        assert(self.preferences.getboolean("general", "keep_open") is True)
+        assert(self.preferences.get("general", "name") == "test")
+        assert(self.preferences.getfloat("world_map", "qth_latitude") == 51.5)
+        assert(self.preferences.get("general", "missing", fallback="x") == "x")
+        assert(self.preferences.getboolean("records", "use_utc", fallback=True) is True)
+        assert(self.preferences.getboolean("general", "name", fallback=False) is False)  # Not a boolean value.
+        assert(self.preferences.getint("world_map", "qth_latitude", fallback=0) == 0)  # Not an integer.
+
+    def test_caching(self):
+        """ Check that the preferences file is only parsed again when it has changed, or when the preferences are invalidated. """
+        with mock.patch("configparser.ConfigParser.read", autospec=True, side_effect=configparser.ConfigParser.read) as read:
+            for i in range(10):
+                self.preferences.getboolean("general", "keep_open")
+            assert(read.call_count == 1)
+
+            # Change the file (and its size, so the change is detected even if the modification time is unchanged).
+            self.write("[general]\nkeep_open = False\n")
+            assert(self.preferences.getboolean("general", "keep_open") is False)
+            assert(read.call_count == 2)
+
+            self.preferences.invalidate()
+            self.preferences.get("general", "keep_open")
+            assert(read.call_count == 3)
+
+    def test_missing_file(self):
+        """ Check that fallback values are used if there is no preferences file. """
+        os.remove(self.path)
+        assert(not self.preferences.exists)
+        assert(not self.preferences.has_option("general", "keep_open"))
+        assert(self.preferences.getboolean("general", "keep_open", fallback=False) is False)
+
+    def test_get_preferences(self):
+        """ Check that the same preferences object is shared. """
+        assert(get_preferences() is get_preferences())
+        assert(get_preferences().path == PREFERENCES_FILE)
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -95,6 +95,34 @@ class TestRecordDialog(unittest.TestCase):
         converted = self.record_dialog.convert_frequency(frequency, from_unit="MHz", to_unit="kHz")
         assert(converted == frequency)
 
+    def test_callsign_lookup_complete(self):
+        """ Check that the result of a callsign lookup only fills in the fields that have not been edited since the lookup was started, and is ignored once the dialog has been destroyed. """
+        for field_name in ["CALL", "NAME", "COUNTRY"]:
+            self.record_dialog.sources[field_name] = Gtk.Entry()
+        self.record_dialog.sources["CALL"].set_text("MYCALL")
+        self.record_dialog.sources["NAME"].set_text("Unknown")
+        self.record_dialog.lookup_callsign = "MYCALL"
+        self.record_dialog.lookup_data = dict([(field_name, self.record_dialog.get_data(field_name)) for field_name in self.record_dialog.sources])
+
+        self.record_dialog.sources["NAME"].set_text("Bob")
+        self.record_dialog.on_callsign_lookup_complete({"NAME": "Robert", "COUNTRY": "England"}, None)
+        assert(self.record_dialog.sources["NAME"].get_text() == "Bob")
+        assert(self.record_dialog.sources["COUNTRY"].get_text() == "England")
+
+        # A result for a callsign that is no longer in the CALL field is discarded.
+        self.record_dialog.sources["CALL"].set_text("OTHERCALL")
+        self.record_dialog.on_callsign_lookup_complete({"COUNTRY": "Wales"}, None)
+        assert(self.record_dialog.sources["COUNTRY"].get_text() == "England")
+
+        # Nothing is filled in once the dialog has been destroyed, and the pending lookup is cancelled.
+        self.record_dialog.sources["CALL"].set_text("MYCALL")
+        self.record_dialog.lookup = mock.MagicMock()
+        lookup = self.record_dialog.lookup
+        self.record_dialog.on_destroy(self.record_dialog.dialog)
+        lookup.cancel.assert_called_once_with()
+        self.record_dialog.on_callsign_lookup_complete({"COUNTRY": "Wales"}, None)
+        assert(self.record_dialog.sources["COUNTRY"].get_text() == "England")
+
     def test_hamlib_autofill(self):
         """ Check that FREQ, MODE and SUBMODE information can be retrieved from Hamlib's dummy rig (if the Hamlib module exists). """
         if(have_hamlib):
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+from pyqso.schema import *
+
+
+class TestSchema(unittest.TestCase):
+
+    """ The unit tests for the log table schema and its migrations. """
+
+    def setUp(self):
+        """ Work on a copy of the test database, which has never been migrated. """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "test.db")
+        shutil.copy(os.path.join(os.path.realpath(os.path.dirname(__file__)), "res", "test.db"), self.path)
+        self.connection = sqlite.connect(self.path)
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.directory)
+
+    def get_index_names(self, name):
+        return sorted([row[1] for row in self.connection.execute("PRAGMA index_list(%s)" % name)])
+
+    def get_trigger_names(self, name):
+        return sorted([row[0] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND tbl_name=?", (name,))])
+
+    def insert(self, name, record):
+        """ Insert a record into a log table along with its shadow columns, in the same way as the Log class. """
+        columns = list(record.keys()) + list(SHADOW_FUNCTIONS.keys())
+        values = list(record.values()) + [function(record) for function in SHADOW_FUNCTIONS.values()]
+        with self.connection:
+            self.connection.execute("INSERT INTO %s (%s) VALUES (%s)" % (name, ", ".join(columns).lower(), ", ".join("?"*len(values))), values)
+
+    def test_create_log_table(self):
+        """ Check that a new log table has the shadow columns and indexes, and that the shadow columns are kept up-to-date when records are edited. """
+        create_log_table(self.connection, "new")
+        assert(self.get_index_names("new") == ["new_band_mode_index", "new_duplicates_index", "new_dxcc_index", "new_qso_date_index"])
+        assert(self.get_trigger_names("new") == ["new_shadow_update"])
+        self.insert("new", {"CALL": "TEST123", "FREQ": "14.070", "QSO_DATE": "20130312", "TIME_ON": "123456"})
+        self.insert("new", {"CALL": "TEST456", "FREQ": "unknown", "QSO_DATE": "20130312", "TIME_ON": ""})
+        assert(self.connection.execute("SELECT freq, freq_mhz, qso_timestamp FROM new ORDER BY id").fetchall() == [("14.070", 14.07, 1363091696), ("unknown", None, None)])
+        with self.connection:
+            self.connection.execute("UPDATE new SET freq='7.1', time_on='1200' WHERE id=1")
+        assert(self.connection.execute("SELECT freq_mhz, qso_timestamp FROM new WHERE id=1").fetchone() == (7.1, 1363089600))
+        with self.assertRaises(sqlite.Error):
+            create_log_table(self.connection, "new")
+
+    def test_shadow_functions(self):
+        """ Check that the shadow columns of a new record are computed in Python in exactly the same way as by their SQL expressions when a record is edited. """
+        values = [("14.070", "20130312", "1234"), (" 7.1MHz", "20130312", "123456"), ("1e1", "20130231", "2400"), ("-14", "2013031", "1234"), ("0", "20131312", "1234"),
+                  (".5", "20130312", "1260"), ("+3.", "2013-03-", "1234"), ("abc", "20130312", "12345"), ("", "", ""), (None, None, None), ("14.070", "19000101", "0000"),
+                  ("14.070", "20130312x", "1234"), ("14.070", "20130300", "1234"), ("\t10", "00000101", "0000"), ("1.5e", "20130312", "12345x"), ("1e+", "20130312", " 1234")]
+        for (freq, qso_date, time_on) in values:
+            query = "SELECT %s FROM (SELECT ? AS freq, ? AS qso_date, ? AS time_on) AS record" % ", ".join([expression.format("record") for (column_name, column_type, expression) in SHADOW_COLUMNS])
+            expected = self.connection.execute(query, (freq, qso_date, time_on)).fetchone()
+            record = {"FREQ": freq, "QSO_DATE": qso_date, "TIME_ON": time_on}
+            assert(tuple([SHADOW_FUNCTIONS[column_name](record) for (column_name, column_type, expression) in SHADOW_COLUMNS]) == expected), (freq, qso_date, time_on, expected)
+
+    def test_rename_log_table(self):
+        """ Check that a log's triggers and indexes are renamed along with it, so that a new log with its old name gets triggers and indexes of its own. """
+        create_log_table(self.connection, "a")
+        self.insert("a", {"CALL": "TEST123", "FREQ": "14.070", "QSO_DATE": "20130312", "TIME_ON": "1234"})
+        rename_log_table(self.connection, "a", "b")
+        create_log_table(self.connection, "a")
+        for name in ["a", "b"]:
+            assert(self.get_index_names(name) == ["%s_band_mode_index" % name, "%s_duplicates_index" % name, "%s_dxcc_index" % name, "%s_qso_date_index" % name])
+            assert(self.get_trigger_names(name) == ["%s_shadow_update" % name])
+        self.insert("a", {"CALL": "TEST456", "FREQ": "7.1", "QSO_DATE": "20130312", "TIME_ON": "1234"})
+        with self.connection:
+            self.connection.execute("UPDATE a SET freq='3.5'")
+            self.connection.execute("UPDATE b SET freq='21'")
+        assert(self.connection.execute("SELECT call, freq_mhz FROM a").fetchall() == [("TEST456", 3.5)])
+        assert(self.connection.execute("SELECT call, freq_mhz FROM b").fetchall() == [("TEST123", 21.0)])
+        with self.assertRaises(sqlite.Error):
+            rename_log_table(self.connection, "a", "b")
+        assert(self.get_index_names("a")[0] == "a_band_mode_index")
+
+    def test_migrate(self):
+        """ Check that every log table is upgraded the first time a logbook is migrated, and that the migrations are not run again. """
+        assert(get_schema_version(self.connection) == 0)
+        assert(migrate(self.connection) == SCHEMA_VERSION)
+        assert(get_schema_version(self.connection) == SCHEMA_VERSION)
+        for name in ["test", "test2"]:
+            assert("%s_dxcc_index" % name in self.get_index_names(name))
+            column_names = [row[1] for row in self.connection.execute("PRAGMA table_info(%s)" % name)]
+            assert("freq_mhz" in column_names and "qso_timestamp" in column_names)
+        assert(self.connection.execute("SELECT qso_timestamp FROM test2 ORDER BY id").fetchall() == [(1491949620,), (1491949620,), (1491949620,), (1483739040,)])
+        assert(get_log_names(self.connection) == ["test", "test2"])
+        assert(migrate(self.connection) == 0)
+
+    def test_migrate_renamed_logs(self):
+        """ Check that migrating a logbook repairs the triggers and indexes of logs that were renamed before the triggers and indexes were renamed along with them. """
+        assert(migrate(self.connection) == SCHEMA_VERSION)
+        with self.connection:
+            self.connection.execute("ALTER TABLE test RENAME TO renamed")
+        create_log_table(self.connection, "test")
+        assert(self.get_index_names("test") == [] and self.get_trigger_names("test") == [])
+        with self.connection:
+            self.connection.execute("PRAGMA user_version = 1")
+        assert(migrate(self.connection) == SCHEMA_VERSION - 1)
+        for name in ["renamed", "test", "test2"]:
+            assert("%s_dxcc_index" % name in self.get_index_names(name))
+            assert(self.get_trigger_names(name) == ["%s_shadow_update" % name])
+
+    def test_enable_write_ahead_logging(self):
+        """ Check that a logbook is switched to write-ahead logging for good, so that it can be read by one connection while another is writing to it. """
+        assert(enable_write_ahead_logging(self.connection) == "wal")
+        self.connection.close()
+        self.connection = sqlite.connect(self.path)
+        assert(self.connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal")
+        writer = sqlite.connect(self.path)
+        try:
+            writer.execute("BEGIN")
+            writer.execute("DELETE FROM test2")
+            assert(self.connection.execute("SELECT Count(*) FROM test2").fetchone()[0] == 4)
+            writer.rollback()
+        finally:
+            writer.close()
+
+    def test_migrate_failure(self):
+        """ Check that a migration which fails leaves the logbook as it was. """
+        def fail(connection):
+            migrate_1(connection)
+            raise sqlite.OperationalError("Failed.")
+        with mock.patch("pyqso.schema.MIGRATIONS", [fail]):
+            with self.assertRaises(sqlite.Error):
+                migrate(self.connection)
+        assert(get_schema_version(self.connection) == 0)
+        assert("test_dxcc_index" not in self.get_index_names("test"))
+        assert("freq_mhz" not in [row[1] for row in self.connection.execute("PRAGMA table_info(test)")])
+
+if(__name__ == '__main__'):
+    unittest.main()
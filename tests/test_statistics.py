@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sqlite3 as sqlite
+import unittest
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+from pyqso.statistics import *
+
+
+class TestStatistics(unittest.TestCase):
+
+    """ The unit tests for the Statistics class. """
+
+    def setUp(self):
+        """ Set up the objects needed for the unit tests and create a connection to the test database. """
+        path_to_test_database = os.path.join(os.path.realpath(os.path.dirname(__file__)), "res", "test.db")
+        # Work on an in-memory copy of the test database, since records are deleted in some of the tests.
+        self.connection = sqlite.connect(":memory:")
+        source = sqlite.connect(path_to_test_database)
+        source.backup(self.connection)
+        source.close()
+        logs = [mock.MagicMock(), mock.MagicMock()]
+        logs[0].name = "test"
+        logs[1].name = "test2"
+        self.logbook = mock.MagicMock(connection=self.connection, logs=logs)
+        self.statistics = Statistics()
+
+    def tearDown(self):
+        """ Destroy the connection to the test database. """
+        self.connection.close()
+
+    def test_statistics(self):
+        """ Check the record count, year bounds, and the numbers of QSOs made in each month and with each mode in 2017. """
+        assert(self.statistics.get_record_count(self.logbook) == 7)
+        assert(self.statistics.get_year_bounds(self.logbook) == (2012, 2017))
+
+        count = self.statistics.get_annual_contact_count(self.logbook, 2017)
+        assert(count[datetime(2017, 4, 1)] == 3)
+        assert(sum(count.values()) == 4)
+
+        count = self.statistics.get_annual_mode_count(self.logbook, 2017)
+        assert(count["CW"] == 1)
+        assert(count["FM"] == 2)
+        assert(count["SSB"] == 1)
+
+    def test_cache(self):
+        """ Check that the aggregate query is only run again when the cached statistics have been invalidated, or when the logs change. """
+        counts = self.statistics.get_counts(self.logbook)
+        self.connection.execute("DELETE FROM test")  # The statistics are not told about this.
+        assert(self.statistics.get_counts(self.logbook) is counts)
+        assert(self.statistics.get_record_count(self.logbook) == 7)
+
+        # Edits to fields other than the date and mode do not affect the statistics.
+        self.statistics.on_record_edited(self.logbook.logs[0], {"QSO_DATE": "20170101", "NAME": "A"}, {"QSO_DATE": "20170101", "NAME": "B"})
+        assert(self.statistics.get_record_count(self.logbook) == 7)
+
+        self.statistics.on_record_edited(self.logbook.logs[0], {"MODE": "FM"}, {"MODE": "SSB"})
+        assert(self.statistics.get_record_count(self.logbook) == 4)  # Only the records in the second log remain.
+
+        # Removing a log from the logbook changes the statistics.
+        self.logbook.logs = self.logbook.logs[1:]
+        assert(self.statistics.get_record_count(self.logbook) == 4)
+        self.logbook.logs = []
+        assert(self.statistics.get_record_count(self.logbook) == 0)
+
+    def test_monitor(self):
+        """ Check that the statistics are invalidated when a log signals that its records have changed. """
+        self.statistics.monitor(self.logbook.logs)
+        (signal, handler) = self.logbook.logs[0].connect.call_args_list[0][0]
+        assert(signal == "record-added")
+        self.statistics.get_counts(self.logbook)
+        handler(self.logbook.logs[0], {})
+        assert(self.statistics.counts is None)
+
+        # Logs that are no longer in the logbook are no longer monitored.
+        self.statistics.monitor(self.logbook.logs[1:])
+        assert(self.logbook.logs[0].disconnect.call_count == 4)
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from pyqso.task_runner import *
+
+
+class TestTaskRunner(unittest.TestCase):
+
+    """ The unit tests for the TaskRunner class. """
+
+    def setUp(self):
+        """ Create a logbook in a temporary directory, and a task runner which passes everything back to the main thread through a queue (instead of GLib.idle_add). """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "logbook.db")
+        connection = sqlite.connect(self.path)
+        with connection:
+            connection.execute("CREATE TABLE test (id INTEGER PRIMARY KEY AUTOINCREMENT, call TEXT)")
+        connection.close()
+
+        self.queue = queue.Queue()
+        self.progress = []
+        self.finished = []
+        self.runner = TaskRunner(self.path, dispatch=self.dispatch, on_progress=lambda task: self.progress.append(task.count), on_finished=self.finished.append)
+
+    def tearDown(self):
+        self.runner.close()
+        shutil.rmtree(self.directory)
+
+    def dispatch(self, function, *args):
+        self.queue.put((function, args))
+
+    def iterate(self):
+        (function, args) = self.queue.get(timeout=10)
+        function(*args)
+
+    def test_submit(self):
+        """ Check that a task's job is run in a worker thread with its own connection, and that its progress and result are passed back to the main thread. """
+        results = []
+
+        def job(task, connection):
+            assert(threading.current_thread() is not threading.main_thread())
+            with connection:
+                for i in range(0, 5):
+                    connection.execute("INSERT INTO test (call) VALUES (?)", ("TEST%d" % i,))
+                    task.report(i+1, 5)
+            return connection.execute("SELECT Count(*) FROM test").fetchone()[0]
+
+        task = self.runner.submit(Task("Adding", job, on_complete=results.append, writes=True))
+        assert(self.runner.wait(task, self.iterate) == 5)
+        assert(results == [5] and self.finished == [task])
+        assert(self.progress[0] == 0 and self.progress[-1] == 5 and task.total == 5)
+        assert(self.runner.tasks == [])
+
+    def test_track(self):
+        """ Check that the items of an iterable are counted as a task's job goes through them. """
+        task = self.runner.submit(Task("Counting", lambda task, connection: sum(task.track(range(0, 2500), interval=1000))))
+        assert(self.runner.wait(task, self.iterate) == sum(range(0, 2500)))
+        assert(task.count == 2500 and self.progress[-1] == 2500)
+
+    def test_error(self):
+        """ Check that an exception raised by a task's job is passed to the task's on_error function, and re-raised by wait. """
+        errors = []
+
+        def job(task, connection):
+            connection.execute("SELECT * FROM missing")
+
+        task = self.runner.submit(Task("Failing", job, on_complete=self.fail, on_error=errors.append))
+        with self.assertRaises(sqlite.OperationalError):
+            self.runner.wait(task, self.iterate)
+        assert(len(errors) == 1 and isinstance(errors[0], sqlite.OperationalError))
+
+    def test_cancel(self):
+        """ Check that a cancelled task stops the next time it reports its progress, and that its writes are rolled back. """
+        started = threading.Event()
+        errors = []
+
+        def job(task, connection):
+            with connection:
+                connection.execute("INSERT INTO test (call) VALUES ('TEST')")
+                started.set()
+                while(True):
+                    task.report(1)
+
+        task = self.runner.submit(Task("Cancelling", job, on_complete=self.fail, on_error=errors.append, writes=True))
+        started.wait(10)
+        task.cancel()
+        with self.assertRaises(TaskCancelled):
+            self.runner.wait(task, self.iterate)
+        assert(len(errors) == 1 and isinstance(errors[0], TaskCancelled))
+        connection = sqlite.connect(self.path)
+        assert(connection.execute("SELECT Count(*) FROM test").fetchone()[0] == 0)
+        connection.close()
+
+    def test_interrupt(self):
+        """ Check that cancelling a task interrupts any database query that its job is in the middle of. """
+        started = threading.Event()
+
+        def job(task, connection):
+            started.set()
+            connection.execute("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i+1 FROM n) SELECT Count(*) FROM n").fetchone()
+
+        task = self.runner.submit(Task("Interrupting", job, on_complete=self.fail))
+        started.wait(10)
+        # Interrupting the connection has no effect until the query has actually started.
+        while(self.queue.empty()):
+            task.cancel()
+            time.sleep(0.01)
+        with self.assertRaises(TaskCancelled):
+            self.runner.wait(task, self.iterate)
+
+    def test_writes(self):
+        """ Check that tasks which write to the logbook at the same time do not fail with "database is locked" errors, and that the main thread's connection can read the logbook meanwhile. """
+        def job(task, connection):
+            for i in range(0, 50):
+                with connection:
+                    connection.execute("INSERT INTO test (call) VALUES (?)", ("TEST%d" % i,))
+            return True
+
+        tasks = [self.runner.submit(Task("Adding %d" % i, job, writes=True)) for i in range(0, 4)]
+        connection = sqlite.connect(self.path, timeout=BUSY_TIMEOUT)
+        connection.execute("SELECT Count(*) FROM test").fetchone()
+        for task in tasks:
+            assert(self.runner.wait(task, self.iterate))
+        assert(connection.execute("SELECT Count(*) FROM test").fetchone()[0] == 200)
+        connection.close()
+
+    def test_writing(self):
+        """ Check that a write from outside the tasks gives up with LogbookBusy while a task is writing to the logbook, and goes ahead once it has finished. """
+        started = threading.Event()
+        stop = threading.Event()
+
+        def job(task, connection):
+            started.set()
+            stop.wait(10)
+            return True
+
+        task = self.runner.submit(Task("Writing", job, writes=True))
+        started.wait(10)
+        assert(self.runner.is_writing())
+        with self.assertRaises(LogbookBusy):
+            with self.runner.writing(timeout=0.1):
+                self.fail()
+        stop.set()
+        assert(self.runner.wait(task, self.iterate))
+        with self.runner.writing(timeout=0.1):
+            assert(self.runner.is_writing())
+        assert(not self.runner.is_writing())
+
+    def test_close(self):
+        """ Check that closing the task runner cancels its tasks, and discards their results. """
+        started = threading.Event()
+
+        def job(task, connection):
+            started.set()
+            while(True):
+                task.report(0)
+
+        task = self.runner.submit(Task("Closing", job, on_complete=self.fail, on_error=self.fail))
+        started.wait(10)
+        self.runner.close()
+        assert(task.cancelled.is_set() and self.runner.tasks == [])
+        while(not self.queue.empty()):
+            self.iterate()
+        assert(self.finished == [])
+        with self.assertRaises(RuntimeError):
+            self.runner.submit(Task("Too late", job))
+
+if(__name__ == '__main__'):
+    unittest.main()
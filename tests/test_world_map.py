@@ -22,7 +22,8 @@ try:
     import unittest.mock as mock
 except ImportError:
     import mock
-from pyqso.world_map import Maidenhead, WorldMap
+import numpy
+from pyqso.world_map import *
 
 
 class TestMaidenhead(unittest.TestCase):
@@ -49,6 +50,33 @@ class TestMaidenhead(unittest.TestCase):
         gs6 = "IO91gb"
         assert self.maidenhead.gs2ll(gs6) == (51.0625, -1.4583333333333335)
 
+    def test_ll2gs_array(self):
+        """ Check that arrays of latitude-longitude coordinates can be converted to Maidenhead grid squares, and that they agree with the single-point conversion. """
+        latitudes = [51.0593, -33.8688, 90.0, -90.0, 100.0, numpy.nan]
+        longitudes = [-1.4262, 151.2093, 180.0, -180.0, 0.0, 0.0]
+        assert list(self.maidenhead.ll2gs_array(latitudes, longitudes)) == ["IO91", "QF56", "RR99", "AA00", "", ""]
+        assert list(self.maidenhead.ll2gs_array(latitudes, longitudes, length=6)[:2]) == ["IO91gb", "QF56od"]
+        assert list(self.maidenhead.ll2gs_array(latitudes, longitudes, length=8)[:2]) == ["IO91gb84", "QF56od51"]
+        for (latitude, longitude) in zip(latitudes[:2], longitudes[:2]):
+            assert self.maidenhead.ll2gs_array([latitude], [longitude], length=6)[0] == self.maidenhead.ll2gs(latitude, longitude, subsquare=True)
+        self.assertRaises(ValueError, self.maidenhead.ll2gs_array, latitudes, longitudes, 5)
+
+    def test_gs2ll_array(self):
+        """ Check that arrays of Maidenhead grid squares of mixed lengths can be converted to latitude-longitude coordinates, and that invalid grid squares are masked. """
+        (latitudes, longitudes, valid) = self.maidenhead.gs2ll_array(["JN05", "JN05aa", "io91GB", "IO91gb84", "ZZ00", "IO9", "IO91g", ""])
+        assert list(valid) == [True, True, True, True, False, False, False, False]
+        assert numpy.allclose((latitudes[0], longitudes[0]), self.maidenhead.gs2ll("JN05"))
+        assert numpy.allclose((latitudes[1], longitudes[1]), self.maidenhead.gs2ll("JN05aa"))
+        assert numpy.allclose((latitudes[2], longitudes[2]), self.maidenhead.gs2ll("IO91gb"))
+        assert numpy.isclose(latitudes[3], 51.0593, atol=0.25/60) and numpy.isclose(longitudes[3], -1.4262, atol=0.5/60)
+        assert numpy.isnan(latitudes[~valid]).all() and numpy.isnan(longitudes[~valid]).all()
+
+        # Converting the centres of the grid squares back again should give the same grid squares.
+        grid_squares = self.maidenhead.ll2gs_array(numpy.linspace(-89.9, 89.9, 1000), numpy.linspace(-179.9, 179.9, 1000), length=8)
+        (latitudes, longitudes, valid) = self.maidenhead.gs2ll_array(grid_squares)
+        assert valid.all()
+        assert (self.maidenhead.ll2gs_array(latitudes, longitudes, length=8) == grid_squares).all()
+
 
 class TestWorldMap(unittest.TestCase):
 
@@ -65,10 +93,109 @@ class TestWorldMap(unittest.TestCase):
         Log = mock.MagicMock()
         logbook = Logbook()
         l = Log()
-        l.records = [{"CALL": "TEST123", "COUNTRY": "England", "GRIDSQUARE": "IO91gb"}, {"CALL": "TEST456", "COUNTRY": "England", "GRIDSQUARE": "IO90hv"}, {"CALL": "TEST789", "COUNTRY": "England", "GRIDSQUARE": None}]
+        l.get_field_values.return_value = ["IO91gb", "io90hv", "ZZ00"]
         logbook.logs = [l]
         worked_grid_squares = self.world_map.get_worked_grid_squares(logbook=logbook)
+        l.get_field_values.assert_called_with("GRIDSQUARE")
         assert worked_grid_squares[14, 8]  # IO square.
+        assert worked_grid_squares.sum() == 1  # The invalid ZZ square is ignored.
+
+    def test_worked_grid_squares_cache(self):
+        """ Check that the worked grid squares are only re-read from the logs when their records have changed. """
+        logbook = mock.MagicMock()
+        l = mock.MagicMock()
+        l.name = "test"
+        l.get_field_values.return_value = ["IO91gb"]
+        logbook.logs = [l]
+        self.world_map.get_worked_grid_squares(logbook)
+        self.world_map.get_worked_grid_squares(logbook)
+        assert l.get_field_values.call_count == 1
+        assert [c[0][0] for c in l.connect.call_args_list] == ["record-added", "record-edited", "record-deleted", "records-changed"]
+
+        # A new record's grid square is added to the cached array.
+        self.world_map.on_record_added(l, {"CALL": "TEST", "GRIDSQUARE": "JN05"})
+        worked_grid_squares = self.world_map.get_worked_grid_squares(logbook)
+        assert l.get_field_values.call_count == 1
+        assert worked_grid_squares[14, 8] and worked_grid_squares[13, 9] and worked_grid_squares.sum() == 2
+
+        # Other changes are only picked up by re-reading the logs.
+        self.world_map.on_record_edited(l, {"GRIDSQUARE": "JN05"}, {"GRIDSQUARE": "JN05", "NAME": "TEST"})
+        self.world_map.get_worked_grid_squares(logbook)
+        assert l.get_field_values.call_count == 1
+        self.world_map.on_record_edited(l, {"GRIDSQUARE": "JN05"}, {"GRIDSQUARE": ""})
+        worked_grid_squares = self.world_map.get_worked_grid_squares(logbook)
+        assert l.get_field_values.call_count == 2 and worked_grid_squares.sum() == 1
+
+    def test_plot_log(self):
+        """ Check that the coordinates of all the QSOs in a log are determined from their GRIDSQUARE, or otherwise their COUNTRY. """
+        log = mock.MagicMock()
+        log.get_fields.return_value = [("TEST1", "IO91gb", "England"), ("TEST2", None, "Wales"), ("TEST3", "", "Narnia"), ("TEST4", None, None)]
+        self.world_map.geocoder = mock.MagicMock()
+        self.world_map.geocoder.get.side_effect = lambda country: {"Wales": (52.1, -3.8)}.get(country)
+        with mock.patch("pyqso.world_map.have_necessary_modules", True), mock.patch.object(self.world_map, "draw"):
+            self.world_map.plot_log(log)
+        log.get_fields.assert_called_with(["CALL", "GRIDSQUARE", "COUNTRY"], visible=True)
+        assert list(self.world_map.bulk_names) == ["TEST1", "TEST2", "TEST3", "TEST4"]
+        assert numpy.allclose(self.world_map.bulk_latitudes[:2], [51.0625, 52.1])
+        assert numpy.isnan(self.world_map.bulk_latitudes[2:]).all()
+        # Only the unknown country is looked up online.
+        (country, callback) = self.world_map.geocoder.request.call_args[0]
+        assert country == "Narnia"
+        self.world_map.on_bulk_geocoded("Narnia", (10.0, 20.0))
+        assert (self.world_map.bulk_latitudes[2], self.world_map.bulk_longitudes[2]) == (10.0, 20.0)
+
+    def test_plot_log_without_modules(self):
+        """ Check that nothing is plotted if the modules needed by the world map could not be imported. """
+        log = mock.MagicMock()
+        with mock.patch("pyqso.world_map.have_necessary_modules", False):
+            self.world_map.plot_log(log)
+        log.get_fields.assert_not_called()
+        assert self.world_map.bulk_names is None
+
+    def test_get_clusters(self):
+        """ Check that QSOs are only clustered together when there are too many of them to show individually. """
+        self.world_map.bulk_names = numpy.array(["TEST%d" % i for i in range(CLUSTERING_THRESHOLD + 1)])
+        self.world_map.bulk_latitudes = numpy.full(CLUSTERING_THRESHOLD + 1, 51.0)
+        self.world_map.bulk_longitudes = numpy.full(CLUSTERING_THRESHOLD + 1, -1.0)
+        self.world_map.bulk_latitudes[0] = -33.9
+        self.world_map.bulk_longitudes[0] = 151.2
+
+        # Zoomed in, only the QSOs around the first are visible.
+        (longitudes, latitudes, counts, labels) = self.world_map.get_clusters((150, 152, -35, -33))
+        assert list(counts) == [1] and list(labels) == ["TEST0"]
+
+        # Zoomed out, all the other QSOs are clustered together.
+        (longitudes, latitudes, counts, labels) = self.world_map.get_clusters((-180, 180, -90, 90))
+        assert sorted(counts) == [1, CLUSTERING_THRESHOLD]
+        assert sorted(labels) == [str(CLUSTERING_THRESHOLD), "TEST0"]
+        i = list(counts).index(CLUSTERING_THRESHOLD)
+        assert (longitudes[i], latitudes[i]) == (-1.0, 51.0)
+
+    def test_zoom(self):
+        """ Check that the static layer is drawn from the vector features while the map is zoomed in or panned, and from the raster basemap otherwise. """
+        self.world_map.ax = mock.MagicMock()
+        self.world_map.ax.get_xlim.return_value = (-180.0, 180.0)
+        self.world_map.ax.get_ylim.return_value = (-90.0, 90.0)
+        self.world_map.basemap_image = mock.MagicMock()
+        self.world_map.canvas = mock.MagicMock()
+        self.world_map.draw_static_layer = mock.MagicMock(return_value=[mock.MagicMock(), mock.MagicMock()])
+        assert not self.world_map.is_zoomed()
+        self.world_map.on_zoom()
+        assert not self.world_map.zoomed and not self.world_map.draw_static_layer.called
+
+        self.world_map.ax.get_xlim.return_value = (-10.0, 10.0)
+        assert self.world_map.is_zoomed()
+        self.world_map.on_zoom()
+        assert self.world_map.zoomed and len(self.world_map.vector_artists) == 2
+        self.world_map.basemap_image.set_visible.assert_called_with(False)
+
+        self.world_map.ax.get_xlim.return_value = (-180.0, 180.0)
+        artists = self.world_map.vector_artists
+        self.world_map.on_zoom()
+        assert not self.world_map.zoomed and self.world_map.vector_artists == []
+        assert all([artist.remove.called for artist in artists])
+        self.world_map.basemap_image.set_visible.assert_called_with(True)
+        assert self.world_map.canvas.draw_idle.call_count == 2
 
 if(__name__ == '__main__'):
     unittest.main()